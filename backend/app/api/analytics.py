@@ -0,0 +1,227 @@
+"""Analytics API endpoints"""
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session as DBSession
+from sqlalchemy.exc import OperationalError
+from pydantic import BaseModel
+from typing import List, Literal, Optional
+from datetime import datetime, timedelta, timezone
+import time
+import logging
+
+from ..db.models import Session
+from ..dependencies import get_current_session, get_session_db, require_admin
+from ..config import settings
+from ..services.analytics import BreakdownService
+from ..services.columnar import columnar_engine
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/analytics", tags=["analytics"])
+
+
+class BreakdownRow(BaseModel):
+    """Aggregates for one value of a dimension"""
+    dimension: str
+    value: Optional[str] = None
+    event_count: int
+    error_count: int
+    error_rate: float
+    tokens_prompt: int
+    tokens_completion: int
+    tokens_total: int
+    total_cost: float
+    latency_avg_ms: Optional[float] = None
+    latency_p50_ms: Optional[float] = None
+    latency_p95_ms: Optional[float] = None
+    latency_max_ms: Optional[int] = None
+
+
+class BreakdownResponse(BaseModel):
+    """Breakdown by model, provider and status plus the overall total"""
+    scope: str
+    session_id: Optional[str] = None
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+    total: BreakdownRow
+    by_model: List[BreakdownRow]
+    by_provider: List[BreakdownRow]
+    by_status: List[BreakdownRow]
+    sampled: bool
+    sample_fraction: float
+    query_ms: float
+
+
+def _run_breakdown(db: Optional[DBSession], session_id, start, end, archived_after: Optional[str] = None) -> dict:
+    try:
+        if db is None:
+            result = BreakdownService.fleet_breakdown(start=start, end=end)
+        else:
+            result = BreakdownService.breakdown(db, session_id=session_id, start=start, end=end)
+        return BreakdownService.with_archive(result, session_id, start, end, archived_after)
+    except OperationalError as e:
+        if db is not None:
+            db.rollback()
+        if "statement timeout" in str(e):
+            raise HTTPException(
+                status_code=503,
+                detail=f"Breakdown exceeded the {settings.analytics_latency_budget_ms}ms budget; narrow the time range"
+            )
+        raise
+
+
+@router.get("/session/breakdown", response_model=BreakdownResponse)
+async def get_session_breakdown(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    session: Session = Depends(get_current_session),
+    db: DBSession = Depends(get_session_db)
+):
+    """
+    Breakdown of the current session's events by model, provider and status.
+    Optional [start, end) time range; archived events are included when it
+    reaches past the hot window.
+    """
+    session_key, session_pk = session.session_id, session.id
+    if session_pk is None:
+        # Never written to: nothing to aggregate
+        return BreakdownResponse(scope="session", session_id=session_key, start=start, end=end,
+                                 **BreakdownService.empty())
+    archived_after = (session.session_metadata or {}).get("archive_reset_at")
+    result = _run_breakdown(db, session_pk, start, end, archived_after)
+    return BreakdownResponse(scope="session", session_id=session_key, start=start, end=end, **result)
+
+
+@router.get("/breakdown", response_model=BreakdownResponse, dependencies=[Depends(require_admin)])
+async def get_fleet_breakdown(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+):
+    """
+    Operator view: breakdown across all sessions, gathered from every shard in parallel.
+    Large ranges are answered from a block sample to stay within the latency budget;
+    'sampled' and 'sample_fraction' say when that happened.
+    """
+    result = _run_breakdown(None, None, start, end)
+    return BreakdownResponse(scope="all", start=start, end=end, **result)
+
+
+class FleetRow(BaseModel):
+    """Aggregates for one value of a dimension, from the in-memory snapshot"""
+    value: Optional[str] = None
+    event_count: int
+    error_count: int
+    error_rate: float
+    tokens_total: int
+    total_cost: float
+    latency_avg_ms: Optional[float] = None
+    latency_p95_ms: Optional[float] = None
+
+
+class FleetResponse(BaseModel):
+    """Rows plus how stale the snapshot they came from may be"""
+    dimension: str
+    rows: List[FleetRow]
+    refreshed_at: Optional[datetime] = None
+    query_ms: float
+
+
+class FleetBucket(BaseModel):
+    start: datetime
+    event_count: int
+    error_count: int
+    error_rate: float
+    total_cost: float
+
+
+class FleetTimeseriesResponse(BaseModel):
+    bucket_seconds: int
+    buckets: List[FleetBucket]
+    refreshed_at: Optional[datetime] = None
+    query_ms: float
+
+
+MAX_TIMESERIES_BUCKETS = 10000
+
+
+def _require_snapshot() -> Optional[datetime]:
+    if not settings.columnar_enabled:
+        raise HTTPException(status_code=503, detail="Columnar analytics is disabled")
+    if columnar_engine.refreshed_at is None:
+        raise HTTPException(status_code=503, detail="Columnar snapshot is still loading")
+    return datetime.fromtimestamp(columnar_engine.refreshed_at, tz=timezone.utc)
+
+
+@router.get("/fleet/groupby", response_model=FleetResponse, dependencies=[Depends(require_admin)])
+async def get_fleet_groupby(
+    dimension: Literal["model", "provider", "status"] = "model",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    model: Optional[str] = None,
+    provider: Optional[str] = None,
+    status: Optional[str] = None,
+):
+    """
+    Operator view: per-model/provider/status aggregates over the recent window,
+    answered from the in-process snapshot instead of the database. Results lag
+    the database by up to columnar_refresh_seconds (see /analytics/fleet/status).
+    """
+    refreshed_at = _require_snapshot()
+    started = time.perf_counter()
+    rows = columnar_engine.group_by(dimension, start, end, model=model, provider=provider, status=status)
+    return FleetResponse(dimension=dimension, rows=rows, refreshed_at=refreshed_at,
+                         query_ms=round((time.perf_counter() - started) * 1000, 2))
+
+
+@router.get("/fleet/top", response_model=FleetResponse, dependencies=[Depends(require_admin)])
+async def get_fleet_top(
+    dimension: Literal["session", "model", "provider", "status"] = "session",
+    metric: Literal["cost", "events", "errors", "error_rate", "tokens", "latency_avg", "latency_p95"] = "latency_p95",
+    k: int = Query(10, ge=1, le=1000),
+    min_events: int = Query(1, ge=1),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    model: Optional[str] = None,
+    provider: Optional[str] = None,
+    status: Optional[str] = None,
+):
+    """
+    Operator view: the k sessions (or models, ...) with the highest metric,
+    e.g. the worst-latency sessions in the last hour. min_events keeps
+    one-off sessions out of rate and percentile rankings.
+    """
+    refreshed_at = _require_snapshot()
+    started = time.perf_counter()
+    rows = columnar_engine.top_k(dimension, metric, k, start, end, min_events,
+                                 model=model, provider=provider, status=status)
+    return FleetResponse(dimension=dimension, rows=rows, refreshed_at=refreshed_at,
+                         query_ms=round((time.perf_counter() - started) * 1000, 2))
+
+
+@router.get("/fleet/timeseries", response_model=FleetTimeseriesResponse, dependencies=[Depends(require_admin)])
+async def get_fleet_timeseries(
+    bucket_seconds: int = Query(60, ge=1),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    model: Optional[str] = None,
+    provider: Optional[str] = None,
+    status: Optional[str] = None,
+):
+    """Operator view: events, errors and cost per bucket (defaults to the last hour), for spotting error spikes"""
+    refreshed_at = _require_snapshot()
+    end = end or datetime.now(timezone.utc)
+    start = start or end - timedelta(hours=1)
+    start, end = (v if v.tzinfo else v.replace(tzinfo=timezone.utc) for v in (start, end))
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+    if (end - start).total_seconds() / bucket_seconds > MAX_TIMESERIES_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_TIMESERIES_BUCKETS} buckets; widen bucket_seconds")
+    started = time.perf_counter()
+    buckets = columnar_engine.timeseries(bucket_seconds, start, end, model=model, provider=provider, status=status)
+    return FleetTimeseriesResponse(bucket_seconds=bucket_seconds, buckets=buckets, refreshed_at=refreshed_at,
+                                   query_ms=round((time.perf_counter() - started) * 1000, 2))
+
+
+@router.get("/fleet/status", dependencies=[Depends(require_admin)])
+async def get_fleet_status():
+    """Snapshot size, memory, watermarks and refresh timings"""
+    return columnar_engine.status()
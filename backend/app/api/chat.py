@@ -1,18 +1,28 @@
 """Chat API endpoint for playground"""
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Header, Response
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
+from typing import Literal, Optional
 from sqlalchemy.orm import Session as DBSession
 import os
 import time
 import logging
-from anthropic import Anthropic
+from anthropic import AsyncAnthropic
 from datetime import datetime
 import uuid as uuid_lib
 
-from ..db.models import Session, LLMEvent
-from ..db.base import get_db
-from ..dependencies import get_current_session
+from ..db.models import Session
+from ..dependencies import get_event_session, get_session_db
 from ..config import settings
+from ..tracing import tracer
+from ..services.pricing import PricingService, to_micros
+from ..services.content_capture import ContentCaptureService
+from ..services.event_spool import event_spool, SpoolFull
+from ..services.idempotency import (
+    idempotency_store, fingerprint, IdempotencyConflict, IdempotencyInProgress
+)
+from ..services.upstream_scheduler import upstream_scheduler, estimate_tokens, UpstreamQueueError
+from ..services.upstream_guard import upstream_guard, CircuitOpenError
 
 logger = logging.getLogger(__name__)
 
@@ -20,6 +30,7 @@ router = APIRouter(prefix="/playground", tags=["playground"])
 
 class ChatRequest(BaseModel):
     message: str
+    priority: Literal["interactive", "batch"] = "interactive"  # Scheduling class for the upstream call
 
 class ChatResponse(BaseModel):
     response: str
@@ -34,91 +45,217 @@ def get_anthropic_client():
         api_key = settings.anthropic_api_key
         if not api_key:
             raise HTTPException(status_code=500, detail="ANTHROPIC_API_KEY not configured")
-        anthropic_client = Anthropic(api_key=api_key)
+        anthropic_client = AsyncAnthropic(
+            api_key=api_key,
+            base_url=settings.anthropic_base_url,
+            timeout=settings.upstream_timeout_seconds
+        )
     return anthropic_client
 
 @router.post("/chat", response_model=ChatResponse)
 async def chat(
     request: ChatRequest,
-    session: Session = Depends(get_current_session),
-    db: DBSession = Depends(get_db)
+    response: Response,
+    session: Session = Depends(get_event_session),
+    db: DBSession = Depends(get_session_db),
+    idempotency_key: Optional[str] = Header(None, max_length=255),
 ):
-    """Chat with Claude and track the interaction"""
+    """
+    Chat with Claude and track the interaction.
+
+    With an Idempotency-Key header, a retry of the same request within
+    idempotency_ttl_seconds returns the original response (waiting for it if
+    it is still in flight) instead of calling upstream and recording a second
+    event. Reusing a key for a different request is rejected with 422.
+    Keys are remembered per worker process only: with several workers, a
+    retry that reaches another one is served as a new call.
+    """
+    if not idempotency_key:
+        return await _complete_chat(request, session, db)
+
     try:
-        logger.info(f"Received chat request: {request.message[:50]}...")
+        result, replayed = await idempotency_store.run(
+            (session.session_id, idempotency_key),
+            # Every field, so reusing a key with other parameters (priority, ...) is a 422
+            fingerprint(request.model_dump_json()),
+            lambda: _complete_chat(request, session, db),
+        )
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except IdempotencyInProgress as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    if replayed:
+        logger.info("Replayed chat response for Idempotency-Key %s", idempotency_key)
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+
+async def _complete_chat(request: ChatRequest, session: Session, db: DBSession) -> ChatResponse:
+    """Call upstream once and record the event"""
+    # Read up front: after a failed write the session can't be reloaded if the database is down.
+    # session_pk is None while a new session waits in the spool for its row (see get_event_session).
+    session_pk, session_key = session.id, session.session_id
+    policy = ContentCaptureService.for_session(session)
+
+    # Claim the event's slot before paying for the upstream call; the claim is
+    # used by either the success or the error event below. It is held in memory
+    # if the database can't take it in time (services/event_spool.py).
+    with tracer.span("event.reserve_slot") as span:
+        reserved = await run_in_threadpool(event_spool.reserve, db, session_pk, session_key)
+        if reserved is None:
+            raise HTTPException(
+                status_code=429,
+                detail=f"Session has reached its limit of {settings.session_max_events_per_session} events; reset it or start a new session"
+            )
+        span.set_attribute("event.slot_in_memory", not reserved)
+
+    queue_wait_ms = None
+    try:
+        # Prompt and response content only at DEBUG
+        logger.debug("Received chat request: %.50s...", request.message)
         client = get_anthropic_client()
 
-        # Call Anthropic API
-        start_time = time.time()
-        logger.info("Calling Anthropic API...")
-        response = client.messages.create(
-            model="claude-3-5-sonnet-20241022",
-            max_tokens=1024,
-            messages=[{"role": "user", "content": request.message}]
-        )
-        end_time = time.time()
+        # Shed before queueing for a slot while the model's circuit is open
+        upstream_guard.check("anthropic", "claude-3-5-sonnet-20241022")
+
+        # Wait for a fair share of the upstream slots, then call Anthropic API
+        estimate = estimate_tokens(request.message, 1024)
+        async with upstream_scheduler.slot(session_key, request.priority, estimate) as ticket:
+            queue_wait_ms = ticket.queue_wait_ms
+            tracer.annotate(**{"upstream.queue_wait_ms": queue_wait_ms})
+            start_time = time.time()
+            logger.info("Calling Anthropic API after %sms in queue...", queue_wait_ms)
+            upstream = await upstream_guard.call(
+                "anthropic", "claude-3-5-sonnet-20241022",
+                lambda: client.messages.stream(
+                    model="claude-3-5-sonnet-20241022",
+                    max_tokens=1024,
+                    messages=[{"role": "user", "content": request.message}]
+                ),
+                # A backup request only runs on a slot that is free right now
+                hedge_slot=lambda: upstream_scheduler.try_acquire(session_key, request.priority, estimate),
+            )
+            response = upstream.message
+            end_time = time.time()
+            ticket.settle(response.usage.input_tokens + response.usage.output_tokens)
         latency_ms = int((end_time - start_time) * 1000)
-        logger.info(f"Anthropic API call successful, latency: {latency_ms}ms")
+        logger.info("Anthropic API call successful, latency: %sms", latency_ms)
 
         # Extract response
         assistant_message = response.content[0].text
-        logger.info(f"Response extracted: {assistant_message[:50]}...")
-
-        # Calculate cost (approximate for Claude 3.5 Sonnet)
-        cost_per_1k_input = 0.003
-        cost_per_1k_output = 0.015
-        cost_usd = (
-            (response.usage.input_tokens / 1000) * cost_per_1k_input +
-            (response.usage.output_tokens / 1000) * cost_per_1k_output
+        logger.debug("Response extracted: %.50s...", assistant_message)
+
+        # Price the call from the versioned price table
+        event_time = datetime.utcnow()
+        cached_input_tokens = getattr(response.usage, "cache_read_input_tokens", None) or 0
+        cost_usd = PricingService.cost(
+            "claude-3-5-sonnet-20241022", event_time,
+            response.usage.input_tokens, response.usage.output_tokens, cached_input_tokens
         )
 
-        # Create event
-        event = LLMEvent(
-            time=datetime.utcnow(),
-            session_id=session.id,
+        # Keep as much of the content as the session's capture policy asks for
+        captured = ContentCaptureService.apply(
+            policy,
+            [{"role": "user", "content": request.message}], assistant_message, has_error=False,
+        )
+
+        # Create event; the id is set here so a spooled copy keeps it
+        event = dict(
+            id=uuid_lib.uuid4(),
+            time=event_time,
             model="claude-3-5-sonnet-20241022",
             provider="anthropic",
             endpoint="/api/v1/playground/chat",
+            status="success",
             tokens_prompt=response.usage.input_tokens,
             tokens_completion=response.usage.output_tokens,
             tokens_total=response.usage.input_tokens + response.usage.output_tokens,
+            tokens_cached_input=cached_input_tokens,
             latency_ms=latency_ms,
-            cost_usd=cost_usd,
-            messages=[{"role": "user", "content": request.message}],
-            response=assistant_message,
-            status="success",
+            time_to_first_token_ms=upstream.ttft_ms,
+            queue_wait_ms=queue_wait_ms,
+            hedge_outcome=upstream.hedge_outcome,
+            circuit_state=upstream.circuit_state,
+            cost_micros=to_micros(cost_usd),
+            messages=captured.messages,
+            response=captured.response,
+            content_capture=captured.capture,
+            content_sample_rate=captured.sample_rate,
             has_error=False,
         )
 
-        db.add(event)
-        db.commit()
-        db.refresh(event)
+        # Falls back to the local spool if the database is slow or down (services/event_spool.py)
+        with tracer.span("event.persist") as span:
+            try:
+                stored = await run_in_threadpool(event_spool.write, db, session_pk, session_key, event, reserved)
+                span.set_attribute("event.spooled", not stored)
+            except SpoolFull as e:
+                # The call succeeded: answer it, and lose only its event
+                logger.error("Dropped event %s for session %s: %s", event["id"], session_key, e)
+                await run_in_threadpool(event_spool.release, db, session_pk, session_key, reserved)
 
         return ChatResponse(
             response=assistant_message,
-            event_id=str(event.id)
+            event_id=str(event["id"])
+        )
+
+    except UpstreamQueueError as e:
+        # Refused before reaching upstream: no event, hand the reserved slot back
+        logger.warning("Chat request for session %s not scheduled: %s", session_key, e)
+        db.rollback()
+        await run_in_threadpool(event_spool.release, db, session_pk, session_key, reserved)
+        raise HTTPException(
+            status_code=503,
+            detail=f"Upstream is busy: {str(e)}",
+            headers={"Retry-After": str(e.retry_after)}
         )
 
     except Exception as e:
-        logger.error(f"Chat error: {str(e)}", exc_info=True)
-        # Log error event
+        logger.error("Chat error: %s", e, exc_info=True)
+        db.rollback()
+        # Log error event; failed calls keep their prompt whatever the capture policy
         try:
-            error_event = LLMEvent(
+            captured = ContentCaptureService.apply(
+                policy,
+                [{"role": "user", "content": request.message}], None, has_error=True,
+            )
+            error_event = dict(
+                id=uuid_lib.uuid4(),
                 time=datetime.utcnow(),
-                session_id=session.id,
                 model="claude-3-5-sonnet-20241022",
                 provider="anthropic",
                 endpoint="/api/v1/playground/chat",
                 status="error",
+                messages=captured.messages,
+                content_capture=captured.capture,
                 has_error=True,
                 error_message=str(e),
+                queue_wait_ms=queue_wait_ms,
+                circuit_state=(
+                    "open" if isinstance(e, CircuitOpenError)
+                    else upstream_guard.breaker("anthropic", "claude-3-5-sonnet-20241022").state
+                ),
                 tokens_prompt=0,
                 tokens_completion=0,
                 tokens_total=0,
             )
-            db.add(error_event)
-            db.commit()
+            with tracer.span("event.persist", **{"event.has_error": True}) as span:
+                stored = await run_in_threadpool(event_spool.write, db, session_pk, session_key, error_event, reserved)
+                span.set_attribute("event.spooled", not stored)
         except Exception as db_error:
-            logger.error(f"Failed to log error event: {str(db_error)}", exc_info=True)
+            logger.error("Failed to log error event: %s", db_error, exc_info=True)
+            try:
+                db.rollback()
+            except Exception:
+                pass
+            await run_in_threadpool(event_spool.release, db, session_pk, session_key, reserved)
 
+        if isinstance(e, CircuitOpenError):
+            # Shed without calling upstream
+            raise HTTPException(
+                status_code=503,
+                detail=f"Chat error: {str(e)}",
+                headers={"Retry-After": str(e.retry_after)}
+            )
         raise HTTPException(status_code=500, detail=f"Chat error: {str(e)}")
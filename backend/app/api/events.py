@@ -1,14 +1,21 @@
 """Events API endpoints"""
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session as DBSession
-from sqlalchemy import desc
-from typing import List
+from sqlalchemy import desc, text
+from typing import List, Optional
 from pydantic import BaseModel
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from collections import namedtuple
 
+from ..config import settings
 from ..db.models import Session, LLMEvent
-from ..db.base import get_db
-from ..dependencies import get_current_session
+from ..db.dimensions import dimensions
+from ..dependencies import get_current_session, get_session_db, get_read_db
+from ..services.event_export import EventExportService, MEDIA_TYPES
+from ..services.event_archive import EventArchiveService
+from ..services.pricing import from_micros
+from ..responses import FastJSONResponse
 
 router = APIRouter(prefix="/events", tags=["events"])
 
@@ -29,31 +36,219 @@ class EventResponse(BaseModel):
     class Config:
         from_attributes = True
 
+RECENT_COLUMNS = [
+    "id", "time", "model", "provider", "tokens_total", "tokens_prompt", "tokens_completion",
+    "cost_usd", "latency_ms", "status", "has_error", "error_message",
+]
+# Hot rows (decoded) and archived rows share this shape
+RecentRow = namedtuple("RecentRow", RECENT_COLUMNS)
+
+
 @router.get("/recent", response_model=List[EventResponse])
 async def get_recent_events(
+    request: Request,
     limit: int = 50,
     session: Session = Depends(get_current_session),
-    db: DBSession = Depends(get_db)
+    db: DBSession = Depends(get_read_db)
 ):
     """Get recent events for the current session"""
-    events = db.query(LLMEvent).filter(
+    if session.id is None:
+        # Never written to: no events, and no query
+        return FastJSONResponse([], request=request)
+
+    # Only the columns the response needs: no ORM instances, no messages/response blobs
+    query = db.query(
+        LLMEvent.id, LLMEvent.time, LLMEvent.model_id, LLMEvent.provider_id,
+        LLMEvent.tokens_total, LLMEvent.tokens_prompt, LLMEvent.tokens_completion,
+        LLMEvent.cost_micros, LLMEvent.latency_ms, LLMEvent.status_id, LLMEvent.has_error,
+        LLMEvent.error_message,
+    ).filter(
         LLMEvent.session_id == session.id
-    ).order_by(desc(LLMEvent.time)).limit(limit).all()
-
-    return [
-        EventResponse(
-            id=str(e.id),
-            time=e.time,
-            model=e.model or "unknown",
-            provider=e.provider or "unknown",
-            tokens_total=e.tokens_total or 0,
-            tokens_prompt=e.tokens_prompt or 0,
-            tokens_completion=e.tokens_completion or 0,
-            cost_usd=float(e.cost_usd or 0),
-            latency_ms=e.latency_ms,
-            status=e.status or "unknown",
-            has_error=e.has_error or False,
-            error=e.error_message,
+    ).order_by(desc(LLMEvent.time))
+
+    # A literal time bound lets the planner skip every older partition; most sessions are filled from here
+    window_start = datetime.now(timezone.utc) - timedelta(hours=settings.recent_events_window_hours)
+    rows = query.filter(LLMEvent.time >= window_start).limit(limit).all()
+    if len(rows) < limit:
+        rows = list(rows) + query.filter(LLMEvent.time < window_start).limit(limit - len(rows)).all()
+    rows = [
+        RecentRow(
+            r.id, r.time, dimensions.decode(db, "model", r.model_id), dimensions.decode(db, "provider", r.provider_id),
+            r.tokens_total, r.tokens_prompt, r.tokens_completion, from_micros(r.cost_micros), r.latency_ms,
+            dimensions.decode(db, "status", r.status_id), r.has_error, r.error_message,
         )
-        for e in events
+        for r in rows
     ]
+
+    if len(rows) < limit and session.archived_event_count and EventArchiveService.enabled():
+        # The rest of the session's history is older than the hot window
+        rows = list(rows) + [
+            RecentRow(*row)
+            for batch in EventArchiveService.session_events(
+                session.id, RECENT_COLUMNS,
+                archived_after=(session.session_metadata or {}).get("archive_reset_at"),
+                newest_first=True, limit=limit - len(rows),
+            )
+            for row in batch
+        ]
+
+    # Rows go straight to orjson in EventResponse's shape, skipping per-row model validation
+    return FastJSONResponse([
+        {
+            "id": str(r.id),
+            "time": r.time,
+            "model": r.model or "unknown",
+            "provider": r.provider or "unknown",
+            "tokens_total": r.tokens_total or 0,
+            "tokens_prompt": r.tokens_prompt or 0,
+            "tokens_completion": r.tokens_completion or 0,
+            "cost_usd": float(r.cost_usd or 0),
+            "latency_ms": r.latency_ms,
+            "status": r.status or "unknown",
+            "has_error": r.has_error or False,
+            "error": r.error_message,
+        }
+        for r in rows
+    ], request=request)
+
+
+class SearchHit(BaseModel):
+    """One ranked search result"""
+    id: str
+    time: datetime
+    model: str
+    status: str
+    rank: float
+    prompt_snippet: str | None = None
+    response_snippet: str | None = None
+
+
+class SearchResponse(BaseModel):
+    """A page of search results"""
+    query: str
+    results: List[SearchHit]
+    limit: int
+    offset: int
+    has_more: bool
+
+
+# Rank and paginate inside the index-driven subquery; snippets are only
+# generated for the returned page because ts_headline re-parses the text.
+SEARCH_SQL = text("""
+    WITH q AS (SELECT websearch_to_tsquery('english', :query) AS tsq),
+    page AS (
+        SELECT e.id, e.time, e.model_id, e.status_id, e.messages, e.response,
+               ts_rank_cd(e.search_vector, q.tsq) AS rank
+        FROM playground_events e, q
+        WHERE e.session_id = :session_id
+          AND e.search_vector @@ q.tsq
+          AND (CAST(:start AS timestamptz) IS NULL OR e.time >= :start)
+          AND (CAST(:end AS timestamptz) IS NULL OR e.time < :end)
+        ORDER BY rank DESC, e.time DESC
+        LIMIT :limit OFFSET :offset
+    )
+    SELECT page.id, page.time, page.model_id, page.status_id, page.rank,
+           ts_headline('english',
+                       coalesce((SELECT string_agg(m ->> 'content', ' ')
+                                 FROM jsonb_array_elements(page.messages) AS m), ''),
+                       q.tsq, :headline_options) AS prompt_snippet,
+           ts_headline('english', coalesce(page.response, ''), q.tsq, :headline_options) AS response_snippet
+    FROM page, q
+    ORDER BY page.rank DESC, page.time DESC
+""")
+
+HEADLINE_OPTIONS = "StartSel=<mark>, StopSel=</mark>, MaxWords=30, MinWords=10, MaxFragments=2"
+
+
+@router.get("/search", response_model=SearchResponse)
+async def search_events(
+    q: str = Query(..., min_length=1, max_length=500),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    session: Session = Depends(get_current_session),
+    db: DBSession = Depends(get_session_db)
+):
+    """
+    Full-text search over the current session's prompts and responses.
+
+    Supports web-search syntax ("quoted phrases", -exclusions, OR).
+    Prompt matches rank above response matches. Results are ranked and
+    paginated with highlighted snippets.
+    """
+    if session.id is None:
+        return SearchResponse(query=q, results=[], limit=limit, offset=offset, has_more=False)
+
+    rows = db.execute(SEARCH_SQL, {
+        "query": q,
+        "session_id": session.id,
+        "start": start,
+        "end": end,
+        "limit": limit + 1,
+        "offset": offset,
+        "headline_options": HEADLINE_OPTIONS,
+    }).all()
+
+    return SearchResponse(
+        query=q,
+        results=[
+            SearchHit(
+                id=str(r.id),
+                time=r.time,
+                model=dimensions.decode(db, "model", r.model_id) or "unknown",
+                status=dimensions.decode(db, "status", r.status_id) or "unknown",
+                rank=float(r.rank),
+                prompt_snippet=r.prompt_snippet or None,
+                response_snippet=r.response_snippet or None,
+            )
+            for r in rows[:limit]
+        ],
+        limit=limit,
+        offset=offset,
+        has_more=len(rows) > limit,
+    )
+
+
+@router.get("/export")
+async def export_events(
+    format: str = Query("ndjson", pattern="^(ndjson|csv|parquet)$"),
+    model: Optional[str] = None,
+    status: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    include_content: bool = True,
+    session: Session = Depends(get_current_session)
+):
+    """
+    Stream the current session's events as NDJSON, CSV or Parquet.
+
+    Rows are read through a server-side cursor and sent in chunks, so memory
+    use does not depend on how many events the session has. Archived events
+    come first when the range reaches past the hot window.
+    Optional filters: model, status, and a [start, end) time range.
+    """
+    if format == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise HTTPException(status_code=501, detail="Parquet export requires pyarrow")
+
+    body = EventExportService.stream(
+        format,
+        session.id,
+        session.session_id,
+        include_content=include_content,
+        model=model,
+        status=status,
+        start=start,
+        end=end,
+        from_archive=bool(session.archived_event_count) and EventArchiveService.reaches(start),
+        archived_after=(session.session_metadata or {}).get("archive_reset_at"),
+    )
+    filename = f"events-{session.session_id}.{format}"
+    return StreamingResponse(
+        body,
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
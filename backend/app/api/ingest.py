@@ -0,0 +1,141 @@
+"""Bulk event ingestion API for external producers"""
+from fastapi import APIRouter, Depends, HTTPException, Request, Header
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session as DBSession
+from pydantic import BaseModel
+from typing import Optional, List, Dict, Any
+import hmac
+import time
+import logging
+
+from ..db.models import Session
+from ..db.shards import shard_router
+from ..dependencies import get_current_session, get_session_db, materialize_session
+from ..config import settings
+from ..services.event_ingestion import EventIngestionService, IngestError, MAX_REPORTED_ERRORS
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/ingest", tags=["ingest"])
+
+
+class IngestResponse(BaseModel):
+    """Outcome of one ingested batch"""
+    received: int
+    accepted: int
+    duplicates: int
+    rejected: int
+    errors: List[Dict[str, Any]]
+    duration_ms: float
+
+
+async def require_ingest_key(
+    authorization: Optional[str] = Header(None),
+    x_api_key: Optional[str] = Header(None),
+):
+    """Check the ingest API key; without one configured, ingestion is off"""
+    if not settings.ingest_api_key:
+        # Anyone could otherwise write events into any session
+        raise HTTPException(status_code=403, detail="Ingestion is disabled (INGEST_API_KEY not set)")
+    token = x_api_key
+    if not token and authorization and authorization.lower().startswith("bearer "):
+        token = authorization[7:]
+    if not token or not hmac.compare_digest(token.encode(), settings.ingest_api_key.encode()):
+        raise HTTPException(status_code=401, detail="Invalid or missing ingest API key")
+
+
+async def _read_body(request: Request) -> bytes:
+    """The raw body, refused as soon as it is known to exceed ingest_max_body_bytes"""
+    limit = settings.ingest_max_body_bytes
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > limit:
+        raise HTTPException(status_code=413, detail="Body exceeds ingest_max_body_bytes")
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            raise HTTPException(status_code=413, detail="Body exceeds ingest_max_body_bytes")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+@router.post("/events", response_model=IngestResponse, dependencies=[Depends(require_ingest_key)])
+async def ingest_events(
+    request: Request,
+    session: Session = Depends(get_current_session),
+    db: DBSession = Depends(get_session_db)
+):
+    """
+    Ingest a batch of LLM events.
+
+    Body is a JSON array (Content-Type: application/json) or NDJSON
+    (Content-Type: application/x-ndjson), optionally with Content-Encoding: gzip.
+    Events without a session_id are attached to the caller's session.
+    Invalid rows are reported by index and skipped; valid rows are loaded
+    in one transaction.
+    """
+    start = time.perf_counter()
+    body = await _read_body(request)
+    # Decompression, parsing, validation and COPY are all blocking: keep them off the event loop
+    return await run_in_threadpool(_ingest, request, session, db, body, start)
+
+
+def _ingest(request: Request, session: Session, db: DBSession, body: bytes, start: float) -> IngestResponse:
+    try:
+        objects, errors = EventIngestionService.decode_body(
+            body,
+            request.headers.get("content-type", "application/json"),
+            request.headers.get("content-encoding"),
+        )
+        valid, errors = EventIngestionService.validate(objects, errors)
+    except IngestError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+    if objects and not valid:
+        raise HTTPException(status_code=422, detail={"message": "No valid events in batch", "errors": errors[:MAX_REPORTED_ERRORS]})
+
+    if session.id is None and any(not event.session_id for _, event in valid):
+        # Events without a session_id are the caller's session's first write
+        session = materialize_session(request, db, session.session_id)
+
+    # Each shard's share of the batch is loaded in its own transaction
+    caller_shard = shard_router.shard_for(session.session_id)
+    groups: Dict[str, List[int]] = {}
+    for position, (_, event) in enumerate(valid):
+        shard = shard_router.shard_for(event.session_id) if event.session_id else caller_shard
+        groups.setdefault(shard, []).append(position)
+
+    inserted, duplicates, refused = 0, 0, []
+    for shard, positions in groups.items():
+        shard_db = db if shard == caller_shard else shard_router.session_on(shard)
+        try:
+            shard_inserted, shard_duplicates, shard_refused = EventIngestionService.load(
+                shard_db, [valid[p][1] for p in positions], session if shard == caller_shard else None
+            )
+        except Exception as e:
+            shard_db.rollback()
+            logger.error("Ingest batch failed on shard %s: %s", shard, e, exc_info=True)
+            stored = f"{inserted} events on other shards were stored" if inserted else "no events stored"
+            raise HTTPException(status_code=500, detail=f"Ingest failed, {stored}: {str(e)}")
+        finally:
+            if shard_db is not db:
+                shard_db.close()
+        inserted += shard_inserted
+        duplicates += shard_duplicates
+        refused.extend((positions[p], reason) for p, reason in shard_refused)
+
+    if refused:
+        errors.extend({"index": valid[position][0], "errors": [reason]} for position, reason in refused)
+        errors.sort(key=lambda e: e["index"])
+
+    duration_ms = (time.perf_counter() - start) * 1000
+    logger.info("Ingested %d events (%d duplicates, %d rejected) in %.1fms", inserted, duplicates, len(errors), duration_ms)
+
+    return IngestResponse(
+        received=len(objects),
+        accepted=inserted,
+        duplicates=duplicates,
+        rejected=len(errors),
+        errors=errors[:MAX_REPORTED_ERRORS],
+        duration_ms=round(duration_ms, 2),
+    )
@@ -0,0 +1,113 @@
+"""Model pricing API endpoints"""
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session as DBSession
+from pydantic import BaseModel, ConfigDict, Field
+from typing import List, Optional
+from datetime import datetime
+from decimal import Decimal
+import logging
+
+from ..db.models import ModelPrice, CostBackfillJob
+from ..db.base import get_db
+from ..db.shards import shard_router
+from ..dependencies import require_admin
+from ..services.pricing import PricingService
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/pricing", tags=["pricing"])
+
+
+class PriceVersionIn(BaseModel):
+    """A new price version; takes effect at effective_from"""
+    model_config = ConfigDict(protected_namespaces=())
+
+    model_prefix: str = Field(..., max_length=50)
+    provider: str = Field("anthropic", max_length=50)
+    input_per_mtok: Decimal = Field(..., ge=0)
+    output_per_mtok: Decimal = Field(..., ge=0)
+    cached_input_per_mtok: Decimal = Field(Decimal(0), ge=0)
+    effective_from: datetime
+
+
+class PriceVersionOut(PriceVersionIn):
+    id: int
+
+
+class BackfillJobOut(BaseModel):
+    id: int
+    shard: Optional[str] = None
+    status: str
+    started_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    since: Optional[datetime] = None
+    until: Optional[datetime] = None
+    cursor_time: Optional[datetime] = None
+    rows_scanned: Optional[int] = None
+    rows_updated: Optional[int] = None
+    error_message: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+
+def _to_out(row: ModelPrice) -> PriceVersionOut:
+    return PriceVersionOut(
+        id=row.id,
+        model_prefix=row.model_prefix,
+        provider=row.provider,
+        input_per_mtok=row.input_per_mtok,
+        output_per_mtok=row.output_per_mtok,
+        cached_input_per_mtok=row.cached_input_per_mtok,
+        effective_from=row.effective_from,
+    )
+
+
+@router.get("", response_model=List[PriceVersionOut])
+async def list_prices(db: DBSession = Depends(get_db)):
+    """All price versions, newest first per model"""
+    rows = (
+        db.query(ModelPrice)
+        .order_by(ModelPrice.model_prefix, ModelPrice.effective_from.desc())
+        .all()
+    )
+    return [_to_out(r) for r in rows]
+
+
+@router.post("", response_model=PriceVersionOut, dependencies=[Depends(require_admin)])
+async def add_price(price: PriceVersionIn, db: DBSession = Depends(get_db)):
+    """
+    Add a price version. Existing events keep their stored cost until
+    `python -m app.services.cost_backfill` is run over the affected range.
+    """
+    exists = db.query(ModelPrice).filter(
+        ModelPrice.model_prefix == price.model_prefix,
+        ModelPrice.provider == price.provider,
+        ModelPrice.effective_from == price.effective_from,
+    ).first()
+    if exists:
+        raise HTTPException(status_code=409, detail="A price version with this effective_from already exists")
+
+    row = ModelPrice(**price.model_dump())
+    db.add(row)
+    db.commit()
+    db.refresh(row)
+    PricingService.invalidate()
+    logger.info("Added price version %s for %s effective %s", row.id, row.model_prefix, row.effective_from)
+    return _to_out(row)
+
+
+@router.get("/backfill/jobs", response_model=List[BackfillJobOut], dependencies=[Depends(require_admin)])
+async def list_backfill_jobs(limit: int = 20):
+    """Recent cost backfill runs with their progress cursor; each shard keeps its own jobs"""
+    limit = min(max(limit, 1), 100)
+
+    def recent_jobs(db: DBSession) -> List[BackfillJobOut]:
+        jobs = db.query(CostBackfillJob).order_by(CostBackfillJob.id.desc()).limit(limit).all()
+        return [BackfillJobOut.model_validate(j) for j in jobs]
+
+    jobs = []
+    for shard, shard_jobs in shard_router.scatter(recent_jobs).items():
+        jobs.extend(job.model_copy(update={"shard": shard}) for job in shard_jobs)
+    jobs.sort(key=lambda j: j.started_at.timestamp() if j.started_at else 0, reverse=True)
+    return jobs[:limit]
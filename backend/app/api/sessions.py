@@ -1,16 +1,21 @@
 """Session management API endpoints"""
-from fastapi import APIRouter, Depends, HTTPException, Response
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from sqlalchemy.orm import Session as DBSession
-from sqlalchemy import func, and_
-from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from sqlalchemy import func, distinct
+from pydantic import BaseModel, Field
+from typing import Literal, Optional, Dict, Any
 from datetime import datetime, timedelta
 import logging
 
 from ..db.models import Session, LLMEvent
-from ..db.base import get_db
-from ..dependencies import get_session_id, get_current_session
-from ..config import settings
+from ..db.dimensions import dimensions
+from ..dependencies import get_current_session, get_writable_session, get_session_db, get_path_session_db, get_read_db
+from .. import session_tokens
+from ..responses import FastJSONResponse
+from ..services.session_quota import SessionQuotaService
+from ..services.event_archive import EventArchiveService
+from ..services.pricing import from_micros
+from ..services.content_capture import ContentCaptureService, METADATA_KEY
 
 logger = logging.getLogger(__name__)
 
@@ -27,6 +32,8 @@ class SessionResponse(BaseModel):
     event_count: int
     total_tokens: int
     total_cost: float
+    evicted_event_count: int = 0  # Included in the totals; removed by the per-session cap
+    archived_event_count: int = 0  # Included in the totals; moved to the Parquet archive
 
     class Config:
         from_attributes = True
@@ -35,6 +42,7 @@ class SessionResponse(BaseModel):
 class CreateSessionResponse(BaseModel):
     """Response for session creation"""
     session_id: str
+    session_token: str  # Send as X-Session-ID; replace with X-Session-Token when a response carries one
     message: str
 
 
@@ -45,45 +53,44 @@ class SessionMetrics(BaseModel):
     total_tokens: int
     total_cost: float
     models_used: list
+    evicted_event_count: int = 0  # Included in the totals; removed by the per-session cap
+    archived_event_count: int = 0  # Included in the totals; moved to the Parquet archive
+
+
+class CapturePolicyRequest(BaseModel):
+    """Session override of the content-capture policy; omitted fields follow the deployment default"""
+    mode: Optional[Literal["full", "truncated", "hashed", "sampled"]] = None
+    max_chars: Optional[int] = Field(None, ge=0)
+    sample_rate: Optional[float] = Field(None, ge=0, le=1)
+
+
+class CapturePolicyResponse(BaseModel):
+    """Effective content-capture policy of a session"""
+    session_id: str
+    mode: str
+    max_chars: int
+    sample_rate: float
+    override: Dict[str, Any]  # What the session sets itself; {} = deployment default
 
 
 @router.post("/create", response_model=CreateSessionResponse)
-async def create_session(
-    response: Response,
-    db: DBSession = Depends(get_db)
-):
+async def create_session(response: Response):
     """
     Create a new session.
     Returns the session_id and sets it in a cookie.
     """
-    import uuid
+    # The token is self-validating; the row is only created on the first write
+    session_id = session_tokens.new_session_id()
+    token = session_tokens.sign(session_id)
 
-    # Generate new session ID
-    session_id = str(uuid.uuid4())
+    # Set session cookie (and X-Session-Token for header-based clients)
+    session_tokens.set_cookie(response, token)
 
-    # Create session in database
-    new_session = Session(
-        session_id=session_id,
-        is_active=True,
-        session_metadata={}
-    )
-    db.add(new_session)
-    db.commit()
-    db.refresh(new_session)
-
-    # Set session cookie
-    response.set_cookie(
-        key=settings.session_cookie_name,
-        value=session_id,
-        httponly=True,
-        max_age=settings.session_ttl_days * 24 * 60 * 60,  # Convert days to seconds
-        samesite="lax"
-    )
-
-    logger.info(f"Created new session: {session_id}")
+    logger.info("Created new session: %s", session_id)
 
     return CreateSessionResponse(
         session_id=session_id,
+        session_token=token,
         message="Session created successfully"
     )
 
@@ -91,7 +98,7 @@ async def create_session(
 @router.get("/{session_id}", response_model=SessionResponse)
 async def get_session(
     session_id: str,
-    db: DBSession = Depends(get_db)
+    db: DBSession = Depends(get_path_session_db)
 ):
     """
     Get session information by session_id.
@@ -107,7 +114,7 @@ async def get_session(
     metrics = db.query(
         func.count(LLMEvent.id).label('event_count'),
         func.coalesce(func.sum(LLMEvent.tokens_total), 0).label('total_tokens'),
-        func.coalesce(func.sum(LLMEvent.cost_usd), 0.0).label('total_cost')
+        func.coalesce(func.sum(LLMEvent.cost_micros), 0).label('total_cost_micros')
     ).filter(LLMEvent.session_id == session.id).first()
 
     return SessionResponse(
@@ -116,26 +123,41 @@ async def get_session(
         last_activity=session.last_activity,
         is_active=session.is_active,
         metadata=session.session_metadata or {},
-        event_count=metrics.event_count or 0,
-        total_tokens=int(metrics.total_tokens or 0),
-        total_cost=float(metrics.total_cost or 0.0)
+        event_count=(metrics.event_count or 0) + session.evicted_event_count + session.archived_event_count,
+        total_tokens=int(metrics.total_tokens or 0) + session.evicted_tokens_total + session.archived_tokens_total,
+        total_cost=float(from_micros(metrics.total_cost_micros) + session.evicted_cost_usd + session.archived_cost_usd),
+        evicted_event_count=session.evicted_event_count,
+        archived_event_count=session.archived_event_count
     )
 
 
 @router.get("/current/info", response_model=SessionResponse)
 async def get_current_session_info(
     session: Session = Depends(get_current_session),
-    db: DBSession = Depends(get_db)
+    db: DBSession = Depends(get_read_db)
 ):
     """
     Get current session information (from cookie or header).
     Returns session metadata and aggregated metrics.
     """
+    if session.id is None:
+        # Never written to: all zeros, without a query
+        return SessionResponse(
+            session_id=session.session_id,
+            created_at=session.created_at,
+            last_activity=session.last_activity,
+            is_active=True,
+            metadata={},
+            event_count=0,
+            total_tokens=0,
+            total_cost=0.0
+        )
+
     # Get aggregated metrics
     metrics = db.query(
         func.count(LLMEvent.id).label('event_count'),
         func.coalesce(func.sum(LLMEvent.tokens_total), 0).label('total_tokens'),
-        func.coalesce(func.sum(LLMEvent.cost_usd), 0.0).label('total_cost')
+        func.coalesce(func.sum(LLMEvent.cost_micros), 0).label('total_cost_micros')
     ).filter(LLMEvent.session_id == session.id).first()
 
     return SessionResponse(
@@ -144,16 +166,18 @@ async def get_current_session_info(
         last_activity=session.last_activity,
         is_active=session.is_active,
         metadata=session.session_metadata or {},
-        event_count=metrics.event_count or 0,
-        total_tokens=int(metrics.total_tokens or 0),
-        total_cost=float(metrics.total_cost or 0.0)
+        event_count=(metrics.event_count or 0) + session.evicted_event_count + session.archived_event_count,
+        total_tokens=int(metrics.total_tokens or 0) + session.evicted_tokens_total + session.archived_tokens_total,
+        total_cost=float(from_micros(metrics.total_cost_micros) + session.evicted_cost_usd + session.archived_cost_usd),
+        evicted_event_count=session.evicted_event_count,
+        archived_event_count=session.archived_event_count
     )
 
 
 @router.post("/{session_id}/reset")
 async def reset_session(
     session_id: str,
-    db: DBSession = Depends(get_db)
+    db: DBSession = Depends(get_path_session_db)
 ):
     """
     Reset a session by deleting all its events.
@@ -168,13 +192,16 @@ async def reset_session(
     # Delete all events for this session
     deleted_count = db.query(LLMEvent).filter(LLMEvent.session_id == session.id).delete()
 
-    # Reset session metadata
-    session.session_metadata = {}
+    # Reset session metadata and event counters; archived events stay hidden from here on
+    session.session_metadata = {
+        **EventArchiveService.reset_marker(), **ContentCaptureService.carry_over(session.session_metadata)
+    }
     session.last_activity = func.now()
+    SessionQuotaService.reset(session)
 
     db.commit()
 
-    logger.info(f"Reset session {session_id}: deleted {deleted_count} events")
+    logger.info("Reset session %s: deleted %d events", session_id, deleted_count)
 
     return {
         "success": True,
@@ -186,22 +213,32 @@ async def reset_session(
 @router.post("/current/reset")
 async def reset_current_session(
     session: Session = Depends(get_current_session),
-    db: DBSession = Depends(get_db)
+    db: DBSession = Depends(get_session_db)
 ):
     """
     Reset the current session (from cookie or header).
     Deletes all events for this session.
     """
+    if session.id is None:
+        return {
+            "success": True,
+            "message": "Session reset successfully. Deleted 0 events.",
+            "session_id": session.session_id
+        }
+
     # Delete all events for this session
     deleted_count = db.query(LLMEvent).filter(LLMEvent.session_id == session.id).delete()
 
-    # Reset session metadata
-    session.session_metadata = {}
+    # Reset session metadata and event counters; archived events stay hidden from here on
+    session.session_metadata = {
+        **EventArchiveService.reset_marker(), **ContentCaptureService.carry_over(session.session_metadata)
+    }
     session.last_activity = func.now()
+    SessionQuotaService.reset(session)
 
     db.commit()
 
-    logger.info(f"Reset current session {session.session_id}: deleted {deleted_count} events")
+    logger.info("Reset current session %s: deleted %d events", session.session_id, deleted_count)
 
     return {
         "success": True,
@@ -212,40 +249,85 @@ async def reset_current_session(
 
 @router.get("/current/metrics", response_model=SessionMetrics)
 async def get_current_session_metrics(
+    request: Request,
     session: Session = Depends(get_current_session),
-    db: DBSession = Depends(get_db)
+    db: DBSession = Depends(get_read_db)
 ):
     """
     Get metrics for the current session.
     Returns aggregated statistics about the session's events.
     """
-    # Get aggregated metrics
+    if session.id is None:
+        return FastJSONResponse({
+            "session_id": session.session_id,
+            "event_count": 0,
+            "total_tokens": 0,
+            "total_cost": 0.0,
+            "models_used": [],
+            "evicted_event_count": 0,
+            "archived_event_count": 0,
+        }, request=request)
+
+    # Totals and distinct models in one pass over the session's events
     metrics = db.query(
         func.count(LLMEvent.id).label('event_count'),
         func.coalesce(func.sum(LLMEvent.tokens_total), 0).label('total_tokens'),
-        func.coalesce(func.sum(LLMEvent.cost_usd), 0.0).label('total_cost')
+        func.coalesce(func.sum(LLMEvent.cost_micros), 0).label('total_cost_micros'),
+        func.array_remove(func.array_agg(distinct(LLMEvent.model_id)), None).label('model_ids')
     ).filter(LLMEvent.session_id == session.id).first()
 
-    # Get unique models used
-    models = db.query(LLMEvent.model).filter(
-        and_(LLMEvent.session_id == session.id, LLMEvent.model.isnot(None))
-    ).distinct().all()
+    return FastJSONResponse({
+        "session_id": session.session_id,
+        "event_count": (metrics.event_count or 0) + session.evicted_event_count + session.archived_event_count,
+        "total_tokens": int(metrics.total_tokens or 0) + session.evicted_tokens_total + session.archived_tokens_total,
+        "total_cost": float(from_micros(metrics.total_cost_micros) + session.evicted_cost_usd + session.archived_cost_usd),
+        "models_used": dimensions.decode_many(db, "model", metrics.model_ids or []),
+        "evicted_event_count": session.evicted_event_count,
+        "archived_event_count": session.archived_event_count,
+    }, request=request)
 
-    models_used = [model[0] for model in models] if models else []
 
-    return SessionMetrics(
+def _capture_policy(session: Session) -> CapturePolicyResponse:
+    policy = ContentCaptureService.for_session(session)
+    return CapturePolicyResponse(
         session_id=session.session_id,
-        event_count=metrics.event_count or 0,
-        total_tokens=int(metrics.total_tokens or 0),
-        total_cost=float(metrics.total_cost or 0.0),
-        models_used=models_used
+        override=ContentCaptureService.override(session.session_metadata),
+        **policy._asdict(),
     )
 
 
+@router.get("/current/capture", response_model=CapturePolicyResponse)
+async def get_current_capture_policy(session: Session = Depends(get_current_session)):
+    """How much prompt/response content the current session's events keep"""
+    return _capture_policy(session)
+
+
+@router.put("/current/capture", response_model=CapturePolicyResponse)
+async def set_current_capture_policy(
+    policy: CapturePolicyRequest,
+    session: Session = Depends(get_writable_session),
+    db: DBSession = Depends(get_session_db)
+):
+    """
+    Override the deployment's content-capture policy for the current session.
+    Applies to events written from now on; an empty body goes back to the default.
+    Failed calls keep their content in full under every policy.
+    """
+    override = policy.model_dump(exclude_none=True)
+    metadata = {k: v for k, v in (session.session_metadata or {}).items() if k != METADATA_KEY}
+    if override:
+        metadata[METADATA_KEY] = override
+    session.session_metadata = metadata
+    db.commit()
+
+    logger.info("Content capture for session %s set to %s", session.session_id, override or "the default")
+    return _capture_policy(session)
+
+
 @router.delete("/{session_id}")
 async def delete_session(
     session_id: str,
-    db: DBSession = Depends(get_db)
+    db: DBSession = Depends(get_path_session_db)
 ):
     """
     Permanently delete a session and all its events.
@@ -261,7 +343,7 @@ async def delete_session(
     db.delete(session)
     db.commit()
 
-    logger.info(f"Deleted session {session_id}")
+    logger.info("Deleted session %s", session_id)
 
     return {
         "success": True,
@@ -1,5 +1,5 @@
 """Database package"""
 from .base import Base, engine, SessionLocal, get_db
-from .models import Session, LLMEvent
+from .models import Session, LLMEvent, ModelPrice, CostBackfillJob
 
-__all__ = ['Base', 'engine', 'SessionLocal', 'get_db', 'Session', 'LLMEvent']
+__all__ = ['Base', 'engine', 'SessionLocal', 'get_db', 'Session', 'LLMEvent', 'ModelPrice', 'CostBackfillJob']
@@ -4,8 +4,17 @@ from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from ..config import settings
 
+
+def create_db_engine(url: str):
+    """Engine for a database the request path uses (the catalog, shards, replicas)"""
+    connect_args = {}
+    if url.startswith("postgres"):
+        connect_args["connect_timeout"] = settings.database_connect_timeout_seconds
+    return create_engine(url, pool_pre_ping=True, connect_args=connect_args)
+
+
 # Database engine
-engine = create_engine(settings.database_url, pool_pre_ping=True)
+engine = create_db_engine(settings.database_url)
 
 # Session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
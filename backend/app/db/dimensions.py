@@ -0,0 +1,218 @@
+"""Dictionary encoding of the repeated event dimensions: model, provider, endpoint, status"""
+from sqlalchemy import select, event
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DataError
+from sqlalchemy.orm import Session as DBSession, SessionTransaction
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from decimal import Decimal, ROUND_HALF_UP
+import threading
+import logging
+
+from .models import EventModel, EventProvider, EventEndpoint, EventStatus
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+# Dimension -> lookup table; playground_events stores <dimension>_id
+TABLES = {
+    "model": EventModel.__table__,
+    "provider": EventProvider.__table__,
+    "endpoint": EventEndpoint.__table__,
+    "status": EventStatus.__table__,
+}
+
+# Event columns as the API and exports name them -> as playground_events stores them
+STORED_COLUMNS = {
+    "model": "model_id",
+    "provider": "provider_id",
+    "endpoint": "endpoint_id",
+    "status": "status_id",
+    "cost_usd": "cost_micros",
+}
+
+MICRO = Decimal("0.000001")
+
+
+def to_micros(usd) -> Optional[int]:
+    """USD -> integer micro-dollars (half-up), as stored in playground_events.cost_micros"""
+    if usd is None:
+        return None
+    return int(Decimal(usd).quantize(MICRO, rounding=ROUND_HALF_UP).scaleb(6))
+
+
+def from_micros(micros) -> Optional[Decimal]:
+    """Integer micro-dollars (or a SUM of them) -> USD with 6 decimal places"""
+    if micros is None:
+        return None
+    return Decimal(int(micros)).scaleb(-6)
+
+
+class DimensionLimitExceeded(ValueError):
+    """A new value would take a lookup table past dimension_max_values"""
+
+
+def stored(column: str) -> str:
+    return STORED_COLUMNS.get(column, column)
+
+
+def _engine(db) -> Engine:
+    bind = db.get_bind() if isinstance(db, DBSession) else db
+    return getattr(bind, "engine", bind)
+
+
+class DimensionDictionary:
+    """
+    Process-wide cache of the lookup tables, per database.
+
+    Ids are assigned by each database (every shard has its own tables; a
+    replica has its primary's), so the cache is keyed by the engine's URL.
+    The tables only ever grow: a value's id never changes, which is what
+    lets the cache live for the whole process.
+
+    A value seen for the first time is inserted in a savepoint of the
+    caller's transaction, on its connection, so encoding never checks out
+    a second one. Until that transaction commits, the id is only known to
+    its DB session (db.info); a rollback forgets it. Each table takes at
+    most dimension_max_values values: past that, encode raises
+    DimensionLimitExceeded. That bounds both the id space (model and
+    provider ids are smallints) and this cache, whatever producers send.
+    Callers inserting several new values should do so in sorted order,
+    so concurrent transactions wait on each other's rows in one order.
+    """
+
+    def __init__(self):
+        self._ids: Dict[Tuple[str, str], Dict[str, int]] = {}
+        self._names: Dict[Tuple[str, str], Dict[int, str]] = {}
+        self._lock = threading.Lock()
+
+    def _load(self, db, dimension: str) -> Tuple[Dict[str, int], Dict[int, str]]:
+        table = TABLES[dimension]
+        key = (str(_engine(db).url), dimension)
+        rows = db.execute(select(table.c.id, table.c.name)).all()
+        with self._lock:
+            ids = self._ids.setdefault(key, {})
+            names = self._names.setdefault(key, {})
+            for id_, name in rows:
+                ids[name] = id_
+                names[id_] = name
+        return ids, names
+
+    def _maps(self, db, dimension: str) -> Tuple[Dict[str, int], Dict[int, str]]:
+        key = (str(_engine(db).url), dimension)
+        if key not in self._ids:
+            return self._load(db, dimension)
+        return self._ids[key], self._names[key]
+
+    def encode(self, db: DBSession, dimension: str, value: Optional[str], capped: bool = True) -> Optional[int]:
+        """
+        Id of value, adding it to the lookup table (in db's transaction) if
+        it is new. capped=False skips dimension_max_values, for values that
+        already exist on another shard.
+        """
+        if value is None:
+            return None
+        ids, _ = self._maps(db, dimension)
+        found = ids.get(value)
+        if found is not None:
+            return found
+        pending = db.info.setdefault("dimensions_pending", {})
+        key = (str(_engine(db).url), dimension)
+        found = pending.get(key, {}).get(value)
+        if found is not None:
+            return found
+
+        limit = settings.dimension_max_values
+        if capped and len(ids) + len(pending.get(key, {})) >= limit:
+            ids, _ = self._load(db, dimension)
+            found = ids.get(value)
+            if found is not None:
+                return found
+            if len(ids) >= limit:
+                raise DimensionLimitExceeded(f"{dimension} has reached its limit of {limit} distinct values")
+
+        table = TABLES[dimension]
+        try:
+            with db.begin_nested():
+                db.execute(insert(table).values(name=value).on_conflict_do_nothing(index_elements=["name"]))
+                found = db.execute(select(table.c.id).where(table.c.name == value)).scalar_one()
+        except DataError as e:
+            # The id column's range is exhausted
+            raise DimensionLimitExceeded(f"{dimension} has no ids left: {e.orig}")
+        pending.setdefault(key, {})[value] = found
+        logger.info("New %s %r encoded as %d", dimension, value, found)
+        return found
+
+    def _publish(self, pending: Dict[Tuple[str, str], Dict[str, int]]):
+        with self._lock:
+            for key, values in pending.items():
+                ids = self._ids.setdefault(key, {})
+                names = self._names.setdefault(key, {})
+                for value, id_ in values.items():
+                    ids[value] = id_
+                    names[id_] = value
+
+    def encode_all(self, db, **values: Optional[str]) -> Dict[str, Optional[int]]:
+        """encode_all(db, model=..., status=...) -> {"model_id": ..., "status_id": ...}, for LLMEvent(**...)"""
+        return {f"{dimension}_id": self.encode(db, dimension, value) for dimension, value in values.items()}
+
+    def lookup(self, db, dimension: str, value: str) -> Optional[int]:
+        """Id of an existing value without adding it (for filters: an unknown value matches nothing)"""
+        ids, _ = self._maps(db, dimension)
+        if value not in ids:
+            ids, _ = self._load(db, dimension)
+        return ids.get(value)
+
+    def decode(self, db, dimension: str, id_: Optional[int]) -> Optional[str]:
+        if id_ is None:
+            return None
+        _, names = self._maps(db, dimension)
+        name = names.get(id_)
+        if name is None:
+            # Added by another process since this one loaded the table
+            _, names = self._load(db, dimension)
+            name = names.get(id_)
+        return name
+
+    def decode_many(self, db, dimension: str, ids: Iterable[Optional[int]]) -> list:
+        return [self.decode(db, dimension, id_) for id_ in ids]
+
+    def row_decoder(self, db, columns: List[str]) -> Callable[[tuple], tuple]:
+        """
+        For rows selected as [stored(c) for c in columns]: a function that
+        turns one back into the public values (names, cost in USD)
+        """
+        converters = []
+        for column in columns:
+            if column in TABLES:
+                converters.append(lambda value, dimension=column: self.decode(db, dimension, value))
+            elif column == "cost_usd":
+                converters.append(from_micros)
+            else:
+                converters.append(None)
+        return lambda row: tuple(value if convert is None else convert(value) for convert, value in zip(converters, row))
+
+    def decode_row(self, db, row) -> dict:
+        """A result mapping with <dimension>_id columns, with those replaced by their values"""
+        decoded = dict(row)
+        for dimension in TABLES:
+            if f"{dimension}_id" in decoded:
+                decoded[dimension] = self.decode(db, dimension, decoded.pop(f"{dimension}_id"))
+        return decoded
+
+
+dimensions = DimensionDictionary()
+
+
+@event.listens_for(DBSession, "after_commit")
+def _publish_pending(db: DBSession):
+    pending = db.info.pop("dimensions_pending", None)
+    if pending:
+        dimensions._publish(pending)
+
+
+@event.listens_for(DBSession, "after_transaction_end")
+def _forget_pending(db: DBSession, transaction: SessionTransaction):
+    # Rolled back (a commit has published them already): the rows are gone with the transaction
+    if transaction.parent is None:
+        db.info.pop("dimensions_pending", None)
@@ -30,6 +30,15 @@ from app.config import settings
 if settings.database_url:
     config.set_main_option("sqlalchemy.url", settings.database_url)
 
+# Migrate one shard: alembic -x shard=<name> upgrade head (names from SHARD_DATABASE_URLS)
+from app.db.shards import parse_shard_urls
+_shard = context.get_x_argument(as_dictionary=True).get("shard")
+if _shard:
+    _urls = dict(parse_shard_urls(settings.shard_database_urls))
+    if _shard not in _urls:
+        raise SystemExit(f"Unknown shard {_shard!r}; configured: {', '.join(_urls) or 'none'}")
+    config.set_main_option("sqlalchemy.url", _urls[_shard])
+
 
 def run_migrations_offline() -> None:
     """Run migrations in 'offline' mode.
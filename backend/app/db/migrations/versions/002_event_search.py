@@ -0,0 +1,52 @@
+"""Full-text search vector over event prompts and responses
+
+Revision ID: 002_event_search
+Revises: 001_initial_schema
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '002_event_search'
+down_revision = '001_initial_schema'
+branch_labels = None
+depends_on = None
+
+# Prompt text (every message's string content) weighted above the response.
+# Must match LLMEvent.search_vector in app/db/models.py.
+SEARCH_VECTOR_SQL = (
+    "setweight(jsonb_to_tsvector('english'::regconfig, "
+    "coalesce(jsonb_path_query_array(messages, '$[*].content'), '[]'::jsonb), '[\"string\"]'), 'A') || "
+    "setweight(to_tsvector('english'::regconfig, coalesce(response, '')), 'B')"
+)
+
+
+def upgrade() -> None:
+    # Adding a STORED generated column rewrites the table once; run off-peak on large tables
+    op.add_column(
+        'playground_events',
+        sa.Column('search_vector', postgresql.TSVECTOR(), sa.Computed(SEARCH_VECTOR_SQL, persisted=True), nullable=True)
+    )
+    op.create_index(
+        'ix_playground_events_search_vector',
+        'playground_events',
+        ['search_vector'],
+        unique=False,
+        postgresql_using='gin'
+    )
+    # Search results are scoped by session and ordered/filtered by time
+    op.create_index(
+        'ix_playground_events_session_id_time',
+        'playground_events',
+        ['session_id', 'time'],
+        unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_playground_events_session_id_time', table_name='playground_events')
+    op.drop_index('ix_playground_events_search_vector', table_name='playground_events')
+    op.drop_column('playground_events', 'search_vector')
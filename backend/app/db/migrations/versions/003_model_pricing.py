@@ -0,0 +1,82 @@
+"""Versioned model pricing, cached-input tokens and cost backfill jobs
+
+Revision ID: 003_model_pricing
+Revises: 002_event_search
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '003_model_pricing'
+down_revision = '002_event_search'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('playground_events', sa.Column('tokens_cached_input', sa.Integer(), nullable=True))
+
+    op.create_table(
+        'playground_model_prices',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('model_prefix', sa.String(length=50), nullable=False),
+        sa.Column('provider', sa.String(length=50), nullable=False),
+        sa.Column('input_per_mtok', sa.DECIMAL(precision=12, scale=6), nullable=False),
+        sa.Column('output_per_mtok', sa.DECIMAL(precision=12, scale=6), nullable=False),
+        sa.Column('cached_input_per_mtok', sa.DECIMAL(precision=12, scale=6), nullable=False),
+        sa.Column('effective_from', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('model_prefix', 'provider', 'effective_from', name='uq_model_prices_version')
+    )
+
+    # Seed with the list prices in effect when the playground launched
+    prices = sa.table(
+        'playground_model_prices',
+        sa.column('model_prefix', sa.String),
+        sa.column('provider', sa.String),
+        sa.column('input_per_mtok', sa.DECIMAL),
+        sa.column('output_per_mtok', sa.DECIMAL),
+        sa.column('cached_input_per_mtok', sa.DECIMAL),
+        sa.column('effective_from', sa.DateTime(timezone=True)),
+    )
+    op.bulk_insert(prices, [
+        {'model_prefix': prefix, 'provider': 'anthropic', 'input_per_mtok': i, 'output_per_mtok': o,
+         'cached_input_per_mtok': c, 'effective_from': '2024-01-01T00:00:00+00:00'}
+        for prefix, i, o, c in [
+            ('claude-3-5-sonnet', 3.0, 15.0, 0.30),
+            ('claude-3-5-haiku', 0.80, 4.0, 0.08),
+            ('claude-3-opus', 15.0, 75.0, 1.50),
+            ('claude-3-sonnet', 3.0, 15.0, 0.30),
+            ('claude-3-haiku', 0.25, 1.25, 0.03),
+        ]
+    ])
+
+    op.create_table(
+        'playground_cost_backfill_jobs',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('started_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('since', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('until', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('cursor_time', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('cursor_id', postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column('rows_scanned', sa.Integer(), nullable=True),
+        sa.Column('rows_updated', sa.Integer(), nullable=True),
+        sa.Column('error_message', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+    # Keyset scan order for the backfill
+    op.create_index('ix_playground_events_time_id', 'playground_events', ['time', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_playground_events_time_id', table_name='playground_events')
+    op.drop_table('playground_cost_backfill_jobs')
+    op.drop_table('playground_model_prices')
+    op.drop_column('playground_events', 'tokens_cached_input')
@@ -0,0 +1,38 @@
+"""Maintained per-session event counters and eviction rollups
+
+Revision ID: 004_session_event_counters
+Revises: 003_model_pricing
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '004_session_event_counters'
+down_revision = '003_model_pricing'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Constant defaults: no table rewrite on PostgreSQL 11+
+    op.add_column('playground_sessions', sa.Column('event_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('playground_sessions', sa.Column('evicted_event_count', sa.BigInteger(), server_default='0', nullable=False))
+    op.add_column('playground_sessions', sa.Column('evicted_tokens_total', sa.BigInteger(), server_default='0', nullable=False))
+    op.add_column('playground_sessions', sa.Column('evicted_cost_usd', sa.DECIMAL(precision=14, scale=6), server_default='0', nullable=False))
+
+    # Seed counters from the existing rows; one grouped pass over playground_events
+    op.execute("""
+        UPDATE playground_sessions s
+        SET event_count = c.n
+        FROM (SELECT session_id, count(*) AS n FROM playground_events GROUP BY session_id) c
+        WHERE s.id = c.session_id
+    """)
+
+
+def downgrade() -> None:
+    op.drop_column('playground_sessions', 'evicted_cost_usd')
+    op.drop_column('playground_sessions', 'evicted_tokens_total')
+    op.drop_column('playground_sessions', 'evicted_event_count')
+    op.drop_column('playground_sessions', 'event_count')
@@ -0,0 +1,24 @@
+"""Upstream queue wait per event
+
+Revision ID: 005_event_queue_wait
+Revises: 004_session_event_counters
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '005_event_queue_wait'
+down_revision = '004_session_event_counters'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Nullable, no default: metadata-only change
+    op.add_column('playground_events', sa.Column('queue_wait_ms', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('playground_events', 'queue_wait_ms')
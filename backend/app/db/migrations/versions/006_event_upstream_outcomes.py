@@ -0,0 +1,25 @@
+"""Hedge and circuit-breaker outcome per event
+
+Revision ID: 006_event_upstream_outcomes
+Revises: 005_event_queue_wait
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '006_event_upstream_outcomes'
+down_revision = '005_event_queue_wait'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('playground_events', sa.Column('hedge_outcome', sa.String(length=20), nullable=True))
+    op.add_column('playground_events', sa.Column('circuit_state', sa.String(length=20), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('playground_events', 'circuit_state')
+    op.drop_column('playground_events', 'hedge_outcome')
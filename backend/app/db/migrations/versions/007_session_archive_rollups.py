@@ -0,0 +1,28 @@
+"""Per-session rollups of events moved to the Parquet archive
+
+Revision ID: 007_session_archive_rollups
+Revises: 006_event_upstream_outcomes
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '007_session_archive_rollups'
+down_revision = '006_event_upstream_outcomes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Constant defaults: no table rewrite on PostgreSQL 11+
+    op.add_column('playground_sessions', sa.Column('archived_event_count', sa.BigInteger(), server_default='0', nullable=False))
+    op.add_column('playground_sessions', sa.Column('archived_tokens_total', sa.BigInteger(), server_default='0', nullable=False))
+    op.add_column('playground_sessions', sa.Column('archived_cost_usd', sa.DECIMAL(precision=14, scale=6), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('playground_sessions', 'archived_cost_usd')
+    op.drop_column('playground_sessions', 'archived_tokens_total')
+    op.drop_column('playground_sessions', 'archived_event_count')
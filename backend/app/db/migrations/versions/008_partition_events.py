@@ -0,0 +1,129 @@
+"""Range-partition playground_events by time
+
+Revision ID: 008_partition_events
+Revises: 007_session_archive_rollups
+Create Date: 2026-10-18
+
+The existing table is not rewritten. It is renamed to
+playground_events_legacy and attached as the partition for everything
+before a cutover (the start of the day after tomorrow, UTC), under a new
+partitioned playground_events. Two things keep the locked part short:
+
+- A validated CHECK (time < cutover) lets ATTACH skip scanning the table.
+- Every index the parent declares already exists on it with the same
+  definition, so the parent adopts them instead of building new ones.
+  The BRIN index is built CONCURRENTLY beforehand for this.
+
+New rows go to daily partitions from the cutover onwards (and to the
+DEFAULT partition if they fall outside all of them). After that,
+app.services.event_partitions keeps creating partitions ahead of time.
+The legacy partition is dropped like any other once retention has passed
+its upper bound, or it can be emptied by the archive job.
+"""
+from datetime import datetime, timedelta, timezone
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '008_partition_events'
+down_revision = '007_session_archive_rollups'
+branch_labels = None
+depends_on = None
+
+PREMAKE_DAYS = 7
+
+# Index name -> definition; the same on the parent, the legacy table and the downgraded table
+INDEXES = {
+    'ix_playground_events_session_id': 'btree (session_id)',
+    'ix_playground_events_model': 'btree (model)',
+    'ix_playground_events_provider': 'btree (provider)',
+    'ix_playground_events_user_id': 'btree (user_id)',
+    'ix_playground_events_search_vector': 'gin (search_vector)',
+    'ix_playground_events_session_id_time': 'btree (session_id, "time")',
+    'ix_playground_events_time_id': 'btree ("time", id)',
+    'ix_playground_events_time_brin': 'brin ("time")',
+}
+
+# Every column but the generated search_vector, in table order
+COLUMNS_SQL = """
+    SELECT string_agg(quote_ident(column_name), ', ' ORDER BY ordinal_position)
+    FROM information_schema.columns
+    WHERE table_schema = current_schema() AND table_name = :table AND is_generated = 'NEVER'
+"""
+
+
+def _add_keys(table: str) -> None:
+    op.execute(f'ALTER TABLE {table} ADD CONSTRAINT playground_events_pkey PRIMARY KEY (id, "time")')
+    op.execute(
+        f'ALTER TABLE {table} ADD CONSTRAINT playground_events_session_id_fkey '
+        'FOREIGN KEY (session_id) REFERENCES playground_sessions (id) ON DELETE CASCADE'
+    )
+    for name, definition in INDEXES.items():
+        op.execute(f'CREATE INDEX {name} ON {table} USING {definition}')
+
+
+def upgrade() -> None:
+    cutover = (datetime.now(timezone.utc) + timedelta(days=2)).replace(hour=0, minute=0, second=0, microsecond=0)
+    bind = op.get_bind()
+    has_rows = bind.execute(sa.text('SELECT EXISTS (SELECT 1 FROM playground_events)')).scalar()
+
+    if has_rows:
+        # Online steps: concurrent index build and a CHECK validated under SHARE UPDATE EXCLUSIVE
+        with op.get_context().autocommit_block():
+            op.execute(
+                'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_playground_events_time_brin '
+                'ON playground_events USING brin ("time")'
+            )
+            op.execute(
+                'ALTER TABLE playground_events ADD CONSTRAINT playground_events_legacy_bounds '
+                f"CHECK (\"time\" < '{cutover.isoformat()}') NOT VALID"
+            )
+            op.execute('ALTER TABLE playground_events VALIDATE CONSTRAINT playground_events_legacy_bounds')
+
+    # From here on only catalog changes, in one transaction
+    op.execute('ALTER TABLE playground_events RENAME TO playground_events_legacy')
+    op.execute('ALTER TABLE playground_events_legacy RENAME CONSTRAINT playground_events_pkey TO playground_events_legacy_pkey')
+    op.execute(
+        'ALTER TABLE playground_events_legacy '
+        'RENAME CONSTRAINT playground_events_session_id_fkey TO playground_events_legacy_session_id_fkey'
+    )
+    for name in INDEXES:
+        op.execute(f'ALTER INDEX IF EXISTS {name} RENAME TO {name.replace("playground_events", "playground_events_legacy", 1)}')
+
+    op.execute(
+        'CREATE TABLE playground_events (LIKE playground_events_legacy INCLUDING DEFAULTS INCLUDING GENERATED) '
+        'PARTITION BY RANGE ("time")'
+    )
+    _add_keys('playground_events')
+
+    if has_rows:
+        op.execute(
+            'ALTER TABLE playground_events ATTACH PARTITION playground_events_legacy '
+            f"FOR VALUES FROM (MINVALUE) TO ('{cutover.isoformat()}')"
+        )
+        op.execute('ALTER TABLE playground_events_legacy DROP CONSTRAINT playground_events_legacy_bounds')
+        lower = cutover
+    else:
+        op.execute('DROP TABLE playground_events_legacy')
+        lower = cutover - timedelta(days=2)
+
+    op.execute('CREATE TABLE playground_events_default PARTITION OF playground_events DEFAULT')
+    for _ in range(PREMAKE_DAYS + (cutover - lower).days):
+        upper = lower + timedelta(days=1)
+        op.execute(
+            f'CREATE TABLE playground_events_p{lower:%Y%m%d} PARTITION OF playground_events '
+            f"FOR VALUES FROM ('{lower.isoformat()}') TO ('{upper.isoformat()}')"
+        )
+        lower = upper
+
+
+def downgrade() -> None:
+    # Copies every row into a plain table; needs a maintenance window on large tables
+    columns = op.get_bind().execute(sa.text(COLUMNS_SQL), {'table': 'playground_events'}).scalar()
+    op.execute('CREATE TABLE playground_events_plain (LIKE playground_events INCLUDING DEFAULTS INCLUDING GENERATED)')
+    op.execute(f'INSERT INTO playground_events_plain ({columns}) SELECT {columns} FROM playground_events')
+    op.execute('DROP TABLE playground_events')
+    op.execute('ALTER TABLE playground_events_plain RENAME TO playground_events')
+    _add_keys('playground_events')
+    op.execute('DROP INDEX ix_playground_events_time_brin')
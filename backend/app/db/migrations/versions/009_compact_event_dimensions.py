@@ -0,0 +1,119 @@
+"""Dictionary-encode event dimensions and store cost as integer micro-dollars
+
+Revision ID: 009_compact_event_dimensions
+Revises: 008_partition_events
+Create Date: 2026-10-18
+
+model, provider, endpoint and status repeat a handful of strings on every
+row. They move to small lookup tables, and events keep the 2-4 byte id.
+cost_usd (numeric, 8+ bytes and slow to sum) becomes cost_micros bigint.
+
+The new columns are added empty, which is instant, and then backfilled
+one day of events at a time. Each day is its own transaction, so locks
+stay short and vacuum can keep up. A final catch-up pass runs in the
+transaction that drops the old columns. It picks up anything written by
+the previous release meanwhile.
+
+The btree indexes on model and provider go. Every query now filters or
+groups on the ids, over a session's or a time range's rows. The
+session_id-only index goes too: ix_playground_events_session_id_time
+covers it.
+
+Dropping a column doesn't shrink the rows already on disk. The space
+comes back as old partitions are dropped by retention (or earlier with
+pg_repack / VACUUM FULL on a partition). New partitions are compact
+from the start.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '009_compact_event_dimensions'
+down_revision = '008_partition_events'
+branch_labels = None
+depends_on = None
+
+# dimension -> (lookup table, id type, old column type)
+DIMENSIONS = {
+    'model': ('playground_event_models', sa.SmallInteger(), sa.String(length=50)),
+    'provider': ('playground_event_providers', sa.SmallInteger(), sa.String(length=50)),
+    'endpoint': ('playground_event_endpoints', sa.Integer(), sa.String(length=255)),
+    'status': ('playground_event_statuses', sa.SmallInteger(), sa.String(length=20)),
+}
+
+ENCODE_SET = ', '.join(
+    [f'{d}_id = (SELECT id FROM {table} WHERE name = e.{d})' for d, (table, _, _) in DIMENSIONS.items()]
+    + ['cost_micros = round(e.cost_usd * 1000000)']
+)
+DECODE_SET = ', '.join(
+    [f'{d} = (SELECT name FROM {table} WHERE id = e.{d}_id)' for d, (table, _, _) in DIMENSIONS.items()]
+    + ['cost_usd = e.cost_micros / 1000000.0']
+)
+
+
+def _days(bind):
+    """Day-aligned [lower, upper) ranges covering every event"""
+    return bind.execute(sa.text(
+        "SELECT g, g + interval '1 day' FROM generate_series("
+        "(SELECT date_trunc('day', min(time)) FROM playground_events), "
+        "(SELECT max(time) FROM playground_events), interval '1 day') AS g"
+    )).all()
+
+
+def upgrade() -> None:
+    for dimension, (table, id_type, name_type) in DIMENSIONS.items():
+        op.create_table(
+            table,
+            sa.Column('id', id_type, sa.Identity(), primary_key=True),
+            sa.Column('name', name_type, nullable=False, unique=True),
+        )
+        op.execute(f'INSERT INTO {table} (name) SELECT DISTINCT {dimension} FROM playground_events WHERE {dimension} IS NOT NULL')
+        op.add_column('playground_events', sa.Column(f'{dimension}_id', id_type, nullable=True))
+    op.add_column('playground_events', sa.Column('cost_micros', sa.BigInteger(), nullable=True))
+
+    bind = op.get_bind()
+    with op.get_context().autocommit_block():
+        for lower, upper in _days(bind):
+            bind.execute(sa.text(
+                f'UPDATE playground_events AS e SET {ENCODE_SET} WHERE e.time >= :lower AND e.time < :upper'
+            ), {'lower': lower, 'upper': upper})
+
+    # Values the previous release added since the lookup tables were seeded, then its stragglers
+    for dimension, (table, _, _) in DIMENSIONS.items():
+        op.execute(
+            f'INSERT INTO {table} (name) SELECT DISTINCT {dimension} FROM playground_events '
+            f'WHERE {dimension} IS NOT NULL AND {dimension}_id IS NULL ON CONFLICT (name) DO NOTHING'
+        )
+    stale = ' OR '.join(
+        [f'(e.{d} IS NOT NULL AND e.{d}_id IS NULL)' for d in DIMENSIONS]
+        + ['(e.cost_usd IS NOT NULL AND e.cost_micros IS NULL)']
+    )
+    op.execute(f'UPDATE playground_events AS e SET {ENCODE_SET} WHERE {stale}')
+
+    op.drop_index('ix_playground_events_model', table_name='playground_events')
+    op.drop_index('ix_playground_events_provider', table_name='playground_events')
+    op.drop_index('ix_playground_events_session_id', table_name='playground_events')
+    for dimension in DIMENSIONS:
+        op.drop_column('playground_events', dimension)
+    op.drop_column('playground_events', 'cost_usd')
+
+
+def downgrade() -> None:
+    for dimension, (_, _, name_type) in DIMENSIONS.items():
+        op.add_column('playground_events', sa.Column(dimension, name_type, nullable=True))
+    op.add_column('playground_events', sa.Column('cost_usd', sa.DECIMAL(precision=10, scale=6), nullable=True))
+
+    bind = op.get_bind()
+    with op.get_context().autocommit_block():
+        for lower, upper in _days(bind):
+            bind.execute(sa.text(
+                f'UPDATE playground_events AS e SET {DECODE_SET} WHERE e.time >= :lower AND e.time < :upper'
+            ), {'lower': lower, 'upper': upper})
+
+    op.create_index('ix_playground_events_session_id', 'playground_events', ['session_id'])
+    op.create_index('ix_playground_events_model', 'playground_events', ['model'])
+    op.create_index('ix_playground_events_provider', 'playground_events', ['provider'])
+    for dimension, (table, _, _) in DIMENSIONS.items():
+        op.drop_column('playground_events', f'{dimension}_id')
+        op.drop_table(table)
+    op.drop_column('playground_events', 'cost_micros')
@@ -0,0 +1,26 @@
+"""Record the content-capture decision on each event
+
+Revision ID: 010_event_content_capture
+Revises: 009_compact_event_dimensions
+Create Date: 2026-10-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '010_event_content_capture'
+down_revision = '009_compact_event_dimensions'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Nullable, no default: catalog-only on PostgreSQL. Existing rows (null) were captured in full.
+    op.add_column('playground_events', sa.Column('content_capture', sa.String(length=20), nullable=True))
+    op.add_column('playground_events', sa.Column('content_sample_rate', sa.REAL(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('playground_events', 'content_sample_rate')
+    op.drop_column('playground_events', 'content_capture')
@@ -1,8 +1,8 @@
 """SQLAlchemy models for Playground application"""
-from sqlalchemy import Column, String, DateTime, Integer, Boolean, Text, DECIMAL, ForeignKey
-from sqlalchemy.dialects.postgresql import UUID, JSONB
+from sqlalchemy import Column, String, DateTime, Integer, SmallInteger, BigInteger, Boolean, Text, DECIMAL, REAL, ForeignKey, Computed, Identity, Index, UniqueConstraint, DDL, event
+from sqlalchemy.dialects.postgresql import UUID, JSONB, TSVECTOR
 from sqlalchemy.sql import func
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, deferred
 from .base import Base
 import uuid
 
@@ -20,8 +20,53 @@ class Session(Base):
     # Session state
     is_active = Column(Boolean, default=True)
 
+    # Maintained event counters (see services/session_quota.py), so the
+    # per-session cap never needs COUNT(*). evicted_* roll up the events
+    # removed by the cap so lifetime totals survive eviction.
+    event_count = Column(Integer, nullable=False, default=0, server_default="0")
+    evicted_event_count = Column(BigInteger, nullable=False, default=0, server_default="0")
+    evicted_tokens_total = Column(BigInteger, nullable=False, default=0, server_default="0")
+    evicted_cost_usd = Column(DECIMAL(14, 6), nullable=False, default=0, server_default="0")
+    # Events moved to the Parquet archive (services/event_archive.py)
+    archived_event_count = Column(BigInteger, nullable=False, default=0, server_default="0")
+    archived_tokens_total = Column(BigInteger, nullable=False, default=0, server_default="0")
+    archived_cost_usd = Column(DECIMAL(14, 6), nullable=False, default=0, server_default="0")
+
     # Relationships
-    events = relationship("LLMEvent", back_populates="session", cascade="all, delete-orphan")
+    # The FK's ON DELETE CASCADE removes events in the database; the ORM doesn't load them first
+    events = relationship("LLMEvent", back_populates="session", cascade="all, delete-orphan", passive_deletes=True)
+
+
+class EventModel(Base):
+    """Lookup table for LLMEvent.model_id"""
+    __tablename__ = "playground_event_models"
+
+    id = Column(SmallInteger, Identity(), primary_key=True)
+    name = Column(String(50), nullable=False, unique=True)
+
+
+class EventProvider(Base):
+    """Lookup table for LLMEvent.provider_id"""
+    __tablename__ = "playground_event_providers"
+
+    id = Column(SmallInteger, Identity(), primary_key=True)
+    name = Column(String(50), nullable=False, unique=True)
+
+
+class EventEndpoint(Base):
+    """Lookup table for LLMEvent.endpoint_id"""
+    __tablename__ = "playground_event_endpoints"
+
+    id = Column(Integer, Identity(), primary_key=True)
+    name = Column(String(255), nullable=False, unique=True)
+
+
+class EventStatus(Base):
+    """Lookup table for LLMEvent.status_id"""
+    __tablename__ = "playground_event_statuses"
+
+    id = Column(SmallInteger, Identity(), primary_key=True)
+    name = Column(String(20), nullable=False, unique=True)
 
 
 class LLMEvent(Base):
@@ -32,12 +77,13 @@ class LLMEvent(Base):
     time = Column(DateTime(timezone=True), nullable=False, primary_key=True)
 
     # Session tracking (instead of tenant/project for playground)
-    session_id = Column(UUID(as_uuid=True), ForeignKey('playground_sessions.id', ondelete='CASCADE'), nullable=False, index=True)
+    # Looked up through ix_playground_events_session_id_time; a session_id-only index would be redundant
+    session_id = Column(UUID(as_uuid=True), ForeignKey('playground_sessions.id', ondelete='CASCADE'), nullable=False)
 
-    # Request metadata
-    model = Column(String(50), index=True)
-    provider = Column(String(50), index=True)
-    endpoint = Column(String(255))
+    # Request metadata, dictionary-encoded (see db/dimensions.py)
+    model_id = Column(SmallInteger)
+    provider_id = Column(SmallInteger)
+    endpoint_id = Column(Integer)  # Ingested events bring their own endpoints, so more of them
 
     # User tracking (optional, for playground context)
     user_id = Column(String(255), index=True)
@@ -46,17 +92,35 @@ class LLMEvent(Base):
     tokens_prompt = Column(Integer)
     tokens_completion = Column(Integer)
     tokens_total = Column(Integer)
+    tokens_cached_input = Column(Integer)  # Prompt tokens served from the provider's cache
 
     # Performance metrics
     latency_ms = Column(Integer)
     time_to_first_token_ms = Column(Integer)
+    queue_wait_ms = Column(Integer)  # Time spent waiting for an upstream slot, excluded from latency_ms
+    hedge_outcome = Column(String(20))  # primary_won / hedge_won / skipped; null when no hedge was due
+    circuit_state = Column(String(20))  # Breaker state the call was admitted (or shed) under
 
-    # Cost tracking
-    cost_usd = Column(DECIMAL(10, 6))
+    # Cost in micro-dollars (priced from playground_model_prices at event time); see dimensions.to_micros
+    cost_micros = Column(BigInteger)
 
-    # Content (compressed)
+    # Content (compressed), as much of it as the capture policy kept (services/content_capture.py)
     messages = Column(JSONB)
     response = Column(Text)
+    content_capture = Column(String(20))  # full / truncated / hashed / sampled / omitted / error
+    content_sample_rate = Column(REAL)  # Set when sampled: each kept event stands for 1 / rate
+
+    # Full-text search over prompt (weight A) and response (weight B), maintained by Postgres.
+    # Deferred so regular event loads don't pull the vector over the wire.
+    search_vector = deferred(Column(
+        TSVECTOR,
+        Computed(
+            "setweight(jsonb_to_tsvector('english'::regconfig, "
+            "coalesce(jsonb_path_query_array(messages, '$[*].content'), '[]'::jsonb), '[\"string\"]'), 'A') || "
+            "setweight(to_tsvector('english'::regconfig, coalesce(response, '')), 'B')",
+            persisted=True
+        )
+    ))
 
     # Model parameters
     temperature = Column(DECIMAL(3, 2))
@@ -64,10 +128,71 @@ class LLMEvent(Base):
     top_p = Column(DECIMAL(3, 2))
 
     # Status and flags
-    status = Column(String(20))
+    status_id = Column(SmallInteger)
     error_message = Column(Text)
     has_error = Column(Boolean, default=False)
     pii_detected = Column(Boolean, default=False)
 
     # Relationships
     session = relationship("Session", back_populates="events")
+
+    # Range-partitioned by time (migration 008); partitions are managed by services/event_partitions.py
+    __table_args__ = (
+        Index('ix_playground_events_search_vector', 'search_vector', postgresql_using='gin'),
+        Index('ix_playground_events_session_id_time', 'session_id', 'time'),
+        Index('ix_playground_events_time_id', 'time', 'id'),
+        Index('ix_playground_events_time_brin', 'time', postgresql_using='brin'),
+        {'postgresql_partition_by': 'RANGE (time)'},
+    )
+
+
+# Rows outside every time partition land here until a partition for them exists
+event.listen(
+    LLMEvent.__table__,
+    "after_create",
+    DDL("CREATE TABLE IF NOT EXISTS playground_events_default PARTITION OF playground_events DEFAULT"),
+)
+
+
+class ModelPrice(Base):
+    """Versioned per-model token rates; a new row supersedes older ones from effective_from on"""
+    __tablename__ = "playground_model_prices"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    # Matched as a prefix of LLMEvent.model; the longest matching prefix wins
+    model_prefix = Column(String(50), nullable=False)
+    provider = Column(String(50), nullable=False, default="anthropic")
+
+    # USD per million tokens
+    input_per_mtok = Column(DECIMAL(12, 6), nullable=False)
+    output_per_mtok = Column(DECIMAL(12, 6), nullable=False)
+    cached_input_per_mtok = Column(DECIMAL(12, 6), nullable=False)
+
+    effective_from = Column(DateTime(timezone=True), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        UniqueConstraint('model_prefix', 'provider', 'effective_from', name='uq_model_prices_version'),
+    )
+
+
+class CostBackfillJob(Base):
+    """Progress of a cost recomputation run, so an interrupted backfill can resume"""
+    __tablename__ = "playground_cost_backfill_jobs"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    started_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    status = Column(String(20), nullable=False, default="running")  # running | completed | failed
+
+    # Scope of the run
+    since = Column(DateTime(timezone=True))
+    until = Column(DateTime(timezone=True))
+
+    # Keyset cursor: last (time, id) processed
+    cursor_time = Column(DateTime(timezone=True))
+    cursor_id = Column(UUID(as_uuid=True))
+
+    rows_scanned = Column(Integer, default=0)
+    rows_updated = Column(Integer, default=0)
+    error_message = Column(Text)
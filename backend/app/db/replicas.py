@@ -0,0 +1,238 @@
+"""Read-replica routing with per-session read-your-writes"""
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker, Session as DBSession
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import random
+import threading
+import time
+import logging
+
+from .base import create_db_engine
+from .shards import ShardRouter, shard_router, parse_shard_urls
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+PRIMARY_LSN_SQL = text("SELECT pg_current_wal_lsn()::text")
+REPLAY_LSN_SQL = text("SELECT pg_last_wal_replay_lsn()::text")
+REPLICA_HEALTH_SQL = text("""
+    SELECT pg_is_in_recovery(),
+           pg_last_wal_replay_lsn()::text,
+           EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+""")
+
+# Sessions whose last write position is remembered per worker
+MAX_TRACKED_SESSIONS = 100_000
+
+
+def parse_lsn(value: Optional[str]) -> int:
+    """'16/B374D848' -> comparable integer (0 for None or garbage)"""
+    if not value:
+        return 0
+    high, sep, low = value.partition("/")
+    try:
+        return (int(high, 16) << 32) | int(low, 16) if sep else 0
+    except ValueError:
+        return 0
+
+
+def format_lsn(value: int) -> str:
+    return f"{value >> 32:X}/{value & 0xFFFFFFFF:X}"
+
+
+class Replica:
+    """One streaming replica of a shard, with its last observed state"""
+
+    def __init__(self, shard: str, url: str, index: int):
+        self.shard = shard
+        self.name = f"{shard}/replica{index}"
+        self.engine = create_db_engine(url)
+        self.factory = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        self.healthy = False
+        self.replay_lsn = 0
+        self.lag_bytes: Optional[int] = None
+        self.lag_seconds: Optional[float] = None
+        self.checked_at = 0.0
+        self.error: Optional[str] = None
+
+    def live_replay_lsn(self) -> int:
+        with self.engine.connect() as conn:
+            self.replay_lsn = max(self.replay_lsn, parse_lsn(conn.execute(REPLAY_LSN_SQL).scalar()))
+        return self.replay_lsn
+
+    def status(self) -> dict:
+        return {
+            "name": self.name,
+            "shard": self.shard,
+            "healthy": self.healthy,
+            "replay_lsn": format_lsn(self.replay_lsn) if self.replay_lsn else None,
+            "lag_bytes": self.lag_bytes,
+            "lag_seconds": round(self.lag_seconds, 3) if self.lag_seconds is not None else None,
+            "checked_at": self.checked_at or None,
+            "error": self.error,
+        }
+
+
+class ReplicaRouter:
+    """
+    Sends read-only queries to replicas while keeping each session's reads
+    consistent with its own writes.
+
+    After a request that may have written for a session, note_write()
+    records the shard primary's WAL position (pg_current_wal_lsn) for that
+    session; it is also handed to the client in a cookie so other workers
+    see it. A later read for the session only goes to a replica that has
+    replayed at least that far, waiting up to replica_ryw_wait_ms for one
+    to catch up, and otherwise falls back to the primary. Reads for
+    sessions with no recent write go to any healthy replica.
+
+    A background thread refreshes every replica's replay position and lag
+    each replica_health_interval_seconds. A replica is taken out of
+    rotation on a connection error or when it lags by more than
+    replica_max_lag_seconds.
+    """
+
+    def __init__(self, shards: ShardRouter, replicas: List[Tuple[str, str]]):
+        self.shards = shards
+        self.replicas: Dict[str, List[Replica]] = {}
+        default_shard = shards.names[0]
+        for shard, url in replicas:
+            if shard not in shards.engines:
+                logger.warning("Replica for unknown shard %s assigned to %s", shard, default_shard)
+                shard = default_shard
+            group = self.replicas.setdefault(shard, [])
+            group.append(Replica(shard, url, len(group)))
+        self._session_lsn: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.reads_replica = 0
+        self.reads_primary = 0
+
+    @classmethod
+    def from_settings(cls, shards: ShardRouter) -> "ReplicaRouter":
+        entries = parse_shard_urls(settings.replica_database_urls)
+        # Bare URLs (auto-named shardN) belong to the first shard, which is the only one when unsharded
+        default = shards.names[0]
+        return cls(shards, [(name if name in shards.engines else default, url) for name, url in entries])
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.replicas)
+
+    # Write tracking
+
+    def note_write(self, session_key: str, lsn: Optional[int] = None) -> int:
+        """Remember the primary's WAL position after a session's write; returns it"""
+        if lsn is None:
+            with self.shards.engines[self.shards.shard_for(session_key)].connect() as conn:
+                lsn = parse_lsn(conn.execute(PRIMARY_LSN_SQL).scalar())
+        with self._lock:
+            self._session_lsn[session_key] = max(lsn, self._session_lsn.get(session_key, 0))
+            self._session_lsn.move_to_end(session_key)
+            while len(self._session_lsn) > MAX_TRACKED_SESSIONS:
+                self._session_lsn.popitem(last=False)
+        return lsn
+
+    def required_lsn(self, session_key: str, client_lsn: Optional[str] = None) -> int:
+        with self._lock:
+            known = self._session_lsn.get(session_key, 0)
+        return max(known, parse_lsn(client_lsn))
+
+    # Routing
+
+    def _pick(self, shard: str, min_lsn: int) -> Optional[Replica]:
+        candidates = [r for r in self.replicas.get(shard, []) if r.healthy]
+        if not candidates:
+            return None
+        random.shuffle(candidates)
+        for replica in candidates:
+            if replica.replay_lsn >= min_lsn:
+                return replica
+
+        # None known to be caught up: poll briefly for the write to replay
+        deadline = time.monotonic() + settings.replica_ryw_wait_ms / 1000
+        while True:
+            for replica in candidates:
+                try:
+                    if replica.live_replay_lsn() >= min_lsn:
+                        return replica
+                except Exception as e:
+                    replica.healthy, replica.error = False, str(e)
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(0.005)
+
+    def read_session_for(self, session_key: str, client_lsn: Optional[str] = None) -> DBSession:
+        """DB session for read-only queries on session_key's data; the caller closes it"""
+        shard = self.shards.shard_for(session_key)
+        if shard in self.replicas:
+            replica = self._pick(shard, self.required_lsn(session_key, client_lsn))
+            if replica is not None:
+                self.reads_replica += 1
+                return replica.factory()
+        self.reads_primary += 1
+        return self.shards.session_on(shard)
+
+    # Health
+
+    def check(self):
+        """Refresh replay position, lag and health of every replica"""
+        for shard, group in self.replicas.items():
+            try:
+                with self.shards.engines[shard].connect() as conn:
+                    primary_lsn = parse_lsn(conn.execute(PRIMARY_LSN_SQL).scalar())
+            except Exception as e:
+                logger.warning("Replica check: primary of shard %s unreachable: %s", shard, e)
+                primary_lsn = None
+
+            for replica in group:
+                try:
+                    with replica.engine.connect() as conn:
+                        in_recovery, replay, replay_age = conn.execute(REPLICA_HEALTH_SQL).one()
+                    replica.replay_lsn = max(replica.replay_lsn, parse_lsn(replay))
+                    replica.lag_bytes = max(primary_lsn - replica.replay_lsn, 0) if primary_lsn is not None else None
+                    # Replay timestamps only mean lag while there is WAL left to replay
+                    replica.lag_seconds = 0.0 if replica.lag_bytes == 0 else (float(replay_age) if replay_age is not None else None)
+                    replica.error = None if in_recovery else "not in recovery (promoted?)"
+                    replica.healthy = bool(in_recovery) and (
+                        replica.lag_seconds is None or replica.lag_seconds <= settings.replica_max_lag_seconds
+                    )
+                except Exception as e:
+                    replica.healthy, replica.error = False, str(e)
+                replica.checked_at = time.time()
+                if not replica.healthy:
+                    logger.warning("Replica %s out of rotation: %s", replica.name, replica.error or f"lag {replica.lag_seconds}s")
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.check()
+            except Exception as e:
+                logger.error("Replica health check failed: %s", e)
+            self._stop.wait(settings.replica_health_interval_seconds)
+
+    def start(self):
+        if self.enabled and self._thread is None:
+            self.check()
+            self._thread = threading.Thread(target=self._run, name="replica-health", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def status(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "replicas": [r.status() for group in self.replicas.values() for r in group],
+            "reads_replica": self.reads_replica,
+            "reads_primary": self.reads_primary,
+            "tracked_sessions": len(self._session_lsn),
+        }
+
+
+replica_router = ReplicaRouter.from_settings(shard_router)
@@ -0,0 +1,141 @@
+"""Session-keyed sharding across several PostgreSQL databases"""
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker, Session as DBSession
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, TypeVar
+import bisect
+import hashlib
+import logging
+
+from .base import engine, SessionLocal, create_db_engine
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+DEFAULT_SHARD = "default"
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+def parse_shard_urls(value: Optional[str]) -> List[Tuple[str, str]]:
+    """
+    Parse SHARD_DATABASE_URLS: comma-separated "name=url" entries (or bare
+    urls, named shard0, shard1, ...). Names are what the hash ring is built
+    from, so keep them stable when a database moves to a new host.
+    """
+    shards = []
+    for index, entry in enumerate(e.strip() for e in (value or "").split(",")):
+        if not entry:
+            continue
+        name, sep, url = entry.partition("=")
+        if not sep or "://" in name:
+            name, url = f"shard{index}", entry
+        shards.append((name.strip(), url.strip()))
+    return shards
+
+
+class HashRing:
+    """
+    Consistent hash ring with virtual nodes.
+
+    Each shard owns `vnodes` points on a 64-bit ring; a key belongs to the
+    first point at or after its hash. Adding a shard moves only about
+    1/N of the keys, all of them onto the new shard.
+    """
+
+    def __init__(self, nodes: Iterable[str], vnodes: int = 160):
+        points = sorted(
+            (_hash(f"{node}#{i}"), node) for node in nodes for i in range(vnodes)
+        )
+        if not points:
+            raise ValueError("HashRing needs at least one node")
+        self._hashes = [h for h, _ in points]
+        self._nodes = [n for _, n in points]
+
+    def node_for(self, key: str) -> str:
+        index = bisect.bisect_left(self._hashes, _hash(key))
+        return self._nodes[index % len(self._nodes)]
+
+
+class ShardRouter:
+    """
+    Maps a session to the database that holds it and everything it owns.
+
+    Sessions never join across each other, so a session row and all of
+    its events live on one shard, chosen by consistent hashing of the
+    public session id. Tables that aren't per-session (pricing, backfill
+    jobs) stay on the catalog database, DATABASE_URL. Without
+    SHARD_DATABASE_URLS there is a single shard backed by the catalog
+    engine and routing is a no-op.
+    """
+
+    def __init__(self, shards: List[Tuple[str, str]], vnodes: int = 160):
+        self.engines: Dict[str, Engine] = {}
+        self.factories: Dict[str, sessionmaker] = {}
+        if not shards:
+            self.engines[DEFAULT_SHARD] = engine
+            self.factories[DEFAULT_SHARD] = SessionLocal
+        for name, url in shards:
+            if name in self.engines:
+                raise ValueError(f"Duplicate shard name: {name}")
+            shard_engine = engine if url == settings.database_url else create_db_engine(url)
+            self.engines[name] = shard_engine
+            self.factories[name] = sessionmaker(autocommit=False, autoflush=False, bind=shard_engine)
+        self.ring = HashRing(self.engines, vnodes=vnodes)
+
+    @classmethod
+    def from_settings(cls) -> "ShardRouter":
+        return cls(parse_shard_urls(settings.shard_database_urls), vnodes=settings.shard_vnodes)
+
+    @property
+    def names(self) -> List[str]:
+        return list(self.engines)
+
+    def shard_for(self, session_key: str) -> str:
+        """Shard name for a public session id"""
+        if len(self.engines) == 1:
+            return next(iter(self.engines))
+        return self.ring.node_for(session_key)
+
+    def session_for(self, session_key: str) -> DBSession:
+        """New DB session on the shard that owns session_key; the caller closes it"""
+        return self.factories[self.shard_for(session_key)]()
+
+    def session_on(self, shard: str) -> DBSession:
+        return self.factories[shard]()
+
+    def scatter(self, fn: Callable[[DBSession], T], shards: Optional[Iterable[str]] = None) -> Dict[str, T]:
+        """
+        Run fn(db) on every shard in parallel, each with its own DB session.
+        An exception on any shard propagates after all shards finish.
+        """
+        names = list(shards) if shards is not None else self.names
+
+        def run(name: str) -> T:
+            db = self.factories[name]()
+            try:
+                return fn(db)
+            finally:
+                db.close()
+
+        if len(names) == 1:
+            return {names[0]: run(names[0])}
+        with ThreadPoolExecutor(max_workers=min(len(names), settings.shard_scatter_workers)) as pool:
+            futures = {name: pool.submit(run, name) for name in names}
+            return {name: future.result() for name, future in futures.items()}
+
+
+shard_router = ShardRouter.from_settings()
+
+
+def get_shard_db(session_key: str):
+    """Yield a DB session on the shard that owns session_key"""
+    db = shard_router.session_for(session_key)
+    try:
+        yield db
+    finally:
+        db.close()
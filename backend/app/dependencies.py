@@ -1,11 +1,20 @@
 """Dependency injection for session management"""
-from fastapi import Depends, HTTPException, Cookie, Request
+from fastapi import Depends, HTTPException, Cookie, Request, Header
 from typing import Optional
 from sqlalchemy.orm import Session as DBSession
+from sqlalchemy import text
 from sqlalchemy.sql import func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from . import session_tokens
 from .config import settings
-from .db.base import get_db
 from .db.models import Session
+from .db.shards import get_shard_db, shard_router
+from .db.replicas import replica_router
+from .tracing import tracer
+from .services.event_spool import event_spool, SPOOLABLE
+from datetime import datetime, timezone
+from decimal import Decimal
+import hmac
 import uuid
 import logging
 
@@ -17,56 +26,218 @@ async def get_session_id(
     session_id: Optional[str] = Cookie(None, alias=settings.session_cookie_name)
 ) -> str:
     """
-    Extract session ID from cookie or create a new one.
-    This will be used by the frontend to maintain session state.
+    Extract the session ID from the cookie or X-Session-ID header, or mint a new one.
+
+    Both carry a signed token ('<id>.<state>.<signature>'). Its state says
+    whether the session has a row yet, so reads of never-written sessions
+    are answered without a query. Bare ids from older clients are still
+    accepted unless session_require_signed_tokens is set; their state is
+    unknown, so they are looked up. The state ends up in
+    request.state.session_state (None for bare ids).
     """
-    # Try to get session_id from cookie
-    if session_id:
-        logger.info(f"Session ID from cookie: {session_id}")
-        return session_id
+    value = session_id or request.headers.get("X-Session-ID")
+    request.state.session_state = session_tokens.PENDING
 
-    # Try to get session_id from header (for API clients)
-    header_session_id = request.headers.get("X-Session-ID")
-    if header_session_id:
-        logger.info(f"Session ID from header: {header_session_id}")
-        return header_session_id
+    if value and session_tokens.is_signed(value):
+        parsed = session_tokens.parse(value)
+        if parsed is None:
+            raise HTTPException(status_code=401, detail="Invalid session token")
+        session_key, request.state.session_state = parsed
+    elif value:
+        if settings.session_require_signed_tokens:
+            raise HTTPException(status_code=401, detail="Unsigned session ids are not accepted; create a new session")
+        session_key, request.state.session_state = value, None
+    else:
+        # Nothing is stored until the first write
+        session_key = session_tokens.new_session_id()
+        logger.debug("Generated new session ID: %s", session_key)
 
-    # Generate new session ID
-    new_session_id = str(uuid.uuid4())
-    logger.info(f"Generated new session ID: {new_session_id}")
-    return new_session_id
+    request.state.session_key = session_key
+    return session_key
 
 
-async def get_current_session(
-    session_id: str = Depends(get_session_id),
-    db: DBSession = Depends(get_db)
-) -> Session:
+def get_session_db(session_id: str = Depends(get_session_id)):
     """
-    Get or create current session from database.
-    Updates last_activity timestamp on each access.
+    DB session on the shard that owns the caller's session.
+    Endpoints that take get_current_session should use this rather than
+    get_db; FastAPI caches it per request so both see the same DB session.
     """
-    # Query session from database
-    session = db.query(Session).filter(Session.session_id == session_id).first()
+    yield from get_shard_db(session_id)
+
+
+def get_read_db(request: Request, session_id: str = Depends(get_session_id)):
+    """
+    DB session for the read-only queries of the polling endpoints. Goes to
+    a replica of the owning shard that has replayed this session's last
+    write, or to the primary when none has (or no replicas are configured).
+    """
+    lsn = request.cookies.get(settings.replica_lsn_cookie_name) or request.headers.get("X-Session-LSN")
+    db = replica_router.read_session_for(session_id, lsn)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def get_path_session_db(session_id: str):
+    """DB session on the shard that owns the session named in the URL path"""
+    yield from get_shard_db(session_id)
+
+
+def _unmaterialized(session_id: str) -> Session:
+    """Unsaved stand-in for a session that has no row: no id, no events"""
+    now = datetime.now(timezone.utc)
+    return Session(
+        session_id=session_id,
+        created_at=now,
+        last_activity=now,
+        is_active=True,
+        session_metadata={},
+        event_count=0,
+        evicted_event_count=0,
+        evicted_tokens_total=0,
+        evicted_cost_usd=Decimal(0),
+        archived_event_count=0,
+        archived_tokens_total=0,
+        archived_cost_usd=Decimal(0),
+    )
+
 
+def _budget(db: DBSession, budget_ms: Optional[int]):
+    if budget_ms:
+        db.execute(text(f"SET LOCAL statement_timeout = {int(budget_ms)}"))
+
+
+def materialize_session(request: Request, db: DBSession, session_id: str, budget_ms: Optional[int] = None) -> Session:
+    """
+    The session's row, inserting it if this is the session's first write.
+    A client that presented a pending token is re-issued a materialized one
+    (see the reissue_session_token middleware). With budget_ms, each
+    statement is capped by statement_timeout.
+    """
+    _budget(db, budget_ms)
+    session = db.query(Session).filter(Session.session_id == session_id).first()
     if not session:
-        # Create new session
-        logger.info(f"Creating new session: {session_id}")
-        session = Session(
-            session_id=session_id,
-            is_active=True,
-            metadata={}
+        logger.info("Creating new session: %s", session_id)
+        db.execute(
+            pg_insert(Session)
+            .values(id=uuid.uuid4(), session_id=session_id, is_active=True, session_metadata={})
+            .on_conflict_do_nothing(index_elements=["session_id"])
         )
-        db.add(session)
         db.commit()
-        db.refresh(session)
-    else:
-        # Update last_activity timestamp
+        _budget(db, budget_ms)
+        session = db.query(Session).filter(Session.session_id == session_id).one()
+
+    _reissue_materialized(request, session_id)
+    return session
+
+
+def _reissue_materialized(request: Request, session_id: str):
+    if getattr(request.state, "session_state", None) != session_tokens.MATERIALIZED:
+        request.state.session_token = session_tokens.sign(session_id, session_tokens.MATERIALIZED)
+        request.state.session_state = session_tokens.MATERIALIZED
+
+
+def _touch(db: DBSession, session: Session, budget_ms: Optional[int] = None):
+    """Bump last_activity, at most every session_activity_update_seconds"""
+    if (
+        session.last_activity is None
+        or (datetime.now(timezone.utc) - session.last_activity).total_seconds() >= settings.session_activity_update_seconds
+    ):
+        _budget(db, budget_ms)
         session.last_activity = func.now()
         db.commit()
         db.refresh(session)
-        logger.info(f"Updated session activity: {session_id}")
+        logger.debug("Updated session activity: %s", session.session_id)
 
-    return session
+
+async def get_current_session(
+    request: Request,
+    session_id: str = Depends(get_session_id),
+    db: DBSession = Depends(get_session_db)
+) -> Session:
+    """
+    Get the current session for reading; never creates a row.
+
+    A pending token means nothing was ever written, so an unsaved stand-in
+    (session.id is None) is returned without a query, as it is for ids with
+    no row. Endpoints answer those with empty results.
+    Updates last_activity timestamp, at most every session_activity_update_seconds
+    so that polling doesn't turn every read into a write on the primary.
+    """
+    with tracer.span("session.resolve", **{"session.state": request.state.session_state}) as span:
+        if request.state.session_state == session_tokens.PENDING:
+            return _unmaterialized(session_id)
+
+        session = db.query(Session).filter(Session.session_id == session_id).first()
+        if not session:
+            span.set_attribute("session.found", False)
+            return _unmaterialized(session_id)
+
+        _touch(db, session)
+        return session
+
+
+async def get_writable_session(
+    request: Request,
+    session_id: str = Depends(get_session_id),
+    db: DBSession = Depends(get_session_db)
+) -> Session:
+    """Get the current session for an endpoint that writes to it, creating its row on the first write"""
+    with tracer.span("session.resolve", **{"session.state": request.state.session_state, "session.writable": True}):
+        session = materialize_session(request, db, session_id)
+        _touch(db, session)
+        return session
+
+
+async def get_event_session(
+    request: Request,
+    session_id: str = Depends(get_session_id),
+    db: DBSession = Depends(get_session_db)
+) -> Session:
+    """
+    get_writable_session for endpoints whose write can wait in the event
+    spool (services/event_spool.py). Its statements run under
+    event_spool_session_budget_ms. If the shard is slow or down, it
+    degrades instead of failing: the touch is skipped, and a session with
+    no row yet gets an unsaved stand-in (session.id is None). Its row is
+    created when the spooled event is replayed. Its token is re-issued as
+    materialized right away, so reads look the row up and show the event
+    once replayed (until then they find no row and answer empty, as for a
+    pending token). A stand-in carries no metadata, so the deployment's
+    capture policy applies.
+    """
+    shard = shard_router.shard_for(session_id)
+    with tracer.span("session.resolve", **{"session.state": request.state.session_state, "session.writable": True}) as span:
+        if not event_spool.available(shard):
+            span.set_attribute("session.degraded", True)
+            _reissue_materialized(request, session_id)
+            return _unmaterialized(session_id)
+        budget_ms = settings.event_spool_session_budget_ms if event_spool.enabled else None
+
+        try:
+            session = materialize_session(request, db, session_id, budget_ms)
+        except SPOOLABLE as e:
+            if not event_spool.enabled:
+                raise
+            event_spool.degrade(db, shard, e)
+            span.set_attribute("session.degraded", True)
+            _reissue_materialized(request, session_id)
+            return _unmaterialized(session_id)
+
+        # Read before the touch: a rolled-back session would reload from the database
+        pk, metadata = session.id, session.session_metadata
+        try:
+            _touch(db, session, budget_ms)
+        except SPOOLABLE as e:
+            if not event_spool.enabled:
+                raise
+            event_spool.degrade(db, shard, e)
+            span.set_attribute("session.degraded", True)
+            stand_in = _unmaterialized(session_id)
+            stand_in.id, stand_in.session_metadata = pk, metadata
+            return stand_in
+        return session
 
 
 async def require_active_session(
@@ -85,6 +256,24 @@ async def require_active_session(
     return session
 
 
+async def require_admin(
+    authorization: Optional[str] = Header(None),
+    x_admin_key: Optional[str] = Header(None)
+) -> None:
+    """
+    Guard operator endpoints that read across sessions.
+    Accepts the admin key as a bearer token or X-Admin-Key header.
+    """
+    if not settings.admin_api_key:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (ADMIN_API_KEY not set)")
+
+    token = x_admin_key
+    if not token and authorization and authorization.lower().startswith("bearer "):
+        token = authorization[7:]
+    if not token or not hmac.compare_digest(token.encode(), settings.admin_api_key.encode()):
+        raise HTTPException(status_code=401, detail="Invalid or missing admin key")
+
+
 class SessionMiddleware:
     """
     Middleware to inject session context into requests.
@@ -0,0 +1,173 @@
+"""Non-blocking structured logging"""
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+from datetime import datetime, timezone
+import copy
+import logging
+import queue
+import random
+import sys
+import time
+
+import orjson
+
+from .config import settings
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Attributes every LogRecord has; anything else was passed with extra= and is logged as a field
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "suppressed"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, extra= fields, exception"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return orjson.dumps(entry, default=str).decode()
+
+
+class _LoggerBudget:
+    __slots__ = ("sample_rate", "tokens", "updated", "suppressed")
+
+    def __init__(self, sample_rate: float, burst: float):
+        self.sample_rate = sample_rate
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.suppressed = 0
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Thin out chatty loggers before their records are queued.
+
+    WARNING and above always pass. Below that, a record is kept with its
+    logger's sample rate (the longest matching prefix in log_sample_rates,
+    default 1.0) and then has to fit the logger's token bucket of
+    log_rate_limit_per_second (burst: one second's worth). The next record
+    that gets through carries the number dropped since, as 'suppressed'.
+    Counters are updated without a lock, so they are approximate under
+    contention.
+    """
+
+    def __init__(self, sample_rates: Dict[str, float], rate_per_second: float):
+        super().__init__()
+        self.sample_rates = sample_rates
+        self.rate_per_second = rate_per_second
+        self._budgets: Dict[str, _LoggerBudget] = {}
+        self.dropped = 0
+
+    def _sample_rate(self, name: str) -> float:
+        prefixes = [p for p in self.sample_rates if name == p or name.startswith(p + ".")]
+        return self.sample_rates[max(prefixes, key=len)] if prefixes else 1.0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        budget = self._budgets.get(record.name)
+        if budget is None:
+            budget = self._budgets[record.name] = _LoggerBudget(self._sample_rate(record.name), self.rate_per_second)
+
+        if budget.sample_rate < 1.0 and random.random() >= budget.sample_rate:
+            budget.suppressed += 1
+            self.dropped += 1
+            return False
+        if self.rate_per_second:
+            now = time.monotonic()
+            budget.tokens = min(budget.tokens + (now - budget.updated) * self.rate_per_second, self.rate_per_second)
+            budget.updated = now
+            if budget.tokens < 1:
+                budget.suppressed += 1
+                self.dropped += 1
+                return False
+            budget.tokens -= 1
+
+        if budget.suppressed:
+            record.suppressed = budget.suppressed
+            budget.suppressed = 0
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Hands records to the writer thread, and a full queue drops the record
+    instead of blocking the caller. Only records that passed the level and
+    sampling filters get here, so the message is built (record.getMessage)
+    on the caller's thread, while its arguments are still in the state they
+    were logged in; an ORM object could not be rendered later, once its DB
+    session is closed. Timestamps, JSON and tracebacks are formatted by the
+    writer thread.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    """Root logger -> sampling filter -> bounded queue -> writer thread -> stdout"""
+
+    def __init__(self):
+        self.handler: Optional[NonBlockingQueueHandler] = None
+        self.filter: Optional[SamplingFilter] = None
+        self.listener: Optional[QueueListener] = None
+
+    def start(self):
+        if self.listener is not None:
+            return
+        output = logging.StreamHandler(sys.stdout)
+        output.setFormatter(JsonFormatter() if settings.log_format == "json" else logging.Formatter(TEXT_FORMAT))
+
+        log_queue: queue.Queue = queue.Queue(settings.log_queue_size)
+        self.handler = NonBlockingQueueHandler(log_queue)
+        self.filter = SamplingFilter(settings.log_sample_rates, settings.log_rate_limit_per_second)
+        self.handler.addFilter(self.filter)
+
+        root = logging.getLogger()
+        root.handlers[:] = [self.handler]
+        root.setLevel(settings.log_level.upper())
+        self.listener = QueueListener(log_queue, output, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self):
+        """Flush what is queued and stop the writer thread"""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def stats(self) -> dict:
+        return {
+            "format": settings.log_format,
+            "level": settings.log_level.upper(),
+            "queued": self.handler.queue.qsize() if self.handler else 0,
+            "queue_size": settings.log_queue_size,
+            "dropped_queue_full": self.handler.dropped if self.handler else 0,
+            "dropped_sampled": self.filter.dropped if self.filter else 0,
+        }
+
+
+log_pipeline = LogPipeline()
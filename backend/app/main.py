@@ -1,22 +1,34 @@
 """FastAPI app entry point for LLMScope Playground"""
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Depends, Query
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 from contextlib import asynccontextmanager
 from sqlalchemy import text
 import logging
 
 from .config import settings
-from .db.base import engine, SessionLocal
+from .logging_config import log_pipeline
+from .tracing import tracer, instrument_engines, SERVER
+from .profiler import profiler, ProfilerBusy
+from .responses import FastJSONResponse
+from .db.shards import shard_router
+from .db.replicas import replica_router, format_lsn
+from .services.columnar import columnar_engine
+from .services.event_partitions import partition_maintainer
+from .services.event_spool import event_spool
+from .dependencies import require_admin
+from . import session_tokens
 from .db.models import Session, LLMEvent
-from .api import sessions, chat, events
+from .api import sessions, chat, events, ingest, analytics, pricing
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Configure logging: JSON lines from a background writer thread
+log_pipeline.start()
 logger = logging.getLogger(__name__)
 
+# A span per SQL statement on every engine, for sampled requests
+instrument_engines()
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -24,26 +36,51 @@ async def lifespan(app: FastAPI):
     # Startup
     logger.info("Starting LLMScope Playground API...")
 
-    # Verify database connection
-    db = SessionLocal()
-    try:
-        db.execute(text("SELECT 1"))
-        logger.info("✅ Database connection successful")
+    # Finished spans are exported in the background (no-op unless tracing_enabled)
+    tracer.start()
 
-        # Check if tables exist
-        session_count = db.query(Session).count()
-        logger.info(f"✅ Found {session_count} existing sessions")
+    # Verify every shard's database connection
+    for shard in shard_router.names:
+        db = shard_router.session_on(shard)
+        try:
+            db.execute(text("SELECT 1"))
+            logger.info("✅ Database connection successful (shard %s)", shard)
 
-    except Exception as e:
-        logger.error(f"⚠️  Database connection error: {str(e)}")
-        logger.error("   Make sure to run database migrations: alembic upgrade head")
-    finally:
-        db.close()
+            # Check if tables exist
+            session_count = db.query(Session).count()
+            logger.info("✅ Found %d existing sessions on shard %s", session_count, shard)
+
+        except Exception as e:
+            logger.error("⚠️  Database connection error on shard %s: %s", shard, e)
+            logger.error("   Make sure to run database migrations: alembic upgrade head")
+        finally:
+            db.close()
+
+    # Replica health checks run in the background for the life of the process
+    replica_router.start()
+    if replica_router.enabled:
+        for replica in replica_router.status()["replicas"]:
+            logger.info("Replica %s: %s", replica["name"], "healthy" if replica["healthy"] else "out of rotation")
+
+    # Fleet analytics snapshot loads and refreshes in the background
+    columnar_engine.start()
+
+    # Future event partitions are created, and expired ones dropped, in the background
+    partition_maintainer.start()
+
+    # Events spooled to disk while the database was unavailable are replayed in the background
+    event_spool.start()
 
     yield
 
     # Shutdown
     logger.info("Shutting down LLMScope Playground API...")
+    replica_router.stop()
+    columnar_engine.stop()
+    partition_maintainer.stop()
+    event_spool.stop()
+    tracer.stop()
+    log_pipeline.stop()
 
 
 # Create FastAPI app
@@ -61,12 +98,84 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[session_tokens.TOKEN_HEADER, "X-Session-LSN", "X-Trace-Id"],
 )
 
+
+@app.middleware("http")
+async def track_session_writes(request: Request, call_next):
+    """
+    After a request that may have written for a session, record the shard
+    primary's WAL position so the session's next reads only go to replicas
+    that have replayed it. The position is also returned in a cookie (and
+    X-Session-LSN header) so other workers can honour it.
+    """
+    response = await call_next(request)
+    if replica_router.enabled and request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 500:
+        session_key = getattr(request.state, "session_key", None)
+        if session_key and request.state.session_state != session_tokens.PENDING:
+            try:
+                lsn = format_lsn(await run_in_threadpool(replica_router.note_write, session_key))
+                response.headers["X-Session-LSN"] = lsn
+                response.set_cookie(
+                    key=settings.replica_lsn_cookie_name,
+                    value=lsn,
+                    max_age=settings.session_ttl_days * 24 * 60 * 60,
+                    httponly=True,
+                    samesite="lax"
+                )
+            except Exception as e:
+                # Without a position the session's reads may briefly see a lagging replica
+                logger.warning("Could not record write position for session %s: %s", session_key, e)
+    return response
+
+
+@app.middleware("http")
+async def reissue_session_token(request: Request, call_next):
+    """
+    After a session's first write, replace the client's pending token with a
+    materialized one so its reads start querying the database. Browsers get
+    the cookie; header-based clients should keep the X-Session-Token value.
+    """
+    response = await call_next(request)
+    token = getattr(request.state, "session_token", None)
+    if token:
+        session_tokens.set_cookie(response, token)
+    return response
+
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """
+    Root span of every request, continuing the caller's W3C traceparent.
+    Sampled requests return their trace id in X-Trace-Id, so a slow call
+    seen in the browser can be found in the exported spans.
+    """
+    with tracer.span(
+        f"{request.method} {request.url.path}", SERVER, traceparent=request.headers.get("traceparent"),
+        **{"http.method": request.method, "http.target": request.url.path},
+    ) as span:
+        response = await call_next(request)
+        route = request.scope.get("route")
+        if route is not None:
+            # Name by the route template, so spans of one endpoint group together
+            span.name = f"{request.method} {route.path}"
+            span.set_attribute("http.route", route.path)
+        span.set_attribute("http.status_code", response.status_code)
+        if response.status_code >= 500:
+            span.status = "error"
+        if span.sampled:
+            response.headers["X-Trace-Id"] = span.trace_id
+        return response
+
+
 # Register routers
 app.include_router(sessions.router, prefix="/api/v1", tags=["sessions"])
 app.include_router(chat.router, prefix="/api/v1", tags=["chat"])
 app.include_router(events.router, prefix="/api/v1", tags=["events"])
+app.include_router(ingest.router, prefix="/api/v1", tags=["ingest"])
+app.include_router(analytics.router, prefix="/api/v1", tags=["analytics"])
+app.include_router(pricing.router, prefix="/api/v1", tags=["pricing"])
 
 
 @app.get("/")
@@ -86,29 +195,92 @@ async def root():
 @app.get("/health")
 async def health():
     """Health check endpoint"""
-    db = SessionLocal()
-    try:
+    def shard_counts(db):
         # Check database connection
         db.execute(text("SELECT 1"))
+        return db.query(Session).count(), db.query(LLMEvent).count()
 
-        # Get session count
-        session_count = db.query(Session).count()
-        event_count = db.query(LLMEvent).count()
+    try:
+        # Session and event counts from every shard, in parallel
+        counts = shard_router.scatter(shard_counts)
 
         return {
             "status": "healthy",
             "database": "connected",
-            "sessions": session_count,
-            "events": event_count
+            "sessions": sum(c[0] for c in counts.values()),
+            "events": sum(c[1] for c in counts.values()),
+            "shards": len(counts)
         }
     except Exception as e:
-        logger.error(f"Health check failed: {str(e)}")
+        logger.error("Health check failed: %s", e)
         return {
             "status": "unhealthy",
             "error": str(e)
         }
-    finally:
-        db.close()
+
+
+@app.get("/api/v1/replicas/status", dependencies=[Depends(require_admin)])
+async def get_replica_status():
+    """Replay position, lag and health of each read replica, and how reads were routed"""
+    return replica_router.status()
+
+
+@app.get("/api/v1/upstream/scheduler", dependencies=[Depends(require_admin)])
+async def get_upstream_scheduler_stats():
+    """Upstream slot usage, queue waits, hedging and circuit breakers for this worker"""
+    from .services.upstream_scheduler import upstream_scheduler
+    from .services.upstream_guard import upstream_guard
+
+    return {**upstream_scheduler.stats(), "guard": upstream_guard.status()}
+
+
+@app.get("/api/v1/logging/stats", dependencies=[Depends(require_admin)])
+async def get_logging_stats():
+    """Log queue depth and records dropped by sampling, rate limits or a full queue"""
+    return log_pipeline.stats()
+
+
+@app.get("/api/v1/spool/stats", dependencies=[Depends(require_admin)])
+async def get_event_spool_stats():
+    """Events written, spooled to disk and replayed by this worker, and the spool's size"""
+    return event_spool.stats()
+
+
+@app.get("/api/v1/tracing/stats", dependencies=[Depends(require_admin)])
+async def get_tracing_stats():
+    """Spans sampled, exported and dropped by this worker"""
+    return tracer.stats()
+
+
+@app.get("/api/v1/debug/profile", dependencies=[Depends(require_admin)])
+async def get_profile(
+    request: Request,
+    seconds: float = Query(10.0, gt=0, le=settings.profiler_max_seconds),
+    format: str = Query("speedscope", pattern="^(speedscope|collapsed)$"),
+    interval_ms: float = Query(settings.profiler_interval_ms, ge=1, le=1000),
+    block_threshold_ms: float = Query(settings.profiler_block_threshold_ms, ge=1),
+    include_idle: bool = False,
+):
+    """
+    Sample this worker's threads for `seconds` and return the profile.
+
+    format=speedscope is a file for https://www.speedscope.app; collapsed
+    is folded stacks for flamegraph.pl / inferno (counts in ms). Both
+    include the callbacks that held the event loop longer than
+    block_threshold_ms, with their stacks. The request itself waits out
+    the profile without blocking the loop.
+    """
+    try:
+        profile = await profiler.profile(
+            seconds, interval_ms / 1000, block_threshold_ms / 1000, include_idle=include_idle
+        )
+    except ProfilerBusy:
+        raise HTTPException(status_code=409, detail="A profile is already running in this worker")
+
+    headers = {"X-Loop-Blocks": str(len(profile.blocks))}
+    if format == "collapsed":
+        return PlainTextResponse(profile.collapsed(), headers=headers)
+    return FastJSONResponse(profile.speedscope(), request=request, headers=headers)
 
 
 @app.get("/api/v1/cleanup/stats")
@@ -126,7 +298,7 @@ async def get_cleanup_stats():
             "stats": stats
         }
     except Exception as e:
-        logger.error(f"Error getting cleanup stats: {str(e)}")
+        logger.error("Error getting cleanup stats: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -145,7 +317,7 @@ async def run_cleanup(dry_run: bool = True):
         result = SessionCleanupService.cleanup_expired_sessions(dry_run=dry_run)
         return result
     except Exception as e:
-        logger.error(f"Error running cleanup: {str(e)}")
+        logger.error("Error running cleanup: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
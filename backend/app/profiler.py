@@ -0,0 +1,276 @@
+"""On-demand sampling profiler and event-loop block detection for a live worker"""
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# (file, function, first line): frames aggregate per function, not per line
+Frame = Tuple[str, str, int]
+
+# Leaf frames of a thread that is waiting, not working: idle worker pools,
+# background threads between batches, and the event loop in select()
+IDLE_LEAVES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+}
+
+_ROOTS = tuple(sorted(
+    {os.path.dirname(os.path.dirname(os.path.abspath(__file__)))}
+    | {p for p in sys.path if p and os.path.isdir(p)},
+    key=len, reverse=True,
+))
+
+
+def _short(filename: str) -> str:
+    """Path relative to the backend or the sys.path entry it was imported from"""
+    for root in _ROOTS:
+        if filename.startswith(root + os.sep):
+            return filename[len(root) + 1:]
+    return filename
+
+
+class ProfilerBusy(Exception):
+    """Another profile is already running in this worker"""
+
+
+class LoopBlock(NamedTuple):
+    """A stretch where the event loop ran one callback past the threshold"""
+    offset_ms: float  # From the start of the profile
+    duration_ms: float
+    stack: Tuple[Frame, ...]  # Root first, captured once the threshold was crossed
+
+
+class Profile:
+    """
+    What one run collected: per thread, its stacks in time order (runs of
+    the same stack merged, weighted by wall time) and the loop blocks.
+    """
+
+    def __init__(self, interval: float, block_threshold: float):
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self.started = time.time()
+        self.duration = 0.0
+        self.samples = 0
+        self.threads: Dict[str, List[List[Any]]] = {}  # name -> [[stack, weight_ms], ...]
+        self.blocks: List[LoopBlock] = []
+
+    def add(self, thread: str, stack: Tuple[Frame, ...], weight_ms: float):
+        timeline = self.threads.setdefault(thread, [])
+        if timeline and timeline[-1][0] == stack:
+            timeline[-1][1] += weight_ms
+        else:
+            timeline.append([stack, weight_ms])
+
+    def collapsed(self) -> str:
+        """
+        Brendan Gregg's folded format, one "frame;frame;... count" line per
+        stack, rooted at its thread; counts are milliseconds. Loop blocks
+        are stacks under "event-loop-blocked", weighted by how long each
+        held the loop.
+        """
+        totals: Dict[str, float] = {}
+
+        def fold(root: str, stack: Tuple[Frame, ...], weight: float):
+            line = ";".join([root] + [f"{name} ({file}:{line})" for file, name, line in stack])
+            totals[line] = totals.get(line, 0.0) + weight
+
+        for thread, timeline in self.threads.items():
+            for stack, weight in timeline:
+                fold(thread, stack, weight)
+        for block in self.blocks:
+            fold("event-loop-blocked", block.stack, block.duration_ms)
+        return "".join(f"{line} {max(1, round(weight))}\n" for line, weight in sorted(totals.items()))
+
+    def speedscope(self) -> Dict[str, Any]:
+        """
+        https://www.speedscope.app file: one sampled profile per thread, plus
+        one holding the loop blocks (each sample is a block, weighted by its
+        duration). "blocks" repeats them with offsets for reading as JSON.
+        """
+        frames: List[Dict[str, Any]] = []
+        index: Dict[Frame, int] = {}
+
+        def ids(stack: Tuple[Frame, ...]) -> List[int]:
+            out = []
+            for frame in stack:
+                if frame not in index:
+                    index[frame] = len(frames)
+                    frames.append({"name": frame[1], "file": frame[0], "line": frame[2]})
+                out.append(index[frame])
+            return out
+
+        duration_ms = round(self.duration * 1000, 3)
+        profiles = []
+        for thread, timeline in self.threads.items():
+            profiles.append({
+                "type": "sampled",
+                "name": thread,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": duration_ms,
+                "samples": [ids(stack) for stack, _ in timeline],
+                "weights": [round(weight, 3) for _, weight in timeline],
+            })
+        if self.blocks:
+            profiles.append({
+                "type": "sampled",
+                "name": "event-loop-blocked",
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": round(sum(b.duration_ms for b in self.blocks), 3),
+                "samples": [ids(b.stack) for b in self.blocks],
+                "weights": [b.duration_ms for b in self.blocks],
+            })
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": f"pid {os.getpid()} ({self.duration:.1f}s)",
+            "exporter": "llmscope-playground",
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": profiles,
+            "blocks": [
+                {"offset_ms": b.offset_ms, "duration_ms": b.duration_ms,
+                 "stack": [f"{name} ({file}:{line})" for file, name, line in b.stack]}
+                for b in self.blocks
+            ],
+            "samples": self.samples,
+            "interval_ms": self.interval * 1000,
+            "block_threshold_ms": self.block_threshold * 1000,
+        }
+
+
+def _stack(frame, limit: int) -> Tuple[Frame, ...]:
+    stack = []
+    while frame is not None and len(stack) < limit:
+        code = frame.f_code
+        stack.append((_short(code.co_filename), code.co_name, code.co_firstlineno))
+        frame = frame.f_back
+    stack.reverse()
+    return tuple(stack)
+
+
+def _idle(stack: Tuple[Frame, ...]) -> bool:
+    return bool(stack) and (os.path.basename(stack[-1][0]), stack[-1][1]) in IDLE_LEAVES
+
+
+class SamplingProfiler:
+    """
+    Statistical wall-clock profiler for the running worker.
+
+    A sampler thread wakes every interval and reads every other thread's
+    stack from sys._current_frames(). Nothing is installed in the profiled
+    code (no sys.setprofile), so the cost is one stack walk per thread per
+    sample, under the GIL, and zero when no profile is running. Threads
+    that are only waiting are left out unless include_idle.
+
+    Loop blocking: a heartbeat task on the event loop stamps the time
+    every interval. When the sampler finds the stamp older than
+    block_threshold plus one interval, the loop thread is stuck in one
+    callback (a sync DB or upstream call inside an async def, say), and
+    its stack right then is the culprit. The block lasts until the
+    heartbeat runs again. Each one is logged at WARNING as well.
+
+    One profile runs at a time per worker; a second request gets
+    ProfilerBusy.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._running = False
+
+    async def profile(self, seconds: float, interval: float, block_threshold: float,
+                      include_idle: bool = False) -> Profile:
+        with self._lock:
+            if self._running:
+                raise ProfilerBusy()
+            self._running = True
+        try:
+            result = Profile(interval, block_threshold)
+            loop_thread = threading.get_ident()
+            beat = [time.monotonic()]
+            done = threading.Event()
+
+            async def heartbeat():
+                while not done.is_set():
+                    beat[0] = time.monotonic()
+                    await asyncio.sleep(interval)
+
+            task = asyncio.create_task(heartbeat())
+            try:
+                # The sampler runs on a pool thread while the loop stays free to serve
+                await asyncio.to_thread(self._sample, result, seconds, loop_thread, beat, include_idle)
+            finally:
+                done.set()
+                await task
+            return result
+        finally:
+            with self._lock:
+                self._running = False
+
+    def _sample(self, result: Profile, seconds: float, loop_thread: int, beat: List[float],
+                include_idle: bool):
+        me = threading.get_ident()
+        limit = settings.profiler_max_stack_depth
+        lag_limit = result.block_threshold + result.interval
+        start = last = time.monotonic()
+        deadline = start + seconds
+        block: Optional[Tuple[float, Tuple[Frame, ...]]] = None  # (started, stack) of the open block
+        block_lag = 0.0
+
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            weight_ms = (now - last) * 1000
+            last = now
+            names = {t.ident: t.name for t in threading.enumerate()}
+            frames = sys._current_frames()
+            result.samples += 1
+
+            for ident, frame in frames.items():
+                if ident == me:
+                    continue
+                stack = _stack(frame, limit)
+                if not include_idle and _idle(stack):
+                    continue
+                name = "event-loop" if ident == loop_thread else names.get(ident, f"thread-{ident}")
+                result.add(name, stack, weight_ms)
+
+            lag = now - beat[0]
+            if lag > lag_limit:
+                if block is None:
+                    block = (beat[0], _stack(frames.get(loop_thread), limit))
+                block_lag = lag
+            elif block is not None:
+                self._close_block(result, start, block, block_lag)
+                block = None
+            del frames
+
+            time.sleep(max(0.0, result.interval - (time.monotonic() - now)))
+
+        if block is not None:
+            self._close_block(result, start, block, block_lag)
+        result.duration = time.monotonic() - start
+
+    @staticmethod
+    def _close_block(result: Profile, start: float, block: Tuple[float, Tuple[Frame, ...]], lag: float):
+        began, stack = block
+        entry = LoopBlock(round((began - start) * 1000, 1), round(lag * 1000, 1), stack)
+        result.blocks.append(entry)
+        leaf = stack[-1] if stack else ("?", "?", 0)
+        logger.warning(
+            "Event loop blocked for at least %.0fms in %s (%s:%d)",
+            entry.duration_ms, leaf[1], leaf[0], leaf[2],
+        )
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,87 @@
+"""Fast JSON responses for hot read endpoints"""
+from fastapi import Request
+from fastapi.responses import Response
+from decimal import Decimal
+from typing import Any, Mapping, Optional
+import gzip
+
+import orjson
+
+from .config import settings
+
+try:
+    import brotli
+except ImportError:  # br is optional; gzip is always available
+    brotli = None
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError
+
+
+def _accepted_encodings(request: Optional[Request]) -> set:
+    """Codings the client accepts with a non-zero q-value"""
+    if request is None:
+        return set()
+    accepted = set()
+    for part in request.headers.get("accept-encoding", "").split(","):
+        coding, _, params = part.partition(";")
+        quality = 1.0
+        name, _, value = params.partition("=")
+        if name.strip().lower() == "q":
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        if coding.strip() and quality > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+class FastJSONResponse(Response):
+    """
+    JSON response rendered with orjson.
+
+    Endpoints return this with plain dicts/rows they built themselves;
+    FastAPI skips response_model validation for Response instances, so
+    each row is converted exactly once (response_model still documents
+    the shape in OpenAPI). Bodies of at least response_compress_min_bytes
+    are compressed with br or gzip when the request accepts it.
+    """
+
+    media_type = "application/json"
+
+    def __init__(
+        self,
+        content: Any,
+        request: Optional[Request] = None,
+        status_code: int = 200,
+        headers: Optional[Mapping[str, str]] = None,
+    ):
+        self._request = request
+        super().__init__(content, status_code=status_code, headers=headers)
+
+    def render(self, content: Any) -> bytes:
+        # UTC as "Z", matching how pydantic renders datetimes for response_model endpoints
+        body = orjson.dumps(content, default=_json_default, option=orjson.OPT_UTC_Z)
+        if len(body) < settings.response_compress_min_bytes:
+            return body
+
+        accepted = _accepted_encodings(self._request)
+        if brotli is not None and "br" in accepted:
+            self._encoding = "br"
+            return brotli.compress(body, quality=settings.response_brotli_quality)
+        if "gzip" in accepted:
+            self._encoding = "gzip"
+            return gzip.compress(body, compresslevel=settings.response_gzip_level)
+        return body
+
+    def init_headers(self, headers: Optional[Mapping[str, str]] = None) -> None:
+        super().init_headers(headers)
+        encoding = getattr(self, "_encoding", None)
+        if encoding:
+            self.raw_headers.append((b"content-encoding", encoding.encode()))
+        if self._request is not None:
+            self.raw_headers.append((b"vary", b"Accept-Encoding"))
@@ -0,0 +1,238 @@
+"""Per-dimension analytics computed in a single GROUPING SETS pass"""
+from sqlalchemy.orm import Session as DBSession
+from sqlalchemy import text
+from typing import Optional, List, Dict, Any
+from datetime import datetime
+import json
+import time
+import logging
+
+from ..config import settings
+from ..db.shards import shard_router
+from ..db.dimensions import dimensions
+from .event_archive import EventArchiveService
+
+logger = logging.getLogger(__name__)
+
+# Every dimension and the grand total come out of one scan. GROUPING()
+# tells the rows apart: bit 2 = model, bit 1 = provider, bit 0 = status,
+# a set bit meaning "aggregated over". Grouping is on the small-integer
+# ids; the few result rows are decoded to names afterwards.
+BREAKDOWN_SQL = """
+    SELECT model_id AS model, provider_id AS provider, status_id AS status,
+           GROUPING(model_id, provider_id, status_id) AS grouping_id,
+           count(*) AS event_count,
+           count(*) FILTER (WHERE has_error) AS error_count,
+           coalesce(sum(tokens_prompt), 0) AS tokens_prompt,
+           coalesce(sum(tokens_completion), 0) AS tokens_completion,
+           coalesce(sum(tokens_total), 0) AS tokens_total,
+           coalesce(sum(cost_micros), 0) / 1000000.0 AS total_cost,
+           avg(latency_ms) AS latency_avg_ms,
+           percentile_cont(0.5) WITHIN GROUP (ORDER BY latency_ms) AS latency_p50_ms,
+           percentile_cont(0.95) WITHIN GROUP (ORDER BY latency_ms) AS latency_p95_ms,
+           max(latency_ms) AS latency_max_ms
+    FROM playground_events {sample}
+    WHERE {where}
+    GROUP BY GROUPING SETS ((model_id), (provider_id), (status_id), ())
+"""
+
+DIMENSIONS = {0b011: "model", 0b101: "provider", 0b110: "status", 0b111: "total"}
+
+
+class BreakdownService:
+    """Counts, tokens, cost, error rate and latency grouped by model, provider and status"""
+
+    @staticmethod
+    def _where(session_id, start: Optional[datetime], end: Optional[datetime]):
+        clauses, params = [], {}
+        if session_id is not None:
+            clauses.append("session_id = :session_id")
+            params["session_id"] = session_id
+        if start is not None:
+            clauses.append("time >= :start")
+            params["start"] = start
+        if end is not None:
+            clauses.append("time < :end")
+            params["end"] = end
+        return " AND ".join(clauses) or "TRUE", params
+
+    @staticmethod
+    def _estimate_rows(db: DBSession, where: str, params: dict) -> int:
+        """Planner row estimate: free compared to counting tens of millions of rows"""
+        plan = db.execute(
+            text(f"EXPLAIN (FORMAT JSON) SELECT 1 FROM playground_events WHERE {where}"), params
+        ).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+
+    @staticmethod
+    def _entries(rows, scale: float = 1.0) -> Dict[str, Any]:
+        """Turn GROUPING SETS rows into the per-dimension result, scaling counts and sums"""
+        result: Dict[str, Any] = {"by_model": [], "by_provider": [], "by_status": [], "total": None}
+        for row in rows:
+            dimension = DIMENSIONS[row["grouping_id"]]
+            entry = {
+                "dimension": dimension,
+                "value": None if dimension == "total" else (row[dimension] or "unknown"),
+                "event_count": int(round(row["event_count"] * scale)),
+                "error_count": int(round(row["error_count"] * scale)),
+                "error_rate": round(row["error_count"] / row["event_count"], 6) if row["event_count"] else 0.0,
+                "tokens_prompt": int(round(row["tokens_prompt"] * scale)),
+                "tokens_completion": int(round(row["tokens_completion"] * scale)),
+                "tokens_total": int(round(row["tokens_total"] * scale)),
+                "total_cost": float(row["total_cost"]) * scale,
+                "latency_avg_ms": float(row["latency_avg_ms"]) if row["latency_avg_ms"] is not None else None,
+                "latency_p50_ms": row["latency_p50_ms"],
+                "latency_p95_ms": row["latency_p95_ms"],
+                "latency_max_ms": row["latency_max_ms"],
+            }
+            if dimension == "total":
+                result["total"] = entry
+            else:
+                result[f"by_{dimension}"].append(entry)
+
+        for key in ("by_model", "by_provider", "by_status"):
+            result[key].sort(key=lambda e: e["event_count"], reverse=True)
+
+        return result
+
+    @staticmethod
+    def empty() -> Dict[str, Any]:
+        """Breakdown of no events, for sessions that have never been written to"""
+        result = BreakdownService._entries([{
+            "grouping_id": 0b111, "event_count": 0, "error_count": 0, "tokens_prompt": 0,
+            "tokens_completion": 0, "tokens_total": 0, "total_cost": 0, "latency_avg_ms": None,
+            "latency_p50_ms": None, "latency_p95_ms": None, "latency_max_ms": None,
+        }])
+        result.update(sampled=False, sample_fraction=1.0, query_ms=0.0)
+        return result
+
+    @staticmethod
+    def breakdown(
+        db: DBSession,
+        session_id=None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+    ) -> Dict[str, Any]:
+        """
+        Compute the breakdown for one session (session_id) or all sessions.
+
+        Fleet-wide queries whose estimated input exceeds
+        analytics_exact_row_limit read a block sample instead (TABLESAMPLE
+        SYSTEM) and scale counts and sums back up; latency percentiles are
+        unbiased under sampling. statement_timeout enforces the latency
+        budget either way.
+        """
+        started = time.perf_counter()
+        where, params = BreakdownService._where(session_id, start, end)
+
+        sample_fraction = 1.0
+        if session_id is None:
+            estimated = BreakdownService._estimate_rows(db, where, params)
+            if estimated > settings.analytics_exact_row_limit:
+                sample_fraction = settings.analytics_exact_row_limit / estimated
+
+        sample = ""
+        if sample_fraction < 1.0:
+            sample = f"TABLESAMPLE SYSTEM ({sample_fraction * 100:.6f})"
+
+        db.execute(text(f"SET LOCAL statement_timeout = {int(settings.analytics_latency_budget_ms)}"))
+        rows = db.execute(text(BREAKDOWN_SQL.format(sample=sample, where=where)), params).mappings().all()
+        rows = [
+            {**row, **{dimension: dimensions.decode(db, dimension, row[dimension]) for dimension in ("model", "provider", "status")}}
+            for row in rows
+        ]
+        db.rollback()  # end the read transaction so SET LOCAL doesn't leak
+
+        result = BreakdownService._entries(rows, 1.0 / sample_fraction)
+        result.update(
+            sampled=sample_fraction < 1.0,
+            sample_fraction=sample_fraction,
+            query_ms=round((time.perf_counter() - started) * 1000, 2),
+        )
+        return result
+
+    @staticmethod
+    def fleet_breakdown(start: Optional[datetime] = None, end: Optional[datetime] = None) -> Dict[str, Any]:
+        """
+        All-sessions breakdown across every shard, queried in parallel.
+
+        Counts, tokens, cost, averages and maxima merge exactly. Latency
+        percentiles can't be combined from per-shard values; with more than
+        one shard they are the event-weighted mean of the shard percentiles.
+        """
+        started = time.perf_counter()
+        results = list(shard_router.scatter(
+            lambda db: BreakdownService.breakdown(db, session_id=None, start=start, end=end)
+        ).values())
+        if len(results) == 1:
+            return results[0]
+        merged = BreakdownService.merge(results)
+        merged["query_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        return merged
+
+    @staticmethod
+    def merge(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Combine breakdowns of disjoint event sets (shards, hot and archived
+        events). Counts, tokens, cost, averages and maxima merge exactly;
+        latency percentiles become the event-weighted mean of the parts.
+        """
+        def merge_entries(entries: List[Dict[str, Any]]) -> Dict[str, Any]:
+            events = sum(e["event_count"] for e in entries)
+            errors = sum(e["error_count"] for e in entries)
+
+            def weighted(key):
+                parts = [(e[key], e["event_count"]) for e in entries if e[key] is not None]
+                weight = sum(w for _, w in parts)
+                return float(sum(float(v) * w for v, w in parts) / weight) if weight else None
+
+            maxima = [e["latency_max_ms"] for e in entries if e["latency_max_ms"] is not None]
+            return {
+                "dimension": entries[0]["dimension"],
+                "value": entries[0]["value"],
+                "event_count": events,
+                "error_count": errors,
+                "error_rate": round(errors / events, 6) if events else 0.0,
+                "tokens_prompt": sum(e["tokens_prompt"] for e in entries),
+                "tokens_completion": sum(e["tokens_completion"] for e in entries),
+                "tokens_total": sum(e["tokens_total"] for e in entries),
+                "total_cost": sum(e["total_cost"] for e in entries),
+                "latency_avg_ms": weighted("latency_avg_ms"),
+                "latency_p50_ms": weighted("latency_p50_ms"),
+                "latency_p95_ms": weighted("latency_p95_ms"),
+                "latency_max_ms": max(maxima) if maxima else None,
+            }
+
+        merged: Dict[str, Any] = {"total": merge_entries([r["total"] for r in results if r["total"] is not None])}
+        for key in ("by_model", "by_provider", "by_status"):
+            groups: Dict[Any, List[Dict[str, Any]]] = {}
+            for result in results:
+                for entry in result[key]:
+                    groups.setdefault(entry["value"], []).append(entry)
+            merged[key] = sorted((merge_entries(g) for g in groups.values()), key=lambda e: e["event_count"], reverse=True)
+
+        merged.update(
+            sampled=any(r["sampled"] for r in results),
+            sample_fraction=min(r["sample_fraction"] for r in results),
+            query_ms=max(r["query_ms"] for r in results),
+        )
+        return merged
+
+    @staticmethod
+    def with_archive(result: Dict[str, Any], session_id=None, start: Optional[datetime] = None,
+                     end: Optional[datetime] = None, archived_after: Optional[str] = None) -> Dict[str, Any]:
+        """Fold archived events into a Postgres breakdown when the range reaches past the hot window"""
+        if not EventArchiveService.reaches(start):
+            return result
+        started = time.perf_counter()
+        archived = BreakdownService._entries(
+            EventArchiveService.breakdown_rows(session_id, start, end, archived_after)
+        )
+        if archived["total"] is None or archived["total"]["event_count"] == 0:
+            return result
+        archived.update(sampled=False, sample_fraction=1.0, query_ms=0.0)
+        merged = BreakdownService.merge([result, archived])
+        merged["query_ms"] = round(result["query_ms"] + (time.perf_counter() - started) * 1000, 2)
+        return merged
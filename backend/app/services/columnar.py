@@ -0,0 +1,425 @@
+"""In-process columnar snapshot of event summaries for fleet-wide analytics"""
+from sqlalchemy import select
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+import threading
+import time
+import logging
+
+import numpy as np
+
+from ..config import settings
+from ..db.models import Session, LLMEvent
+from ..db.shards import shard_router
+from ..db.dimensions import dimensions, stored
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+DIMENSIONS = ("model", "provider", "status", "session")
+# Event columns a snapshot is loaded from, by their public names
+FETCH_COLUMNS = ["id", "time", "session_id", "model", "provider", "status", "has_error", "tokens_total", "latency_ms", "cost_usd"]
+TOP_METRICS = ("cost", "events", "errors", "error_rate", "tokens", "latency_avg", "latency_p95")
+
+# Column name -> dtype; about 32 bytes per event
+COLUMNS = {
+    "time": np.int64,      # microseconds since the epoch
+    "session": np.int32,   # dictionary codes
+    "model": np.int16,
+    "provider": np.int16,
+    "status": np.int8,
+    "has_error": np.bool_,
+    "tokens": np.int32,
+    "latency": np.int32,   # -1 = unknown
+    "cost": np.float64,
+}
+
+
+def _micros(value: datetime) -> int:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def _from_micros(value: int) -> datetime:
+    return EPOCH + timedelta(microseconds=int(value))
+
+
+class Dictionary:
+    """Value <-> small integer code; code 0 is reserved for missing values"""
+
+    def __init__(self):
+        self.values: List[Any] = [None]
+        self.codes: Dict[Hashable, int] = {None: 0}
+
+    def encode(self, value) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def lookup(self, value) -> Optional[int]:
+        return self.codes.get(value)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+
+class ColumnarSnapshot:
+    """
+    Append-only column arrays with geometric growth and a hard row cap.
+    When the cap is reached, the oldest tenth is dropped in one compaction,
+    so the amortized cost per append stays O(1).
+    """
+
+    def __init__(self, max_rows: int):
+        self.max_rows = max_rows
+        self.size = 0
+        self.arrays = {name: np.empty(1024, dtype=dtype) for name, dtype in COLUMNS.items()}
+        self.dictionaries = {name: Dictionary() for name in ("session", "model", "provider", "status")}
+        self.dropped = 0
+
+    def _reserve(self, extra: int):
+        needed = self.size + extra
+        if needed > self.max_rows:
+            drop = min(self.size, max(needed - self.max_rows, self.max_rows // 10))
+            for name, array in self.arrays.items():
+                array[:self.size - drop] = array[drop:self.size]
+            self.size -= drop
+            self.dropped += drop
+            needed = self.size + extra
+        capacity = len(self.arrays["time"])
+        if needed > capacity:
+            capacity = min(max(needed, capacity * 2), max(self.max_rows, needed))
+            for name, array in self.arrays.items():
+                grown = np.empty(capacity, dtype=array.dtype)
+                grown[:self.size] = array[:self.size]
+                self.arrays[name] = grown
+
+    def append(self, rows: List[tuple]):
+        """rows: (time, session_pk, model, provider, status, has_error, tokens_total, latency_ms, cost_usd)"""
+        if not rows:
+            return
+        if len(rows) > self.max_rows:
+            self.dropped += len(rows) - self.max_rows
+            rows = rows[-self.max_rows:]
+        self._reserve(len(rows))
+        start, end = self.size, self.size + len(rows)
+        encode = {name: d.encode for name, d in self.dictionaries.items()}
+        t, session, model, provider, status, has_error, tokens, latency, cost = zip(*rows)
+        a = self.arrays
+        a["time"][start:end] = [_micros(v) for v in t]
+        a["session"][start:end] = [encode["session"](v) for v in session]
+        a["model"][start:end] = [encode["model"](v) for v in model]
+        a["provider"][start:end] = [encode["provider"](v) for v in provider]
+        a["status"][start:end] = [encode["status"](v) for v in status]
+        a["has_error"][start:end] = [bool(v) for v in has_error]
+        a["tokens"][start:end] = [v or 0 for v in tokens]
+        a["latency"][start:end] = [-1 if v is None else v for v in latency]
+        a["cost"][start:end] = [float(v) if v is not None else 0.0 for v in cost]
+        self.size = end
+
+    def trim_before(self, cutoff_micros: int):
+        """Drop rows older than the window (rows are appended in roughly time order)"""
+        times = self.arrays["time"][:self.size]
+        keep = times >= cutoff_micros
+        if keep.all():
+            return
+        kept = int(keep.sum())
+        for name, array in self.arrays.items():
+            array[:kept] = array[:self.size][keep]
+        self.dropped += self.size - kept
+        self.size = kept
+
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in self.arrays.values())
+
+
+def _group_quantile(codes: np.ndarray, values: np.ndarray, q: float, groups: int) -> np.ndarray:
+    """
+    Per-group linear-interpolated quantile of non-negative int32 values.
+    Packing (code, value) into one int64 lets a single np.sort order every
+    group at once.
+    """
+    result = np.full(groups, np.nan)
+    if not len(values):
+        return result
+    packed = np.sort((codes.astype(np.int64) << 32) | values.astype(np.int64))
+    codes, values = packed >> 32, (packed & 0xFFFFFFFF).astype(np.float64)
+    counts = np.bincount(codes, minlength=groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    present = counts > 0
+    position = starts[present] + (counts[present] - 1) * q
+    low = np.floor(position).astype(np.int64)
+    high = np.minimum(low + 1, starts[present] + counts[present] - 1)
+    fraction = position - low
+    result[present] = values[low] * (1 - fraction) + values[high] * fraction
+    return result
+
+
+class ColumnarAnalyticsEngine:
+    """
+    Array-backed copy of the summary columns of recent events, answering
+    fleet-wide group-by / top-k / time-series questions with NumPy instead
+    of SQL over playground_events.
+
+    Memory: one row is about 32 bytes. The snapshot keeps the last
+    columnar_window_days and at most columnar_max_rows rows (the oldest
+    go first). Model, provider, status and session are dictionary-encoded.
+
+    Freshness: a background thread pulls rows newer than each shard's
+    watermark every columnar_refresh_seconds. To catch late inserts, it
+    re-reads the last columnar_late_arrival_seconds and skips ids it has
+    already seen. So a new event shows up within the refresh interval.
+    Events inserted with a timestamp older than the late-arrival window,
+    and deletions (resets, eviction, archiving), are reflected at the next
+    full rebuild, every columnar_rebuild_seconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = ColumnarSnapshot(settings.columnar_max_rows)
+        self._watermarks: Dict[str, datetime] = {}
+        self._recent_ids: Dict[Any, int] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.refreshed_at: Optional[float] = None
+        self.rebuilt_at: Optional[float] = None
+        self.last_refresh_ms = 0.0
+
+    # Loading
+
+    @staticmethod
+    def _window_start() -> datetime:
+        return datetime.now(timezone.utc) - timedelta(days=settings.columnar_window_days)
+
+    def _fetch(self, shard: str, since: datetime) -> List[tuple]:
+        table = LLMEvent.__table__
+        query = (
+            select(*[table.c[stored(name)] for name in FETCH_COLUMNS])
+            .where(table.c.time >= since)
+            .order_by(table.c.time)
+            .execution_options(stream_results=True, yield_per=settings.columnar_fetch_rows)
+        )
+        db = shard_router.session_on(shard)
+        try:
+            decode = dimensions.row_decoder(db, FETCH_COLUMNS)
+            return [decode(row) for partition in db.execute(query).partitions() for row in partition]
+        finally:
+            db.close()
+
+    def refresh(self, rebuild: bool = False) -> int:
+        """Pull new rows from every shard (or reload the whole window); returns rows added"""
+        started = time.perf_counter()
+        late = timedelta(seconds=settings.columnar_late_arrival_seconds)
+        window_start = self._window_start()
+
+        fetched: Dict[str, List[tuple]] = {}
+        for shard in shard_router.names:
+            since = window_start if rebuild else max(self._watermarks.get(shard, window_start) - late, window_start)
+            fetched[shard] = self._fetch(shard, since)
+
+        if rebuild:
+            # Load into a fresh snapshot off the lock, then swap it in
+            snapshot, recent_ids = ColumnarSnapshot(settings.columnar_max_rows), {}
+            added = self._merge(snapshot, recent_ids, fetched)
+            with self._lock:
+                self._snapshot, self._recent_ids = snapshot, recent_ids
+        else:
+            with self._lock:
+                added = self._merge(self._snapshot, self._recent_ids, fetched)
+
+        with self._lock:
+            # Ids only need remembering while they can still be re-read
+            horizon = _micros(min(self._watermarks.values(), default=window_start) - late)
+            if len(self._recent_ids) > 2 * max(added, 1000):
+                self._recent_ids = {i: t for i, t in self._recent_ids.items() if t >= horizon}
+            self._snapshot.trim_before(_micros(window_start))
+
+        now = time.time()
+        self.refreshed_at = now
+        if rebuild:
+            self.rebuilt_at = now
+        self.last_refresh_ms = round((time.perf_counter() - started) * 1000, 2)
+        return added
+
+    def _merge(self, snapshot: ColumnarSnapshot, recent_ids: Dict[Any, int],
+               fetched: Dict[str, List[tuple]]) -> int:
+        """Append rows not seen before and advance the shard watermarks"""
+        added = 0
+        for shard, rows in fetched.items():
+            fresh = []
+            for event_id, event_time, *rest in rows:
+                if event_id in recent_ids:
+                    continue
+                recent_ids[event_id] = _micros(event_time)
+                fresh.append((event_time, *rest))
+            snapshot.append(fresh)
+            added += len(fresh)
+            if rows:
+                self._watermarks[shard] = max(self._watermarks.get(shard, rows[-1][1]), rows[-1][1])
+        return added
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                due = self.rebuilt_at is None or time.time() - self.rebuilt_at >= settings.columnar_rebuild_seconds
+                self.refresh(rebuild=due)
+            except Exception as e:
+                logger.error("Columnar refresh failed: %s", e)
+            self._stop.wait(settings.columnar_refresh_seconds)
+
+    def start(self):
+        if settings.columnar_enabled and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="columnar-refresh", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    # Querying
+
+    def _mask(self, start: Optional[datetime], end: Optional[datetime], filters: Dict[str, Optional[str]]):
+        """Row mask for a [start, end) range and equality filters on encoded dimensions"""
+        snapshot = self._snapshot
+        a = {name: array[:snapshot.size] for name, array in snapshot.arrays.items()}
+        mask = np.ones(snapshot.size, dtype=bool)
+        if start is not None:
+            mask &= a["time"] >= _micros(start)
+        if end is not None:
+            mask &= a["time"] < _micros(end)
+        for name, value in filters.items():
+            if value is not None:
+                code = snapshot.dictionaries[name].lookup(value)
+                if code is None:
+                    return a, np.zeros(snapshot.size, dtype=bool)
+                mask &= a[name] == code
+        return a, mask
+
+    def _aggregate(self, a, mask, dimension: str) -> Tuple[Dict[str, np.ndarray], int]:
+        codes = a[dimension][mask].astype(np.int64)
+        groups = len(self._snapshot.dictionaries[dimension])
+        latency = a["latency"][mask]
+        known = latency >= 0
+        events = np.bincount(codes, minlength=groups)
+        errors = np.bincount(codes, weights=a["has_error"][mask], minlength=groups)
+        latency_n = np.bincount(codes[known], minlength=groups)
+        latency_sum = np.bincount(codes[known], weights=latency[known], minlength=groups)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            stats = {
+                "events": events,
+                "errors": errors,
+                "error_rate": np.where(events > 0, errors / np.maximum(events, 1), 0.0),
+                "tokens": np.bincount(codes, weights=a["tokens"][mask], minlength=groups),
+                "cost": np.bincount(codes, weights=a["cost"][mask], minlength=groups),
+                "latency_avg": np.where(latency_n > 0, latency_sum / np.maximum(latency_n, 1), np.nan),
+            }
+        stats["latency_p95"] = _group_quantile(codes[known], latency[known], 0.95, groups)
+        return stats, groups
+
+    @staticmethod
+    def _row(stats: Dict[str, np.ndarray], code: int) -> Dict[str, Any]:
+        def number(value):
+            return None if np.isnan(value) else round(float(value), 3)
+
+        return {
+            "event_count": int(stats["events"][code]),
+            "error_count": int(stats["errors"][code]),
+            "error_rate": round(float(stats["error_rate"][code]), 6),
+            "tokens_total": int(stats["tokens"][code]),
+            "total_cost": round(float(stats["cost"][code]), 6),
+            "latency_avg_ms": number(stats["latency_avg"][code]),
+            "latency_p95_ms": number(stats["latency_p95"][code]),
+        }
+
+    def group_by(self, dimension: str, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                 **filters: Optional[str]) -> List[Dict[str, Any]]:
+        """Aggregates per value of dimension (model, provider or status), largest first"""
+        with self._lock:
+            a, mask = self._mask(start, end, filters)
+            stats, groups = self._aggregate(a, mask, dimension)
+            values = self._snapshot.dictionaries[dimension].values
+        present = np.flatnonzero(stats["events"])
+        rows = [{"value": values[code] or "unknown", **self._row(stats, code)} for code in present]
+        return sorted(rows, key=lambda r: r["event_count"], reverse=True)
+
+    def top_k(self, dimension: str, metric: str, k: int = 10, start: Optional[datetime] = None,
+              end: Optional[datetime] = None, min_events: int = 1, **filters: Optional[str]) -> List[Dict[str, Any]]:
+        """The k values of dimension with the highest metric, e.g. sessions by latency_p95"""
+        with self._lock:
+            a, mask = self._mask(start, end, filters)
+            stats, groups = self._aggregate(a, mask, dimension)
+            values = list(self._snapshot.dictionaries[dimension].values)
+        score = np.where(stats["events"] >= max(min_events, 1), np.nan_to_num(stats[metric], nan=-np.inf), -np.inf)
+        candidates = np.flatnonzero(np.isfinite(score))
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-score[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-score[candidates])]
+        rows = [{"value": values[code], **self._row(stats, code)} for code in candidates]
+        if dimension == "session":
+            self._resolve_sessions(rows)
+        return rows
+
+    @staticmethod
+    def _resolve_sessions(rows: List[Dict[str, Any]]):
+        """Swap internal session ids for the public session ids"""
+        pks = [row["value"] for row in rows]
+        if not pks:
+            return
+        found: Dict[Any, str] = {}
+        for result in shard_router.scatter(
+            lambda db: db.execute(select(Session.id, Session.session_id).where(Session.id.in_(pks))).all()
+        ).values():
+            found.update(dict(result))
+        for row in rows:
+            row["value"] = found.get(row["value"], str(row["value"]))
+
+    def timeseries(self, bucket_seconds: int, start: datetime, end: datetime,
+                   **filters: Optional[str]) -> List[Dict[str, Any]]:
+        """Events, errors and cost per time bucket over [start, end)"""
+        step = bucket_seconds * 1_000_000
+        with self._lock:
+            a, mask = self._mask(start, end, filters)
+            slots = (a["time"][mask] - _micros(start)) // step
+            buckets = max(int((_micros(end) - _micros(start) + step - 1) // step), 1)
+            events = np.bincount(slots, minlength=buckets)
+            errors = np.bincount(slots, weights=a["has_error"][mask], minlength=buckets)
+            cost = np.bincount(slots, weights=a["cost"][mask], minlength=buckets)
+        origin = _micros(start)
+        return [
+            {
+                "start": _from_micros(origin + i * step),
+                "event_count": int(events[i]),
+                "error_count": int(errors[i]),
+                "error_rate": round(float(errors[i] / events[i]), 6) if events[i] else 0.0,
+                "total_cost": round(float(cost[i]), 6),
+            }
+            for i in range(buckets)
+        ]
+
+    def status(self) -> Dict[str, Any]:
+        snapshot = self._snapshot
+        return {
+            "enabled": settings.columnar_enabled,
+            "rows": snapshot.size,
+            "max_rows": snapshot.max_rows,
+            "memory_bytes": snapshot.nbytes(),
+            "rows_dropped": snapshot.dropped,
+            "window_days": settings.columnar_window_days,
+            "oldest": _from_micros(snapshot.arrays["time"][:snapshot.size].min()) if snapshot.size else None,
+            "watermarks": dict(self._watermarks),
+            "refreshed_at": self.refreshed_at,
+            "rebuilt_at": self.rebuilt_at,
+            "last_refresh_ms": self.last_refresh_ms,
+            "refresh_seconds": settings.columnar_refresh_seconds,
+            "late_arrival_seconds": settings.columnar_late_arrival_seconds,
+            "rebuild_seconds": settings.columnar_rebuild_seconds,
+        }
+
+
+columnar_engine = ColumnarAnalyticsEngine()
@@ -0,0 +1,154 @@
+"""Content-capture policy: how much prompt and response text events keep"""
+from sqlalchemy import select
+from sqlalchemy.orm import Session as DBSession
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+import hashlib
+import hmac
+import random
+import uuid
+import logging
+
+import orjson
+
+from ..db.models import Session
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+MODES = ("full", "truncated", "hashed", "sampled")
+
+# Key in Session.session_metadata holding a session's override
+METADATA_KEY = "content_capture"
+
+
+class CapturePolicy(NamedTuple):
+    mode: str
+    max_chars: int
+    sample_rate: float
+
+
+class CapturedContent(NamedTuple):
+    """What an event stores, and the decision recorded with it"""
+    messages: Optional[List[Dict[str, Any]]]
+    response: Optional[str]
+    # full / truncated / hashed / sampled (kept in full) / omitted (sampled out) / error (kept in full)
+    capture: str
+    # Set when the policy sampled, whether or not this event was kept: kept events count 1 / rate
+    sample_rate: Optional[float]
+
+
+def _hash(text: str) -> str:
+    data = text.encode()
+    if settings.content_capture_hash_key:
+        return hmac.new(settings.content_capture_hash_key.encode(), data, hashlib.sha256).hexdigest()
+    return hashlib.sha256(data).hexdigest()
+
+
+def _text(content: Any) -> str:
+    return content if isinstance(content, str) else orjson.dumps(content).decode()
+
+
+class ContentCaptureService:
+    """
+    Decide, per event, what becomes of its messages and response.
+
+    The deployment default comes from the content_capture_* settings; a
+    session can override any part of it in its metadata (see
+    /sessions/current/capture). Failed calls keep their content in full
+    whatever the policy, since that is when it gets read. The decision
+    and the sample rate are stored on the event (content_capture,
+    content_sample_rate), so analytics over content can weight sampled
+    events instead of mistaking them for the whole population.
+    """
+
+    @staticmethod
+    def validate(mode: str, max_chars: int, sample_rate: float) -> CapturePolicy:
+        if mode not in MODES:
+            raise ValueError(f"Unknown capture mode {mode!r}; expected one of {', '.join(MODES)}")
+        if max_chars < 0:
+            raise ValueError("max_chars must not be negative")
+        if not 0.0 <= sample_rate <= 1.0:
+            raise ValueError("sample_rate must be between 0 and 1")
+        return CapturePolicy(mode, max_chars, sample_rate)
+
+    @staticmethod
+    def default() -> CapturePolicy:
+        return ContentCaptureService.validate(
+            settings.content_capture_mode, settings.content_capture_max_chars, settings.content_capture_sample_rate
+        )
+
+    @staticmethod
+    def override(session_metadata: Optional[dict]) -> Dict[str, Any]:
+        """The session's override (possibly partial), or {}"""
+        return dict((session_metadata or {}).get(METADATA_KEY) or {})
+
+    @staticmethod
+    def carry_over(session_metadata: Optional[dict]) -> Dict[str, Any]:
+        """The part of a session's metadata that survives a reset: its override is a setting, not history"""
+        override = ContentCaptureService.override(session_metadata)
+        return {METADATA_KEY: override} if override else {}
+
+    @staticmethod
+    def for_metadata(session_metadata: Optional[dict]) -> CapturePolicy:
+        """Effective policy: the deployment default with the session's override on top"""
+        default = ContentCaptureService.default()
+        override = ContentCaptureService.override(session_metadata)
+        if not override:
+            return default
+        try:
+            return ContentCaptureService.validate(
+                override.get("mode", default.mode),
+                int(override.get("max_chars", default.max_chars)),
+                float(override.get("sample_rate", default.sample_rate)),
+            )
+        except (TypeError, ValueError) as e:
+            logger.warning("Ignoring invalid content capture override %r: %s", override, e)
+            return default
+
+    @staticmethod
+    def for_session(session: Session) -> CapturePolicy:
+        return ContentCaptureService.for_metadata(session.session_metadata)
+
+    @staticmethod
+    def for_sessions(db: DBSession, session_pks: Iterable[uuid.UUID]) -> Dict[uuid.UUID, CapturePolicy]:
+        """Effective policies for many sessions in one query"""
+        rows = db.execute(
+            select(Session.id, Session.session_metadata).where(Session.id.in_(list(session_pks)))
+        ).all()
+        return {pk: ContentCaptureService.for_metadata(metadata) for pk, metadata in rows}
+
+    @staticmethod
+    def apply(policy: CapturePolicy, messages: Optional[List[Dict[str, Any]]], response: Optional[str],
+              has_error: bool) -> CapturedContent:
+        if has_error:
+            return CapturedContent(messages, response, "error", None)
+
+        if policy.mode == "sampled":
+            if random.random() < policy.sample_rate:
+                return CapturedContent(messages, response, "sampled", policy.sample_rate)
+            return CapturedContent(None, None, "omitted", policy.sample_rate)
+
+        if policy.mode == "hashed":
+            # Roles survive, so conversation shape and repeated prompts stay visible
+            hashed_messages = None if messages is None else [
+                {"role": m.get("role"), "content_sha256": _hash(_text(m.get("content", "")))} for m in messages
+            ]
+            hashed_response = None if response is None else f"sha256:{_hash(response)}"
+            return CapturedContent(hashed_messages, hashed_response, "hashed", None)
+
+        if policy.mode == "truncated":
+            limit = policy.max_chars
+            cut = False
+            if messages is not None:
+                kept = []
+                for m in messages:
+                    content = m.get("content")
+                    if isinstance(content, str) and len(content) > limit:
+                        m, cut = {**m, "content": content[:limit]}, True
+                    kept.append(m)
+                messages = kept
+            if response is not None and len(response) > limit:
+                response, cut = response[:limit], True
+            return CapturedContent(messages, response, "truncated" if cut else "full", None)
+
+        return CapturedContent(messages, response, "full", None)
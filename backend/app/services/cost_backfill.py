@@ -0,0 +1,266 @@
+"""Recompute stored event costs after a price change"""
+from typing import Optional
+from datetime import datetime, timedelta, timezone
+import time
+import uuid
+import logging
+
+import numpy as np
+
+from ..db.base import SessionLocal
+from ..db.shards import shard_router
+from ..db.models import CostBackfillJob
+from ..db.dimensions import dimensions
+from ..config import settings
+from .pricing import PricingService, PriceBook, FALLBACK_RATES
+
+logger = logging.getLogger(__name__)
+
+FETCH_SQL = """
+    SELECT id, time, model_id, tokens_prompt, tokens_completion, tokens_cached_input, cost_micros
+    FROM playground_events
+    WHERE (time, id) > (%(cursor_time)s::timestamptz, %(cursor_id)s::uuid)
+      AND (%(since)s::timestamptz IS NULL OR time >= %(since)s)
+      AND (%(until)s::timestamptz IS NULL OR time < %(until)s)
+    ORDER BY time, id
+    LIMIT %(limit)s
+"""
+
+# One statement per chunk: the new costs travel as three parallel arrays
+UPDATE_SQL = """
+    UPDATE playground_events AS e
+    SET cost_micros = v.micros
+    FROM unnest(%(ids)s::uuid[], %(times)s::timestamptz[], %(micros)s::bigint[]) AS v(id, time, micros)
+    WHERE e.id = v.id AND e.time = v.time
+"""
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+# Keyset start: sorts before every real (time, id)
+CURSOR_START = (datetime(1900, 1, 1, tzinfo=timezone.utc), "00000000-0000-0000-0000-000000000000")
+
+
+def _epoch_us(moment: datetime) -> int:
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return (moment - EPOCH) // MICROSECOND
+
+
+def _to_micros(values) -> np.ndarray:
+    """cost_micros column -> int64 array, NULL as 0"""
+    return np.fromiter((v if v is not None else 0 for v in values), dtype=np.int64, count=len(values))
+
+
+def compute_cost_micros(book: PriceBook, times, models, prompt, completion, cached) -> np.ndarray:
+    """
+    Vectorized cost in micro-dollars for one chunk.
+
+    Rows are grouped by model; each model's price versions are resolved for
+    the whole group with one searchsorted over event times. The arithmetic
+    is exact int64 math with the same half-up rounding as compute_cost.
+    """
+    n = len(times)
+    time_us = np.fromiter((_epoch_us(t) for t in times), dtype=np.int64, count=n)
+    prompt = np.asarray(prompt, dtype=np.int64)
+    completion = np.asarray(completion, dtype=np.int64)
+    cached = np.asarray(cached, dtype=np.int64)
+
+    # Rates in micro-dollars per million tokens; default to the fallback table
+    rate_in = np.full(n, int(FALLBACK_RATES[0] * 1_000_000), dtype=np.int64)
+    rate_out = np.full(n, int(FALLBACK_RATES[1] * 1_000_000), dtype=np.int64)
+    rate_cached = np.full(n, int(FALLBACK_RATES[2] * 1_000_000), dtype=np.int64)
+
+    unique_models, inverse = np.unique(np.array([m or "" for m in models]), return_inverse=True)
+    for model_index, model in enumerate(unique_models):
+        prefix = book.prefix_for(str(model))
+        if prefix is None:
+            continue
+        versions = book.versions(prefix)
+        starts = np.array([_epoch_us(v.effective_from) for v in versions], dtype=np.int64)
+        v_in = np.array([int(v.input_per_mtok * 1_000_000) for v in versions], dtype=np.int64)
+        v_out = np.array([int(v.output_per_mtok * 1_000_000) for v in versions], dtype=np.int64)
+        v_cached = np.array([int(v.cached_input_per_mtok * 1_000_000) for v in versions], dtype=np.int64)
+
+        rows = np.nonzero(inverse == model_index)[0]
+        which = np.clip(np.searchsorted(starts, time_us[rows], side="right") - 1, 0, None)
+        rate_in[rows] = v_in[which]
+        rate_out[rows] = v_out[which]
+        rate_cached[rows] = v_cached[which]
+
+    numerator = prompt * rate_in + completion * rate_out + cached * rate_cached
+    return (numerator + 500_000) // 1_000_000
+
+
+class CostBackfillService:
+    """Chunked, resumable recomputation of stored event costs"""
+
+    @staticmethod
+    def run(
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        chunk_size: Optional[int] = None,
+        resume_job_id: Optional[int] = None,
+        dry_run: bool = False,
+        shard: Optional[str] = None,
+    ) -> dict:
+        """
+        Walk playground_events in (time, id) order and rewrite costs that differ
+        from the current price table.
+
+        Each chunk's UPDATE and the job's cursor commit together, so a crashed
+        or interrupted run resumes exactly where it stopped (resume_job_id).
+        Shards are processed one after another, each with its own job row
+        stored on that shard; resuming a job needs its shard when there are
+        several.
+        """
+        shards = [shard] if shard else shard_router.names
+        if resume_job_id is not None and len(shards) > 1:
+            return {"success": False, "message": "Pass the job's shard to resume it"}
+
+        catalog = SessionLocal()
+        try:
+            book = PricingService.load(catalog)
+        finally:
+            catalog.close()
+
+        results = {}
+        for name in shards:
+            results[name] = CostBackfillService._run_on_shard(
+                name, book, since, until, chunk_size or settings.cost_backfill_chunk_size, resume_job_id, dry_run
+            )
+            if not results[name]["success"]:
+                break
+        if len(results) == 1:
+            return results[name]
+
+        scanned = sum(r.get("rows_scanned", 0) for r in results.values())
+        updated = sum(r.get("rows_updated", 0) for r in results.values())
+        failed = [n for n, r in results.items() if not r["success"]]
+        return {
+            "success": not failed,
+            "dry_run": dry_run,
+            "rows_scanned": scanned,
+            "rows_updated": updated,
+            "shards": results,
+            "message": (
+                f"Cost backfill failed on shard {failed[0]}: {results[failed[0]]['message']}" if failed
+                else f"{'Would update' if dry_run else 'Updated'} {updated} of {scanned} events on {len(results)} shards"
+            ),
+        }
+
+    @staticmethod
+    def _run_on_shard(shard: str, book: PriceBook, since, until, chunk_size: int,
+                      resume_job_id: Optional[int], dry_run: bool) -> dict:
+        db = shard_router.session_on(shard)
+        job = None
+        try:
+            if resume_job_id is not None:
+                job = db.get(CostBackfillJob, resume_job_id)
+                if job is None:
+                    raise ValueError(f"Backfill job {resume_job_id} not found")
+                since, until = job.since, job.until
+                job.status = "running"
+            else:
+                job = CostBackfillJob(status="running", since=since, until=until, rows_scanned=0, rows_updated=0)
+                if not dry_run:
+                    db.add(job)
+            if not dry_run:
+                db.commit()
+
+            cursor_time = job.cursor_time or CURSOR_START[0]
+            cursor_id = str(job.cursor_id) if job.cursor_id else CURSOR_START[1]
+            scanned, updated = job.rows_scanned or 0, job.rows_updated or 0
+            started = time.perf_counter()
+            logger.info("Cost backfill %sshard=%s job=%s since=%s until=%s",
+                        "(dry run) " if dry_run else "", shard, job.id, since, until)
+
+            while True:
+                # Each chunk is its own transaction; re-acquire the connection after every commit
+                raw = db.connection().connection
+                with raw.cursor() as cur:
+                    cur.execute(FETCH_SQL, {
+                        "cursor_time": cursor_time, "cursor_id": cursor_id,
+                        "since": since, "until": until, "limit": chunk_size,
+                    })
+                    rows = cur.fetchall()
+                if not rows:
+                    break
+
+                ids, times, model_ids, prompt, completion, cached, current = zip(*rows)
+                new_micros = compute_cost_micros(
+                    book, times, dimensions.decode_many(db, "model", model_ids),
+                    [p or 0 for p in prompt], [c or 0 for c in completion], [c or 0 for c in cached],
+                )
+                changed = np.nonzero(new_micros != _to_micros(current))[0]
+
+                if len(changed) and not dry_run:
+                    with raw.cursor() as cur:
+                        cur.execute(UPDATE_SQL, {
+                            "ids": [str(ids[i]) for i in changed],
+                            "times": [times[i] for i in changed],
+                            "micros": new_micros[changed].tolist(),
+                        })
+
+                scanned += len(rows)
+                updated += len(changed)
+                cursor_time, cursor_id = times[-1], str(ids[-1])
+
+                if not dry_run:
+                    job.cursor_time, job.cursor_id = cursor_time, uuid.UUID(cursor_id)
+                    job.rows_scanned, job.rows_updated = scanned, updated
+                db.commit()
+
+                rate = scanned / max(time.perf_counter() - started, 1e-9)
+                logger.info("Cost backfill: scanned %d, updated %d, at %s (%.0f rows/s)", scanned, updated, cursor_time, rate)
+
+            if not dry_run:
+                job.status = "completed"
+                db.commit()
+
+            return {
+                "success": True,
+                "dry_run": dry_run,
+                "shard": shard,
+                "job_id": job.id,
+                "rows_scanned": scanned,
+                "rows_updated": updated,
+                "message": f"{'Would update' if dry_run else 'Updated'} {updated} of {scanned} events",
+            }
+
+        except Exception as e:
+            db.rollback()
+            logger.error("Error during cost backfill on shard %s: %s", shard, e)
+            if not dry_run and job is not None and job.id is not None:
+                job.status = "failed"
+                job.error_message = str(e)
+                db.commit()
+            return {
+                "success": False,
+                "error": str(e),
+                "shard": shard,
+                "job_id": job.id if job is not None else None,
+                "message": f"Cost backfill failed: {str(e)}",
+            }
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    # python -m app.services.cost_backfill [--dry-run] [--since ISO] [--until ISO] [--chunk N] [--shard NAME] [--resume JOB_ID]
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Recompute event costs from the price table")
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--since", type=datetime.fromisoformat)
+    parser.add_argument("--until", type=datetime.fromisoformat)
+    parser.add_argument("--chunk", type=int)
+    parser.add_argument("--shard", help="Only this shard (default: all, one after another)")
+    parser.add_argument("--resume", type=int, help="Continue an interrupted job (with --shard when sharded)")
+    args = parser.parse_args()
+
+    result = CostBackfillService.run(
+        since=args.since, until=args.until, chunk_size=args.chunk,
+        resume_job_id=args.resume, dry_run=args.dry_run, shard=args.shard,
+    )
+    print(f"\nResult: {result['message']}")
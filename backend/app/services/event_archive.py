@@ -0,0 +1,526 @@
+"""Cold-tier archive of old events in Parquet, queried in place with DuckDB"""
+from sqlalchemy import select, text, func
+from sqlalchemy.orm import Session as DBSession
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from datetime import datetime, timedelta, timezone, date
+from decimal import Decimal
+import hashlib
+import uuid
+import time
+import logging
+
+import orjson
+
+from ..config import settings
+from ..db.models import LLMEvent
+from ..db.dimensions import dimensions, stored, STORED_COLUMNS
+from ..db.shards import shard_router
+
+logger = logging.getLogger(__name__)
+
+# Everything but the generated search vector; content is kept so exports stay complete.
+# Files hold the decoded values (model names, cost in USD), as exports do.
+_PUBLIC_NAMES = {column: name for name, column in STORED_COLUMNS.items()}
+ARCHIVE_COLUMNS = [_PUBLIC_NAMES.get(c.name, c.name) for c in LLMEvent.__table__.c if c.computed is None]
+
+DELETE_CHUNK = 10000
+
+# Files of a day whose delete hasn't committed yet, laid out like the archive itself
+PENDING_DIR = "_pending"
+
+# Does any event of a pending file remain in Postgres, i.e. did its delete not commit?
+LEFT_BEHIND_SQL = text("""
+    SELECT 1 FROM playground_events
+    WHERE time >= :day_start AND time < :day_end AND id = ANY(CAST(:ids AS uuid[]))
+    LIMIT 1
+""")
+
+DELETE_SQL = text("""
+    DELETE FROM playground_events
+    WHERE time >= :day_start AND time < :day_end AND id = ANY(CAST(:ids AS uuid[]))
+""")
+
+# Archived events leave the hot counters and are remembered in the archived_* rollups
+ROLLUP_SQL = text("""
+    UPDATE playground_sessions s SET
+        event_count = GREATEST(s.event_count - v.n, 0),
+        archived_event_count = s.archived_event_count + v.n,
+        archived_tokens_total = s.archived_tokens_total + v.tokens,
+        archived_cost_usd = s.archived_cost_usd + v.cost
+    FROM (
+        SELECT unnest(CAST(:pks AS uuid[])) AS id, unnest(CAST(:ns AS bigint[])) AS n,
+               unnest(CAST(:tokens AS bigint[])) AS tokens, unnest(CAST(:costs AS numeric[])) AS cost
+    ) v
+    WHERE s.id = v.id
+""")
+
+# Columns added after the archive format; files written before them read these as NULL
+LATE_COLUMNS = {"content_capture": "VARCHAR", "content_sample_rate": "FLOAT"}
+
+# Same shape as analytics.BREAKDOWN_SQL, in DuckDB's dialect
+BREAKDOWN_SQL = """
+    SELECT model, provider, status,
+           GROUPING(model, provider, status) AS grouping_id,
+           count(*) AS event_count,
+           count(*) FILTER (WHERE has_error) AS error_count,
+           CAST(coalesce(sum(tokens_prompt), 0) AS BIGINT) AS tokens_prompt,
+           CAST(coalesce(sum(tokens_completion), 0) AS BIGINT) AS tokens_completion,
+           CAST(coalesce(sum(tokens_total), 0) AS BIGINT) AS tokens_total,
+           coalesce(sum(cost_usd), 0) AS total_cost,
+           avg(latency_ms) AS latency_avg_ms,
+           quantile_cont(latency_ms, 0.5) AS latency_p50_ms,
+           quantile_cont(latency_ms, 0.95) AS latency_p95_ms,
+           max(latency_ms) AS latency_max_ms
+    FROM {source}
+    WHERE {where}
+    GROUP BY GROUPING SETS ((model), (provider), (status), ())
+"""
+
+
+def _arrow_schema():
+    import pyarrow as pa
+
+    types = {
+        "id": pa.string(), "time": pa.timestamp("us", tz="UTC"), "session_id": pa.string(),
+        "model": pa.string(), "provider": pa.string(), "endpoint": pa.string(), "user_id": pa.string(),
+        "tokens_prompt": pa.int32(), "tokens_completion": pa.int32(), "tokens_total": pa.int32(),
+        "tokens_cached_input": pa.int32(),
+        "latency_ms": pa.int32(), "time_to_first_token_ms": pa.int32(), "queue_wait_ms": pa.int32(),
+        "hedge_outcome": pa.string(), "circuit_state": pa.string(),
+        "cost_usd": pa.decimal128(10, 6),
+        "messages": pa.string(), "response": pa.string(),
+        "content_capture": pa.string(), "content_sample_rate": pa.float32(),
+        "temperature": pa.decimal128(3, 2), "max_tokens": pa.int32(), "top_p": pa.decimal128(3, 2),
+        "status": pa.string(), "error_message": pa.string(),
+        "has_error": pa.bool_(), "pii_detected": pa.bool_(),
+    }
+    return pa.schema([(name, types[name]) for name in ARCHIVE_COLUMNS])
+
+
+class EventArchiveService:
+    """
+    Move events older than archive_after_days out of Postgres into
+    zstd-compressed Parquet under archive_path (a local directory or an
+    object-store URI pyarrow understands, e.g. s3://bucket/prefix):
+
+        <archive_path>/day=2026-01-31/bucket=07/part-<shard>-<run>.parquet
+
+    bucket is a hash of the session's internal id, so one session's
+    history lives in one directory per day and session queries read only
+    that slice. A day's files are written under <archive_path>/_pending
+    first, its rows are deleted, and only then are the files moved into
+    place, so no row is ever both in Postgres and visible in the archive.
+    If a run dies between those steps, the next run settles its leftovers
+    before starting: a pending file whose events are still in Postgres
+    lost its delete and is discarded (the rows get archived again), and
+    one whose events are gone is moved into place. Events that arrive
+    later for a day already archived get a part of their own next to it.
+
+    When a requested range reaches past the hot window, readers query the
+    files in place with DuckDB and combine the result with Postgres.
+    Full-text search covers hot events only.
+    """
+
+    @staticmethod
+    def enabled() -> bool:
+        return bool(settings.archive_path)
+
+    @staticmethod
+    def hot_cutoff() -> datetime:
+        """Events older than this may live in the archive"""
+        return datetime.now(timezone.utc) - timedelta(days=settings.archive_after_days)
+
+    @staticmethod
+    def reaches(start: Optional[datetime]) -> bool:
+        """Whether a range starting at start (None = unbounded) needs the archive"""
+        if not EventArchiveService.enabled():
+            return False
+        if start is not None and start.tzinfo is None:
+            start = start.replace(tzinfo=timezone.utc)
+        return start is None or start < EventArchiveService.hot_cutoff()
+
+    @staticmethod
+    def bucket_for(session_pk) -> int:
+        digest = hashlib.blake2b(str(session_pk).encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "big") % settings.archive_session_buckets
+
+    @staticmethod
+    def reset_marker() -> dict:
+        """Session metadata that hides archived events from a session after a reset"""
+        if not EventArchiveService.enabled():
+            return {}
+        return {"archive_reset_at": datetime.now(timezone.utc).isoformat()}
+
+    # Writing
+
+    @staticmethod
+    def _filesystem():
+        from pyarrow import fs
+
+        filesystem, root = fs.FileSystem.from_uri(settings.archive_path)
+        return filesystem, root.rstrip("/")
+
+    @staticmethod
+    def run(dry_run: bool = False) -> dict:
+        """
+        Archive every shard's events older than the hot window, one UTC day
+        at a time. Readers use the same window to decide when to look in the
+        archive, so archive_after_days is the only knob.
+        """
+        if not EventArchiveService.enabled():
+            return {"success": False, "message": "Archiving is disabled (ARCHIVE_PATH not set)"}
+
+        cutoff = EventArchiveService.hot_cutoff()
+        started = time.perf_counter()
+        archived, files = 0, 0
+        try:
+            for shard in shard_router.names:
+                db = shard_router.session_on(shard)
+                try:
+                    if not dry_run:
+                        EventArchiveService._settle_pending(db, shard)
+                    # Only the days that have events: one stray old event must not cost a query per day since
+                    utc_day = func.date_trunc("day", func.timezone("UTC", LLMEvent.time))
+                    days = [
+                        d.date() for d in db.execute(
+                            select(utc_day).where(LLMEvent.time < cutoff).distinct().order_by(utc_day)
+                        ).scalars()
+                    ]
+                    db.rollback()
+                    for day in days:
+                        if dry_run:
+                            archived += EventArchiveService._count_day(db, day, cutoff)
+                        else:
+                            rows, written = EventArchiveService._archive_day(db, shard, day, cutoff)
+                            archived += rows
+                            files += written
+                finally:
+                    db.close()
+
+            dropped = 0 if dry_run else EventArchiveService._apply_retention()
+            verb = "Would archive" if dry_run else "Archived"
+            return {
+                "success": True,
+                "dry_run": dry_run,
+                "cutoff": cutoff.isoformat(),
+                "events_archived": archived,
+                "files_written": files,
+                "days_dropped": dropped,
+                "duration_s": round(time.perf_counter() - started, 1),
+                "message": f"{verb} {archived} events older than {settings.archive_after_days} days",
+            }
+        except Exception as e:
+            logger.error("Error archiving events: %s", e)
+            return {
+                "success": False,
+                "error": str(e),
+                "events_archived": archived,
+                "message": f"Archiving failed after {archived} events: {str(e)}",
+            }
+
+    @staticmethod
+    def _day_bounds(day: date, cutoff: datetime) -> Tuple[datetime, datetime]:
+        day_start = datetime.combine(day, datetime.min.time(), timezone.utc)
+        return day_start, min(day_start + timedelta(days=1), cutoff)
+
+    @staticmethod
+    def _count_day(db: DBSession, day: date, cutoff: datetime) -> int:
+        day_start, day_end = EventArchiveService._day_bounds(day, cutoff)
+        count = db.execute(
+            select(func.count()).select_from(LLMEvent).where(LLMEvent.time >= day_start, LLMEvent.time < day_end)
+        ).scalar()
+        db.rollback()
+        return count
+
+    @staticmethod
+    def _archive_day(db: DBSession, shard: str, day: date, cutoff: datetime) -> Tuple[int, int]:
+        """Write one day of a shard's events to per-bucket files, then delete them in one transaction"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        day_start, day_end = EventArchiveService._day_bounds(day, cutoff)
+        filesystem, root = EventArchiveService._filesystem()
+        schema = _arrow_schema()
+        table = LLMEvent.__table__
+        query = (
+            select(*[table.c[stored(name)] for name in ARCHIVE_COLUMNS])
+            .where(table.c.time >= day_start, table.c.time < day_end)
+            .order_by(table.c.session_id, table.c.time, table.c.id)
+            .execution_options(stream_results=True, yield_per=settings.archive_chunk_rows)
+        )
+
+        run = uuid.uuid4().hex
+        writers: Dict[int, Any] = {}
+        ids: List[str] = []
+        rollups: Dict[Any, List] = {}
+        session_index = ARCHIVE_COLUMNS.index("session_id")
+        id_index = ARCHIVE_COLUMNS.index("id")
+        tokens_index = ARCHIVE_COLUMNS.index("tokens_total")
+        cost_index = ARCHIVE_COLUMNS.index("cost_usd")
+        decode = dimensions.row_decoder(db, ARCHIVE_COLUMNS)
+        try:
+            for partition in db.execute(query).partitions():
+                by_bucket: Dict[int, List[tuple]] = {}
+                for row in map(decode, partition):
+                    session_pk = row[session_index]
+                    by_bucket.setdefault(EventArchiveService.bucket_for(session_pk), []).append(row)
+                    ids.append(str(row[id_index]))
+                    rollup = rollups.setdefault(session_pk, [0, 0, Decimal(0)])
+                    rollup[0] += 1
+                    rollup[1] += row[tokens_index] or 0
+                    rollup[2] += row[cost_index] or 0
+
+                for bucket, rows in by_bucket.items():
+                    if bucket not in writers:
+                        relative = f"day={day.isoformat()}/bucket={bucket:02d}"
+                        directory = f"{root}/{PENDING_DIR}/{relative}"
+                        filesystem.create_dir(directory, recursive=True)
+                        # Dot-prefixed until complete, so settling a crashed run never takes it for a whole file
+                        temp_path = f"{directory}/.tmp-{shard}-{run}.parquet"
+                        writers[bucket] = (
+                            pq.ParquetWriter(temp_path, schema, filesystem=filesystem, compression="zstd"),
+                            relative,
+                            temp_path,
+                        )
+                    columns = list(zip(*rows))
+                    arrays = []
+                    for name, values in zip(ARCHIVE_COLUMNS, columns):
+                        if name in ("id", "session_id"):
+                            values = [str(v) for v in values]
+                        elif name == "messages":
+                            values = [orjson.dumps(v).decode() if v is not None else None for v in values]
+                        arrays.append(pa.array(values, type=schema.field(name).type))
+                    writers[bucket][0].write_table(pa.Table.from_arrays(arrays, schema=schema))
+        except Exception:
+            for writer, _, temp_path in writers.values():
+                writer.close()
+                filesystem.delete_file(temp_path)
+            db.rollback()
+            raise
+
+        # Complete files wait in _pending until the delete has committed
+        pending = []
+        for writer, relative, temp_path in writers.values():
+            writer.close()
+            pending_path = f"{root}/{PENDING_DIR}/{relative}/part-{shard}-{run}.parquet"
+            filesystem.move(temp_path, pending_path)
+            pending.append((pending_path, relative))
+        if not ids:
+            db.rollback()
+            return 0, 0
+
+        try:
+            for i in range(0, len(ids), DELETE_CHUNK):
+                db.execute(DELETE_SQL, {"day_start": day_start, "day_end": day_end, "ids": ids[i:i + DELETE_CHUNK]})
+            pks = list(rollups)
+            db.execute(ROLLUP_SQL, {
+                "pks": [str(pk) for pk in pks],
+                "ns": [rollups[pk][0] for pk in pks],
+                "tokens": [rollups[pk][1] for pk in pks],
+                "costs": [rollups[pk][2] for pk in pks],
+            })
+            db.commit()
+        except Exception:
+            db.rollback()
+            for pending_path, _ in pending:
+                filesystem.delete_file(pending_path)
+            raise
+
+        for pending_path, relative in pending:
+            EventArchiveService._publish(filesystem, root, pending_path, relative)
+        logger.info("Archived %d events from shard %s for %s into %d files", len(ids), shard, day, len(writers))
+        return len(ids), len(writers)
+
+    @staticmethod
+    def _publish(filesystem, root: str, pending_path: str, relative: str):
+        directory = f"{root}/{relative}"
+        filesystem.create_dir(directory, recursive=True)
+        filesystem.move(pending_path, f"{directory}/{pending_path.rsplit('/', 1)[1]}")
+
+    @staticmethod
+    def _settle_pending(db: DBSession, shard: str) -> int:
+        """Finish or discard the pending files a crashed run of this shard left; returns how many"""
+        import pyarrow.parquet as pq
+        from pyarrow import fs
+
+        filesystem, root = EventArchiveService._filesystem()
+        base = f"{root}/{PENDING_DIR}"
+        settled = 0
+        for info in filesystem.get_file_info(fs.FileSelector(base, recursive=True, allow_not_found=True)):
+            name = info.base_name
+            if info.type != fs.FileType.File:
+                continue
+            if name.startswith(f".tmp-{shard}-"):
+                filesystem.delete_file(info.path)  # Never completed
+                continue
+            # part-<shard>-<32 hex run>.parquet; shard names may contain dashes themselves
+            if not (name.startswith("part-") and name.endswith(".parquet") and name[5:-41] == shard):
+                continue
+            relative = info.path[len(base) + 1:].rsplit("/", 1)[0]
+            day = date.fromisoformat(relative.split("/")[0][len("day="):])
+            day_start = datetime.combine(day, datetime.min.time(), timezone.utc)
+            ids = [str(i) for i in pq.read_table(info.path, columns=["id"], filesystem=filesystem).column("id").to_pylist()]
+            left_behind = db.execute(LEFT_BEHIND_SQL, {
+                "day_start": day_start, "day_end": day_start + timedelta(days=1), "ids": ids,
+            }).first() is not None
+            db.rollback()
+            if left_behind:
+                # The delete never committed: these rows are archived again with the rest of the day
+                filesystem.delete_file(info.path)
+            else:
+                EventArchiveService._publish(filesystem, root, info.path, relative)
+            settled += 1
+            logger.warning("Settled pending archive file %s (%s)", info.path, "discarded" if left_behind else "published")
+        return settled
+
+    @staticmethod
+    def _apply_retention() -> int:
+        """Drop whole day directories older than archive_retention_days (0 keeps everything)"""
+        if settings.archive_retention_days <= 0:
+            return 0
+        from pyarrow import fs
+
+        filesystem, root = EventArchiveService._filesystem()
+        oldest_kept = (datetime.now(timezone.utc) - timedelta(days=settings.archive_retention_days)).date()
+        dropped = 0
+        for info in filesystem.get_file_info(fs.FileSelector(root, allow_not_found=True)):
+            name = info.base_name
+            if info.type == fs.FileType.Directory and name.startswith("day="):
+                try:
+                    expired = date.fromisoformat(name[4:]) < oldest_kept
+                except ValueError:
+                    continue
+                if expired:
+                    filesystem.delete_dir(info.path)
+                    dropped += 1
+        return dropped
+
+    # Reading
+
+    @staticmethod
+    def _connect():
+        import duckdb
+
+        conn = duckdb.connect()
+        conn.execute("SET TimeZone='UTC'")
+        if "://" in settings.archive_path and not settings.archive_path.startswith("file://"):
+            conn.execute("INSTALL httpfs")
+            conn.execute("LOAD httpfs")
+        return conn
+
+    @staticmethod
+    def _source(session_pk=None) -> str:
+        root = settings.archive_path.rstrip("/")
+        if root.startswith("file://"):
+            root = root[len("file://"):]
+        bucket = "*" if session_pk is None else f"{EventArchiveService.bucket_for(session_pk):02d}"
+        return f"read_parquet('{root}/day=*/bucket={bucket}/part-*.parquet', hive_partitioning = true, union_by_name = true)"
+
+    @staticmethod
+    def _where(session_pk, start, end, archived_after=None, model=None, status=None) -> Tuple[str, list]:
+        clauses, params = [], []
+        if session_pk is not None:
+            clauses.append("session_id = ?")
+            params.append(str(session_pk))
+        for bound, op in ((start, ">="), (archived_after, ">"), (end, "<")):
+            if bound is None:
+                continue
+            if isinstance(bound, str):
+                bound = datetime.fromisoformat(bound)
+            if bound.tzinfo is None:
+                bound = bound.replace(tzinfo=timezone.utc)
+            bound = bound.astimezone(timezone.utc)
+            # The day bound prunes hive partitions before any file is opened
+            clauses.append(f"day {'<=' if op == '<' else '>='} CAST(? AS DATE) AND time {op} CAST(? AS TIMESTAMPTZ)")
+            params.extend([bound.date().isoformat(), bound.isoformat()])
+        if model:
+            clauses.append("model = ?")
+            params.append(model)
+        if status:
+            clauses.append("status = ?")
+            params.append(status)
+        return " AND ".join(clauses) or "TRUE", params
+
+    @staticmethod
+    def _execute(sql: str, params: list, rows_per_batch: int = 5000) -> Iterator[List[dict]]:
+        """Run a DuckDB query and yield lists of row dicts; no files yet means no rows"""
+        import duckdb
+
+        conn = EventArchiveService._connect()
+        try:
+            try:
+                reader = conn.execute(sql, params).fetch_record_batch(rows_per_batch)
+            except duckdb.IOException as e:
+                if "No files found" in str(e):
+                    return
+                raise
+            for batch in reader:
+                if batch.num_rows:
+                    yield batch.to_pylist()
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _select_list(session_pk, columns: List[str]) -> str:
+        """columns for a SELECT, with LATE_COLUMNS that no archived file has yet as typed NULLs"""
+        late = [c for c in columns if c in LATE_COLUMNS]
+        present = set()
+        if late:
+            import duckdb
+
+            conn = EventArchiveService._connect()
+            try:
+                present = {row[0] for row in conn.execute(f"DESCRIBE SELECT * FROM {EventArchiveService._source(session_pk)}").fetchall()}
+            except duckdb.IOException as e:
+                if "No files found" not in str(e):
+                    raise
+            finally:
+                conn.close()
+        return ", ".join(
+            f"CAST(NULL AS {LATE_COLUMNS[c]}) AS {c}" if c in late and c not in present else c for c in columns
+        )
+
+    @staticmethod
+    def session_events(session_pk, columns: List[str], start: Optional[datetime] = None,
+                       end: Optional[datetime] = None, archived_after: Optional[str] = None,
+                       model: Optional[str] = None, status: Optional[str] = None,
+                       newest_first: bool = False, limit: Optional[int] = None) -> Iterator[List[tuple]]:
+        """One session's archived events as row tuples in `columns` order, in batches"""
+        where, params = EventArchiveService._where(session_pk, start, end, archived_after, model, status)
+        sql = (
+            f"SELECT {EventArchiveService._select_list(session_pk, columns)} FROM {EventArchiveService._source(session_pk)} WHERE {where} "
+            f"ORDER BY time {'DESC' if newest_first else 'ASC'}"
+            + (f" LIMIT {int(limit)}" if limit is not None else "")
+        )
+        messages_index = columns.index("messages") if "messages" in columns else None
+        for batch in EventArchiveService._execute(sql, params):
+            rows = [tuple(row[name] for name in columns) for row in batch]
+            if messages_index is not None:
+                # Stored as JSON text; hand back the same structure Postgres returns
+                rows = [
+                    row[:messages_index] + (orjson.loads(row[messages_index]) if row[messages_index] else None,)
+                    + row[messages_index + 1:]
+                    for row in rows
+                ]
+            yield rows
+
+    @staticmethod
+    def breakdown_rows(session_pk=None, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                       archived_after: Optional[str] = None) -> List[dict]:
+        """GROUPING SETS rows over the archive, shaped like analytics.BREAKDOWN_SQL's"""
+        where, params = EventArchiveService._where(session_pk, start, end, archived_after)
+        sql = BREAKDOWN_SQL.format(source=EventArchiveService._source(session_pk), where=where)
+        return [row for batch in EventArchiveService._execute(sql, params) for row in batch]
+
+
+if __name__ == "__main__":
+    # python -m app.services.event_archive [--dry-run]
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Archive events older than archive_after_days to Parquet")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    result = EventArchiveService.run(dry_run=args.dry_run)
+    print(f"\nResult: {result['message']}")
@@ -0,0 +1,228 @@
+"""Streaming export of session events"""
+from sqlalchemy import select, and_, false
+from typing import Iterator, List, Optional
+from datetime import datetime
+from decimal import Decimal
+import csv
+import io
+import logging
+
+import orjson
+
+from ..db.shards import shard_router
+from ..db.models import LLMEvent
+from ..db.dimensions import dimensions, stored
+from .event_archive import EventArchiveService
+
+logger = logging.getLogger(__name__)
+
+# Rows fetched per server-side cursor round trip; also the size of each body chunk
+EXPORT_CHUNK_ROWS = 5000
+
+SUMMARY_COLUMNS = [
+    "id", "time", "model", "provider", "endpoint", "user_id",
+    "tokens_prompt", "tokens_completion", "tokens_total", "tokens_cached_input",
+    "latency_ms", "time_to_first_token_ms", "queue_wait_ms", "cost_usd",
+    "hedge_outcome", "circuit_state",
+    "temperature", "max_tokens", "top_p",
+    "status", "error_message", "has_error", "pii_detected",
+]
+# With the capture decision, so consumers can tell omitted or hashed content from none
+CONTENT_COLUMNS = ["messages", "response", "content_capture", "content_sample_rate"]
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError
+
+
+class _ChunkSink:
+    """Write-only file object that hands its buffered bytes back to the caller"""
+
+    def __init__(self):
+        self._buffer = io.BytesIO()
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self._buffer.write(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = self._buffer.getvalue()
+        self._buffer = io.BytesIO()
+        return data
+
+
+class EventExportService:
+    """Builds chunked response bodies from a server-side cursor"""
+
+    @staticmethod
+    def columns(include_content: bool) -> List[str]:
+        return SUMMARY_COLUMNS + (CONTENT_COLUMNS if include_content else [])
+
+    @staticmethod
+    def _batches(
+        session_id,
+        session_key: str,
+        columns: List[str],
+        model: Optional[str],
+        status: Optional[str],
+        start: Optional[datetime],
+        end: Optional[datetime],
+        from_archive: bool = False,
+        archived_after: Optional[str] = None,
+    ) -> Iterator[List[tuple]]:
+        """
+        Yield lists of plain row tuples, EXPORT_CHUNK_ROWS at a time.
+
+        Selecting columns rather than ORM entities keeps rows out of the
+        identity map, and stream_results makes psycopg2 use a named
+        (server-side) cursor, so only one chunk is ever held in memory.
+        With from_archive, the session's archived events (all older than
+        the hot rows) are read from Parquet first, in the same shape.
+        A session without a row (session_id None) has no events.
+        """
+        if session_id is None:
+            return
+        if from_archive:
+            yield from EventArchiveService.session_events(
+                session_id, columns, start=start, end=end, archived_after=archived_after,
+                model=model, status=status,
+            )
+
+        db = shard_router.session_for(session_key)
+        try:
+            table = LLMEvent.__table__
+            conditions = [table.c.session_id == session_id]
+            for dimension, value in (("model", model), ("status", status)):
+                if value:
+                    # A value that was never stored can't match
+                    value_id = dimensions.lookup(db, dimension, value)
+                    conditions.append(false() if value_id is None else table.c[stored(dimension)] == value_id)
+            if start:
+                conditions.append(table.c.time >= start)
+            if end:
+                conditions.append(table.c.time < end)
+
+            query = (
+                select(*[table.c[stored(name)] for name in columns])
+                .where(and_(*conditions))
+                .order_by(table.c.time)
+                .execution_options(stream_results=True, yield_per=EXPORT_CHUNK_ROWS)
+            )
+
+            decode = dimensions.row_decoder(db, columns)
+            result = db.execute(query)
+            for partition in result.partitions():
+                yield [decode(row) for row in partition]
+        finally:
+            db.close()
+
+    @staticmethod
+    def stream(fmt: str, session_id, session_key: str, include_content: bool = True, model: Optional[str] = None,
+               status: Optional[str] = None, start: Optional[datetime] = None,
+               end: Optional[datetime] = None, from_archive: bool = False,
+               archived_after: Optional[str] = None) -> Iterator[bytes]:
+        """
+        Return an iterator of body chunks in the requested format.
+        session_id is the internal id; session_key (the public id) picks the shard.
+        """
+        columns = EventExportService.columns(include_content)
+        batches = EventExportService._batches(
+            session_id, session_key, columns, model, status, start, end, from_archive, archived_after
+        )
+        if fmt == "ndjson":
+            return EventExportService._ndjson(batches, columns)
+        if fmt == "csv":
+            return EventExportService._csv(batches, columns)
+        if fmt == "parquet":
+            return EventExportService._parquet(batches, columns)
+        raise ValueError(f"Unsupported export format: {fmt}")
+
+    @staticmethod
+    def _ndjson(batches, columns) -> Iterator[bytes]:
+        option = orjson.OPT_APPEND_NEWLINE
+        for batch in batches:
+            yield b"".join(
+                orjson.dumps(dict(zip(columns, row)), default=_json_default, option=option)
+                for row in batch
+            )
+
+    @staticmethod
+    def _csv(batches, columns) -> Iterator[bytes]:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        messages_index = columns.index("messages") if "messages" in columns else None
+        for batch in batches:
+            for row in batch:
+                if messages_index is not None and row[messages_index] is not None:
+                    row = list(row)
+                    row[messages_index] = orjson.dumps(row[messages_index]).decode()
+                writer.writerow(row)
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode()
+
+    @staticmethod
+    def _parquet(batches, columns) -> Iterator[bytes]:
+        """One Parquet row group per cursor chunk, flushed to the client as it is written"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        fields = {
+            "id": pa.string(), "time": pa.timestamp("us", tz="UTC"),
+            "model": pa.string(), "provider": pa.string(), "endpoint": pa.string(), "user_id": pa.string(),
+            "tokens_prompt": pa.int32(), "tokens_completion": pa.int32(), "tokens_total": pa.int32(),
+            "tokens_cached_input": pa.int32(),
+            "latency_ms": pa.int32(), "time_to_first_token_ms": pa.int32(), "queue_wait_ms": pa.int32(),
+            "cost_usd": pa.decimal128(10, 6),
+            "hedge_outcome": pa.string(), "circuit_state": pa.string(),
+            "temperature": pa.decimal128(3, 2), "max_tokens": pa.int32(), "top_p": pa.decimal128(3, 2),
+            "status": pa.string(), "error_message": pa.string(),
+            "has_error": pa.bool_(), "pii_detected": pa.bool_(),
+            "messages": pa.string(), "response": pa.string(),
+            "content_capture": pa.string(), "content_sample_rate": pa.float32(),
+        }
+        schema = pa.schema([(name, fields[name]) for name in columns])
+        id_index = columns.index("id")
+        messages_index = columns.index("messages") if "messages" in columns else None
+
+        sink = _ChunkSink()
+        writer = pq.ParquetWriter(sink, schema, compression="zstd")
+        try:
+            for batch in batches:
+                arrays = [list(col) for col in zip(*batch)]
+                arrays[id_index] = [str(v) for v in arrays[id_index]]
+                if messages_index is not None:
+                    arrays[messages_index] = [
+                        orjson.dumps(v).decode() if v is not None else None for v in arrays[messages_index]
+                    ]
+                writer.write_table(pa.Table.from_arrays(
+                    [pa.array(values, type=field.type) for values, field in zip(arrays, schema)],
+                    schema=schema,
+                ))
+                yield sink.take()
+        finally:
+            writer.close()
+        yield sink.take()
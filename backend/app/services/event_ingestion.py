@@ -0,0 +1,334 @@
+"""Bulk ingestion of externally produced LLM events"""
+from sqlalchemy.orm import Session as DBSession
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from pydantic import BaseModel, Field, ValidationError, model_validator
+from typing import Annotated, Any, Dict, List, Optional, Tuple
+from datetime import datetime, timezone
+from decimal import Decimal
+import gzip
+import io
+import uuid
+import logging
+
+import orjson
+
+from ..db.models import Session, LLMEvent
+from ..db.dimensions import dimensions, DimensionLimitExceeded, TABLES as DIMENSIONS
+from ..config import settings
+from .pricing import PricingService, compute_cost, to_micros
+from .session_quota import SessionQuotaService
+from .content_capture import ContentCaptureService
+
+logger = logging.getLogger(__name__)
+
+# Column order used for the COPY stream and the staging table
+COPY_COLUMNS = [
+    "id", "time", "session_id", "model_id", "provider_id", "endpoint_id", "user_id",
+    "tokens_prompt", "tokens_completion", "tokens_total", "tokens_cached_input", "latency_ms",
+    "time_to_first_token_ms", "cost_micros", "messages", "response", "content_capture", "content_sample_rate",
+    "temperature", "max_tokens", "top_p", "status_id", "error_message",
+    "has_error", "pii_detected",
+]
+
+# Cap on per-row errors echoed back so a bad batch can't produce a huge response
+MAX_REPORTED_ERRORS = 100
+
+# Largest value of an Integer (int4) column; anything above fails the whole COPY
+INT4_MAX = 2**31 - 1
+
+TEXT_FIELDS = ("session_id", "model", "provider", "endpoint", "user_id", "response", "status", "error_message")
+
+
+class IngestError(Exception):
+    """Raised for batch-level problems (bad encoding, oversize body)"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class IngestEvent(BaseModel):
+    """One externally produced event, mirroring LLMEvent columns"""
+    id: Optional[uuid.UUID] = None  # Supply (with time) for idempotent retries
+    time: Optional[datetime] = None  # Defaults to arrival; required with id, which is unique per (id, time)
+    session_id: Optional[str] = Field(None, max_length=255)
+    model: Optional[str] = Field(None, max_length=50)
+    provider: Optional[str] = Field(None, max_length=50)
+    endpoint: Optional[str] = Field(None, max_length=255)
+    user_id: Optional[str] = Field(None, max_length=255)
+    tokens_prompt: Optional[int] = Field(None, ge=0, le=INT4_MAX)
+    tokens_completion: Optional[int] = Field(None, ge=0, le=INT4_MAX)
+    tokens_total: Optional[int] = Field(None, ge=0, le=INT4_MAX)
+    tokens_cached_input: Optional[int] = Field(None, ge=0, le=INT4_MAX)
+    latency_ms: Optional[int] = Field(None, ge=0, le=INT4_MAX)
+    time_to_first_token_ms: Optional[int] = Field(None, ge=0, le=INT4_MAX)
+    cost_usd: Optional[Annotated[Decimal, Field(ge=0, max_digits=10, decimal_places=6)]] = None
+    messages: Optional[List[Dict[str, Any]]] = None
+    response: Optional[str] = None
+    temperature: Optional[Annotated[Decimal, Field(ge=0, max_digits=3, decimal_places=2)]] = None
+    max_tokens: Optional[int] = Field(None, ge=0, le=INT4_MAX)
+    top_p: Optional[Annotated[Decimal, Field(ge=0, le=1, max_digits=3, decimal_places=2)]] = None
+    status: Optional[str] = Field(None, max_length=20)
+    error_message: Optional[str] = None
+    has_error: Optional[bool] = None
+    pii_detected: Optional[bool] = False
+
+    @model_validator(mode="after")
+    def fill_derived(self):
+        if self.id is not None and self.time is None:
+            # A retry would get a new arrival time and land as a second row
+            raise ValueError("time is required when id is set")
+        # PostgreSQL text and jsonb can't hold NUL, and one such row would fail the batch's COPY
+        for field in TEXT_FIELDS:
+            if "\x00" in (getattr(self, field) or ""):
+                raise ValueError(f"{field} must not contain NUL characters")
+        if self.messages is not None and _has_nul(self.messages):
+            raise ValueError("messages must not contain NUL characters")
+        if self.tokens_total is None and (self.tokens_prompt is not None or self.tokens_completion is not None):
+            self.tokens_total = (self.tokens_prompt or 0) + (self.tokens_completion or 0)
+            if self.tokens_total > INT4_MAX:
+                raise ValueError(f"tokens_prompt + tokens_completion must be at most {INT4_MAX}")
+        if self.has_error is None:
+            self.has_error = self.status == "error" or self.error_message is not None
+        if self.status is None:
+            self.status = "error" if self.has_error else "success"
+        return self
+
+
+def _has_nul(value: Any) -> bool:
+    """NUL anywhere in a JSON value's strings or keys"""
+    if isinstance(value, str):
+        return "\x00" in value
+    if isinstance(value, dict):
+        return any("\x00" in k or _has_nul(v) for k, v in value.items())
+    if isinstance(value, list):
+        return any(_has_nul(v) for v in value)
+    return False
+
+
+def _copy_text(value: Any) -> str:
+    """Render one value in PostgreSQL COPY text format"""
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (list, dict)):
+        value = orjson.dumps(value).decode()
+    else:
+        value = str(value)
+    return (
+        value.replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+class EventIngestionService:
+    """Decode, validate and bulk-load event batches"""
+
+    @staticmethod
+    def decode_body(body: bytes, content_type: str, content_encoding: Optional[str]) -> Tuple[List[Any], List[dict]]:
+        """
+        Turn a request body into raw event objects.
+
+        Accepts a JSON array (application/json) or newline-delimited JSON
+        (application/x-ndjson), optionally gzip-encoded.
+
+        Returns:
+            (objects, errors) where errors are per-line NDJSON parse failures
+        """
+        if content_encoding and content_encoding.lower() == "gzip":
+            try:
+                with gzip.GzipFile(fileobj=io.BytesIO(body)) as f:
+                    body = f.read(settings.ingest_max_body_bytes + 1)
+            except (OSError, EOFError) as e:
+                raise IngestError(400, f"Invalid gzip body: {e}")
+        elif content_encoding and content_encoding.lower() != "identity":
+            raise IngestError(415, f"Unsupported Content-Encoding: {content_encoding}")
+
+        if len(body) > settings.ingest_max_body_bytes:
+            raise IngestError(413, "Decompressed body exceeds ingest_max_body_bytes")
+
+        media_type = (content_type or "application/json").split(";")[0].strip().lower()
+        errors = []
+
+        if media_type in ("application/x-ndjson", "application/ndjson", "application/jsonl"):
+            objects = []
+            for line_no, line in enumerate(body.splitlines()):
+                if not line.strip():
+                    continue
+                try:
+                    objects.append(orjson.loads(line))
+                except orjson.JSONDecodeError as e:
+                    objects.append(None)
+                    errors.append({"index": len(objects) - 1, "line": line_no + 1, "errors": [str(e)]})
+            return objects, errors
+
+        if media_type == "application/json":
+            try:
+                objects = orjson.loads(body)
+            except orjson.JSONDecodeError as e:
+                raise IngestError(400, f"Invalid JSON: {e}")
+            if not isinstance(objects, list):
+                raise IngestError(400, "Expected a JSON array of events")
+            return objects, errors
+
+        raise IngestError(415, f"Unsupported Content-Type: {media_type}")
+
+    @staticmethod
+    def validate(objects: List[Any], errors: List[dict]) -> Tuple[List[Tuple[int, IngestEvent]], List[dict]]:
+        """Validate raw objects, collecting per-row errors instead of failing the batch"""
+        if len(objects) > settings.ingest_max_batch_events:
+            raise IngestError(413, f"Batch exceeds {settings.ingest_max_batch_events} events")
+
+        failed = {e["index"] for e in errors}
+        valid = []
+        for index, obj in enumerate(objects):
+            if index in failed:
+                continue
+            try:
+                valid.append((index, IngestEvent.model_validate(obj)))
+            except ValidationError as e:
+                errors.append({
+                    "index": index,
+                    "errors": [f"{'.'.join(str(p) for p in err['loc']) or 'event'}: {err['msg']}" for err in e.errors()],
+                })
+        errors.sort(key=lambda e: e["index"])
+        return valid, errors
+
+    @staticmethod
+    def _resolve_sessions(db: DBSession, session_keys: set) -> Dict[str, uuid.UUID]:
+        """Map public session ids to internal ids, creating missing sessions in one statement"""
+        if not session_keys:
+            return {}
+        db.execute(
+            insert(Session.__table__)
+            .values([
+                {"id": uuid.uuid4(), "session_id": key, "is_active": True, "session_metadata": {}}
+                for key in session_keys
+            ])
+            .on_conflict_do_nothing(index_elements=["session_id"])
+        )
+        rows = db.execute(
+            select(Session.id, Session.session_id).where(Session.session_id.in_(session_keys))
+        ).all()
+        return {row.session_id: row.id for row in rows}
+
+    @staticmethod
+    def _encode_dimensions(db: DBSession, events: List[IngestEvent]) -> Dict[int, str]:
+        """
+        Encode the batch's new dimension values, each once and in sorted order
+        (see DimensionDictionary); returns the positions that can't be stored
+        """
+        refused: Dict[int, str] = {}
+        for dimension in DIMENSIONS:
+            values = sorted({getattr(e, dimension) for e in events} - {None})
+            for value in values:
+                try:
+                    dimensions.encode(db, dimension, value)
+                except DimensionLimitExceeded as e:
+                    for position, event in enumerate(events):
+                        if getattr(event, dimension) == value:
+                            refused.setdefault(position, str(e))
+        return refused
+
+    @staticmethod
+    def load(db: DBSession, events: List[IngestEvent], default_session: Optional[Session]) -> Tuple[int, int, List[Tuple[int, str]]]:
+        """
+        Insert validated events in a single transaction.
+
+        Rows are streamed with COPY into a temporary staging table and moved
+        into playground_events with one INSERT ... ON CONFLICT DO NOTHING, so
+        a retried batch with client-supplied ids doesn't create duplicates.
+        Each target session's event counter is updated in the same
+        transaction (see SessionQuotaService). Messages and responses are
+        kept as each target session's capture policy says
+        (ContentCaptureService). All events must belong on db's shard;
+        default_session receives those without a session_id.
+
+        Returns:
+            (inserted, duplicates, refused) where refused lists (position in
+            events, reason) for rows turned away while loading: a new
+            dimension value past dimension_max_values, or a full session
+            (reject policy)
+        """
+        if not events:
+            return 0, 0, []
+
+        now = datetime.now(timezone.utc)
+        refused = EventIngestionService._encode_dimensions(db, events)
+        session_ids = EventIngestionService._resolve_sessions(
+            db, {e.session_id for e in events if e.session_id}
+        )
+        targets = [session_ids[e.session_id] if e.session_id else default_session.id for e in events]
+
+        # Claim cap slots per session, in a fixed order so concurrent batches can't deadlock
+        positions: Dict[uuid.UUID, List[int]] = {}
+        for position, target in enumerate(targets):
+            if position not in refused:
+                positions.setdefault(target, []).append(position)
+        granted: Dict[uuid.UUID, int] = {}
+        full = f"session has reached its limit of {settings.session_max_events_per_session} events"
+        for target in sorted(positions, key=str):
+            granted[target] = SessionQuotaService.reserve(db, target, len(positions[target]))
+            refused.update((position, full) for position in positions[target][granted[target]:])
+
+        book = PricingService.book()
+        policies = ContentCaptureService.for_sessions(db, positions)
+        default_policy = ContentCaptureService.default()
+        buffer = io.StringIO()
+        for position, event in enumerate(events):
+            if position in refused:
+                continue
+            row = event.model_dump()
+            row["id"] = row["id"] or uuid.uuid4()
+            row["time"] = row["time"] or now
+            row["session_id"] = targets[position]
+            if row["cost_usd"] is None and row["tokens_prompt"] is not None:
+                # Price events the producer didn't, at the rate in effect when they happened
+                row["cost_usd"] = compute_cost(
+                    book.resolve(row["model"], row["time"]),
+                    row["tokens_prompt"], row["tokens_completion"], row["tokens_cached_input"]
+                )
+            row["cost_micros"] = to_micros(row["cost_usd"])
+            row["messages"], row["response"], row["content_capture"], row["content_sample_rate"] = ContentCaptureService.apply(
+                policies.get(targets[position], default_policy), row["messages"], row["response"], row["has_error"]
+            )
+            for dimension in DIMENSIONS:
+                row[f"{dimension}_id"] = dimensions.encode(db, dimension, row[dimension])
+            buffer.write("\t".join(_copy_text(row[column]) for column in COPY_COLUMNS))
+            buffer.write("\n")
+        buffer.seek(0)
+
+        columns = ", ".join(COPY_COLUMNS)
+        cursor = db.connection().connection.cursor()
+        try:
+            cursor.execute(
+                "CREATE TEMP TABLE playground_events_ingest "
+                "(LIKE playground_events INCLUDING DEFAULTS) ON COMMIT DROP"
+            )
+            cursor.copy_expert(f"COPY playground_events_ingest ({columns}) FROM STDIN", buffer)
+            cursor.execute(
+                f"WITH inserted AS ("
+                f"INSERT INTO {LLMEvent.__tablename__} ({columns}) "
+                f"SELECT {columns} FROM playground_events_ingest "
+                "ON CONFLICT DO NOTHING RETURNING session_id"
+                ") SELECT session_id, count(*) FROM inserted GROUP BY session_id"
+            )
+            inserted_by_session = {uuid.UUID(str(pk)): n for pk, n in cursor.fetchall()}
+        finally:
+            cursor.close()
+
+        # Duplicates don't occupy slots; then trim any session pushed over its cap
+        for target, n in granted.items():
+            SessionQuotaService.release(db, target, n - inserted_by_session.get(target, 0))
+        SessionQuotaService.record(db, inserted_by_session)
+
+        db.commit()
+        inserted = sum(inserted_by_session.values())
+        return inserted, len(events) - len(refused) - inserted, sorted(refused.items())
@@ -0,0 +1,289 @@
+"""Time-range partitions of playground_events: creation ahead of time and retention by dropping"""
+from sqlalchemy import text
+from sqlalchemy.orm import Session as DBSession
+from typing import Dict, List, Optional
+from datetime import datetime, timedelta, timezone
+import threading
+import logging
+
+from ..config import settings
+from ..db.models import LLMEvent
+from ..db.shards import shard_router
+
+logger = logging.getLogger(__name__)
+
+PARENT = "playground_events"
+DEFAULT_PARTITION = "playground_events_default"
+PARTITION_PREFIX = "playground_events_p"
+
+# Everything but the generated search vector, which each partition computes itself
+EVENT_COLUMNS = ", ".join(c.name for c in LLMEvent.__table__.c if c.computed is None)
+
+# Serializes partition DDL between workers, the CLI and cron on one database
+ADVISORY_LOCK_SQL = text("SELECT pg_advisory_xact_lock(hashtext('playground_events_partitions'))")
+
+PARTITIONS_SQL = text("""
+    SELECT name, bound = 'DEFAULT' AS is_default,
+           CASE WHEN m[1] = 'MINVALUE' THEN NULL ELSE CAST(trim(both '''' from m[1]) AS timestamptz) END AS lower,
+           CASE WHEN m[2] = 'MAXVALUE' THEN NULL ELSE CAST(trim(both '''' from m[2]) AS timestamptz) END AS upper,
+           rows, bytes
+    FROM (
+        SELECT c.relname AS name,
+               pg_get_expr(c.relpartbound, c.oid) AS bound,
+               regexp_match(pg_get_expr(c.relpartbound, c.oid), 'FROM \\((.+)\\) TO \\((.+)\\)') AS m,
+               GREATEST(c.reltuples, 0)::bigint AS rows,
+               pg_total_relation_size(c.oid) AS bytes
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = CAST(:parent AS regclass)
+    ) p
+    ORDER BY lower NULLS FIRST
+""")
+
+# Events leaving by retention are rolled up like those removed by the per-session cap;
+# returns how many events were rolled up
+ROLLUP_SQL = """
+    WITH v AS (
+        SELECT session_id, count(*) AS n, coalesce(sum(tokens_total), 0) AS tokens,
+               coalesce(sum(cost_micros), 0) / 1000000.0 AS cost
+        FROM {table} {where}
+        GROUP BY session_id
+    ), rolled AS (
+        UPDATE playground_sessions s SET
+            event_count = GREATEST(s.event_count - v.n, 0),
+            evicted_event_count = s.evicted_event_count + v.n,
+            evicted_tokens_total = s.evicted_tokens_total + v.tokens,
+            evicted_cost_usd = s.evicted_cost_usd + v.cost
+        FROM v
+        WHERE s.id = v.session_id
+    )
+    SELECT coalesce(sum(n), 0) FROM v
+"""
+
+
+def _align(moment: datetime) -> datetime:
+    """Start of the partition interval containing moment (UTC)"""
+    moment = moment.astimezone(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    if settings.event_partition_interval == "week":
+        return moment - timedelta(days=moment.weekday())
+    if settings.event_partition_interval == "month":
+        return moment.replace(day=1)
+    return moment
+
+
+def _next(lower: datetime) -> datetime:
+    if settings.event_partition_interval == "week":
+        return lower + timedelta(days=7)
+    if settings.event_partition_interval == "month":
+        return (lower.replace(day=1) + timedelta(days=32)).replace(day=1)
+    return lower + timedelta(days=1)
+
+
+class EventPartitionService:
+    """
+    Keep playground_events partitioned by time (see migration 008).
+
+    Future partitions are made event_partition_premake intervals ahead.
+    Each one is built as a standalone table and then attached, which only
+    takes a SHARE UPDATE EXCLUSIVE lock on the parent, so inserts and
+    queries keep running. Rows that landed in the DEFAULT partition for its
+    range (late or far-future timestamps) are moved into it first.
+
+    Retention drops whole partitions whose range ended more than
+    event_retention_days ago, after rolling their per-session totals into
+    the evicted_* counters. Partitions left empty by the archive job are
+    dropped once they are past the archive window. Each drop briefly needs
+    an ACCESS EXCLUSIVE lock on the parent; lock_timeout makes it give up
+    (and retry next run) rather than queue behind long queries.
+    """
+
+    @staticmethod
+    def partitions(db: DBSession) -> List[dict]:
+        return [dict(row) for row in db.execute(PARTITIONS_SQL, {"parent": PARENT}).mappings()]
+
+    @staticmethod
+    def _lock(db: DBSession):
+        db.execute(text(f"SET LOCAL lock_timeout = '{int(settings.event_partition_lock_timeout_ms)}ms'"))
+        db.execute(ADVISORY_LOCK_SQL)
+
+    @staticmethod
+    def _create(db: DBSession, lower: datetime, upper: datetime) -> int:
+        """Create and attach [lower, upper); returns rows moved in from the default partition"""
+        name = f"{PARTITION_PREFIX}{lower:%Y%m%d}"
+        bounds = {"lower": lower, "upper": upper}
+        db.execute(text(f"CREATE TABLE {name} (LIKE {PARENT} INCLUDING DEFAULTS INCLUDING GENERATED)"))
+        # A matching CHECK lets ATTACH skip scanning the new table
+        db.execute(text(f"ALTER TABLE {name} ADD CONSTRAINT {name}_bounds CHECK (time >= :lower AND time < :upper)"), bounds)
+        moved = db.execute(text(f"""
+            WITH moved AS (
+                DELETE FROM {DEFAULT_PARTITION} WHERE time >= :lower AND time < :upper RETURNING {EVENT_COLUMNS}
+            )
+            INSERT INTO {name} ({EVENT_COLUMNS}) SELECT {EVENT_COLUMNS} FROM moved
+        """), bounds).rowcount
+        db.execute(text(f"ALTER TABLE {PARENT} ATTACH PARTITION {name} FOR VALUES FROM (:lower) TO (:upper)"), bounds)
+        db.execute(text(f"ALTER TABLE {name} DROP CONSTRAINT {name}_bounds"))
+        return moved
+
+    @staticmethod
+    def ensure_future(db: DBSession, now: Optional[datetime] = None) -> List[str]:
+        """Create partitions up to event_partition_premake intervals past now; returns their names"""
+        now = now or datetime.now(timezone.utc)
+        EventPartitionService._lock(db)
+        ranged = [p for p in EventPartitionService.partitions(db) if not p["is_default"] and p["upper"] is not None]
+        upper = max((p["upper"] for p in ranged), default=None) or _align(now)
+
+        horizon = _align(now)
+        for _ in range(settings.event_partition_premake):
+            horizon = _next(horizon)
+
+        created = []
+        while upper < horizon:
+            lower, upper = upper, _next(upper)
+            moved = EventPartitionService._create(db, lower, upper)
+            created.append(f"{PARTITION_PREFIX}{lower:%Y%m%d}")
+            if moved:
+                logger.info("Moved %d events from %s into %s", moved, DEFAULT_PARTITION, created[-1])
+        db.commit()
+        return created
+
+    @staticmethod
+    def ensure_range(db: DBSession, lower: datetime, upper: datetime) -> List[str]:
+        """Create the partitions of [lower, upper) that no existing partition overlaps (bulk loads of past data)"""
+        EventPartitionService._lock(db)
+        ranged = [p for p in EventPartitionService.partitions(db) if not p["is_default"]]
+
+        created = []
+        start = _align(lower)
+        while start < upper:
+            end = _next(start)
+            if not any((p["lower"] is None or p["lower"] < end) and (p["upper"] is None or p["upper"] > start)
+                       for p in ranged):
+                EventPartitionService._create(db, start, end)
+                created.append(f"{PARTITION_PREFIX}{start:%Y%m%d}")
+            start = end
+        db.commit()
+        return created
+
+    @staticmethod
+    def expired(db: DBSession, now: Optional[datetime] = None) -> List[dict]:
+        """Partitions that retention (or the archive) has finished with"""
+        now = now or datetime.now(timezone.utc)
+        retention_cutoff = now - timedelta(days=settings.event_retention_days) if settings.event_retention_days else None
+        archive_cutoff = now - timedelta(days=settings.archive_after_days) if settings.archive_path else None
+
+        expired = []
+        for p in EventPartitionService.partitions(db):
+            if p["is_default"] or p["upper"] is None:
+                continue
+            if retention_cutoff is not None and p["upper"] <= retention_cutoff:
+                expired.append({**p, "reason": "retention"})
+            elif archive_cutoff is not None and p["upper"] <= archive_cutoff:
+                if db.execute(text(f"SELECT NOT EXISTS (SELECT 1 FROM {p['name']})")).scalar():
+                    expired.append({**p, "reason": "archived"})
+        return expired
+
+    @staticmethod
+    def drop_expired(db: DBSession, dry_run: bool = False, now: Optional[datetime] = None) -> Dict[str, int]:
+        """Detach and drop expired partitions, rolling up what they hold first"""
+        now = now or datetime.now(timezone.utc)
+        expired = EventPartitionService.expired(db, now)
+        if dry_run:
+            db.rollback()
+            return {"partitions_would_drop": len(expired), "events_would_drop": sum(p["rows"] for p in expired)}
+
+        dropped, events = 0, 0
+        for p in expired:
+            try:
+                EventPartitionService._lock(db)
+                # No writes into it while its totals are rolled up
+                db.execute(text(f"LOCK TABLE {p['name']} IN SHARE MODE"))
+                rolled = db.execute(text(ROLLUP_SQL.format(table=p["name"], where=""))).scalar()
+                db.execute(text(f"ALTER TABLE {PARENT} DETACH PARTITION {p['name']}"))
+                db.execute(text(f"DROP TABLE {p['name']}"))
+                db.commit()
+                dropped += 1
+                events += rolled
+                logger.info("Dropped partition %s (%s)", p["name"], p["reason"])
+            except Exception as e:
+                db.rollback()
+                logger.warning("Could not drop partition %s, will retry next run: %s", p["name"], e)
+
+        # Stragglers older than every partition live in the default one; it is small, so DELETE is fine
+        if settings.event_retention_days:
+            cutoff = {"cutoff": now - timedelta(days=settings.event_retention_days)}
+            where = "WHERE time < :cutoff"
+            events += db.execute(text(ROLLUP_SQL.format(table=DEFAULT_PARTITION, where=where)), cutoff).scalar()
+            db.execute(text(f"DELETE FROM {DEFAULT_PARTITION} {where}"), cutoff)
+            db.commit()
+
+        return {"partitions_dropped": dropped, "events_dropped": events}
+
+    @staticmethod
+    def run(dry_run: bool = False) -> dict:
+        """Create upcoming partitions and apply retention on every shard"""
+        def maintain(db: DBSession) -> dict:
+            try:
+                created = [] if dry_run else EventPartitionService.ensure_future(db)
+                return {"success": True, "partitions_created": len(created),
+                        **EventPartitionService.drop_expired(db, dry_run)}
+            except Exception as e:
+                db.rollback()
+                logger.error("Partition maintenance failed: %s", e)
+                return {"success": False, "message": f"Partition maintenance failed: {str(e)}"}
+
+        results = shard_router.scatter(maintain)
+        return {"success": all(r["success"] for r in results.values()), "shards": results}
+
+
+class PartitionMaintainer:
+    """Runs EventPartitionService.run every event_partition_maintenance_hours in a daemon thread"""
+
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                result = EventPartitionService.run()
+                if not result["success"]:
+                    logger.error("Partition maintenance incomplete: %s", result["shards"])
+            except Exception:
+                logger.exception("Partition maintenance failed")
+            self._stop.wait(settings.event_partition_maintenance_hours * 3600)
+
+    def start(self):
+        if settings.event_partition_maintenance_hours > 0 and self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="partition-maintenance", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+partition_maintainer = PartitionMaintainer()
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Create upcoming event partitions and drop expired ones")
+    parser.add_argument("--dry-run", action="store_true", help="Report what retention would drop")
+    parser.add_argument("--list", action="store_true", help="List partitions with row estimates and sizes")
+    args = parser.parse_args()
+
+    if args.list:
+        for shard in shard_router.names:
+            db = shard_router.session_on(shard)
+            try:
+                for p in EventPartitionService.partitions(db):
+                    bounds = "DEFAULT" if p["is_default"] else f"[{p['lower'] or 'MINVALUE'}, {p['upper']})"
+                    print(f"{shard:>10} {p['name']:<36} {bounds:<56} ~{p['rows']:>10} rows {p['bytes'] / 2**20:>9.1f} MB")
+            finally:
+                db.close()
+    else:
+        print(json.dumps(EventPartitionService.run(dry_run=args.dry_run), indent=2, default=str))
@@ -0,0 +1,562 @@
+"""Durable local spool for chat events the database cannot take in time"""
+from sqlalchemy import select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import DBAPIError, OperationalError, InterfaceError, TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import Session as DBSession
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import fcntl
+import glob
+import os
+import struct
+import threading
+import time
+import uuid
+import zlib
+import logging
+
+import orjson
+
+from ..db.models import Session, LLMEvent
+from ..db.dimensions import dimensions, TABLES
+from ..db.shards import shard_router
+from ..config import settings
+from .session_quota import SessionQuotaService, REJECT
+
+logger = logging.getLogger(__name__)
+
+# Each record: payload length, crc32 of the payload, then the payload (orjson)
+RECORD_HEADER = struct.Struct("<II")
+SEGMENT_SUFFIX = ".seg"
+RECORD_VERSION = 1
+
+# Errors that mean the database is slow or unreachable, not that the event is bad
+# (statement_timeout surfaces as OperationalError; a pool checkout timeout as TimeoutError)
+SPOOLABLE = (OperationalError, InterfaceError, PoolTimeoutError)
+QUERY_CANCELED = "57014"
+
+# Every insertable event column with its scalar default, so replayed rows share one shape
+EVENT_DEFAULTS = {
+    column.name: column.default.arg if column.default is not None and column.default.is_scalar else None
+    for column in LLMEvent.__table__.columns
+    if column.computed is None
+}
+
+
+class SpoolFull(Exception):
+    """The spool is at event_spool_max_bytes; the event is dropped"""
+
+
+def _is_timeout(error: Exception) -> bool:
+    return isinstance(error, PoolTimeoutError) or getattr(getattr(error, "orig", None), "pgcode", None) == QUERY_CANCELED
+
+
+def _stored(db: DBSession, fields: Dict[str, Any]) -> Dict[str, Any]:
+    """Event fields with public dimension names -> playground_events columns for db's database"""
+    row = {name: value for name, value in fields.items() if name not in TABLES}
+    row.update(dimensions.encode_all(db, **{d: fields[d] for d in TABLES if d in fields}))
+    return row
+
+
+def encode_record(record: Dict[str, Any]) -> bytes:
+    payload = orjson.dumps(record)
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def decode_segment(data: bytes) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Records of one segment file, and how many could not be read. A bad
+    checksum or a short record (a write cut off by a crash) ends the
+    segment: past it, the lengths can't be trusted.
+    """
+    records, pos = [], 0
+    while pos < len(data):
+        if pos + RECORD_HEADER.size > len(data):
+            return records, 1
+        length, checksum = RECORD_HEADER.unpack_from(data, pos)
+        start = pos + RECORD_HEADER.size
+        payload = data[start:start + length]
+        if len(payload) < length or zlib.crc32(payload) != checksum:
+            return records, 1
+        records.append(orjson.loads(payload))
+        pos = start + length
+    return records, 0
+
+
+class EventSpool:
+    """
+    Event writes with a latency budget, and a disk spool behind them.
+
+    write() inserts an event in the caller's transaction under a
+    statement_timeout of event_spool_write_budget_ms. If the database
+    times out or errors at the connection level, the event is appended
+    to the spool instead, and its shard is marked down for this worker:
+    later events for it go straight to disk without waiting on the
+    database. Events the database rejects (bad data) still raise.
+
+    The spool is a directory of append-only segment files of
+    length + crc32 framed records, fsynced per record. A writer holds an
+    exclusive flock on its open segment. Anything not locked is a sealed
+    segment, from this worker or from one that died, and the background
+    replayer drains it. Replay is idempotent: events carry their id from
+    the start, inserts are ON CONFLICT (id, time) DO NOTHING, and a
+    segment is deleted only after its shards committed. A crash mid-replay
+    just means the next pass finds those events already there. Dimension
+    names are encoded at replay time, against the shard being written.
+
+    The writes before the upstream call degrade the same way (see
+    get_event_session and reserve()): under event_spool_session_budget_ms,
+    and skipped while the shard is down. A session first written then has
+    no row yet (session_pk None) and is created on replay. A slot that
+    could not be claimed in the database is held in memory until the event
+    is spooled, and claimed on replay; under the reject policy, events that
+    no longer fit are dropped there. Events whose session was deleted
+    meanwhile are dropped. A successful drain, or a SELECT 1 probe each
+    interval, brings a shard back.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._file = None
+        self._size = 0
+        self._bytes: Optional[int] = None  # Spool directory size: kept on append and unlink, recounted each pass
+        self._down: Dict[str, float] = {}  # shard -> when it was marked down (time.time())
+        self._held: Dict[str, int] = {}  # session key -> slots reserved in memory, not yet spooled
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._replay_lock = threading.Lock()
+        self.written = 0
+        self.spooled = {"timeout": 0, "error": 0, "shard_down": 0}
+        self.dropped_full = 0
+        self.replayed = 0
+        self.duplicates = 0
+        self.orphaned = 0
+        self.rejected = 0
+        self.over_cap = 0
+        self.corrupt = 0
+        self.replay_errors = 0
+        self.last_replay_error: Optional[str] = None
+
+    @property
+    def enabled(self) -> bool:
+        return settings.event_spool_enabled
+
+    # Writing
+
+    def available(self, shard: str) -> bool:
+        """False while this worker has the shard marked down: its writes go to the spool"""
+        return not (self.enabled and shard in self._down)
+
+    @staticmethod
+    def budget(db: DBSession, ms: int):
+        """Cap the statements of db's current transaction at ms"""
+        db.execute(text(f"SET LOCAL statement_timeout = {int(ms)}"))
+
+    def degrade(self, db: DBSession, shard: str, error: Exception):
+        """A write hit a slow or failing database: roll back and send the shard's writes to the spool"""
+        logger.warning("Database write on shard %s failed (%s): %s",
+                       shard, "timeout" if _is_timeout(error) else "error", error)
+        try:
+            db.rollback()
+        except Exception:
+            pass
+        self.mark_down(shard)
+
+    def reserve(self, db: DBSession, session_pk: Optional[uuid.UUID], session_key: str) -> Optional[bool]:
+        """
+        Claim the slot of one event before the upstream call.
+
+        Returns:
+            True if claimed in the database; False if held in memory instead
+            (no row yet, or the shard is slow or down: the spooled event
+            claims it on replay); None if the session is full
+        """
+        shard = shard_router.shard_for(session_key)
+        if session_pk is not None and self.available(shard):
+            try:
+                if self.enabled:
+                    self.budget(db, settings.event_spool_session_budget_ms)
+                if SessionQuotaService.reserve(db, session_pk) == 0:
+                    db.rollback()
+                    return None
+                db.commit()
+                return True
+            except SPOOLABLE as e:
+                if not self.enabled:
+                    raise
+                self.degrade(db, shard, e)
+
+        with self._lock:
+            held = self._held.get(session_key, 0)
+            if (SessionQuotaService.enabled() and settings.session_event_cap_policy == REJECT
+                    and held >= settings.session_max_events_per_session):
+                return None
+            self._held[session_key] = held + 1
+        return False
+
+    def release(self, db: DBSession, session_pk: Optional[uuid.UUID], session_key: str, in_db: bool):
+        """Give back a slot from reserve() whose event will not be written"""
+        if not in_db:
+            self._unhold(session_key)
+            return
+        try:
+            SessionQuotaService.release(db, session_pk, 1)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.warning("Could not release event slot for session %s: %s", session_key, e)
+
+    def _unhold(self, session_key: str):
+        with self._lock:
+            held = self._held.get(session_key, 0) - 1
+            if held > 0:
+                self._held[session_key] = held
+            else:
+                self._held.pop(session_key, None)
+
+    def write(self, db: DBSession, session_pk: Optional[uuid.UUID], session_key: str, fields: Dict[str, Any],
+              reserved: bool = True) -> bool:
+        """
+        Record one event (fields use public names: model, status, ...; id
+        and time must be set). Commits the caller's transaction. Blocks on
+        the database or the disk: call it from a worker thread.
+
+        session_pk and reserved come from a degraded request: a session
+        with no row yet, or a slot held in memory. Those events go straight
+        to the spool, and replay creates the row or claims the slot.
+
+        Returns:
+            True if the event is in the database, False if it was spooled
+        """
+        shard = shard_router.shard_for(session_key)
+        if session_pk is None or not reserved or not self.available(shard):
+            self._append(session_pk, session_key, reserved, fields, "shard_down")
+            if not reserved:
+                # The spooled record carries the claim from here (a failed append leaves it to release())
+                self._unhold(session_key)
+            return False
+
+        try:
+            if self.enabled:
+                self.budget(db, settings.event_spool_write_budget_ms)
+            db.add(LLMEvent(session_id=session_pk, **_stored(db, fields)))
+            db.flush()
+            SessionQuotaService.evict_overflow(db, session_pk)
+            db.commit()
+        except SPOOLABLE as e:
+            if not self.enabled:
+                raise
+            reason = "timeout" if _is_timeout(e) else "error"
+            logger.warning("Spooling event %s for shard %s (%s): %s", fields["id"], shard, reason, e)
+            try:
+                db.rollback()
+            except Exception:
+                pass
+            self.mark_down(shard)
+            self._append(session_pk, session_key, reserved, fields, reason)
+            return False
+
+        self.written += 1
+        return True
+
+    def _append(self, session_pk: Optional[uuid.UUID], session_key: str, reserved: bool,
+                fields: Dict[str, Any], reason: str):
+        frame = encode_record({
+            "v": RECORD_VERSION, "session_pk": session_pk, "session_key": session_key,
+            "reserved": reserved, "event": fields,
+        })
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = self._disk_bytes()
+            if self._bytes + len(frame) > settings.event_spool_max_bytes:
+                self.dropped_full += 1
+                raise SpoolFull(f"Event spool is full ({settings.event_spool_max_bytes} bytes)")
+            if self._file is None or self._size + len(frame) > settings.event_spool_segment_bytes:
+                self._open_segment()
+            self._file.write(frame)
+            self._file.flush()
+            if settings.event_spool_fsync:
+                os.fsync(self._file.fileno())
+            self._size += len(frame)
+            self._bytes += len(frame)
+            self.spooled[reason] += 1
+
+    def _open_segment(self):
+        """Seal the current segment and start a new one (caller holds _lock)"""
+        self._seal()
+        os.makedirs(settings.event_spool_path, exist_ok=True)
+        name = os.path.join(settings.event_spool_path, f"{time.time_ns():020d}-{os.getpid()}")
+        # Locked before it is visible under its .seg name, so a replayer never takes it while open
+        f = open(name + ".open", "ab")
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        os.rename(name + ".open", name + SEGMENT_SUFFIX)
+        if settings.event_spool_fsync:
+            directory = os.open(settings.event_spool_path, os.O_RDONLY)
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
+        self._file, self._size = f, 0
+
+    def _seal(self):
+        """Close the open segment, releasing its lock (caller holds _lock)"""
+        if self._file is not None:
+            self._file.close()
+            self._file, self._size = None, 0
+
+    def _segments(self) -> List[str]:
+        return sorted(glob.glob(os.path.join(settings.event_spool_path, "*" + SEGMENT_SUFFIX)))
+
+    def _disk_bytes(self) -> int:
+        total = 0
+        for path in self._segments():
+            try:
+                total += os.path.getsize(path)
+            except FileNotFoundError:  # drained meanwhile
+                pass
+        return total
+
+    def mark_down(self, shard: str):
+        if shard not in self._down:
+            self._down[shard] = time.time()
+            logger.warning("Shard %s marked down for event writes; spooling until it recovers", shard)
+
+    def _mark_up(self, shard: str):
+        if self._down.pop(shard, None) is not None:
+            logger.info("Shard %s is back; event writes go to the database again", shard)
+
+    # Replay
+
+    def replay(self) -> dict:
+        """Drain every sealed segment into the database; this worker's open one is sealed first"""
+        with self._replay_lock:
+            with self._lock:
+                if self._size > 0:
+                    self._seal()
+
+            drained = 0
+            for path in self._segments():
+                f = open(path, "rb")
+                try:
+                    try:
+                        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue  # being written, or drained by another worker
+                    if not os.path.exists(path):
+                        continue  # drained and deleted between listing and locking
+                    records, corrupt = decode_segment(f.read())
+                    if corrupt:
+                        self.corrupt += corrupt
+                        logger.error("Event spool segment %s has an unreadable tail after %d records", path, len(records))
+                    if not self._drain(records):
+                        break
+                    size = os.fstat(f.fileno()).st_size
+                    os.unlink(path)
+                    drained += 1
+                    with self._lock:
+                        if self._bytes is not None:
+                            self._bytes = max(0, self._bytes - size)
+                finally:
+                    f.close()
+
+            # Other workers append and drain too: resync once per pass rather than per write
+            with self._lock:
+                self._bytes = self._disk_bytes()
+
+            for shard in list(self._down):
+                self._probe(shard)
+            return {"segments_drained": drained, "segments_left": len(self._segments())}
+
+    def _drain(self, records: List[Dict[str, Any]]) -> bool:
+        """Insert a segment's records, shard by shard; False if a shard is still unavailable"""
+        by_shard: Dict[str, List[Dict[str, Any]]] = {}
+        for record in records:
+            by_shard.setdefault(shard_router.shard_for(record["session_key"]), []).append(record)
+
+        for shard, shard_records in by_shard.items():
+            try:
+                self._replay_shard(shard, shard_records)
+            except SPOOLABLE as e:
+                self.replay_errors += 1
+                self.last_replay_error = str(e)
+                self.mark_down(shard)
+                logger.warning("Event spool replay to shard %s failed, retrying later: %s", shard, e)
+                return False
+            self._mark_up(shard)
+        return True
+
+    def _sessions(self, db: DBSession, records: List[Dict[str, Any]]) -> List[Optional[uuid.UUID]]:
+        """Each record's session pk on this shard, or None if the session was deleted meanwhile"""
+        known = {uuid.UUID(r["session_pk"]) for r in records if r["session_pk"]}
+        existing = set(db.execute(select(Session.id).where(Session.id.in_(list(known)))).scalars()) if known else set()
+
+        by_key: Dict[str, uuid.UUID] = {}
+        keys = sorted({r["session_key"] for r in records if not r["session_pk"]})
+        if keys:
+            # First written while the shard was down: the row is created now, as materialize_session would have
+            db.execute(
+                insert(Session.__table__)
+                .values([{"id": uuid.uuid4(), "session_id": key, "is_active": True, "session_metadata": {}} for key in keys])
+                .on_conflict_do_nothing(index_elements=["session_id"])
+            )
+            by_key = dict(db.execute(select(Session.session_id, Session.id).where(Session.session_id.in_(keys))).all())
+
+        pks = []
+        for record in records:
+            if record["session_pk"]:
+                pk = uuid.UUID(record["session_pk"])
+                pks.append(pk if pk in existing else None)
+            else:
+                pks.append(by_key.get(record["session_key"]))
+        return pks
+
+    def _replay_shard(self, shard: str, records: List[Dict[str, Any]]):
+        db = shard_router.session_on(shard)
+        try:
+            rows = []
+            unreserved: Dict[uuid.UUID, List[uuid.UUID]] = {}  # session pk -> ids of events still needing a slot
+            for record, pk in zip(records, self._sessions(db, records)):
+                if pk is None:
+                    self.orphaned += 1
+                    continue
+                event = dict(record["event"])
+                event["id"] = uuid.UUID(event["id"])
+                event["time"] = datetime.fromisoformat(event["time"])
+                rows.append({**EVENT_DEFAULTS, **_stored(db, event), "session_id": pk})
+                if not record.get("reserved", True):
+                    unreserved.setdefault(pk, []).append(event["id"])
+
+            # Claim the slots held in memory while the shard was down; under reject, some may not fit
+            over_cap = set()
+            for pk in sorted(unreserved, key=str):
+                granted = SessionQuotaService.reserve(db, pk, len(unreserved[pk]))
+                over_cap.update(unreserved[pk][granted:])
+            if over_cap:
+                self.over_cap += len(over_cap)
+                rows = [row for row in rows if row["id"] not in over_cap]
+                logger.warning("Dropping %d spooled events for sessions at their cap", len(over_cap))
+
+            inserted, rejected = set(), set()
+            batch_size = settings.event_spool_replay_batch_size
+            for i in range(0, len(rows), batch_size):
+                batch_inserted, batch_rejected = self._insert(db, rows[i:i + batch_size])
+                inserted |= batch_inserted
+                rejected |= batch_rejected
+
+            counts: Dict[uuid.UUID, int] = {}
+            for row in rows:
+                if row["id"] in inserted:
+                    counts[row["session_id"]] = counts.get(row["session_id"], 0) + 1
+            # A duplicate that claimed a slot above gives it back
+            for pk, ids in unreserved.items():
+                SessionQuotaService.release(db, pk, sum(
+                    1 for id_ in ids if id_ not in inserted and id_ not in rejected and id_ not in over_cap
+                ))
+            SessionQuotaService.record(db, counts)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+        duplicates = len(rows) - len(inserted) - len(rejected)
+        self.replayed += len(inserted)
+        self.duplicates += duplicates
+        if rows:
+            logger.info("Replayed %d spooled events to shard %s (%d already there)", len(inserted), shard, duplicates)
+
+    def _insert(self, db: DBSession, rows: List[Dict[str, Any]]) -> Tuple[set, set]:
+        """Insert a batch; returns the ids inserted and rejected. A row the database rejects is dropped alone."""
+        def statement(batch):
+            return (
+                insert(LLMEvent.__table__).values(batch)
+                .on_conflict_do_nothing(index_elements=["id", "time"])
+                .returning(LLMEvent.__table__.c.id)
+            )
+
+        rejected = set()
+        try:
+            with db.begin_nested():
+                inserted = set(db.execute(statement(rows)).scalars())
+        except SPOOLABLE:
+            raise
+        except DBAPIError:
+            # One bad row fails the batch: retry one by one and keep the rest
+            inserted = set()
+            for row in rows:
+                try:
+                    with db.begin_nested():
+                        inserted.update(db.execute(statement([row])).scalars())
+                except SPOOLABLE:
+                    raise
+                except DBAPIError as e:
+                    self.rejected += 1
+                    rejected.add(row["id"])
+                    SessionQuotaService.release(db, row["session_id"], 1)
+                    logger.error("Dropping spooled event %s rejected by the database: %s", row["id"], e)
+        return inserted, rejected
+
+    def _probe(self, shard: str):
+        db = shard_router.session_on(shard)
+        try:
+            db.execute(text("SELECT 1"))
+            self._mark_up(shard)
+        except Exception as e:
+            logger.debug("Shard %s still down: %s", shard, e)
+        finally:
+            db.close()
+
+    # Lifecycle
+
+    def _loop(self):
+        while not self._stop.wait(settings.event_spool_replay_seconds):
+            try:
+                self.replay()
+            except Exception as e:
+                self.last_replay_error = str(e)
+                logger.error("Event spool replay failed: %s", e, exc_info=True)
+
+    def start(self):
+        if self.enabled and self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="event-spool-replay", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        # Whatever is left is sealed for the next process to drain
+        with self._lock:
+            self._seal()
+
+    def stats(self) -> dict:
+        segments = self._segments()
+        oldest = None
+        if segments:
+            oldest = round(time.time() - int(os.path.basename(segments[0]).split("-")[0]) / 1e9, 1)
+        return {
+            "enabled": self.enabled,
+            "shards_down": {shard: round(time.time() - since, 1) for shard, since in self._down.items()},
+            "written": self.written,
+            "spooled": dict(self.spooled),
+            "held_slots": sum(self._held.values()),
+            "dropped_full": self.dropped_full,
+            "segments": len(segments),
+            "bytes": self._disk_bytes(),
+            "max_bytes": settings.event_spool_max_bytes,
+            "oldest_segment_age_seconds": oldest,
+            "replayed": self.replayed,
+            "duplicates": self.duplicates,
+            "orphaned": self.orphaned,
+            "rejected": self.rejected,
+            "over_cap": self.over_cap,
+            "corrupt": self.corrupt,
+            "replay_errors": self.replay_errors,
+            "last_replay_error": self.last_replay_error,
+        }
+
+
+event_spool = EventSpool()
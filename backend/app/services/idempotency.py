@@ -0,0 +1,148 @@
+"""Idempotency-Key handling for non-idempotent POST endpoints"""
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Tuple
+import asyncio
+import hashlib
+import time
+import logging
+
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class IdempotencyConflict(Exception):
+    """The key was already used for a different request body"""
+
+
+class IdempotencyInProgress(Exception):
+    """The original request is still running after the wait timeout"""
+
+
+class _Record:
+    __slots__ = ("fingerprint", "future", "expires_at")
+
+    def __init__(self, fingerprint: str, future: asyncio.Future, expires_at: float):
+        self.fingerprint = fingerprint
+        self.future = future
+        self.expires_at = expires_at
+
+
+def fingerprint(*parts: Any) -> str:
+    """Stable digest of the request fields that must match on replay"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class IdempotencyStore:
+    """
+    Bounded in-process store of idempotent results.
+
+    Records are kept in insertion order, which is also expiry order since
+    every record gets the same TTL, so both TTL expiry and the size bound
+    evict from the front in O(1). A record holds a future: duplicates that
+    arrive while the first request is in flight await it instead of
+    starting their own upstream call. Failed calls are not remembered, so a
+    retry after an error goes upstream again.
+
+    The store is per worker process and all access happens on the event
+    loop, so no locking is needed. It follows that the guarantee is per
+    worker too: with several workers, a retry routed to another one is not
+    recognised.
+    """
+
+    def __init__(self, ttl_seconds: float, max_keys: int, wait_timeout_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self.max_keys = max_keys
+        self.wait_timeout_seconds = wait_timeout_seconds
+        self._records: "OrderedDict[Hashable, _Record]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def _evict(self, now: float):
+        records = self._records
+        while records:
+            key, record = next(iter(records.items()))
+            if record.expires_at > now and len(records) <= self.max_keys:
+                break
+            records.popitem(last=False)
+            if record.expires_at > now:
+                self.evictions += 1
+
+    async def run(
+        self,
+        key: Hashable,
+        request_fingerprint: str,
+        call: Callable[[], Awaitable[Any]],
+    ) -> Tuple[Any, bool]:
+        """
+        Run call() once per key within the TTL.
+
+        Returns:
+            (result, replayed) where replayed is True when the result came
+            from an earlier request with the same key
+        """
+        now = time.monotonic()
+        self._evict(now)
+
+        record = self._records.get(key)
+        if record is not None:
+            if record.fingerprint != request_fingerprint:
+                raise IdempotencyConflict("Idempotency-Key was already used with a different request")
+            self.hits += 1
+            try:
+                result = await asyncio.wait_for(asyncio.shield(record.future), self.wait_timeout_seconds)
+            except asyncio.TimeoutError:
+                raise IdempotencyInProgress("A request with this Idempotency-Key is still in progress")
+            except asyncio.CancelledError:
+                if not record.future.cancelled():
+                    raise
+                # The original request was abandoned (client disconnect); the key is free again
+                raise IdempotencyInProgress("The original request with this Idempotency-Key was cancelled; retry")
+            return result, True
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        # Waiters re-raise a failure themselves; mark it retrieved so an unwaited failure isn't logged
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._records[key] = _Record(request_fingerprint, future, now + self.ttl_seconds)
+        self._evict(now)
+
+        try:
+            result = await call()
+        except BaseException as e:
+            current = self._records.get(key)
+            if current is not None and current.future is future:
+                del self._records[key]
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+            raise
+
+        future.set_result(result)
+        return result, False
+
+    def stats(self) -> dict:
+        return {
+            "keys": len(self._records),
+            "max_keys": self.max_keys,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+idempotency_store = IdempotencyStore(
+    ttl_seconds=settings.idempotency_ttl_seconds,
+    max_keys=settings.idempotency_max_keys,
+    wait_timeout_seconds=settings.idempotency_wait_timeout_seconds,
+)
@@ -0,0 +1,161 @@
+"""Pricing engine: versioned per-model rates and cost computation"""
+from sqlalchemy.orm import Session as DBSession
+from typing import Dict, List, NamedTuple, Optional
+from datetime import datetime, timezone
+from decimal import Decimal, ROUND_HALF_UP
+import bisect
+import threading
+import time
+import logging
+
+from ..db.base import SessionLocal
+from ..db.models import ModelPrice
+from ..db.dimensions import to_micros, from_micros  # noqa: F401  (re-exported)
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+MICRO = Decimal("0.000001")
+
+# Used for models with no price row (and before the table is seeded):
+# the Claude 3.5 Sonnet list price the playground originally hardcoded.
+FALLBACK_RATES = (Decimal("3"), Decimal("15"), Decimal("0.30"))
+
+DEFAULT_PRICES = [
+    # (model_prefix, input, output, cached input) in USD per million tokens
+    ("claude-3-5-sonnet", "3.00", "15.00", "0.30"),
+    ("claude-3-5-haiku", "0.80", "4.00", "0.08"),
+    ("claude-3-opus", "15.00", "75.00", "1.50"),
+    ("claude-3-sonnet", "3.00", "15.00", "0.30"),
+    ("claude-3-haiku", "0.25", "1.25", "0.03"),
+]
+DEFAULT_EFFECTIVE_FROM = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+class PriceVersion(NamedTuple):
+    id: Optional[int]
+    model_prefix: str
+    effective_from: datetime
+    input_per_mtok: Decimal
+    output_per_mtok: Decimal
+    cached_input_per_mtok: Decimal
+
+
+class PriceBook:
+    """
+    Immutable snapshot of the price table.
+
+    Versions are grouped by model prefix and sorted by effective_from, so
+    resolving (model, time) is a prefix match plus a bisect.
+    """
+
+    def __init__(self, versions: List[PriceVersion]):
+        self._by_prefix: Dict[str, List[PriceVersion]] = {}
+        for version in sorted(versions, key=lambda v: v.effective_from):
+            self._by_prefix.setdefault(version.model_prefix, []).append(version)
+        self._starts = {p: [v.effective_from for v in vs] for p, vs in self._by_prefix.items()}
+        # Longest prefix first so "claude-3-5-sonnet" beats "claude-3"
+        self._prefixes = sorted(self._by_prefix, key=len, reverse=True)
+        self._prefix_cache: Dict[str, Optional[str]] = {}
+
+    def prefix_for(self, model: Optional[str]) -> Optional[str]:
+        if not model:
+            return None
+        if model not in self._prefix_cache:
+            self._prefix_cache[model] = next((p for p in self._prefixes if model.startswith(p)), None)
+        return self._prefix_cache[model]
+
+    def versions(self, prefix: str) -> List[PriceVersion]:
+        return self._by_prefix.get(prefix, [])
+
+    def resolve(self, model: Optional[str], at: datetime) -> Optional[PriceVersion]:
+        """Price version in effect for model at the given time"""
+        prefix = self.prefix_for(model)
+        if prefix is None:
+            return None
+        if at.tzinfo is None:
+            at = at.replace(tzinfo=timezone.utc)
+        index = bisect.bisect_right(self._starts[prefix], at) - 1
+        if index < 0:
+            # Event predates the first known price: use the earliest one
+            index = 0
+        return self._by_prefix[prefix][index]
+
+
+def compute_cost(version: Optional[PriceVersion], input_tokens: int, output_tokens: int,
+                 cached_input_tokens: int = 0) -> Decimal:
+    """
+    Cost in USD, rounded to whole micro-dollars (what cost_micros stores).
+    input_tokens excludes cached tokens, as in the Anthropic usage block.
+    """
+    rates = (version.input_per_mtok, version.output_per_mtok, version.cached_input_per_mtok) if version else FALLBACK_RATES
+    cost = (
+        Decimal(input_tokens or 0) * rates[0]
+        + Decimal(output_tokens or 0) * rates[1]
+        + Decimal(cached_input_tokens or 0) * rates[2]
+    ) / Decimal(1_000_000)
+    return cost.quantize(MICRO, rounding=ROUND_HALF_UP)
+
+
+class PricingService:
+    """
+    Process-wide cached view of playground_model_prices.
+    The price table is global, so it is always read from the catalog
+    database (DATABASE_URL), whichever shard the events live on.
+    """
+
+    _book: Optional[PriceBook] = None
+    _loaded_at: float = 0.0
+    _lock = threading.Lock()
+
+    @staticmethod
+    def load(db: DBSession) -> PriceBook:
+        rows = db.query(ModelPrice).all()
+        return PriceBook([
+            PriceVersion(r.id, r.model_prefix, r.effective_from, r.input_per_mtok,
+                         r.output_per_mtok, r.cached_input_per_mtok)
+            for r in rows
+        ])
+
+    @classmethod
+    def book(cls) -> PriceBook:
+        """Cached price book, reloaded every pricing_cache_ttl_seconds"""
+        if cls._book is None or time.monotonic() - cls._loaded_at > settings.pricing_cache_ttl_seconds:
+            with cls._lock:
+                if cls._book is None or time.monotonic() - cls._loaded_at > settings.pricing_cache_ttl_seconds:
+                    db = SessionLocal()
+                    try:
+                        cls._book = cls.load(db)
+                    finally:
+                        db.close()
+                    cls._loaded_at = time.monotonic()
+        return cls._book
+
+    @classmethod
+    def invalidate(cls):
+        cls._book = None
+
+    @classmethod
+    def cost(cls, model: str, at: datetime, input_tokens: int, output_tokens: int,
+             cached_input_tokens: int = 0) -> Decimal:
+        version = cls.book().resolve(model, at)
+        if version is None:
+            logger.warning("No price configured for model %s; using fallback rates", model)
+        return compute_cost(version, input_tokens, output_tokens, cached_input_tokens)
+
+    @staticmethod
+    def seed_defaults(db: DBSession) -> int:
+        """Insert DEFAULT_PRICES when the table is empty (init_db path; migrations seed their own)"""
+        if db.query(ModelPrice).first() is not None:
+            return 0
+        for prefix, input_rate, output_rate, cached_rate in DEFAULT_PRICES:
+            db.add(ModelPrice(
+                model_prefix=prefix,
+                provider="anthropic",
+                input_per_mtok=Decimal(input_rate),
+                output_per_mtok=Decimal(output_rate),
+                cached_input_per_mtok=Decimal(cached_rate),
+                effective_from=DEFAULT_EFFECTIVE_FROM,
+            ))
+        db.commit()
+        return len(DEFAULT_PRICES)
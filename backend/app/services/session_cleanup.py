@@ -4,13 +4,33 @@ from sqlalchemy import and_
 from datetime import datetime, timedelta
 import logging
 
-from ..db.base import SessionLocal
+from ..db.shards import shard_router
 from ..db.models import Session, LLMEvent
 from ..config import settings
 
 logger = logging.getLogger(__name__)
 
 
+def _merge_shard_results(results: dict) -> dict:
+    """Combine per-shard results: counts are summed, success requires every shard"""
+    merged = {}
+    for result in results.values():
+        for key, value in result.items():
+            if isinstance(value, bool) or not isinstance(value, int):
+                merged.setdefault(key, value)
+            else:
+                merged[key] = merged.get(key, 0) + value
+    merged["success"] = all(r.get("success", True) for r in results.values())
+    if len(results) > 1:
+        merged["shards"] = results
+        failed = [name for name, r in results.items() if not r.get("success", True)]
+        if failed:
+            merged["message"] = f"Failed on shards {', '.join(failed)}: " + "; ".join(
+                results[name]["message"] for name in failed
+            )
+    return merged
+
+
 class SessionCleanupService:
     """Service to clean up expired sessions"""
 
@@ -18,6 +38,7 @@ class SessionCleanupService:
     def cleanup_expired_sessions(dry_run: bool = False) -> dict:
         """
         Clean up sessions that have been inactive for longer than the TTL.
+        Runs on every shard in parallel.
 
         Args:
             dry_run: If True, only report what would be deleted without actually deleting
@@ -25,13 +46,31 @@ class SessionCleanupService:
         Returns:
             Dictionary with cleanup statistics
         """
-        db = SessionLocal()
+        results = shard_router.scatter(
+            lambda db: SessionCleanupService._cleanup_expired_on_shard(db, dry_run)
+        )
+        merged = _merge_shard_results(results)
+        if len(results) > 1 and merged["success"]:
+            if dry_run:
+                merged["message"] = (
+                    f"DRY RUN: Would delete {merged.get('sessions_would_delete', 0)} sessions "
+                    f"and {merged.get('events_would_delete', 0)} events"
+                )
+            else:
+                merged["message"] = (
+                    f"Successfully deleted {merged.get('sessions_deleted', 0)} sessions "
+                    f"and {merged.get('events_deleted', 0)} events"
+                )
+        return merged
+
+    @staticmethod
+    def _cleanup_expired_on_shard(db: DBSession, dry_run: bool) -> dict:
         try:
             # Calculate expiration cutoff time
             cutoff_time = datetime.utcnow() - timedelta(days=settings.session_ttl_days)
 
-            logger.info(f"Starting session cleanup (dry_run={dry_run})")
-            logger.info(f"Cutoff time: {cutoff_time}")
+            logger.info("Starting session cleanup (dry_run=%s)", dry_run)
+            logger.info("Cutoff time: %s", cutoff_time)
 
             # Query expired sessions
             expired_sessions = db.query(Session).filter(
@@ -39,7 +78,7 @@ class SessionCleanupService:
             ).all()
 
             session_count = len(expired_sessions)
-            logger.info(f"Found {session_count} expired sessions")
+            logger.info("Found %d expired sessions", session_count)
 
             if session_count == 0:
                 return {
@@ -56,13 +95,13 @@ class SessionCleanupService:
                 LLMEvent.session_id.in_(session_ids)
             ).count()
 
-            logger.info(f"Found {event_count} events to delete")
+            logger.info("Found %d events to delete", event_count)
 
             if dry_run:
                 # Just report what would be deleted
                 expired_session_ids = [session.session_id for session in expired_sessions]
-                logger.info(f"DRY RUN: Would delete {session_count} sessions and {event_count} events")
-                logger.info(f"Expired session IDs: {expired_session_ids[:10]}...")  # Show first 10
+                logger.info("DRY RUN: Would delete %d sessions and %d events", session_count, event_count)
+                logger.info("Expired session IDs: %s...", expired_session_ids[:10])  # Show first 10
 
                 return {
                     "success": True,
@@ -77,13 +116,13 @@ class SessionCleanupService:
             # Actually delete the sessions (cascade will delete events)
             deleted_session_count = 0
             for session in expired_sessions:
-                logger.info(f"Deleting session: {session.session_id} (last active: {session.last_activity})")
+                logger.info("Deleting session: %s (last active: %s)", session.session_id, session.last_activity)
                 db.delete(session)
                 deleted_session_count += 1
 
             db.commit()
 
-            logger.info(f"Cleanup complete: Deleted {deleted_session_count} sessions and {event_count} events")
+            logger.info("Cleanup complete: Deleted %d sessions and %d events", deleted_session_count, event_count)
 
             return {
                 "success": True,
@@ -95,14 +134,12 @@ class SessionCleanupService:
 
         except Exception as e:
             db.rollback()
-            logger.error(f"Error during session cleanup: {str(e)}")
+            logger.error("Error during session cleanup: %s", e)
             return {
                 "success": False,
                 "error": str(e),
                 "message": f"Session cleanup failed: {str(e)}"
             }
-        finally:
-            db.close()
 
     @staticmethod
     def cleanup_inactive_sessions(inactive_hours: int = 24, dry_run: bool = False) -> dict:
@@ -117,12 +154,24 @@ class SessionCleanupService:
         Returns:
             Dictionary with cleanup statistics
         """
-        db = SessionLocal()
+        results = shard_router.scatter(
+            lambda db: SessionCleanupService._cleanup_inactive_on_shard(db, inactive_hours, dry_run)
+        )
+        merged = _merge_shard_results(results)
+        if len(results) > 1 and merged["success"]:
+            if dry_run:
+                merged["message"] = f"DRY RUN: Would mark {merged.get('sessions_would_mark', 0)} sessions as inactive"
+            else:
+                merged["message"] = f"Successfully marked {merged.get('sessions_marked_inactive', 0)} sessions as inactive"
+        return merged
+
+    @staticmethod
+    def _cleanup_inactive_on_shard(db: DBSession, inactive_hours: int, dry_run: bool) -> dict:
         try:
             cutoff_time = datetime.utcnow() - timedelta(hours=inactive_hours)
 
-            logger.info(f"Starting inactive session cleanup (inactive_hours={inactive_hours}, dry_run={dry_run})")
-            logger.info(f"Cutoff time: {cutoff_time}")
+            logger.info("Starting inactive session cleanup (inactive_hours=%s, dry_run=%s)", inactive_hours, dry_run)
+            logger.info("Cutoff time: %s", cutoff_time)
 
             # Query inactive sessions
             inactive_sessions = db.query(Session).filter(
@@ -133,7 +182,7 @@ class SessionCleanupService:
             ).all()
 
             session_count = len(inactive_sessions)
-            logger.info(f"Found {session_count} inactive sessions")
+            logger.info("Found %d inactive sessions", session_count)
 
             if session_count == 0:
                 return {
@@ -144,7 +193,7 @@ class SessionCleanupService:
                 }
 
             if dry_run:
-                logger.info(f"DRY RUN: Would mark {session_count} sessions as inactive")
+                logger.info("DRY RUN: Would mark %d sessions as inactive", session_count)
                 return {
                     "success": True,
                     "dry_run": True,
@@ -161,7 +210,7 @@ class SessionCleanupService:
 
             db.commit()
 
-            logger.info(f"Marked {marked_count} sessions as inactive")
+            logger.info("Marked %d sessions as inactive", marked_count)
 
             return {
                 "success": True,
@@ -172,14 +221,12 @@ class SessionCleanupService:
 
         except Exception as e:
             db.rollback()
-            logger.error(f"Error during inactive session cleanup: {str(e)}")
+            logger.error("Error during inactive session cleanup: %s", e)
             return {
                 "success": False,
                 "error": str(e),
                 "message": f"Inactive session cleanup failed: {str(e)}"
             }
-        finally:
-            db.close()
 
     @staticmethod
     def get_cleanup_stats() -> dict:
@@ -187,44 +234,48 @@ class SessionCleanupService:
         Get statistics about sessions and potential cleanup targets.
 
         Returns:
-            Dictionary with session statistics
+            Dictionary with session statistics, summed across shards
         """
-        db = SessionLocal()
-        try:
-            cutoff_time = datetime.utcnow() - timedelta(days=settings.session_ttl_days)
-
-            # Total sessions
-            total_sessions = db.query(Session).count()
-
-            # Active sessions
-            active_sessions = db.query(Session).filter(Session.is_active == True).count()
+        cutoff_time = datetime.utcnow() - timedelta(days=settings.session_ttl_days)
+        results = shard_router.scatter(
+            lambda db: SessionCleanupService._stats_on_shard(db, cutoff_time)
+        )
+        stats = _merge_shard_results(results)
+        stats.pop("success", None)
+        stats["ttl_days"] = settings.session_ttl_days
+        return stats
 
-            # Expired sessions
-            expired_sessions = db.query(Session).filter(
-                Session.last_activity < cutoff_time
-            ).count()
-
-            # Inactive sessions (last 24 hours)
-            inactive_cutoff = datetime.utcnow() - timedelta(hours=24)
-            inactive_24h = db.query(Session).filter(
-                and_(
-                    Session.last_activity < inactive_cutoff,
-                    Session.is_active == True
-                )
-            ).count()
-
-            return {
-                "total_sessions": total_sessions,
-                "active_sessions": active_sessions,
-                "inactive_sessions": total_sessions - active_sessions,
-                "expired_sessions": expired_sessions,
-                "inactive_24h": inactive_24h,
-                "ttl_days": settings.session_ttl_days,
-                "cutoff_time": cutoff_time.isoformat()
-            }
-
-        finally:
-            db.close()
+    @staticmethod
+    def _stats_on_shard(db: DBSession, cutoff_time: datetime) -> dict:
+        # Total sessions
+        total_sessions = db.query(Session).count()
+
+        # Active sessions
+        active_sessions = db.query(Session).filter(Session.is_active == True).count()
+
+        # Expired sessions
+        expired_sessions = db.query(Session).filter(
+            Session.last_activity < cutoff_time
+        ).count()
+
+        # Inactive sessions (last 24 hours)
+        inactive_cutoff = datetime.utcnow() - timedelta(hours=24)
+        inactive_24h = db.query(Session).filter(
+            and_(
+                Session.last_activity < inactive_cutoff,
+                Session.is_active == True
+            )
+        ).count()
+
+        return {
+            "total_sessions": total_sessions,
+            "active_sessions": active_sessions,
+            "inactive_sessions": total_sessions - active_sessions,
+            "expired_sessions": expired_sessions,
+            "inactive_24h": inactive_24h,
+            "ttl_days": settings.session_ttl_days,
+            "cutoff_time": cutoff_time.isoformat()
+        }
 
 
 # Convenience function for cron jobs
@@ -237,7 +288,7 @@ def run_cleanup(dry_run: bool = False):
     """
     logger.info("Running scheduled session cleanup")
     result = SessionCleanupService.cleanup_expired_sessions(dry_run=dry_run)
-    logger.info(f"Cleanup result: {result}")
+    logger.info("Cleanup result: %s", result)
     return result
 
 
@@ -0,0 +1,198 @@
+"""Per-session event caps backed by maintained counters"""
+from sqlalchemy.orm import Session as DBSession
+from sqlalchemy import text
+from typing import Dict, Optional
+import uuid
+import logging
+
+from ..db.shards import shard_router
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+EVICT = "evict"
+REJECT = "reject"
+
+# Unconditional increment (evict policy)
+INCREMENT_SQL = text("""
+    UPDATE playground_sessions SET event_count = event_count + :n
+    WHERE id = :session_pk
+""")
+
+# Take as much of :n as fits under the cap (reject policy); the row lock
+# serializes concurrent writers to the same session
+RESERVE_SQL = text("""
+    WITH s AS (
+        SELECT id, LEAST(:n, GREATEST(:cap - event_count, 0)) AS granted
+        FROM playground_sessions WHERE id = :session_pk FOR UPDATE
+    )
+    UPDATE playground_sessions p SET event_count = p.event_count + s.granted
+    FROM s WHERE p.id = s.id
+    RETURNING s.granted
+""")
+
+RELEASE_SQL = text("""
+    UPDATE playground_sessions SET event_count = GREATEST(event_count - :n, 0)
+    WHERE id = :session_pk
+""")
+
+# Delete the oldest events down to :target and fold them into the rollups, in one statement.
+# Walks ix_playground_events_session_id_time from the old end.
+EVICT_SQL = text("""
+    WITH s AS (
+        SELECT GREATEST(event_count - :target, 0) AS excess
+        FROM playground_sessions WHERE id = :session_pk FOR UPDATE
+    ), victims AS (
+        SELECT id, time FROM playground_events
+        WHERE session_id = :session_pk
+        ORDER BY time, id
+        LIMIT (SELECT coalesce(max(excess), 0) FROM s)
+    ), gone AS (
+        DELETE FROM playground_events e USING victims v
+        WHERE e.id = v.id AND e.time = v.time
+        RETURNING e.tokens_total, e.cost_micros
+    ), totals AS (
+        SELECT count(*) AS n, coalesce(sum(tokens_total), 0) AS tokens,
+               coalesce(sum(cost_micros), 0) / 1000000.0 AS cost
+        FROM gone
+    )
+    UPDATE playground_sessions p SET
+        event_count = GREATEST(p.event_count - totals.n, 0),
+        evicted_event_count = p.evicted_event_count + totals.n,
+        evicted_tokens_total = p.evicted_tokens_total + totals.tokens,
+        evicted_cost_usd = p.evicted_cost_usd + totals.cost
+    FROM totals WHERE p.id = :session_pk
+    RETURNING totals.n
+""")
+
+RECOUNT_SQL = text("""
+    UPDATE playground_sessions s
+    SET event_count = (SELECT count(*) FROM playground_events e WHERE e.session_id = s.id)
+    WHERE :session_pk IS NULL OR s.id = :session_pk
+""")
+
+
+class SessionQuotaService:
+    """
+    Enforce settings.session_max_events_per_session.
+
+    Every write bumps playground_sessions.event_count with a single-row
+    UPDATE in the writer's transaction, so checking the cap is O(1) and
+    never counts rows. Under the "evict" policy a session that goes over
+    the cap loses its oldest events in one batch, down to
+    cap - session_evict_batch_size, so eviction runs once per batch of
+    inserts rather than on every insert (ring-buffer semantics). The
+    evicted events' count, tokens and cost are added to the session's
+    evicted_* rollups, keeping lifetime totals exact. Under "reject",
+    writes that don't fit are refused.
+
+    All methods run in the caller's transaction; the caller commits.
+    """
+
+    @staticmethod
+    def enabled() -> bool:
+        return settings.session_max_events_per_session > 0
+
+    @staticmethod
+    def reserve(db: DBSession, session_pk: uuid.UUID, n: int = 1) -> int:
+        """
+        Count n new events against the session before they are written.
+
+        Returns:
+            How many of the n may be written: always n under the evict
+            policy, possibly fewer (down to 0) under reject
+        """
+        if n <= 0 or not SessionQuotaService.enabled():
+            return n
+        if settings.session_event_cap_policy == REJECT:
+            granted = db.execute(RESERVE_SQL, {
+                "session_pk": session_pk, "n": n, "cap": settings.session_max_events_per_session,
+            }).scalar()
+            return granted or 0
+        db.execute(INCREMENT_SQL, {"session_pk": session_pk, "n": n})
+        return n
+
+    @staticmethod
+    def release(db: DBSession, session_pk: uuid.UUID, n: int):
+        """Return reserved slots that were not used (failed write, duplicate rows)"""
+        if n > 0 and SessionQuotaService.enabled():
+            db.execute(RELEASE_SQL, {"session_pk": session_pk, "n": n})
+
+    @staticmethod
+    def evict_overflow(db: DBSession, session_pk: uuid.UUID) -> int:
+        """
+        Under the evict policy, trim the session back under its cap if the
+        last write pushed it over. Call after the new events are inserted.
+
+        Returns:
+            Number of events evicted
+        """
+        if not SessionQuotaService.enabled() or settings.session_event_cap_policy != EVICT:
+            return 0
+        cap = settings.session_max_events_per_session
+        count = db.execute(
+            text("SELECT event_count FROM playground_sessions WHERE id = :session_pk"),
+            {"session_pk": session_pk},
+        ).scalar()
+        if count is None or count <= cap:
+            return 0
+
+        target = max(cap - settings.session_evict_batch_size, 0)
+        evicted = db.execute(EVICT_SQL, {"session_pk": session_pk, "target": target}).scalar() or 0
+        logger.info("Evicted %d oldest events from session %s (cap %d)", evicted, session_pk, cap)
+        return evicted
+
+    @staticmethod
+    def record(db: DBSession, counts: Dict[uuid.UUID, int]) -> int:
+        """Evict overflow for every session that just received events; returns total evicted"""
+        return sum(SessionQuotaService.evict_overflow(db, pk) for pk, n in counts.items() if n > 0)
+
+    @staticmethod
+    def reset(session) -> None:
+        """Zero the counters of a session whose events were all deleted"""
+        session.event_count = 0
+        session.evicted_event_count = 0
+        session.evicted_tokens_total = 0
+        session.evicted_cost_usd = 0
+        session.archived_event_count = 0
+        session.archived_tokens_total = 0
+        session.archived_cost_usd = 0
+
+    @staticmethod
+    def recount(session_pk: Optional[uuid.UUID] = None) -> dict:
+        """
+        Rebuild event_count from the rows (one session, or all of them on
+        every shard). Only needed if events were deleted outside these code paths.
+        """
+        def recount_shard(db: DBSession) -> int:
+            try:
+                updated = db.execute(RECOUNT_SQL, {"session_pk": session_pk}).rowcount
+                db.commit()
+                return updated
+            except Exception:
+                db.rollback()
+                raise
+
+        try:
+            updated = sum(shard_router.scatter(recount_shard).values())
+            return {
+                "success": True,
+                "sessions_updated": updated,
+                "message": f"Recounted events for {updated} sessions",
+            }
+        except Exception as e:
+            logger.error("Error recounting session events: %s", e)
+            return {
+                "success": False,
+                "error": str(e),
+                "message": f"Recount failed: {str(e)}",
+            }
+
+
+if __name__ == "__main__":
+    # python -m app.services.session_quota [SESSION_PK]
+    import sys
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    result = SessionQuotaService.recount(uuid.UUID(sys.argv[1]) if len(sys.argv) > 1 else None)
+    print(f"\nResult: {result['message']}")
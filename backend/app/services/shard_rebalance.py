@@ -0,0 +1,200 @@
+"""Move sessions to the shard that owns them under the current hash ring"""
+from sqlalchemy import create_engine, select, func, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import sessionmaker, Session as DBSession
+from typing import Dict, List, Optional, Tuple
+import logging
+import time
+
+from ..db.models import Session, LLMEvent
+from ..db.shards import shard_router, parse_shard_urls
+from ..db.dimensions import dimensions, TABLES as DIMENSIONS
+from .session_quota import RECOUNT_SQL
+
+logger = logging.getLogger(__name__)
+
+# The generated search_vector column is recomputed by the target database
+EVENT_COLUMNS = [c for c in LLMEvent.__table__.c if c.computed is None]
+SESSION_COLUMNS = list(Session.__table__.c)
+ROLLUP_COLUMNS = [
+    "evicted_event_count", "evicted_tokens_total", "evicted_cost_usd",
+    "archived_event_count", "archived_tokens_total", "archived_cost_usd",
+]
+
+
+class ShardRebalanceService:
+    """
+    Converge every session onto its owner in the configured ring.
+
+    Run after changing SHARD_DATABASE_URLS (new shards must already be
+    migrated). Each misplaced session is copied to its owner in one target
+    transaction and only then deleted from the source, so an interrupted
+    run loses nothing and can simply be run again:
+
+    - the copy keeps the session's primary key, so finding a target row
+      with the same key means an earlier run already copied it; events are
+      re-inserted with ON CONFLICT DO NOTHING and rollups are not re-added
+    - a target row with a different key is a session the app recreated
+      after the cut-over; the moved events and evicted_* rollups are
+      merged into it (the one step that isn't repeat-safe: a crash between
+      the target commit and the source delete re-adds those rollups)
+
+    Shards being retired can be drained by passing them as extra sources.
+    """
+
+    @staticmethod
+    def run(extra_sources: Optional[List[Tuple[str, str]]] = None, dry_run: bool = False,
+            batch_size: int = 1000) -> dict:
+        sources: Dict[str, sessionmaker] = dict(shard_router.factories)
+        for name, url in extra_sources or []:
+            if name not in sources:
+                sources[name] = sessionmaker(autocommit=False, autoflush=False,
+                                             bind=create_engine(url, pool_pre_ping=True))
+
+        started = time.perf_counter()
+        moved_sessions, moved_events, plan = 0, 0, {}
+        try:
+            for source_name, factory in sources.items():
+                source = factory()
+                try:
+                    last_key = ""
+                    while True:
+                        # Keyset walk over the source's sessions; only the key columns are read here
+                        rows = source.execute(
+                            select(Session.id, Session.session_id)
+                            .where(Session.session_id > last_key)
+                            .order_by(Session.session_id)
+                            .limit(batch_size)
+                        ).all()
+                        source.rollback()
+                        if not rows:
+                            break
+                        last_key = rows[-1].session_id
+
+                        for session_pk, session_key in rows:
+                            owner = shard_router.shard_for(session_key)
+                            if owner == source_name:
+                                continue
+                            route = f"{source_name}->{owner}"
+                            if dry_run:
+                                events = source.execute(
+                                    select(func.count()).select_from(LLMEvent).where(LLMEvent.session_id == session_pk)
+                                ).scalar()
+                                source.rollback()
+                            else:
+                                events = ShardRebalanceService._move(source, session_pk, owner, batch_size)
+                            plan.setdefault(route, {"sessions": 0, "events": 0})
+                            plan[route]["sessions"] += 1
+                            plan[route]["events"] += events
+                            moved_sessions += 1
+                            moved_events += events
+                finally:
+                    source.close()
+                logger.info("Rebalance: finished source shard %s (%d sessions so far)", source_name, moved_sessions)
+
+            verb = "Would move" if dry_run else "Moved"
+            return {
+                "success": True,
+                "dry_run": dry_run,
+                "sessions_moved": moved_sessions,
+                "events_moved": moved_events,
+                "routes": plan,
+                "duration_s": round(time.perf_counter() - started, 1),
+                "message": f"{verb} {moved_sessions} sessions and {moved_events} events",
+            }
+        except Exception as e:
+            logger.error("Error during shard rebalance: %s", e)
+            return {
+                "success": False,
+                "error": str(e),
+                "sessions_moved": moved_sessions,
+                "events_moved": moved_events,
+                "routes": plan,
+                "message": f"Shard rebalance failed after {moved_sessions} sessions: {str(e)}",
+            }
+
+    @staticmethod
+    def _recode(source: DBSession, target: DBSession, event: dict) -> dict:
+        """Dimension ids are per shard: translate an event's from source's lookup tables to target's"""
+        for dimension in DIMENSIONS:
+            column = f"{dimension}_id"
+            value = dimensions.decode(source, dimension, event[column])
+            event[column] = dimensions.encode(target, dimension, value, capped=False)
+        return event
+
+    @staticmethod
+    def _move(source: DBSession, session_pk, owner: str, batch_size: int) -> int:
+        """Copy one session and its events to owner, then delete it from source"""
+        session_row = source.execute(
+            select(*SESSION_COLUMNS).where(Session.id == session_pk)
+        ).mappings().one()
+
+        target = shard_router.session_on(owner)
+        try:
+            existing = target.execute(
+                select(Session.id).where(Session.session_id == session_row["session_id"])
+            ).scalar()
+            if existing is None:
+                target.execute(insert(Session.__table__).values(**session_row))
+                target_pk = session_pk
+            else:
+                target_pk = existing
+                if existing != session_pk:
+                    # Merge into a session recreated on the owner after the cut-over
+                    target.execute(
+                        Session.__table__.update().where(Session.id == existing).values({
+                            column: Session.__table__.c[column] + session_row[column] for column in ROLLUP_COLUMNS
+                        })
+                    )
+
+            copied = 0
+            cursor = None
+            while True:
+                query = select(*EVENT_COLUMNS).where(LLMEvent.session_id == session_pk)
+                if cursor is not None:
+                    query = query.where(tuple_(LLMEvent.time, LLMEvent.id) > cursor)
+                events = source.execute(
+                    query.order_by(LLMEvent.time, LLMEvent.id).limit(batch_size)
+                ).mappings().all()
+                if not events:
+                    break
+                target.execute(
+                    insert(LLMEvent.__table__)
+                    .values([ShardRebalanceService._recode(source, target, {**event, "session_id": target_pk}) for event in events])
+                    .on_conflict_do_nothing()
+                )
+                copied += len(events)
+                cursor = (events[-1]["time"], events[-1]["id"])
+
+            target.execute(RECOUNT_SQL, {"session_pk": target_pk})
+            target.commit()
+        except Exception:
+            target.rollback()
+            raise
+        finally:
+            target.close()
+
+        # The copy is durable on the owner; now drop the source (events cascade)
+        source.execute(Session.__table__.delete().where(Session.id == session_pk))
+        source.commit()
+        logger.info("Moved session %s (%d events) to shard %s", session_row["session_id"], copied, owner)
+        return copied
+
+
+if __name__ == "__main__":
+    # python -m app.services.shard_rebalance [--dry-run] [--drain name=url,...] [--batch N]
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Move sessions onto their owning shard")
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--drain", help="Extra source shards being retired, same format as SHARD_DATABASE_URLS")
+    parser.add_argument("--batch", type=int, default=1000)
+    args = parser.parse_args()
+
+    result = ShardRebalanceService.run(
+        extra_sources=parse_shard_urls(args.drain), dry_run=args.dry_run, batch_size=args.batch
+    )
+    for route, counts in result["routes"].items():
+        print(f"  {route}: {counts['sessions']} sessions, {counts['events']} events")
+    print(f"\nResult: {result['message']}")
@@ -0,0 +1,340 @@
+"""Hedged upstream calls and per-model circuit breaking"""
+from collections import deque
+from typing import Any, AsyncContextManager, Callable, Deque, Dict, List, Optional, Tuple
+import asyncio
+import time
+import logging
+
+import numpy as np
+from anthropic import APIConnectionError, APIStatusError, APITimeoutError
+
+from ..config import settings
+from ..tracing import tracer, Span, CLIENT
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# hedge_outcome values recorded on the event
+PRIMARY_WON = "primary_won"
+HEDGE_WON = "hedge_won"
+HEDGE_SKIPPED = "skipped"  # Threshold passed but no spare slot or hedge budget
+
+
+class CircuitOpenError(Exception):
+    """The model/provider is shedding load; retry_after is a hint in seconds"""
+
+    def __init__(self, key: Tuple[str, str], retry_after: int):
+        super().__init__(f"Upstream {key[0]}/{key[1]} is failing; circuit open for {retry_after}s")
+        self.key = key
+        self.retry_after = retry_after
+
+
+def counts_as_failure(error: BaseException) -> bool:
+    """Upstream health failures: timeouts, connection errors, 429 and 5xx (not bad requests)"""
+    if isinstance(error, (APITimeoutError, APIConnectionError, asyncio.TimeoutError)):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+class CircuitBreaker:
+    """
+    Rolling-window breaker for one (provider, model).
+
+    It opens when at least upstream_breaker_min_requests calls in the last
+    upstream_breaker_window_seconds failed at a rate of
+    upstream_breaker_error_rate or more. While open, calls are refused
+    without going upstream. After upstream_breaker_cooldown_seconds it lets
+    a few probe calls through (half-open). A successful probe closes it;
+    a failed one reopens it.
+    """
+
+    def __init__(self, key: Tuple[str, str]):
+        self.key = key
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probes_in_flight = 0
+        self.outcomes: Deque[Tuple[float, bool]] = deque(maxlen=10000)
+        self.shed = 0
+
+    def _trim(self, now: float):
+        horizon = now - settings.upstream_breaker_window_seconds
+        while self.outcomes and self.outcomes[0][0] < horizon:
+            self.outcomes.popleft()
+
+    def check(self):
+        """
+        Raise CircuitOpenError if admit() would shed right now, without
+        taking a probe: lets a caller fail fast before it queues for a slot
+        """
+        if self.state == OPEN:
+            remaining = settings.upstream_breaker_cooldown_seconds - (time.monotonic() - self.opened_at)
+            if remaining > 0:
+                self.shed += 1
+                raise CircuitOpenError(self.key, max(int(remaining + 0.999), 1))
+        elif self.state == HALF_OPEN and self.probes_in_flight >= settings.upstream_breaker_half_open_probes:
+            self.shed += 1
+            raise CircuitOpenError(self.key, 1)
+
+    def admit(self) -> str:
+        """State the call is admitted under; raises CircuitOpenError when shedding"""
+        now = time.monotonic()
+        if self.state == OPEN:
+            remaining = settings.upstream_breaker_cooldown_seconds - (now - self.opened_at)
+            if remaining > 0:
+                self.shed += 1
+                raise CircuitOpenError(self.key, max(int(remaining + 0.999), 1))
+            self.state = HALF_OPEN
+            logger.info("Circuit %s half-open, probing", self.key)
+        if self.state == HALF_OPEN:
+            if self.probes_in_flight >= settings.upstream_breaker_half_open_probes:
+                self.shed += 1
+                raise CircuitOpenError(self.key, 1)
+            self.probes_in_flight += 1
+        return self.state
+
+    def record(self, admitted_state: str, ok: bool):
+        now = time.monotonic()
+        if admitted_state == HALF_OPEN:
+            self.probes_in_flight = max(self.probes_in_flight - 1, 0)
+            if ok:
+                self.state = CLOSED
+                self.outcomes.clear()
+                logger.info("Circuit %s closed", self.key)
+            else:
+                self._open(now)
+            return
+
+        self.outcomes.append((now, ok))
+        self._trim(now)
+        if not ok and self.state == CLOSED and len(self.outcomes) >= settings.upstream_breaker_min_requests:
+            failures = sum(1 for _, good in self.outcomes if not good)
+            if failures / len(self.outcomes) >= settings.upstream_breaker_error_rate:
+                self._open(now)
+
+    def abandon(self, admitted_state: str):
+        """A call ended without an outcome (cancelled); free its probe if it had one"""
+        if admitted_state == HALF_OPEN:
+            self.probes_in_flight = max(self.probes_in_flight - 1, 0)
+
+    def _open(self, now: float):
+        self.state = OPEN
+        self.opened_at = now
+        logger.warning("Circuit %s opened for %ss", self.key, settings.upstream_breaker_cooldown_seconds)
+
+    def status(self) -> dict:
+        self._trim(time.monotonic())
+        failures = sum(1 for _, good in self.outcomes if not good)
+        return {
+            "provider": self.key[0],
+            "model": self.key[1],
+            "state": self.state,
+            "window_requests": len(self.outcomes),
+            "window_error_rate": round(failures / len(self.outcomes), 3) if self.outcomes else 0.0,
+            "shed": self.shed,
+        }
+
+
+class UpstreamResult:
+    """Final message of the winning attempt and how it was obtained"""
+
+    def __init__(self, message: Any, ttft_ms: Optional[int], hedge_outcome: Optional[str], circuit_state: str):
+        self.message = message
+        self.ttft_ms = ttft_ms
+        self.hedge_outcome = hedge_outcome
+        self.circuit_state = circuit_state
+
+
+class _Attempt:
+    """
+    One streaming upstream request running as its own task. TTFT counts
+    from the start of the call (the primary's start), so a winning hedge
+    includes the delay before it was sent, as the caller experienced it.
+    """
+
+    def __init__(self, make_stream: Callable[[], AsyncContextManager], hedge: bool = False,
+                 call_started: Optional[float] = None):
+        self.first_token = asyncio.Event()
+        self.ttft_ms: Optional[int] = None
+        self.started = time.monotonic()
+        self.call_started = call_started if call_started is not None else self.started
+        self.hedge = hedge
+        self.span: Optional[Span] = None
+        self.task = asyncio.create_task(self._run(make_stream))
+        # Losers may fail after the race is decided; nobody awaits them
+        self.task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    async def _run(self, make_stream):
+        # The task runs in a copy of the caller's context, so this span nests under upstream.call
+        with tracer.span("upstream.attempt", CLIENT, **{"upstream.hedge": self.hedge}) as self.span:
+            async with make_stream() as stream:
+                async for event in stream:
+                    if event.type == "content_block_delta" and not self.first_token.is_set():
+                        self._mark_first_token()
+                message = await stream.get_final_message()
+            if not self.first_token.is_set():
+                # Nothing was streamed (empty completion): the whole call is the first token
+                self._mark_first_token()
+            return message
+
+    def _mark_first_token(self):
+        self.ttft_ms = int((time.monotonic() - self.call_started) * 1000)
+        self.first_token.set()
+        self.span.add_event("first_token", ttft_ms=self.ttft_ms)
+        self.span.set_attribute("upstream.ttft_ms", self.ttft_ms)
+
+    @property
+    def failed(self) -> bool:
+        return self.task.done() and not self.task.cancelled() and self.task.exception() is not None
+
+
+class UpstreamGuard:
+    """
+    Wrap each upstream call with hedging and a circuit breaker.
+
+    Hedging: if the primary request has not streamed its first token by the
+    upstream_hedge_percentile of recent time-to-first-token for that model
+    (clamped to upstream_hedge_min_delay_ms; upstream_hedge_default_delay_ms
+    until enough samples exist), a backup request is sent. Whichever
+    streams first wins and the other is cancelled, which closes its
+    connection. A hedge only runs when the scheduler has a free slot and the
+    hedge budget (upstream_hedge_max_ratio of calls) allows it, so hedging
+    never queues and can't double the load during an incident.
+
+    State is per worker process and touched only on the event loop.
+    """
+
+    def __init__(self):
+        self.breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+        self.ttft_samples: Dict[str, Deque[int]] = {}
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def breaker(self, provider: str, model: str) -> CircuitBreaker:
+        key = (provider, model)
+        if key not in self.breakers:
+            self.breakers[key] = CircuitBreaker(key)
+        return self.breakers[key]
+
+    def hedge_delay_ms(self, model: str) -> int:
+        samples = self.ttft_samples.get(model)
+        if not samples or len(samples) < settings.upstream_hedge_min_samples:
+            return settings.upstream_hedge_default_delay_ms
+        threshold = float(np.percentile(np.fromiter(samples, dtype=np.int64), settings.upstream_hedge_percentile))
+        return max(int(threshold), settings.upstream_hedge_min_delay_ms)
+
+    def _record_ttft(self, model: str, ttft_ms: Optional[int]):
+        if ttft_ms is not None:
+            self.ttft_samples.setdefault(model, deque(maxlen=settings.upstream_hedge_window)).append(ttft_ms)
+
+    def check(self, provider: str, model: str):
+        """Raise CircuitOpenError now if the model's breaker is shedding (call it before queueing)"""
+        self.breaker(provider, model).check()
+
+    def _hedge_allowed(self) -> bool:
+        return settings.upstream_hedge_enabled and self.hedges + 1 <= settings.upstream_hedge_max_ratio * self.calls
+
+    async def call(
+        self,
+        provider: str,
+        model: str,
+        make_stream: Callable[[], AsyncContextManager],
+        hedge_slot: Callable[[], Optional[Any]] = lambda: None,
+    ) -> UpstreamResult:
+        """
+        Run make_stream() (an SDK messages.stream(...) context) under the
+        model's breaker, hedging if it's slow to start. hedge_slot() returns
+        a scheduler ticket for the backup request, or None if none is free.
+        Raises CircuitOpenError without calling upstream while shedding.
+        """
+        with tracer.span("upstream.call", CLIENT, **{"llm.provider": provider, "llm.model": model}) as span:
+            result = await self._call(provider, model, make_stream, hedge_slot)
+            span.set_attribute("upstream.ttft_ms", result.ttft_ms)
+            span.set_attribute("upstream.hedge_outcome", result.hedge_outcome)
+            span.set_attribute("upstream.circuit_state", result.circuit_state)
+            return result
+
+    async def _call(self, provider: str, model: str, make_stream: Callable[[], AsyncContextManager],
+                    hedge_slot: Callable[[], Optional[Any]]) -> UpstreamResult:
+        breaker = self.breaker(provider, model)
+        admitted = breaker.admit()
+        self.calls += 1
+
+        attempts: List[_Attempt] = [_Attempt(make_stream)]
+        hedge_ticket = None
+        hedge_outcome = None
+        hedge_at = attempts[0].started + self.hedge_delay_ms(model) / 1000
+        leader = None
+        try:
+            while leader is None:
+                leader = next((a for a in attempts if a.first_token.is_set() and not a.failed), None)
+                if leader is not None:
+                    break
+                alive = [a for a in attempts if not a.task.done()]
+                if not alive:
+                    # Every attempt failed before streaming; surface the primary's error
+                    await attempts[0].task
+
+                timeout = None
+                if len(attempts) == 1 and hedge_outcome is None and settings.upstream_hedge_enabled:
+                    timeout = hedge_at - time.monotonic()
+                    if timeout <= 0:
+                        hedge_ticket = hedge_slot() if self._hedge_allowed() else None
+                        if hedge_ticket is None:
+                            hedge_outcome = HEDGE_SKIPPED
+                        else:
+                            self.hedges += 1
+                            attempts.append(_Attempt(make_stream, hedge=True, call_started=attempts[0].started))
+                            logger.info("Hedging %s call after %sms without a first token", model, self.hedge_delay_ms(model))
+                        continue
+
+                waiters = [asyncio.create_task(a.first_token.wait()) for a in alive]
+                try:
+                    await asyncio.wait([*waiters, *(a.task for a in alive)], timeout=timeout,
+                                       return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    for waiter in waiters:
+                        waiter.cancel()
+
+            for attempt in attempts:
+                if attempt is not leader:
+                    attempt.task.cancel()
+            if len(attempts) > 1:
+                hedge_outcome = HEDGE_WON if leader is attempts[1] else PRIMARY_WON
+                self.hedge_wins += hedge_outcome == HEDGE_WON
+            message = await leader.task
+        except asyncio.CancelledError:
+            # The client went away; says nothing about upstream health
+            breaker.abandon(admitted)
+            raise
+        except BaseException as e:
+            breaker.record(admitted, not counts_as_failure(e))
+            raise
+        finally:
+            for attempt in attempts:
+                if not attempt.task.done():
+                    attempt.task.cancel()
+            if hedge_ticket is not None:
+                hedge_ticket.release()
+
+        breaker.record(admitted, True)
+        self._record_ttft(model, leader.ttft_ms)
+        return UpstreamResult(message, leader.ttft_ms, hedge_outcome, admitted)
+
+    def status(self) -> dict:
+        return {
+            "hedging_enabled": settings.upstream_hedge_enabled,
+            "calls": self.calls,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "hedge_delay_ms": {model: self.hedge_delay_ms(model) for model in self.ttft_samples},
+            "breakers": [b.status() for b in self.breakers.values()],
+        }
+
+
+upstream_guard = UpstreamGuard()
@@ -0,0 +1,324 @@
+"""Fair-share scheduling of upstream LLM calls across sessions"""
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+import asyncio
+import heapq
+import itertools
+import time
+import logging
+
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITIES = (INTERACTIVE, BATCH)
+
+
+class UpstreamQueueError(Exception):
+    """A call was refused a slot; retry_after is a hint in seconds"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class UpstreamQueueFull(UpstreamQueueError):
+    """Too many calls are already waiting"""
+
+
+class UpstreamQueueTimeout(UpstreamQueueError):
+    """The call waited longer than its class's queue-time limit"""
+
+
+class Ticket:
+    """A granted upstream slot"""
+    __slots__ = ("flow", "priority", "charged", "queue_wait_ms", "_scheduler", "_released")
+
+    def __init__(self, scheduler: "UpstreamScheduler", flow: str, priority: str, charged: int):
+        self._scheduler = scheduler
+        self.flow = flow
+        self.priority = priority
+        self.charged = charged
+        self.queue_wait_ms = 0
+        self._released = False
+
+    def settle(self, actual_tokens: int):
+        """Replace the up-front token estimate with what the call really used"""
+        self._scheduler._settle(self, actual_tokens)
+
+    def release(self):
+        """Give the slot back (idempotent)"""
+        if not self._released:
+            self._released = True
+            self._scheduler._release(self)
+
+
+class _Waiter:
+    __slots__ = ("start", "finish", "seq", "flow", "priority", "cost", "future", "cancelled")
+
+    def __init__(self, start: float, finish: float, seq: int, flow: str, priority: str, cost: int,
+                 future: asyncio.Future):
+        self.start = start
+        self.finish = finish
+        self.seq = seq
+        self.flow = flow
+        self.priority = priority
+        self.cost = cost
+        self.future = future
+        self.cancelled = False
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.start, self.seq) < (other.start, other.seq)
+
+
+class UpstreamScheduler:
+    """
+    Bounded pool of in-flight upstream calls shared by all sessions.
+
+    Waiting calls are served in start-time fair queuing order. Each flow
+    (a session within a priority class) gets a virtual clock. A call's tag
+    is max(global virtual time, the flow's previous finish), and its finish
+    is tag + estimated tokens / class weight. The lowest tag is dispatched
+    first. So a session that queues a hundred batch calls only gets its
+    weighted share of the slots, and a single interactive call is not stuck
+    behind them. Interactive calls weigh upstream_interactive_weight
+    times more than batch calls.
+
+    A flow's clock only advances when one of its calls is granted. Its
+    queued calls are tagged one behind the other, and when one times out
+    or is cancelled, the calls queued after it are re-tagged without it.
+    So a call that never ran costs its session nothing.
+
+    If upstream_tokens_per_minute is set, dispatch also draws each
+    call's estimated tokens from a token bucket that refills at that rate
+    (capacity: one minute). settle() corrects the bucket once the actual
+    usage is known.
+
+    Calls fail fast instead of piling up. One is refused when
+    upstream_max_queue calls are already waiting, or when it has waited
+    longer than its class's limit.
+
+    State is per worker process and only touched on the event loop. With
+    several workers, divide the account's limits between them.
+    """
+
+    def __init__(self, max_concurrency: int, tokens_per_minute: int, weights: Dict[str, float],
+                 max_wait_seconds: Dict[str, float], max_queue: int):
+        self.max_concurrency = max_concurrency
+        self.tokens_per_minute = tokens_per_minute
+        self.weights = weights
+        self.max_wait_seconds = max_wait_seconds
+        self.max_queue = max_queue
+
+        self._heap: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._last_finish: Dict[tuple, float] = {}  # Flow -> finish of its last granted call
+        self._pending: Dict[tuple, List[_Waiter]] = {}  # Flow -> its queued calls, in order
+        self._virtual_time = 0.0
+        self._waiting = 0
+        self.in_flight = 0
+
+        self._tokens = float(tokens_per_minute)
+        self._refilled_at = time.monotonic()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+        self.dispatched = {p: 0 for p in weights}
+        self.timeouts = {p: 0 for p in weights}
+        self.rejected = {p: 0 for p in weights}
+        self.wait_ms_total = {p: 0 for p in weights}
+
+    @classmethod
+    def from_settings(cls) -> "UpstreamScheduler":
+        return cls(
+            max_concurrency=settings.upstream_max_concurrency,
+            tokens_per_minute=settings.upstream_tokens_per_minute,
+            weights={INTERACTIVE: settings.upstream_interactive_weight, BATCH: settings.upstream_batch_weight},
+            max_wait_seconds={
+                INTERACTIVE: settings.upstream_interactive_max_wait_seconds,
+                BATCH: settings.upstream_batch_max_wait_seconds,
+            },
+            max_queue=settings.upstream_max_queue,
+        )
+
+    # Token bucket
+
+    def _refill(self):
+        if not self.tokens_per_minute:
+            return
+        now = time.monotonic()
+        self._tokens = min(
+            self._tokens + (now - self._refilled_at) * self.tokens_per_minute / 60,
+            float(self.tokens_per_minute),
+        )
+        self._refilled_at = now
+
+    def _settle(self, ticket: Ticket, actual_tokens: int):
+        if self.tokens_per_minute:
+            self._refill()
+            self._tokens = min(self._tokens + ticket.charged - actual_tokens, float(self.tokens_per_minute))
+            ticket.charged = actual_tokens
+
+    # Queue
+
+    def _arm(self, delay: Optional[float]):
+        """Point the refill timer at the current head: None disarms it"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if delay is not None:
+            self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+
+    def _unqueue(self, waiter: _Waiter, retag: bool = False):
+        """Take waiter off its flow's queue; retag moves the calls behind it up (it never ran)"""
+        key = (waiter.priority, waiter.flow)
+        pending = self._pending[key]
+        index = pending.index(waiter)
+        del pending[index]
+        if not pending:
+            del self._pending[key]
+        elif retag and index < len(pending):
+            previous = pending[index - 1].finish if index else self._last_finish.get(key, 0.0)
+            for follower in pending[index:]:
+                follower.start = max(self._virtual_time, previous)
+                follower.finish = follower.start + max(follower.cost, 1) / self.weights[follower.priority]
+                previous = follower.finish
+            heapq.heapify(self._heap)
+
+    def _dispatch(self):
+        self._refill()
+        while self._heap and self.in_flight < self.max_concurrency:
+            head = self._heap[0]
+            if head.cancelled:
+                heapq.heappop(self._heap)
+                continue
+            # A call bigger than the whole bucket runs once the bucket is full
+            cost = min(head.cost, self.tokens_per_minute) if self.tokens_per_minute else 0
+            if cost > self._tokens:
+                # The head may have changed since the timer was set, so re-arm it for this one
+                self._arm((cost - self._tokens) * 60 / self.tokens_per_minute)
+                return
+            heapq.heappop(self._heap)
+            self._unqueue(head)
+            self._waiting -= 1
+            self._tokens -= cost
+            self.in_flight += 1
+            self._virtual_time = head.start
+            key = (head.priority, head.flow)
+            self._last_finish[key] = max(self._last_finish.get(key, 0.0), head.finish)
+            head.future.set_result(Ticket(self, head.flow, head.priority, cost))
+        # Nothing is waiting on the bucket: a slot release dispatches the rest
+        self._arm(None)
+
+        if len(self._last_finish) > 10 * max(self.max_queue, 1):
+            # Flows at or behind the virtual clock would restart from it anyway
+            self._last_finish = {f: t for f, t in self._last_finish.items() if t > self._virtual_time}
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+    def _release(self, ticket: Ticket):
+        self.in_flight -= 1
+        self._dispatch()
+
+    def try_acquire(self, flow: str, priority: str = INTERACTIVE, est_tokens: int = 1) -> Optional[Ticket]:
+        """
+        A slot right now, or None. Only granted when nobody is waiting, so
+        opportunistic calls (hedges) never jump the queue. Doesn't advance the
+        flow's virtual clock.
+        """
+        self._refill()
+        cost = min(est_tokens, self.tokens_per_minute) if self.tokens_per_minute else 0
+        if self._waiting or self.in_flight >= self.max_concurrency or cost > self._tokens:
+            return None
+        self._tokens -= cost
+        self.in_flight += 1
+        return Ticket(self, flow, priority, cost)
+
+    async def acquire(self, flow: str, priority: str = INTERACTIVE, est_tokens: int = 1) -> Ticket:
+        """Wait for a slot; raises UpstreamQueueFull or UpstreamQueueTimeout"""
+        if priority not in self.weights:
+            raise ValueError(f"Unknown priority class: {priority}")
+        if self._waiting >= self.max_queue:
+            self.rejected[priority] += 1
+            raise UpstreamQueueFull(f"Upstream queue is full ({self._waiting} calls waiting)", retry_after=1)
+
+        key = (priority, flow)
+        pending = self._pending.get(key)
+        # Queued calls of the same flow are tagged behind each other, but charged only once granted
+        previous = pending[-1].finish if pending else self._last_finish.get(key, 0.0)
+        start = max(self._virtual_time, previous)
+        waiter = _Waiter(start, start + max(est_tokens, 1) / self.weights[priority], next(self._seq),
+                         flow, priority, est_tokens, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._heap, waiter)
+        self._pending.setdefault(key, []).append(waiter)
+        self._waiting += 1
+        enqueued_at = time.monotonic()
+        self._dispatch()
+
+        max_wait = self.max_wait_seconds[priority]
+        try:
+            ticket = await asyncio.wait_for(asyncio.shield(waiter.future), timeout=max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.future.done():
+                # Granted at the last moment: hand the slot straight back
+                waiter.future.result().release()
+            else:
+                waiter.cancelled = True
+                waiter.future.cancel()
+                self._waiting -= 1
+                self._unqueue(waiter, retag=True)
+                # It may have been the head the refill timer was set for
+                self._dispatch()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self.timeouts[priority] += 1
+            raise UpstreamQueueTimeout(
+                f"No upstream slot within {max_wait:g}s ({self._waiting} calls waiting)",
+                retry_after=max(int(max_wait), 1),
+            )
+
+        ticket.queue_wait_ms = int((time.monotonic() - enqueued_at) * 1000)
+        self.dispatched[priority] += 1
+        self.wait_ms_total[priority] += ticket.queue_wait_ms
+        return ticket
+
+    @asynccontextmanager
+    async def slot(self, flow: str, priority: str = INTERACTIVE, est_tokens: int = 1):
+        """async with scheduler.slot(session, priority, estimate) as ticket: <upstream call>"""
+        ticket = await self.acquire(flow, priority, est_tokens)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    def stats(self) -> dict:
+        self._refill()
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "waiting": self._waiting,
+            "tokens_per_minute": self.tokens_per_minute or None,
+            "tokens_available": int(self._tokens) if self.tokens_per_minute else None,
+            "classes": {
+                p: {
+                    "weight": self.weights[p],
+                    "max_wait_seconds": self.max_wait_seconds[p],
+                    "dispatched": self.dispatched[p],
+                    "avg_queue_wait_ms": round(self.wait_ms_total[p] / self.dispatched[p], 1) if self.dispatched[p] else 0,
+                    "timeouts": self.timeouts[p],
+                    "rejected": self.rejected[p],
+                }
+                for p in self.weights
+            },
+        }
+
+
+def estimate_tokens(text: str, max_tokens: int) -> int:
+    """Rough upfront cost of a call: ~4 characters per prompt token plus the completion budget"""
+    return len(text) // 4 + max_tokens
+
+
+upstream_scheduler = UpstreamScheduler.from_settings()
@@ -0,0 +1,59 @@
+"""Signed session tokens"""
+from typing import Optional, Tuple
+import base64
+import hashlib
+import hmac
+import uuid
+
+from fastapi import Response
+
+from .config import settings
+
+# Token states: a pending session has no row yet; a materialized one has been written to
+PENDING = "p"
+MATERIALIZED = "m"
+
+TOKEN_HEADER = "X-Session-Token"
+
+
+def _signature(session_id: str, state: str) -> str:
+    digest = hmac.new(settings.secret_key.encode(), f"{session_id}.{state}".encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:16]).rstrip(b"=").decode()
+
+
+def new_session_id() -> str:
+    return str(uuid.uuid4())
+
+
+def sign(session_id: str, state: str = PENDING) -> str:
+    """Token for a session: '<session_id>.<state>.<signature>'"""
+    return f"{session_id}.{state}.{_signature(session_id, state)}"
+
+
+def is_signed(value: str) -> bool:
+    return value.count(".") == 2
+
+
+def parse(token: str) -> Optional[Tuple[str, str]]:
+    """(session_id, state) of a token with a valid signature, else None"""
+    try:
+        session_id, state, signature = token.split(".")
+    except ValueError:
+        return None
+    if state not in (PENDING, MATERIALIZED):
+        return None
+    if not hmac.compare_digest(signature, _signature(session_id, state)):
+        return None
+    return session_id, state
+
+
+def set_cookie(response: Response, token: str):
+    """Hand the client its (re)issued token, as a cookie and in X-Session-Token"""
+    response.headers[TOKEN_HEADER] = token
+    response.set_cookie(
+        key=settings.session_cookie_name,
+        value=token,
+        httponly=True,
+        max_age=settings.session_ttl_days * 24 * 60 * 60,  # Convert days to seconds
+        samesite="lax"
+    )
@@ -0,0 +1,376 @@
+"""Request tracing: W3C trace context in, OpenTelemetry-shaped spans out"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import asyncio
+import importlib
+import logging
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+
+import orjson
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+INVALID_TRACE_ID = "0" * 32
+INVALID_SPAN_ID = "0" * 16
+
+# OTLP span kinds
+INTERNAL, SERVER, CLIENT = 1, 2, 3
+
+_current: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+class Span:
+    """
+    One timed operation. Unsampled spans still carry the trace id, so
+    context propagates, but record nothing and are never exported.
+    """
+
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "sampled",
+                 "start_ns", "end_ns", "attributes", "events", "status", "status_message")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], sampled: bool,
+                 kind: int = INTERNAL, attributes: Optional[Dict[str, Any]] = None):
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.sampled = sampled
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = dict(attributes or {}) if sampled else {}
+        self.events: List[Tuple[str, int, Dict[str, Any]]] = []
+        self.status = "unset"
+        self.status_message: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any):
+        if self.sampled and value is not None:
+            self.attributes[key] = value
+
+    def add_event(self, name: str, **attributes):
+        if self.sampled:
+            self.events.append((name, time.time_ns(), attributes))
+
+    def record_exception(self, error: BaseException):
+        self.status, self.status_message = "error", f"{type(error).__name__}: {error}"
+        self.add_event("exception", **{"exception.type": type(error).__name__, "exception.message": str(error)})
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def to_dict(self) -> Dict[str, Any]:
+        """OTLP/JSON span (attribute values kept as plain JSON; exporters convert if they need to)"""
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "attributes": self.attributes,
+            "events": [{"name": n, "timeUnixNano": t, "attributes": a} for n, t, a in self.events],
+            "status": {"code": {"unset": 0, "ok": 1, "error": 2}[self.status], "message": self.status_message or ""},
+        }
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """(trace_id, parent span_id, sampled) from a W3C traceparent header, or None if absent or invalid"""
+    if not header:
+        return None
+    match = TRACEPARENT.match(header.strip().lower())
+    if not match or match.group(1) == INVALID_TRACE_ID or match.group(2) == INVALID_SPAN_ID:
+        return None
+    return match.group(1), match.group(2), bool(int(match.group(3), 16) & 1)
+
+
+# Exporters
+
+
+class SpanExporter:
+    """Receives batches of finished spans on the tracer's background thread"""
+
+    def export(self, spans: List[Dict[str, Any]]):
+        raise NotImplementedError
+
+    def shutdown(self):
+        pass
+
+
+class FileSpanExporter(SpanExporter):
+    """One OTLP/JSON span per line; stands in for a collector in development and benchmarks"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or settings.tracing_file_path
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, "ab")
+
+    def export(self, spans: List[Dict[str, Any]]):
+        self._file.write(b"".join(orjson.dumps(span, default=str) + b"\n" for span in spans))
+        self._file.flush()
+
+    def shutdown(self):
+        self._file.close()
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{"key": k, "value": _otlp_value(v)} for k, v in attributes.items()]
+
+
+class OTLPHttpExporter(SpanExporter):
+    """POSTs OTLP/JSON to a collector (tracing_otlp_endpoint, e.g. an OpenTelemetry Collector on :4318)"""
+
+    def __init__(self, endpoint: Optional[str] = None):
+        import httpx
+
+        self.endpoint = endpoint or settings.tracing_otlp_endpoint
+        self._client = httpx.Client(timeout=5.0)
+
+    def export(self, spans: List[Dict[str, Any]]):
+        for span in spans:
+            span["attributes"] = _otlp_attributes(span["attributes"])
+            span["startTimeUnixNano"] = str(span["startTimeUnixNano"])
+            span["endTimeUnixNano"] = str(span["endTimeUnixNano"])
+            for event in span["events"]:
+                event["attributes"] = _otlp_attributes(event["attributes"])
+                event["timeUnixNano"] = str(event["timeUnixNano"])
+        body = {"resourceSpans": [{
+            "resource": {"attributes": _otlp_attributes({"service.name": settings.tracing_service_name})},
+            "scopeSpans": [{"scope": {"name": "app.tracing"}, "spans": spans}],
+        }]}
+        response = self._client.post(self.endpoint, content=orjson.dumps(body, default=str),
+                                     headers={"Content-Type": "application/json"})
+        response.raise_for_status()
+
+    def shutdown(self):
+        self._client.close()
+
+
+EXPORTERS: Dict[str, Callable[[], SpanExporter]] = {
+    "file": FileSpanExporter,
+    "otlp": OTLPHttpExporter,
+}
+
+
+def load_exporter(name: str) -> SpanExporter:
+    """A registered exporter by name, or a SpanExporter subclass given as package.module:Class"""
+    if name in EXPORTERS:
+        return EXPORTERS[name]()
+    module, _, attribute = name.partition(":")
+    if not attribute:
+        raise ValueError(f"Unknown tracing exporter {name!r}; expected one of {', '.join(EXPORTERS)} or module:Class")
+    return getattr(importlib.import_module(module), attribute)()
+
+
+# Tracer
+
+
+class Tracer:
+    """
+    Creates spans and ships finished ones to the exporter from a
+    background thread, like the log pipeline: the request path only
+    appends to a bounded queue, and a full queue drops spans (counted)
+    rather than blocking.
+
+    Sampling is decided once per trace, at its root. A remote parent's
+    sampled flag is followed either way, so a caller that dropped a trace
+    doesn't get orphan spans from us. A trace that starts here is decided
+    by its trace id against tracing_sample_ratio, so every worker agrees
+    on the same trace. Unsampled spans are cheap: no attributes, events or export.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.exporter: Optional[SpanExporter] = None
+        self._queue: queue.Queue = queue.Queue(settings.tracing_queue_size)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.started_spans = 0
+        self.exported = 0
+        self.dropped = 0
+        self.export_errors = 0
+
+    def start(self):
+        if self._thread is not None or not settings.tracing_enabled:
+            return
+        try:
+            self.exporter = load_exporter(settings.tracing_exporter)
+        except Exception as e:
+            logger.error("Tracing disabled: could not load exporter %r: %s", settings.tracing_exporter, e)
+            return
+        self.enabled = True
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="span-exporter", daemon=True)
+        self._thread.start()
+        logger.info("Tracing %.1f%% of requests to the %s exporter",
+                    settings.tracing_sample_ratio * 100, settings.tracing_exporter)
+
+    def stop(self):
+        """Export what is queued and stop the exporter thread"""
+        if self._thread is None:
+            return
+        self.enabled = False
+        self._stop.set()
+        self._thread.join(timeout=10)
+        self._thread = None
+        self._flush()
+        self.exporter.shutdown()
+
+    def _loop(self):
+        while not self._stop.wait(settings.tracing_flush_seconds):
+            self._flush()
+
+    def _flush(self):
+        while True:
+            batch = []
+            while len(batch) < settings.tracing_batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            try:
+                self.exporter.export([span.to_dict() for span in batch])
+                self.exported += len(batch)
+            except Exception as e:
+                self.export_errors += 1
+                self.dropped += len(batch)
+                logger.warning("Could not export %d spans: %s", len(batch), e)
+
+    @staticmethod
+    def _sampled(trace_id: str) -> bool:
+        # The low 64 bits of a random trace id are uniform: a ratio threshold on them
+        return int(trace_id[16:], 16) < settings.tracing_sample_ratio * (1 << 64)
+
+    def current(self) -> Optional[Span]:
+        return _current.get()
+
+    def annotate(self, **attributes):
+        """Set attributes on the current span, if there is one"""
+        span = _current.get()
+        if span is not None:
+            for key, value in attributes.items():
+                span.set_attribute(key, value)
+
+    def start_span(self, name: str, kind: int = INTERNAL, attributes: Optional[Dict[str, Any]] = None,
+                   traceparent: Optional[str] = None) -> Span:
+        """A new span under the current one, or the root of a trace (continuing traceparent, if valid)"""
+        parent = _current.get()
+        if parent is not None:
+            trace_id, parent_id, sampled = parent.trace_id, parent.span_id, parent.sampled
+        else:
+            remote = parse_traceparent(traceparent)
+            if remote is not None:
+                trace_id, parent_id, sampled = remote
+            else:
+                trace_id, parent_id = secrets.token_hex(16), None
+                sampled = self._sampled(trace_id)
+        span = Span(name, trace_id, parent_id, sampled and self.enabled, kind, attributes)
+        self.started_spans += span.sampled
+        return span
+
+    def end_span(self, span: Span):
+        span.end_ns = time.time_ns()
+        if not span.sampled:
+            return
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    @contextmanager
+    def span(self, name: str, kind: int = INTERNAL, traceparent: Optional[str] = None, **attributes) -> Iterator[Span]:
+        """Run a block as the current span; an exception marks it failed and propagates"""
+        span = self.start_span(name, kind, attributes, traceparent)
+        token = _current.set(span)
+        try:
+            yield span
+        except asyncio.CancelledError:
+            # A lost hedge or a client that went away: not a failure of the operation itself
+            span.set_attribute("cancelled", True)
+            raise
+        except BaseException as e:
+            span.record_exception(e)
+            raise
+        finally:
+            _current.reset(token)
+            self.end_span(span)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "exporter": settings.tracing_exporter if self.enabled else None,
+            "sample_ratio": settings.tracing_sample_ratio,
+            "sampled_spans": self.started_spans,
+            "exported": self.exported,
+            "queued": self._queue.qsize(),
+            "dropped": self.dropped,
+            "export_errors": self.export_errors,
+        }
+
+
+tracer = Tracer()
+
+
+def instrument_engines():
+    """
+    A client span around every SQL statement, on every engine (shards,
+    replicas and the jobs'). Only the statement text is recorded, cut to
+    tracing_statement_max_chars; parameters never are.
+    """
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    @event.listens_for(Engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        parent = _current.get()
+        if parent is None or not parent.sampled or context is None:
+            return
+        span = tracer.start_span("db.query", CLIENT, {
+            "db.system": conn.dialect.name,
+            "db.name": conn.engine.url.database,
+            "db.statement": statement[:settings.tracing_statement_max_chars],
+            "db.operation": statement.lstrip().split(None, 1)[0].upper() if statement.strip() else None,
+        })
+        if executemany:
+            span.set_attribute("db.executemany", True)
+        context._trace_span = span
+
+    @event.listens_for(Engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        span = getattr(context, "_trace_span", None)
+        if span is not None:
+            span.set_attribute("db.rows", cursor.rowcount if cursor.rowcount >= 0 else None)
+            tracer.end_span(span)
+            context._trace_span = None
+
+    @event.listens_for(Engine, "handle_error")
+    def _error(exception_context):
+        context = exception_context.execution_context
+        span = getattr(context, "_trace_span", None) if context is not None else None
+        if span is not None:
+            span.record_exception(exception_context.original_exception)
+            tracer.end_span(span)
+            context._trace_span = None
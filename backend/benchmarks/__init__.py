@@ -0,0 +1 @@
+"""Benchmark suites for the Playground backend"""
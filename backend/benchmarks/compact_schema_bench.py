@@ -0,0 +1,158 @@
+"""Size and aggregate speed of the compact event schema against the one it replaced.
+
+Copies the events loaded by benchmarks.datagen into two side tables with
+the same rows. One is shaped like playground_events before migration 009:
+model/provider/endpoint/status strings, numeric cost_usd, and btree
+indexes on model, provider and session_id. The other is shaped like it is
+now: lookup-table ids, cost_micros bigint, and only the (session_id, time)
+index. messages and response are left out of both because they didn't
+change. The report covers what did: per-row metadata, the indexes, and
+the aggregates that read them.
+
+    python -m benchmarks.datagen --database-url $BENCH_DATABASE_URL --events 5000000 --truncate
+    python -m benchmarks.compact_schema_bench --database-url $BENCH_DATABASE_URL --runs 10
+
+Both tables are dropped at the end unless --keep is given.
+"""
+from sqlalchemy import create_engine, text
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.db.dimensions import TABLES as DIMENSIONS  # noqa: E402
+
+COMMON_COLUMNS = (
+    "id, time, session_id, user_id, tokens_prompt, tokens_completion, tokens_total, tokens_cached_input, "
+    "latency_ms, time_to_first_token_ms, queue_wait_ms, hedge_outcome, circuit_state, "
+    "temperature, max_tokens, top_p, error_message, has_error, pii_detected"
+)
+
+WIDE_SQL = (
+    f"CREATE TABLE compact_bench_wide AS SELECT {COMMON_COLUMNS}, "
+    + ", ".join(
+        f"CAST((SELECT name FROM {table.name} WHERE id = e.{d}_id) AS varchar({table.c.name.type.length})) AS {d}"
+        for d, table in DIMENSIONS.items()
+    )
+    + ", CAST(cost_micros / 1000000.0 AS numeric(10, 6)) AS cost_usd FROM playground_events e"
+)
+NARROW_SQL = (
+    f"CREATE TABLE compact_bench_narrow AS SELECT {COMMON_COLUMNS}, "
+    + ", ".join(f"{d}_id" for d in DIMENSIONS)
+    + ", cost_micros FROM playground_events"
+)
+INDEXES = {
+    "compact_bench_wide": ["(id, time)", "(session_id, time)", "(time, id)", "(session_id)", "(model)", "(provider)"],
+    "compact_bench_narrow": ["(id, time)", "(session_id, time)", "(time, id)"],
+}
+
+# name -> (query on the old shape, query on the new shape); :session is the largest session
+QUERIES = {
+    "breakdown (all events)": (
+        """SELECT model, provider, status, GROUPING(model, provider, status), count(*),
+                  sum(tokens_total), coalesce(sum(cost_usd), 0)
+           FROM compact_bench_wide GROUP BY GROUPING SETS ((model), (provider), (status), ())""",
+        """SELECT model_id, provider_id, status_id, GROUPING(model_id, provider_id, status_id), count(*),
+                  sum(tokens_total), coalesce(sum(cost_micros), 0) / 1000000.0
+           FROM compact_bench_narrow GROUP BY GROUPING SETS ((model_id), (provider_id), (status_id), ())""",
+    ),
+    "daily cost (last 7 days)": (
+        """SELECT date_trunc('day', time), sum(cost_usd) FROM compact_bench_wide
+           WHERE time >= (SELECT max(time) FROM compact_bench_wide) - interval '7 days' GROUP BY 1""",
+        """SELECT date_trunc('day', time), sum(cost_micros) / 1000000.0 FROM compact_bench_narrow
+           WHERE time >= (SELECT max(time) FROM compact_bench_narrow) - interval '7 days' GROUP BY 1""",
+    ),
+    "session totals (largest)": (
+        """SELECT count(*), sum(tokens_total), sum(cost_usd), array_agg(DISTINCT model)
+           FROM compact_bench_wide WHERE session_id = :session""",
+        """SELECT count(*), sum(tokens_total), sum(cost_micros), array_agg(DISTINCT model_id)
+           FROM compact_bench_narrow WHERE session_id = :session""",
+    ),
+}
+
+SIZE_SQL = """
+    SELECT pg_table_size(CAST(:table AS regclass)), pg_indexes_size(CAST(:table AS regclass)),
+           (SELECT avg(pg_column_size(t.*)) FROM (SELECT * FROM {table} LIMIT 100000) t)
+"""
+
+
+def build(engine):
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE IF EXISTS compact_bench_wide, compact_bench_narrow"))
+        for sql in (WIDE_SQL, NARROW_SQL):
+            started = time.perf_counter()
+            conn.execute(text(sql))
+            print(f"  {sql.split()[2]} in {time.perf_counter() - started:.1f}s", flush=True)
+        for table, columns in INDEXES.items():
+            for i, column in enumerate(columns):
+                conn.execute(text(f"CREATE INDEX {table}_{i} ON {table} {column}"))
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("VACUUM ANALYZE compact_bench_wide"))
+        conn.execute(text("VACUUM ANALYZE compact_bench_narrow"))
+
+
+def sizes(engine, table: str) -> dict:
+    with engine.connect() as conn:
+        heap, indexes, row = conn.execute(text(SIZE_SQL.format(table=table)), {"table": table}).one()
+    return {"heap": heap, "indexes": indexes, "row": float(row or 0)}
+
+
+def time_query(engine, sql: str, params: dict, runs: int) -> float:
+    timings = []
+    with engine.connect() as conn:
+        conn.execute(text(sql), params).all()  # warm cache
+        for _ in range(runs):
+            started = time.perf_counter()
+            conn.execute(text(sql), params).all()
+            timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def _mb(size: int) -> str:
+    return f"{size / 1024 / 1024:,.1f} MB"
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.compact_schema_bench", description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL"))
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--keep", action="store_true", help="Leave the side tables for inspection")
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error("--database-url (or BENCH_DATABASE_URL) is required")
+
+    engine = create_engine(args.database_url)
+    with engine.connect() as conn:
+        total = conn.execute(text("SELECT count(*) FROM playground_events")).scalar()
+        session = conn.execute(text(
+            "SELECT session_id FROM playground_events GROUP BY session_id ORDER BY count(*) DESC LIMIT 1"
+        )).scalar()
+    if not total:
+        parser.error("playground_events is empty; load it with benchmarks.datagen first")
+
+    print(f"Copying {total:,} events into both shapes...")
+    build(engine)
+    try:
+        wide, narrow = sizes(engine, "compact_bench_wide"), sizes(engine, "compact_bench_narrow")
+        print(f"\n{'':<26}{'before':>14}{'after':>14}{'saved':>9}")
+        for key, label in (("row", "avg row (bytes)"), ("heap", "table"), ("indexes", "indexes")):
+            show = (lambda v: f"{v:,.0f}") if key == "row" else _mb
+            saved = 1 - narrow[key] / wide[key] if wide[key] else 0.0
+            print(f"{label:<26}{show(wide[key]):>14}{show(narrow[key]):>14}{saved:>9.0%}")
+
+        print(f"\n{'query (median ms)':<26}{'before':>14}{'after':>14}{'speedup':>9}")
+        for name, (before_sql, after_sql) in QUERIES.items():
+            before = time_query(engine, before_sql, {"session": session}, args.runs)
+            after = time_query(engine, after_sql, {"session": session}, args.runs)
+            print(f"{name:<26}{before:>14.1f}{after:>14.1f}{before / after:>8.2f}x")
+    finally:
+        if not args.keep:
+            with engine.begin() as conn:
+                conn.execute(text("DROP TABLE IF EXISTS compact_bench_wide, compact_bench_narrow"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+"""End-to-end HTTP load testing against a fake upstream LLM server"""
@@ -0,0 +1,136 @@
+"""Fake Anthropic-compatible upstream server for load testing.
+
+Implements just enough of ``POST /v1/messages`` for the Anthropic SDK:
+a regular JSON response and, when ``stream`` is set, the SSE event sequence.
+Latency and token counts are drawn from configurable distributions so the
+backend can be driven at realistic service times without paying for calls.
+
+Configured through environment variables (the runner launches it with uvicorn):
+
+    FAKE_UPSTREAM_LATENCY_MEDIAN_MS   median total latency (default 800)
+    FAKE_UPSTREAM_LATENCY_SIGMA       lognormal sigma of the latency (default 0.5)
+    FAKE_UPSTREAM_TTFT_FRACTION       share of latency spent before the first token (default 0.3)
+    FAKE_UPSTREAM_OUTPUT_TOKENS_MEAN  mean completion tokens (default 250)
+    FAKE_UPSTREAM_ERROR_RATE          fraction of calls answered with a 529 (default 0.0)
+    FAKE_UPSTREAM_SEED                RNG seed (default unset)
+"""
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+import asyncio
+import json
+import math
+import os
+import random
+import uuid
+
+LATENCY_MEDIAN_MS = float(os.getenv("FAKE_UPSTREAM_LATENCY_MEDIAN_MS", "800"))
+LATENCY_SIGMA = float(os.getenv("FAKE_UPSTREAM_LATENCY_SIGMA", "0.5"))
+TTFT_FRACTION = float(os.getenv("FAKE_UPSTREAM_TTFT_FRACTION", "0.3"))
+OUTPUT_TOKENS_MEAN = float(os.getenv("FAKE_UPSTREAM_OUTPUT_TOKENS_MEAN", "250"))
+ERROR_RATE = float(os.getenv("FAKE_UPSTREAM_ERROR_RATE", "0.0"))
+
+_rng = random.Random(os.getenv("FAKE_UPSTREAM_SEED"))
+
+app = FastAPI(title="Fake Anthropic upstream")
+
+
+def _sample_latency_s() -> float:
+    """Lognormal latency around the configured median"""
+    return _rng.lognormvariate(math.log(LATENCY_MEDIAN_MS), LATENCY_SIGMA) / 1000
+
+
+def _sample_output_tokens() -> int:
+    """Geometric-ish completion length with the configured mean"""
+    return max(1, int(_rng.expovariate(1 / OUTPUT_TOKENS_MEAN)))
+
+
+def _estimate_input_tokens(body: dict) -> int:
+    """Roughly 4 characters per token, like the real tokenizer on English text"""
+    chars = 0
+    for message in body.get("messages", []):
+        content = message.get("content", "")
+        if isinstance(content, str):
+            chars += len(content)
+        else:
+            chars += sum(len(block.get("text", "")) for block in content)
+    return max(1, chars // 4)
+
+
+def _error_response() -> JSONResponse:
+    return JSONResponse(
+        status_code=529,
+        content={"type": "error", "error": {"type": "overloaded_error", "message": "Overloaded"}},
+    )
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/v1/messages")
+async def create_message(request: Request):
+    body = await request.json()
+    latency_s = _sample_latency_s()
+    input_tokens = _estimate_input_tokens(body)
+    output_tokens = _sample_output_tokens()
+    model = body.get("model", "claude-3-5-sonnet-20241022")
+    message_id = f"msg_{uuid.uuid4().hex[:24]}"
+    text = "lorem " * output_tokens
+
+    if _rng.random() < ERROR_RATE:
+        await asyncio.sleep(latency_s * TTFT_FRACTION)
+        return _error_response()
+
+    if not body.get("stream"):
+        await asyncio.sleep(latency_s)
+        return {
+            "id": message_id,
+            "type": "message",
+            "role": "assistant",
+            "model": model,
+            "content": [{"type": "text", "text": text}],
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens},
+        }
+
+    async def events():
+        await asyncio.sleep(latency_s * TTFT_FRACTION)
+        yield _sse("message_start", {
+            "type": "message_start",
+            "message": {
+                "id": message_id, "type": "message", "role": "assistant", "model": model,
+                "content": [], "stop_reason": None, "stop_sequence": None,
+                "usage": {"input_tokens": input_tokens, "output_tokens": 1},
+            },
+        })
+        yield _sse("content_block_start", {
+            "type": "content_block_start", "index": 0,
+            "content_block": {"type": "text", "text": ""},
+        })
+        # Spread the remaining latency over a handful of chunks
+        chunks = min(output_tokens, 10)
+        per_chunk = latency_s * (1 - TTFT_FRACTION) / chunks
+        words = text.split(" ")
+        step = max(1, len(words) // chunks)
+        for i in range(chunks):
+            piece = " ".join(words[i * step:(i + 1) * step]) + " "
+            yield _sse("content_block_delta", {
+                "type": "content_block_delta", "index": 0,
+                "delta": {"type": "text_delta", "text": piece},
+            })
+            await asyncio.sleep(per_chunk)
+        yield _sse("content_block_stop", {"type": "content_block_stop", "index": 0})
+        yield _sse("message_delta", {
+            "type": "message_delta",
+            "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+            "usage": {"output_tokens": output_tokens},
+        })
+        yield _sse("message_stop", {"type": "message_stop"})
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.get("/health")
+async def health():
+    return {"status": "healthy"}
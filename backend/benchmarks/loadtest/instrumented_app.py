@@ -0,0 +1,86 @@
+"""Playground app with per-endpoint DB accounting, for load testing only.
+
+Wraps ``app.main.app`` in an ASGI middleware that tags each request with its
+path, and hooks every SQLAlchemy engine the app uses (the catalog, each shard
+and each read replica) so every statement is attributed to the endpoint that
+issued it. Totals are served from ``/__bench__/db-stats`` and
+reset through ``POST /__bench__/db-stats/reset``.
+"""
+from contextvars import ContextVar
+from collections import defaultdict
+from sqlalchemy import event
+import json
+import threading
+import time
+
+from app.main import app as playground_app
+from app.db.base import engine
+from app.db.shards import shard_router
+from app.db.replicas import replica_router
+
+_current_endpoint: ContextVar[str] = ContextVar("bench_endpoint", default="<background>")
+
+_lock = threading.Lock()
+_stats = defaultdict(lambda: {"statements": 0, "db_time_ms": 0.0})
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("bench_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed_ms = (time.perf_counter() - conn.info["bench_start"].pop()) * 1000
+    with _lock:
+        entry = _stats[_current_endpoint.get()]
+        entry["statements"] += 1
+        entry["db_time_ms"] += elapsed_ms
+
+
+def _engines() -> list:
+    """Every distinct engine: the default shard shares the catalog engine"""
+    engines = [engine, *shard_router.engines.values()]
+    engines += [replica.engine for group in replica_router.replicas.values() for replica in group]
+    return list({id(e): e for e in engines}.values())
+
+
+for _engine in _engines():
+    event.listen(_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _snapshot() -> dict:
+    with _lock:
+        return {endpoint: dict(values) for endpoint, values in _stats.items()}
+
+
+async def _send_json(send, payload: dict):
+    body = json.dumps(payload).encode()
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"application/json")],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def app(scope, receive, send):
+    """ASGI entry point: ``uvicorn benchmarks.loadtest.instrumented_app:app``"""
+    if scope["type"] != "http":
+        await playground_app(scope, receive, send)
+        return
+
+    path = scope["path"]
+    if path == "/__bench__/db-stats":
+        await _send_json(send, _snapshot())
+        return
+    if path == "/__bench__/db-stats/reset":
+        with _lock:
+            _stats.clear()
+        await _send_json(send, {"reset": True})
+        return
+
+    token = _current_endpoint.set(f"{scope['method']} {path}")
+    try:
+        await playground_app(scope, receive, send)
+    finally:
+        _current_endpoint.reset(token)
@@ -0,0 +1,328 @@
+"""Open-loop load generator and reporting for the Playground backend.
+
+Each endpoint in the scenario gets its own fixed arrival rate. Requests are
+fired on schedule whether or not earlier ones have completed, so queueing in
+the backend shows up as latency instead of being hidden by a closed loop.
+"""
+from dataclasses import dataclass, field, asdict
+from typing import Callable, Dict, List, Optional
+from sqlalchemy import create_engine, text
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pg_stat_database counters sampled before and after the measured phase
+PG_STAT_COLUMNS = [
+    "xact_commit", "xact_rollback", "blks_read", "blks_hit",
+    "tup_returned", "tup_fetched", "tup_inserted", "tup_updated", "tup_deleted",
+]
+
+
+@dataclass
+class EndpointLoad:
+    """One traffic stream: a request shape issued at a fixed rate"""
+    name: str
+    method: str
+    path: str
+    rate_per_s: float
+    json_body: Optional[dict] = None
+    uses_session: bool = True
+
+
+@dataclass
+class Scenario:
+    """A full load-test configuration"""
+    name: str = "mixed"
+    duration_s: float = 60.0
+    warmup_s: float = 5.0
+    session_pool_size: int = 50
+    endpoints: List[EndpointLoad] = field(default_factory=list)
+
+
+def default_scenario() -> Scenario:
+    """Traffic shaped like the frontend: mostly dashboard polling, some chat"""
+    return Scenario(endpoints=[
+        EndpointLoad("create_session", "POST", "/api/v1/sessions/create", 1.0, uses_session=False),
+        EndpointLoad("chat", "POST", "/api/v1/playground/chat", 5.0,
+                     json_body={"message": "Summarize the plot of Hamlet in three sentences."}),
+        EndpointLoad("session_info", "GET", "/api/v1/sessions/current/info", 20.0),
+        EndpointLoad("session_metrics", "GET", "/api/v1/sessions/current/metrics", 20.0),
+        EndpointLoad("recent_events", "GET", "/api/v1/events/recent?limit=50", 20.0),
+    ])
+
+
+def load_scenario(path: str) -> Scenario:
+    """Read a scenario from a JSON file with the same shape as ``Scenario``"""
+    with open(path) as f:
+        raw = json.load(f)
+    endpoints = [EndpointLoad(**e) for e in raw.pop("endpoints")]
+    return Scenario(endpoints=endpoints, **raw)
+
+
+def _percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_for(url: str, timeout_s: float = 30.0):
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Timed out waiting for {url}")
+
+
+@contextlib.contextmanager
+def _serve(module: str, port: int, env: dict, workers: int = 1):
+    """Run an ASGI app under uvicorn in a child process"""
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", module, "--host", "127.0.0.1",
+         "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env={**os.environ, **env},
+    )
+    try:
+        yield proc
+    finally:
+        proc.send_signal(signal.SIGINT)
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def _pg_stats(database_url: str) -> Dict[str, int]:
+    engine = create_engine(database_url)
+    try:
+        with engine.connect() as conn:
+            row = conn.execute(text(
+                f"SELECT {', '.join(PG_STAT_COLUMNS)} FROM pg_stat_database "
+                "WHERE datname = current_database()"
+            )).mappings().one()
+            return {k: int(v) for k, v in row.items()}
+    finally:
+        engine.dispose()
+
+
+def _prepare_database(database_url: str, reset: bool):
+    """Create the schema and seed model prices (like init_db.py), and optionally empty it"""
+    os.environ["DATABASE_URL"] = database_url
+    sys.path.insert(0, BACKEND_DIR)
+    from sqlalchemy.orm import Session as DBSession
+    from app.db.base import Base
+    from app.db import models  # noqa: F401  (register tables)
+    from app.services.pricing import PricingService
+
+    engine = create_engine(database_url)
+    try:
+        Base.metadata.create_all(bind=engine)
+        if reset:
+            with engine.begin() as conn:
+                conn.execute(text("TRUNCATE playground_events, playground_sessions"))
+        # Without price rows every model is costed at the Sonnet fallback rates
+        with DBSession(engine) as db:
+            PricingService.seed_defaults(db)
+    finally:
+        engine.dispose()
+
+
+class LoadDriver:
+    """Fires the scenario at a running backend and collects per-request samples"""
+
+    def __init__(self, base_url: str, scenario: Scenario, seed: Optional[int] = None):
+        self.base_url = base_url
+        self.scenario = scenario
+        self.rng = random.Random(seed)
+        self.sessions: List[str] = []
+        self.samples: Dict[str, List[tuple]] = {e.name: [] for e in scenario.endpoints}
+
+    async def _create_session(self, client: httpx.AsyncClient) -> str:
+        # The signed token, as real clients send it; a bare id would be looked up on every read
+        response = await client.post("/api/v1/sessions/create")
+        response.raise_for_status()
+        return response.json()["session_token"]
+
+    async def _fire(self, client: httpx.AsyncClient, load: EndpointLoad, record: bool):
+        headers = {}
+        index = None
+        if load.uses_session:
+            index = self.rng.randrange(len(self.sessions))
+            headers["X-Session-ID"] = self.sessions[index]
+        start = time.perf_counter()
+        try:
+            response = await client.request(load.method, load.path, json=load.json_body, headers=headers)
+            ok = response.status_code < 400
+            # Keep the reissued token (e.g. once the session has a row), like the frontend does
+            token = response.headers.get("X-Session-Token")
+            if index is not None and token:
+                self.sessions[index] = token
+            if load.name == "create_session" and ok:
+                self.sessions.append(response.json()["session_token"])
+        except httpx.HTTPError:
+            ok = False
+        if record:
+            self.samples[load.name].append(((time.perf_counter() - start) * 1000, ok))
+
+    async def _stream(self, client: httpx.AsyncClient, load: EndpointLoad, measure_start: float, end: float):
+        interval = 1.0 / load.rate_per_s
+        next_at = time.perf_counter() + self.rng.random() * interval
+        tasks = set()
+        while next_at < end:
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+            task = asyncio.create_task(self._fire(client, load, record=next_at >= measure_start))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            next_at += interval
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    async def _start_measuring(self, client: httpx.AsyncClient, measure_start: float,
+                               on_measure_start: Optional[Callable[[], None]]):
+        # Session creation, health checks and warmup traffic don't count towards the per-request DB figures
+        await asyncio.sleep(max(0.0, measure_start - time.perf_counter()))
+        await client.post("/__bench__/db-stats/reset")
+        if on_measure_start is not None:
+            await asyncio.to_thread(on_measure_start)
+
+    async def run(self, on_measure_start: Optional[Callable[[], None]] = None) -> float:
+        """
+        Run warmup plus measured phase; returns the measured wall time. The
+        backend's statement counters are reset when warmup ends, and
+        on_measure_start (blocking, run on a thread) is called then too.
+        """
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=200)
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=120.0, limits=limits) as client:
+            self.sessions = list(await asyncio.gather(
+                *(self._create_session(client) for _ in range(self.scenario.session_pool_size))
+            ))
+            now = time.perf_counter()
+            measure_start = now + self.scenario.warmup_s
+            end = measure_start + self.scenario.duration_s
+            await asyncio.gather(
+                self._start_measuring(client, measure_start, on_measure_start),
+                *(self._stream(client, load, measure_start, end) for load in self.scenario.endpoints),
+            )
+            return time.perf_counter() - measure_start
+
+    def summarize(self, wall_s: float) -> Dict[str, dict]:
+        summary = {}
+        for name, samples in self.samples.items():
+            latencies = sorted(latency for latency, _ in samples)
+            errors = sum(1 for _, ok in samples if not ok)
+            summary[name] = {
+                "requests": len(samples),
+                "rps": round(len(samples) / wall_s, 2) if wall_s else 0.0,
+                "p50_ms": _percentile(latencies, 50),
+                "p95_ms": _percentile(latencies, 95),
+                "p99_ms": _percentile(latencies, 99),
+                "max_ms": latencies[-1] if latencies else None,
+                "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+            }
+        return summary
+
+
+def _attach_db_stats(summary: Dict[str, dict], scenario: Scenario, db_stats: Dict[str, dict]):
+    """Fold per-path statement accounting into the per-endpoint summary"""
+    for load in scenario.endpoints:
+        key = f"{load.method} {load.path.split('?')[0]}"
+        stats = db_stats.get(key, {"statements": 0, "db_time_ms": 0.0})
+        requests = summary[load.name]["requests"] or 1
+        summary[load.name]["db_statements_per_request"] = round(stats["statements"] / requests, 2)
+        summary[load.name]["db_time_ms_per_request"] = round(stats["db_time_ms"] / requests, 3)
+
+
+def run_load_test(
+    scenario: Scenario,
+    database_url: str,
+    workers: int = 1,
+    upstream_env: Optional[dict] = None,
+    reset_db: bool = True,
+    seed: Optional[int] = None,
+) -> dict:
+    """Start fake upstream + backend, drive the scenario, and return the result document"""
+    _prepare_database(database_url, reset=reset_db)
+
+    upstream_port = _free_port()
+    backend_port = _free_port()
+    backend_url = f"http://127.0.0.1:{backend_port}"
+
+    backend_env = {
+        "DATABASE_URL": database_url,
+        "ANTHROPIC_API_KEY": "sk-ant-loadtest",
+        "ANTHROPIC_BASE_URL": f"http://127.0.0.1:{upstream_port}",
+    }
+
+    with _serve("benchmarks.loadtest.fake_upstream:app", upstream_port, upstream_env or {}), \
+            _serve("benchmarks.loadtest.instrumented_app:app", backend_port, backend_env, workers):
+        _wait_for(f"http://127.0.0.1:{upstream_port}/health")
+        _wait_for(f"{backend_url}/health")
+
+        driver = LoadDriver(backend_url, scenario, seed=seed)
+        pg_before: Dict[str, int] = {}
+        wall_s = asyncio.run(driver.run(on_measure_start=lambda: pg_before.update(_pg_stats(database_url))))
+        pg_after = _pg_stats(database_url)
+        # With several workers this only covers the worker that answers; use workers=1 for DB attribution
+        db_stats = httpx.get(f"{backend_url}/__bench__/db-stats").json()
+
+    summary = driver.summarize(wall_s)
+    _attach_db_stats(summary, scenario, db_stats)
+
+    return {
+        "scenario": asdict(scenario),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "workers": workers,
+            "upstream": upstream_env or {},
+        },
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "wall_s": round(wall_s, 3),
+        "endpoints": summary,
+        "database": {k: pg_after[k] - pg_before[k] for k in PG_STAT_COLUMNS},
+    }
+
+
+def compare(baseline: dict, candidate: dict, tolerance: float = 0.10) -> List[str]:
+    """Describe per-endpoint changes; lines prefixed with '!' exceed the tolerance"""
+    lines = []
+    for name, new in candidate["endpoints"].items():
+        old = baseline["endpoints"].get(name)
+        if old is None:
+            lines.append(f"  {name}: new endpoint")
+            continue
+        for metric in ("rps", "p50_ms", "p95_ms", "p99_ms", "error_rate", "db_time_ms_per_request"):
+            before, after = old.get(metric), new.get(metric)
+            if before is None or after is None:
+                continue
+            delta = (after - before) / before if before else (0.0 if after == before else float("inf"))
+            # Throughput regresses downwards, everything else upwards
+            regressed = delta < -tolerance if metric == "rps" else delta > tolerance
+            marker = "!" if regressed else " "
+            lines.append(f"{marker} {name}.{metric}: {before:.2f} -> {after:.2f} ({delta:+.1%})")
+    return lines
@@ -0,0 +1,111 @@
+"""Per-request logging overhead, before and after the queued JSON pipeline.
+
+"before" is the original setup: logging.basicConfig writing to the stream
+from the calling thread, with the f-string log calls every poll and chat
+request used to make. "after" is app.logging_config: lazy %-style calls,
+content only at DEBUG, sampling of app.dependencies, and a queue handler
+whose writer thread does the formatting and I/O. Times are wall-clock
+microseconds spent in the calling thread (what the event loop or a
+threadpool worker pays), with output going to a file.
+
+    python -m benchmarks.logging_bench --requests 20000 --threads 1 8
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import settings  # noqa: E402
+from app.logging_config import LogPipeline, TEXT_FORMAT  # noqa: E402
+
+dependencies_log = logging.getLogger("app.dependencies")
+chat_log = logging.getLogger("app.api.chat")
+
+SESSION_ID = str(uuid.uuid4())
+MESSAGE = "Summarize the following incident report for the on-call channel. " * 20
+RESPONSE = "The outage was caused by an expired certificate on the upstream proxy. " * 20
+
+
+def poll_before():
+    dependencies_log.info(f"Session ID from header: {SESSION_ID}")
+    dependencies_log.info(f"Updated session activity: {SESSION_ID}")
+
+
+def chat_before():
+    poll_before()
+    chat_log.info(f"Received chat request: {MESSAGE[:50]}...")
+    chat_log.info(f"Calling Anthropic API after {12}ms in queue...")
+    chat_log.info(f"Anthropic API call successful, latency: {840}ms")
+    chat_log.info(f"Response extracted: {RESPONSE[:50]}...")
+
+
+def poll_after():
+    dependencies_log.debug("Updated session activity: %s", SESSION_ID)
+
+
+def chat_after():
+    poll_after()
+    chat_log.debug("Received chat request: %.50s...", MESSAGE)
+    chat_log.info("Calling Anthropic API after %sms in queue...", 12)
+    chat_log.info("Anthropic API call successful, latency: %sms", 840)
+    chat_log.debug("Response extracted: %.50s...", RESPONSE)
+
+
+def configure_before(path: str):
+    root = logging.getLogger()
+    handler = logging.StreamHandler(open(path, "w"))
+    handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    root.handlers[:] = [handler]
+    root.setLevel(logging.INFO)
+
+
+def run(fn, requests: int, threads: int) -> float:
+    """Mean calling-thread microseconds per request"""
+    def worker(count):
+        started = time.perf_counter()
+        for _ in range(count):
+            fn()
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(threads) as pool:
+        spent = sum(pool.map(worker, [requests // threads] * threads))
+    return spent / (requests // threads * threads) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 8])
+    args = parser.parse_args()
+
+    # The writer keeps up in this benchmark; don't let a full queue flatter "after"
+    settings.log_queue_size = args.requests * 10
+    settings.log_rate_limit_per_second = 0
+
+    print(f"{'request':>8} {'threads':>8} {'before µs':>10} {'after µs':>9} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        for name, before, after in (("poll", poll_before, poll_after), ("chat", chat_before, chat_after)):
+            for threads in args.threads:
+                configure_before(os.path.join(directory, "before.log"))
+                before_us = run(before, args.requests, threads)
+
+                stdout, sys.stdout = sys.stdout, open(os.path.join(directory, "after.log"), "w")
+                pipeline = LogPipeline()
+                pipeline.start()
+                try:
+                    after_us = run(after, args.requests, threads)
+                finally:
+                    pipeline.stop()
+                    sys.stdout.close()
+                    sys.stdout = stdout
+                print(f"{name:>8} {threads:>8} {before_us:>10.2f} {after_us:>9.2f} {before_us / after_us:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+"""Time the hot database queries and fail on regressions against a baseline.
+
+Runs the queries behind api/sessions.py, api/events.py and
+services/session_cleanup.py (built the same way the handlers build them)
+against data from benchmarks.datagen. For each case it records the
+median/p95 of --runs executions after a warm-up, plus one
+EXPLAIN (ANALYZE, BUFFERS) plan. Writes run inside a transaction that is
+rolled back, so the data is unchanged between runs.
+
+Session-scoped cases run for a large session (the biggest by event_count)
+and a typical one (the median), since plans often flip between the two.
+
+    python -m benchmarks.datagen --database-url $BENCH_DATABASE_URL --truncate
+    python -m benchmarks.query_bench --database-url $BENCH_DATABASE_URL --save-baseline benchmarks/results/queries.json
+    # ...change queries, indexes or partitioning...
+    python -m benchmarks.query_bench --database-url $BENCH_DATABASE_URL --baseline benchmarks/results/queries.json
+
+A case regresses when its median is more than --tolerance slower than the
+baseline's and by more than --min-delta-ms. It also regresses when its plan
+touches more than --tolerance more shared buffers (hit + read) than the
+baseline's. Buffer counts do not depend on machine noise, so they catch
+plan changes that timings on a warm cache can hide. The exit status is 1
+when anything regressed.
+"""
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List
+from sqlalchemy import create_engine, delete, desc, distinct, func, select, text, update, and_
+import argparse
+import json
+import os
+import re
+import statistics
+import sys
+import time
+
+import psycopg2.extras
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import settings  # noqa: E402
+from app.db.models import Session, LLMEvent  # noqa: E402
+from app.api.events import SEARCH_SQL, HEADLINE_OPTIONS  # noqa: E402
+
+BUFFERS_RE = re.compile(r"Buffers: shared(?: hit=(\d+))?(?: read=(\d+))?")
+
+
+@dataclass
+class Fixture:
+    """Sessions and cutoffs the cases run against, chosen from the loaded data"""
+    large_session: object
+    typical_session: object
+    large_session_key: str
+    now: datetime
+    expired_ids: List[object]
+
+
+@dataclass
+class QueryCase:
+    name: str
+    source: str
+    build: Callable[[Fixture], object]
+    writes: bool = False
+
+
+@dataclass
+class CaseResult:
+    name: str
+    source: str
+    rows: int
+    median_ms: float
+    p95_ms: float
+    buffers: int
+    plan: List[str]
+
+
+def _totals(session_id):
+    # api/sessions.py get_current_session_info
+    return select(
+        func.count(LLMEvent.id).label('event_count'),
+        func.coalesce(func.sum(LLMEvent.tokens_total), 0).label('total_tokens'),
+        func.coalesce(func.sum(LLMEvent.cost_micros), 0).label('total_cost_micros'),
+    ).where(LLMEvent.session_id == session_id)
+
+
+def _metrics(session_id):
+    # api/sessions.py get_current_session_metrics
+    return select(
+        func.count(LLMEvent.id).label('event_count'),
+        func.coalesce(func.sum(LLMEvent.tokens_total), 0).label('total_tokens'),
+        func.coalesce(func.sum(LLMEvent.cost_micros), 0).label('total_cost_micros'),
+        func.array_remove(func.array_agg(distinct(LLMEvent.model_id)), None).label('model_ids'),
+    ).where(LLMEvent.session_id == session_id)
+
+
+def _recent(session_id, window_start: datetime, older: bool, limit: int = 50):
+    # api/events.py get_recent_events: the recent window first, older partitions only to fill the page
+    return select(
+        LLMEvent.id, LLMEvent.time, LLMEvent.model_id, LLMEvent.provider_id,
+        LLMEvent.tokens_total, LLMEvent.tokens_prompt, LLMEvent.tokens_completion,
+        LLMEvent.cost_micros, LLMEvent.latency_ms, LLMEvent.status_id, LLMEvent.has_error,
+        LLMEvent.error_message,
+    ).where(
+        LLMEvent.session_id == session_id,
+        LLMEvent.time < window_start if older else LLMEvent.time >= window_start,
+    ).order_by(desc(LLMEvent.time)).limit(limit)
+
+
+def _search(session_id, query: str):
+    # api/events.py search_events
+    return SEARCH_SQL.bindparams(
+        query=query, session_id=session_id, start=None, end=None, limit=21, offset=0,
+        headline_options=HEADLINE_OPTIONS,
+    )
+
+
+def _window_start(f: Fixture) -> datetime:
+    return f.now - timedelta(hours=settings.recent_events_window_hours)
+
+
+def _ttl_cutoff(f: Fixture) -> datetime:
+    return f.now - timedelta(days=settings.session_ttl_days)
+
+
+def _session_cases(kind: str, pick: Callable[[Fixture], object]) -> List[QueryCase]:
+    return [
+        QueryCase(f"session_totals[{kind}]", "api/sessions.py:get_current_session_info",
+                  lambda f: _totals(pick(f))),
+        QueryCase(f"session_metrics[{kind}]", "api/sessions.py:get_current_session_metrics",
+                  lambda f: _metrics(pick(f))),
+        QueryCase(f"recent_window[{kind}]", "api/events.py:get_recent_events",
+                  lambda f: _recent(pick(f), _window_start(f), older=False)),
+        QueryCase(f"recent_older[{kind}]", "api/events.py:get_recent_events",
+                  lambda f: _recent(pick(f), _window_start(f), older=True)),
+        QueryCase(f"search_common[{kind}]", "api/events.py:search_events",
+                  lambda f: _search(pick(f), "kubernetes")),
+        QueryCase(f"search_phrase[{kind}]", "api/events.py:search_events",
+                  lambda f: _search(pick(f), '"quarterly revenue"')),
+        QueryCase(f"reset_events[{kind}]", "api/sessions.py:reset_current_session",
+                  lambda f: delete(LLMEvent).where(LLMEvent.session_id == pick(f)), writes=True),
+    ]
+
+
+CASES: List[QueryCase] = [
+    QueryCase("session_lookup", "dependencies.py:get_current_session",
+              lambda f: select(Session).where(Session.session_id == f.large_session_key).limit(1)),
+    QueryCase("session_touch", "dependencies.py:_touch",
+              lambda f: update(Session).where(Session.id == f.large_session).values(last_activity=func.now()),
+              writes=True),
+    *_session_cases("large", lambda f: f.large_session),
+    *_session_cases("typical", lambda f: f.typical_session),
+    QueryCase("cleanup_expired_sessions", "services/session_cleanup.py:_cleanup_expired_on_shard",
+              lambda f: select(Session).where(Session.last_activity < _ttl_cutoff(f))),
+    QueryCase("cleanup_expired_event_count", "services/session_cleanup.py:_cleanup_expired_on_shard",
+              lambda f: select(func.count()).select_from(LLMEvent).where(LLMEvent.session_id.in_(f.expired_ids))),
+    QueryCase("cleanup_inactive_sessions", "services/session_cleanup.py:_cleanup_inactive_on_shard",
+              lambda f: select(Session).where(and_(
+                  Session.last_activity < f.now - timedelta(hours=24), Session.is_active == True  # noqa: E712
+              ))),
+    QueryCase("cleanup_stats_total", "services/session_cleanup.py:_stats_on_shard",
+              lambda f: select(func.count()).select_from(Session)),
+    QueryCase("cleanup_stats_active", "services/session_cleanup.py:_stats_on_shard",
+              lambda f: select(func.count()).select_from(Session).where(Session.is_active == True)),  # noqa: E712
+    QueryCase("cleanup_stats_expired", "services/session_cleanup.py:_stats_on_shard",
+              lambda f: select(func.count()).select_from(Session).where(Session.last_activity < _ttl_cutoff(f))),
+]
+
+
+def fixture(conn) -> Fixture:
+    large = conn.execute(
+        select(Session.id, Session.session_id).order_by(desc(Session.event_count)).limit(1)
+    ).one()
+    populated = conn.execute(select(func.count()).select_from(Session).where(Session.event_count > 0)).scalar()
+    typical = conn.execute(
+        select(Session.id).where(Session.event_count > 0).order_by(Session.event_count).offset(populated // 2).limit(1)
+    ).scalar()
+    now = datetime.now(timezone.utc)
+    expired = conn.execute(
+        select(Session.id).where(Session.last_activity < now - timedelta(days=settings.session_ttl_days))
+    ).scalars().all()
+    return Fixture(large.id, typical, large.session_id, now, list(expired))
+
+
+def explain(conn, statement) -> List[str]:
+    compiled = statement.compile(dialect=conn.dialect, compile_kwargs={"render_postcompile": True})
+    return [row[0] for row in conn.exec_driver_sql(
+        "EXPLAIN (ANALYZE, BUFFERS) " + str(compiled), compiled.construct_params()
+    )]
+
+
+def shared_buffers(plan: List[str]) -> int:
+    """Shared hit + read of the top plan node, which includes its children"""
+    for line in plan:
+        match = BUFFERS_RE.search(line)
+        if match:
+            return sum(int(n or 0) for n in match.groups())
+    return 0
+
+
+def run_case(engine, case: QueryCase, f: Fixture, runs: int) -> CaseResult:
+    statement = case.build(f)
+    timings = []
+    with engine.connect() as conn:
+        for attempt in range(runs + 1):
+            with conn.begin() as transaction:
+                started = time.perf_counter()
+                result = conn.execute(statement)
+                rows = result.rowcount if case.writes else len(result.all())
+                elapsed = (time.perf_counter() - started) * 1000
+                transaction.rollback()
+            if attempt:  # the first run warms the cache
+                timings.append(elapsed)
+        with conn.begin() as transaction:
+            plan = explain(conn, statement)
+            transaction.rollback()
+    timings.sort()
+    return CaseResult(
+        name=case.name,
+        source=case.source,
+        rows=rows,
+        median_ms=round(statistics.median(timings), 3),
+        p95_ms=round(timings[int(0.95 * (len(timings) - 1))], 3),
+        buffers=shared_buffers(plan),
+        plan=plan,
+    )
+
+
+def dataset(conn) -> Dict[str, int]:
+    """What the numbers were measured on; baselines from different data don't compare"""
+    return {
+        "sessions": conn.execute(select(func.count()).select_from(Session)).scalar(),
+        "events": conn.execute(select(func.count()).select_from(LLMEvent)).scalar(),
+        "partitions": conn.execute(text(
+            "SELECT count(*) FROM pg_inherits WHERE inhparent = 'playground_events'::regclass"
+        )).scalar(),
+    }
+
+
+def compare(results: List[CaseResult], baseline: dict, tolerance: float, min_delta_ms: float) -> List[str]:
+    regressions = []
+    previous = {case["name"]: case for case in baseline["cases"]}
+    for result in results:
+        before = previous.get(result.name)
+        if before is None:
+            continue
+        slower = result.median_ms - before["median_ms"]
+        if result.median_ms > before["median_ms"] * (1 + tolerance) and slower > min_delta_ms:
+            regressions.append(
+                f"{result.name}: median {before['median_ms']:.2f} -> {result.median_ms:.2f} ms (+{slower:.2f})"
+            )
+        if before["buffers"] and result.buffers > before["buffers"] * (1 + tolerance):
+            regressions.append(f"{result.name}: shared buffers {before['buffers']} -> {result.buffers}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.query_bench", description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL"))
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--only", nargs="+", help="Run only cases whose name starts with one of these")
+    parser.add_argument("--baseline", help="Fail if a case regressed against this results file")
+    parser.add_argument("--save-baseline", help="Write the results (with plans) to this file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown / buffer growth")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="Ignore slowdowns smaller than this")
+    parser.add_argument("--show-plans", action="store_true")
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error("--database-url (or BENCH_DATABASE_URL) is required")
+
+    # EXPLAIN goes through the driver directly, which needs to adapt uuid.UUID parameters
+    psycopg2.extras.register_uuid()
+    engine = create_engine(args.database_url)
+    with engine.connect() as conn:
+        data = dataset(conn)
+        f = fixture(conn)
+    print(f"{data['events']:,} events, {data['sessions']:,} sessions, {data['partitions']} partitions\n")
+
+    cases = [c for c in CASES if not args.only or c.name.startswith(tuple(args.only))]
+    results: List[CaseResult] = []
+    print(f"{'case':<34}{'rows':>8}{'median ms':>12}{'p95 ms':>10}{'buffers':>10}")
+    for case in cases:
+        result = run_case(engine, case, f, args.runs)
+        results.append(result)
+        print(f"{result.name:<34}{result.rows:>8}{result.median_ms:>12.2f}{result.p95_ms:>10.2f}{result.buffers:>10}")
+        if args.show_plans:
+            print("\n".join("      " + line for line in result.plan))
+
+    report = {"dataset": data, "cases": [asdict(r) for r in results]}
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as out:
+            json.dump(report, out, indent=2)
+        print(f"\nSaved {len(results)} cases to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as source:
+            baseline = json.load(source)
+        if baseline["dataset"] != data:
+            print(f"\nWarning: baseline was measured on {baseline['dataset']}, this run on {data}")
+        regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against {args.baseline}:")
+            print("\n".join("  " + r for r in regressions))
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""CPU cost of serializing /events/recent pages, before and after the fast path.
+
+"before" is the original handler: one EventResponse per ORM row, then
+FastAPI's response_model validation and stdlib JSON rendering. "after" is
+the current handler: column rows turned into dicts and rendered by
+FastJSONResponse. Both sides start from already-fetched rows, so the
+numbers isolate serialization (no database needed).
+
+    python -m benchmarks.serialization_bench --sizes 50 200 500 1000 --compress
+"""
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from types import SimpleNamespace
+from typing import List
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+from fastapi.utils import create_response_field  # noqa: E402
+from starlette.requests import Request  # noqa: E402
+
+from app.api.events import EventResponse  # noqa: E402
+from app.responses import FastJSONResponse  # noqa: E402
+
+# serialize_response is a coroutine; reuse one loop so loop setup isn't billed to "before"
+LOOP = asyncio.new_event_loop()
+
+MODELS = ["claude-3-5-sonnet-20241022", "claude-3-5-haiku-20241022", "claude-3-opus-20240229"]
+
+
+def make_rows(count: int) -> list:
+    """Rows with the attributes both the ORM objects and the column tuples expose"""
+    rng = random.Random(count)
+    start = datetime(2024, 6, 1, tzinfo=timezone.utc)
+    rows = []
+    for i in range(count):
+        prompt, completion = rng.randint(10, 4000), rng.randint(10, 2000)
+        failed = rng.random() < 0.03
+        rows.append(SimpleNamespace(
+            id=uuid.uuid4(),
+            time=start + timedelta(seconds=i * 7, microseconds=rng.randint(0, 999999)),
+            model=rng.choice(MODELS),
+            provider="anthropic",
+            tokens_total=prompt + completion,
+            tokens_prompt=prompt,
+            tokens_completion=completion,
+            cost_usd=Decimal(prompt * 3 + completion * 15) / Decimal(1_000_000),
+            latency_ms=rng.randint(200, 9000),
+            status="error" if failed else "success",
+            has_error=failed,
+            error_message="upstream timeout" if failed else None,
+        ))
+    return rows
+
+
+def before(rows, field) -> bytes:
+    models = [
+        EventResponse(
+            id=str(e.id),
+            time=e.time,
+            model=e.model or "unknown",
+            provider=e.provider or "unknown",
+            tokens_total=e.tokens_total or 0,
+            tokens_prompt=e.tokens_prompt or 0,
+            tokens_completion=e.tokens_completion or 0,
+            cost_usd=float(e.cost_usd or 0),
+            latency_ms=e.latency_ms,
+            status=e.status or "unknown",
+            has_error=e.has_error or False,
+            error=e.error_message,
+        )
+        for e in rows
+    ]
+    content = LOOP.run_until_complete(serialize_response(field=field, response_content=models))
+    return JSONResponse(content).body
+
+
+def after(rows, request=None) -> bytes:
+    return FastJSONResponse([
+        {
+            "id": str(r.id),
+            "time": r.time,
+            "model": r.model or "unknown",
+            "provider": r.provider or "unknown",
+            "tokens_total": r.tokens_total or 0,
+            "tokens_prompt": r.tokens_prompt or 0,
+            "tokens_completion": r.tokens_completion or 0,
+            "cost_usd": float(r.cost_usd or 0),
+            "latency_ms": r.latency_ms,
+            "status": r.status or "unknown",
+            "has_error": r.has_error or False,
+            "error": r.error_message,
+        }
+        for r in rows
+    ], request=request).body
+
+
+def cpu_per_call(fn, *args, min_seconds: float = 0.5) -> float:
+    """Best-of-5 process CPU microseconds per call"""
+    fn(*args)
+    iterations = 1
+    while True:
+        started = time.process_time()
+        for _ in range(iterations):
+            fn(*args)
+        if time.process_time() - started >= min_seconds / 5:
+            break
+        iterations *= 2
+    best = float("inf")
+    for _ in range(5):
+        started = time.process_time()
+        for _ in range(iterations):
+            fn(*args)
+        best = min(best, (time.process_time() - started) / iterations)
+    return best * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 200, 500, 1000])
+    parser.add_argument("--compress", action="store_true", help="Also time the after path with Accept-Encoding")
+    args = parser.parse_args()
+
+    field = create_response_field(name="Response_get_recent_events", type_=List[EventResponse], mode="serialization")
+    encodings = ["gzip", "br"] if args.compress else []
+
+    header = f"{'rows':>6} {'before µs':>11} {'after µs':>10} {'speedup':>8} {'bytes':>9}"
+    for encoding in encodings:
+        header += f" {encoding + ' µs':>10} {encoding + ' bytes':>11}"
+    print(header)
+
+    for size in args.sizes:
+        rows = make_rows(size)
+        assert before(rows, field) == after(rows), "fast path must produce the same JSON"
+        before_us = cpu_per_call(before, rows, field)
+        after_us = cpu_per_call(after, rows)
+        line = f"{size:>6} {before_us:>11.0f} {after_us:>10.0f} {before_us / after_us:>7.1f}x {len(after(rows)):>9}"
+        for encoding in encodings:
+            request = Request({"type": "http", "headers": [(b"accept-encoding", encoding.encode())]})
+            body = after(rows, request)
+            line += f" {cpu_per_call(after, rows, request):>10.0f} {len(body):>11}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
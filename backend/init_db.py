@@ -6,8 +6,10 @@ import time
 # Add parent directory to path
 sys.path.insert(0, str(Path(__file__).parent))
 
-from app.db.base import engine, Base
+from app.db.base import engine, Base, SessionLocal
 from app.db.models import Session, LLMEvent
+from app.db.shards import shard_router
+from app.services.pricing import PricingService
 import logging
 
 logging.basicConfig(level=logging.INFO)
@@ -19,7 +21,17 @@ def init_db(max_retries=5):
         try:
             logger.info(f"Creating database tables... (attempt {attempt + 1}/{max_retries})")
             Base.metadata.create_all(bind=engine)
-            logger.info("✅ Database tables created successfully")
+            for shard, shard_engine in shard_router.engines.items():
+                if shard_engine is not engine:
+                    Base.metadata.create_all(bind=shard_engine)
+            logger.info(f"✅ Database tables created successfully ({len(shard_router.engines)} shards)")
+            db = SessionLocal()
+            try:
+                seeded = PricingService.seed_defaults(db)
+                if seeded:
+                    logger.info(f"✅ Seeded {seeded} default model prices")
+            finally:
+                db.close()
             return True
         except Exception as e:
             logger.error(f"❌ Error creating tables: {str(e)}")
@@ -38,6 +38,22 @@ apiClient.interceptors.request.use((config) => {
   return config;
 });
 
+// The backend re-issues the session token after the session's first write
+let onSessionToken: ((token: string) => void) | null = null;
+
+export const setSessionTokenListener = (listener: ((token: string) => void) | null) => {
+  onSessionToken = listener;
+};
+
+apiClient.interceptors.response.use((response) => {
+  const token = response.headers['x-session-token'];
+  if (token && token !== currentSessionId) {
+    currentSessionId = token;
+    onSessionToken?.(token);
+  }
+  return response;
+});
+
 // API Functions
 
 export const createSession = async (): Promise<CreateSessionResponse> => {
@@ -69,8 +85,28 @@ export const getHealth = async (): Promise<HealthResponse> => {
 };
 
 // Chat Functions
-export const sendChatMessage = async (message: string): Promise<ChatResponse> => {
-  const response = await apiClient.post<ChatResponse>('/playground/chat', { message });
+// crypto.randomUUID only exists in secure contexts (HTTPS or localhost), so a
+// plain-HTTP deployment builds a v4 UUID from crypto.getRandomValues instead.
+const newIdempotencyKey = (): string => {
+  if (typeof crypto.randomUUID === 'function') {
+    return crypto.randomUUID();
+  }
+  const bytes = crypto.getRandomValues(new Uint8Array(16));
+  bytes[6] = (bytes[6] & 0x0f) | 0x40;
+  bytes[8] = (bytes[8] & 0x3f) | 0x80;
+  const hex = Array.from(bytes, (b) => b.toString(16).padStart(2, '0')).join('');
+  return `${hex.slice(0, 8)}-${hex.slice(8, 12)}-${hex.slice(12, 16)}-${hex.slice(16, 20)}-${hex.slice(20)}`;
+};
+
+// One key per user message: retries of the same send (axios, proxies) are answered
+// from the backend's stored response instead of making a second upstream call.
+export const sendChatMessage = async (
+  message: string,
+  idempotencyKey: string = newIdempotencyKey()
+): Promise<ChatResponse> => {
+  const response = await apiClient.post<ChatResponse>('/playground/chat', { message }, {
+    headers: { 'Idempotency-Key': idempotencyKey },
+  });
   return response.data;
 };
 
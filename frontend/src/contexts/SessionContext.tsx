@@ -5,6 +5,7 @@ import {
   getCurrentSessionMetrics,
   resetCurrentSession,
   setSessionId as setApiSessionId,
+  setSessionTokenListener,
 } from '../api/client';
 import type { SessionInfo, SessionMetrics, StoredSession } from '../types';
 
@@ -57,16 +58,22 @@ export const SessionProvider: React.FC<{ children: React.ReactNode }> = ({ child
     setApiSessionId(id);
   }, []);
 
+  // Keep the re-issued token the backend sends after the session's first write
+  useEffect(() => {
+    setSessionTokenListener(saveSession);
+    return () => setSessionTokenListener(null);
+  }, [saveSession]);
+
   // Create new session
   const createNewSession = useCallback(async () => {
     try {
       setIsLoading(true);
       setError(null);
       const response = await createSession();
-      saveSession(response.session_id);
+      saveSession(response.session_token);
       // Fetch session info after creating
-      await fetchSessionInfo(response.session_id);
-      await fetchMetrics(response.session_id);
+      await fetchSessionInfo(response.session_token);
+      await fetchMetrics(response.session_token);
     } catch (err) {
       const message = err instanceof Error ? err.message : 'Failed to create session';
       setError(message);
@@ -9,6 +9,8 @@ export interface SessionInfo {
   event_count: number;
   total_tokens: number;
   total_cost: number;
+  evicted_event_count?: number;
+  archived_event_count?: number;
 }
 
 export interface SessionMetrics {
@@ -17,10 +19,13 @@ export interface SessionMetrics {
   total_tokens: number;
   total_cost: number;
   models_used: string[];
+  evicted_event_count?: number;
+  archived_event_count?: number;
 }
 
 export interface CreateSessionResponse {
   session_id: string;
+  session_token: string;
   message: string;
 }
 
@@ -0,0 +1,101 @@
+"""Measure the SDK's cost on the caller's hot path.
+
+Compares ``messages.create`` on a bare client against the same call through
+``InstrumentedClient``. The upstream is an in-process object returning a
+canned response, so the difference is purely instrumentation overhead
+(timing, tuple build, sampling check, deque append). The shipper thread is
+kept idle while the hot path is timed, so GIL contention from batch encoding
+doesn't blur the numbers; encoding throughput is then measured separately
+with a no-op transport.
+
+    python sdk/benchmarks/bench_overhead.py [--calls 200000]
+"""
+from types import SimpleNamespace
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llmscope_sdk import EventShipper, instrument  # noqa: E402
+
+RESPONSE = SimpleNamespace(
+    model="claude-3-5-sonnet-20241022",
+    content=[SimpleNamespace(type="text", text="Hamlet, prince of Denmark, avenges his father.")],
+    usage=SimpleNamespace(input_tokens=42, output_tokens=17),
+)
+
+
+class _Messages:
+    def create(self, **kwargs):
+        return RESPONSE
+
+
+class FakeAnthropic:
+    def __init__(self):
+        self.messages = _Messages()
+
+
+def _per_call_ns(create, kwargs, calls: int, repeats: int) -> list:
+    results = []
+    for _ in range(repeats):
+        start = time.perf_counter_ns()
+        for _ in range(calls):
+            create(**kwargs)
+        results.append((time.perf_counter_ns() - start) / calls)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=200_000)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    kwargs = {
+        "model": "claude-3-5-sonnet-20241022",
+        "max_tokens": 1024,
+        "messages": [{"role": "user", "content": "Summarize Hamlet."}],
+    }
+
+    # Default bounded queue (drop_oldest), so memory stays flat like a drained buffer would
+    idle = dict(batch_size=10 ** 9, flush_interval_s=3600, transport=lambda payload, headers: 200)
+
+    bare = FakeAnthropic()
+    full_shipper = EventShipper("http://localhost:0", **idle)
+    lean_shipper = EventShipper("http://localhost:0", **idle)
+    sampled_shipper = EventShipper("http://localhost:0", sample_rate=0.1, **idle)
+    variants = [
+        ("instrumented", instrument(FakeAnthropic(), full_shipper)),
+        ("instrumented, no content", instrument(FakeAnthropic(), lean_shipper, capture_content=False)),
+        ("instrumented, 10% sampled", instrument(FakeAnthropic(), sampled_shipper)),
+    ]
+
+    # Warm up method caches
+    for _, client in variants:
+        _per_call_ns(client.messages.create, kwargs, 1000, 1)
+
+    # Best of several repeats: the minimum is the least disturbed by scheduler noise
+    baseline = min(_per_call_ns(bare.messages.create, kwargs, args.calls, args.repeats))
+    print(f"{'variant':<28}{'ns/call':>10}{'overhead':>12}")
+    print(f"{'bare client':<28}{baseline:>10.0f}{'-':>12}")
+    for name, client in variants:
+        per_call = min(_per_call_ns(client.messages.create, kwargs, args.calls, args.repeats))
+        print(f"{name:<28}{per_call:>10.0f}{(per_call - baseline) / 1000:>9.2f} µs")
+
+    # Background cost: build + JSON + gzip for the buffer the full variant left behind
+    queued = len(full_shipper._queue)
+    full_shipper.batch_size = 500
+    start = time.perf_counter()
+    full_shipper.flush(timeout_s=600)
+    elapsed = time.perf_counter() - start
+    print(f"\nshipper thread: {queued} events encoded in {elapsed:.2f}s "
+          f"({queued / elapsed:,.0f} events/s, {elapsed / queued * 1e6:.1f} µs/event off the hot path)")
+
+    for shipper in (full_shipper, lean_shipper, sampled_shipper):
+        shipper.close(timeout_s=0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,7 @@
+"""LLMScope client SDK: instrument Anthropic calls and ship events to LLMScope"""
+from .shipper import EventShipper, DROP_OLDEST, DROP_NEWEST
+from .instrument import InstrumentedClient, instrument
+
+__version__ = "0.1.0"
+
+__all__ = ['EventShipper', 'DROP_OLDEST', 'DROP_NEWEST', 'InstrumentedClient', 'instrument']
@@ -0,0 +1,367 @@
+"""Instrumentation wrappers for Anthropic clients"""
+from typing import Any, Dict, Optional, Tuple
+import time
+
+from .shipper import EventShipper
+
+class _Pricing:
+    """Prefix lookup with a per-model cache; rates are USD per 1K tokens (input, output)"""
+
+    def __init__(self, table: Dict[str, Tuple[float, float]]):
+        self._table = table
+        self._cache: Dict[str, Optional[Tuple[float, float]]] = {}
+
+    def cost(self, model: str, input_tokens: int, output_tokens: int) -> Optional[float]:
+        rates = self._cache.get(model, False)
+        if rates is False:
+            rates = next((r for prefix, r in self._table.items() if model.startswith(prefix)), None)
+            self._cache[model] = rates
+        if rates is None:
+            return None
+        return round(input_tokens / 1000 * rates[0] + output_tokens / 1000 * rates[1], 6)
+
+
+def _response_text(response: Any) -> Optional[str]:
+    content = getattr(response, "content", None)
+    if not content:
+        return None
+    return "".join(getattr(block, "text", "") for block in content)
+
+
+class _Recorder:
+    """
+    Shared event construction for the sync and async wrappers.
+
+    The ``*_event`` hooks run on the caller's thread and only enqueue a tuple
+    of references; the ``_build_*`` methods turn that into the ingest dict on
+    the shipper thread (pricing, text extraction, formatting).
+
+    cost_usd is only set when the caller passes a pricing table. Otherwise
+    it is left out and the backend prices the event from its versioned
+    price table, so SDK and playground costs agree.
+    """
+
+    def __init__(self, shipper: EventShipper, endpoint: str, capture_content: bool,
+                 pricing: Optional[Dict[str, Tuple[float, float]]], session_id: Optional[str]):
+        self.shipper = shipper
+        self.endpoint = endpoint
+        self.capture_content = capture_content
+        self.pricing = _Pricing(pricing) if pricing else None
+        self.session_id = session_id
+
+    def _messages(self, kwargs: dict):
+        # Copy the list: callers commonly append the reply to it right after the call
+        messages = kwargs.get("messages")
+        return list(messages) if self.capture_content and messages else None
+
+    # -- caller thread ---------------------------------------------------
+
+    def response_event(self, kwargs: dict, started_wall: float, latency_s: float, response: Any):
+        self.shipper.enqueue((self._build_response, kwargs, self._messages(kwargs), started_wall, latency_s, response))
+
+    def stream_event(self, kwargs: dict, started_wall: float, latency_s: float, tap: "_StreamTap"):
+        self.shipper.enqueue((self._build_stream, kwargs, self._messages(kwargs), started_wall, latency_s, tap))
+
+    def error_event(self, kwargs: dict, started_wall: float, latency_s: float, exc: BaseException):
+        self.shipper.enqueue(
+            (self._build_error, kwargs, self._messages(kwargs), started_wall, latency_s, exc),
+            is_error=True,
+        )
+
+    # -- shipper thread --------------------------------------------------
+
+    def _base(self, kwargs: dict, messages, started_wall: float, latency_s: float) -> dict:
+        return {
+            "time": started_wall,
+            "model": kwargs.get("model"),
+            "provider": "anthropic",
+            "endpoint": self.endpoint,
+            "latency_ms": int(latency_s * 1000),
+            "messages": messages,
+            "temperature": kwargs.get("temperature"),
+            "max_tokens": kwargs.get("max_tokens"),
+            "top_p": kwargs.get("top_p"),
+            "session_id": self.session_id,
+        }
+
+    def _with_usage(self, event: dict, model: Optional[str], input_tokens: int, output_tokens: int,
+                    text: Optional[str]) -> dict:
+        model = model or event["model"]
+        event.update(
+            model=model,
+            tokens_prompt=input_tokens,
+            tokens_completion=output_tokens,
+            response=text if self.capture_content else None,
+            status="success",
+        )
+        if self.pricing is not None:
+            cost = self.pricing.cost(model or "", input_tokens, output_tokens)
+            if cost is not None:
+                event["cost_usd"] = cost
+        return event
+
+    def _build_response(self, kwargs, messages, started_wall, latency_s, response) -> dict:
+        event = self._base(kwargs, messages, started_wall, latency_s)
+        usage = response.usage
+        return self._with_usage(event, response.model, usage.input_tokens, usage.output_tokens,
+                                _response_text(response))
+
+    def _build_stream(self, kwargs, messages, started_wall, latency_s, tap) -> dict:
+        event = self._base(kwargs, messages, started_wall, latency_s)
+        event["time_to_first_token_ms"] = int(tap.ttft_s * 1000) if tap.ttft_s is not None else None
+        return self._with_usage(event, tap.model, tap.input_tokens, tap.output_tokens, "".join(tap.parts))
+
+    def _build_error(self, kwargs, messages, started_wall, latency_s, exc) -> dict:
+        event = self._base(kwargs, messages, started_wall, latency_s)
+        event.update(
+            tokens_prompt=0,
+            tokens_completion=0,
+            status="error",
+            error_message=f"{type(exc).__name__}: {exc}",
+        )
+        return event
+
+
+class _StreamTap:
+    """Tracks TTFT, usage and text while a raw event stream is consumed"""
+
+    def __init__(self, model: Optional[str]):
+        self.model = model
+        self.ttft_s: Optional[float] = None
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.parts = []
+
+    def observe(self, event: Any, started: float):
+        kind = getattr(event, "type", None)
+        if kind == "content_block_delta":
+            if self.ttft_s is None:
+                self.ttft_s = time.perf_counter() - started
+            text = getattr(event.delta, "text", None)
+            if text:
+                self.parts.append(text)
+        elif kind == "message_start":
+            self.model = event.message.model or self.model
+            self.input_tokens = event.message.usage.input_tokens
+        elif kind == "message_delta":
+            self.output_tokens = event.usage.output_tokens
+
+
+class _SyncStream:
+    """
+    Proxy for a sync Stream. The event is recorded once, when the stream
+    ends: exhausted, closed, left early (break, with-block exit) or never
+    iterated at all. Those are successes with whatever usage was seen;
+    only an exception from the stream itself records an error.
+    """
+
+    def __init__(self, stream, recorder: _Recorder, kwargs: dict, started: float, started_wall: float):
+        self._stream = stream
+        self._recorder = recorder
+        self._kwargs = kwargs
+        self._started = started
+        self._started_wall = started_wall
+        self._tap = _StreamTap(kwargs.get("model"))
+        self._recorded = False
+
+    def _record(self, exc: Optional[BaseException] = None):
+        if self._recorded:
+            return
+        self._recorded = True
+        latency_s = time.perf_counter() - self._started
+        if exc is None:
+            self._recorder.stream_event(self._kwargs, self._started_wall, latency_s, self._tap)
+        else:
+            self._recorder.error_event(self._kwargs, self._started_wall, latency_s, exc)
+
+    def _observe(self, events):
+        try:
+            for event in events:
+                self._tap.observe(event, self._started)
+                yield event
+        except GeneratorExit:
+            # Closed before the end: a partial read, not a failed call
+            self._record()
+            raise
+        except BaseException as e:
+            self._record(e)
+            raise
+        self._record()
+
+    async def _aobserve(self, events):
+        try:
+            async for event in events:
+                self._tap.observe(event, self._started)
+                yield event
+        except GeneratorExit:
+            self._record()
+            raise
+        except BaseException as e:
+            self._record(e)
+            raise
+        self._record()
+
+    def __iter__(self):
+        return self._observe(self._stream)
+
+    def close(self):
+        self._stream.close()
+        self._record()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+class _AsyncStream(_SyncStream):
+    """Proxy for an AsyncStream"""
+
+    def __aiter__(self):
+        return self._aobserve(self._stream)
+
+    async def close(self):
+        await self._stream.close()
+        self._record()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+class _StreamManager(_SyncStream):
+    """
+    Proxy for the manager messages.stream() returns. The request is sent
+    on entering the with block, and the helper stream it yields is tapped
+    by wrapping its event iterator, which text_stream, until_done() and
+    get_final_message() all read from. The event is recorded on exit.
+    """
+
+    def __init__(self, manager, recorder: _Recorder, kwargs: dict):
+        super().__init__(manager, recorder, kwargs, time.perf_counter(), time.time())
+        self._helper = None
+
+    def _start(self):
+        self._started_wall = time.time()
+        self._started = time.perf_counter()
+
+    def _tap_helper(self, stream, observe):
+        # On SDK versions without _iterator the call is still recorded, from the final snapshot only
+        if hasattr(stream, "_iterator"):
+            stream._iterator = observe(stream._iterator)
+        self._helper = stream
+        return stream
+
+    def _finish(self):
+        snapshot = getattr(self._helper, "current_message_snapshot", None)
+        if snapshot is not None and getattr(snapshot, "usage", None) is not None:
+            self._tap.model = snapshot.model or self._tap.model
+            self._tap.input_tokens = snapshot.usage.input_tokens
+            self._tap.output_tokens = snapshot.usage.output_tokens
+        self._record()
+
+    def __enter__(self):
+        self._start()
+        try:
+            return self._tap_helper(self._stream.__enter__(), self._observe)
+        except BaseException as e:
+            self._record(e)
+            raise
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            return self._stream.__exit__(exc_type, exc, tb)
+        finally:
+            self._finish()
+
+    async def __aenter__(self):
+        self._start()
+        try:
+            return self._tap_helper(await self._stream.__aenter__(), self._aobserve)
+        except BaseException as e:
+            self._record(e)
+            raise
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            return await self._stream.__aexit__(exc_type, exc, tb)
+        finally:
+            self._finish()
+
+
+class _Messages:
+    def __init__(self, messages, recorder: _Recorder):
+        self._messages = messages
+        self._recorder = recorder
+
+    def create(self, **kwargs):
+        started_wall = time.time()
+        started = time.perf_counter()
+        try:
+            response = self._messages.create(**kwargs)
+        except BaseException as e:
+            self._recorder.error_event(kwargs, started_wall, time.perf_counter() - started, e)
+            raise
+        if kwargs.get("stream"):
+            return _SyncStream(response, self._recorder, kwargs, started, started_wall)
+        self._recorder.response_event(kwargs, started_wall, time.perf_counter() - started, response)
+        return response
+
+    def stream(self, **kwargs):
+        return _StreamManager(self._messages.stream(**kwargs), self._recorder, kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._messages, name)
+
+
+class _AsyncMessages(_Messages):
+    async def create(self, **kwargs):
+        started_wall = time.time()
+        started = time.perf_counter()
+        try:
+            response = await self._messages.create(**kwargs)
+        except BaseException as e:
+            self._recorder.error_event(kwargs, started_wall, time.perf_counter() - started, e)
+            raise
+        if kwargs.get("stream"):
+            return _AsyncStream(response, self._recorder, kwargs, started, started_wall)
+        self._recorder.response_event(kwargs, started_wall, time.perf_counter() - started, response)
+        return response
+
+
+class InstrumentedClient:
+    """
+    Wraps an ``Anthropic`` or ``AsyncAnthropic`` client.
+
+    ``client.messages.create(...)`` and ``client.messages.stream(...)``
+    behave exactly like the wrapped client's, and each call is recorded
+    with the same fields the playground's chat endpoint stores. Everything else is passed through untouched.
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        shipper: EventShipper,
+        endpoint: str = "sdk",
+        capture_content: bool = True,
+        pricing: Optional[Dict[str, Tuple[float, float]]] = None,
+        session_id: Optional[str] = None,
+    ):
+        self._client = client
+        recorder = _Recorder(shipper, endpoint, capture_content, pricing, session_id)
+        is_async = type(client).__name__.startswith("Async")
+        self.messages = (_AsyncMessages if is_async else _Messages)(client.messages, recorder)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def instrument(client: Any, shipper: EventShipper, **kwargs) -> InstrumentedClient:
+    """Convenience wrapper: ``client = instrument(Anthropic(), shipper)``"""
+    return InstrumentedClient(client, shipper, **kwargs)
@@ -0,0 +1,216 @@
+"""Background batching and delivery of events to the LLMScope ingest API"""
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+from datetime import datetime, timezone
+import atexit
+import gzip
+import json
+import logging
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+
+
+class EventShipper:
+    """
+    Buffers events in memory and ships them in gzip-compressed NDJSON batches.
+
+    The caller's thread only pays for a sampling check and a deque append;
+    serialization, compression and HTTP happen on a daemon thread. Memory is
+    bounded by ``max_queue_size`` and overflow follows ``drop_policy``:
+    ``drop_oldest`` keeps the freshest events, ``drop_newest`` keeps what is
+    already queued. Remaining events are flushed at interpreter exit.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        api_key: Optional[str] = None,
+        session_id: Optional[str] = None,
+        batch_size: int = 500,
+        flush_interval_s: float = 2.0,
+        max_queue_size: int = 10000,
+        drop_policy: str = DROP_OLDEST,
+        sample_rate: float = 1.0,
+        always_sample_errors: bool = True,
+        max_retries: int = 3,
+        timeout_s: float = 10.0,
+        transport: Optional[Callable[[bytes, Dict[str, str]], int]] = None,
+    ):
+        if drop_policy not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError(f"Unknown drop_policy: {drop_policy}")
+        if not 0.0 <= sample_rate <= 1.0:
+            raise ValueError("sample_rate must be between 0 and 1")
+
+        self.url = endpoint.rstrip("/") + "/api/v1/ingest/events"
+        self.api_key = api_key
+        self.session_id = session_id
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self.max_queue_size = max_queue_size
+        self.drop_policy = drop_policy
+        self.sample_rate = sample_rate
+        self.always_sample_errors = always_sample_errors
+        self.max_retries = max_retries
+        self.timeout_s = timeout_s
+        self.transport = transport or self._http_post
+
+        # deque(maxlen) evicts from the left on append, which is drop_oldest for free
+        self._queue: Deque[Tuple] = deque(maxlen=max_queue_size if drop_policy == DROP_OLDEST else None)
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._random = random.random
+
+        self._sampling = sample_rate < 1.0
+        self._enqueued = 0
+        self._dropped = 0
+        self._sampled_out = 0
+        self._sent = 0
+        self._failed = 0
+        self._batches = 0
+
+        self._thread = threading.Thread(target=self._run, name="llmscope-shipper", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # -- hot path --------------------------------------------------------
+
+    def enqueue(self, event: Tuple, is_error: bool = False) -> bool:
+        """
+        Queue a deferred event. Returns False if it was not kept.
+
+        ``event`` is ``(build, *args)``; ``build(*args)`` is called on the
+        shipper thread and must return the event as a dict of ingest fields.
+        Keeping the hot path to a tuple build defers all formatting work.
+        """
+        if self._sampling and not (is_error and self.always_sample_errors) and self._random() >= self.sample_rate:
+            self._sampled_out += 1
+            return False
+
+        queue = self._queue
+        size = len(queue)
+        if size >= self.max_queue_size:
+            self._dropped += 1
+            if self.drop_policy == DROP_NEWEST:
+                return False
+        queue.append(event)
+        self._enqueued += 1
+        if size + 1 >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Counters since start; ``queued`` is the current buffer length"""
+        return {
+            "enqueued": self._enqueued,
+            "dropped": self._dropped,
+            "sampled_out": self._sampled_out,
+            "sent": self._sent,
+            "failed": self._failed,
+            "batches": self._batches,
+            "queued": len(self._queue),
+        }
+
+    # -- background thread ----------------------------------------------
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval_s)
+            self._wakeup.clear()
+            self._drain()
+
+    def _take_batch(self) -> List[Tuple]:
+        batch = []
+        queue = self._queue
+        while queue and len(batch) < self.batch_size:
+            try:
+                batch.append(queue.popleft())
+            except IndexError:
+                break
+        return batch
+
+    def _drain(self, deadline: Optional[float] = None):
+        while self._queue:
+            if deadline is not None and time.monotonic() > deadline:
+                return
+            batch = self._take_batch()
+            if batch:
+                self._ship(batch)
+
+    def _encode(self, batch: List[Tuple]) -> bytes:
+        lines = []
+        for raw in batch:
+            try:
+                event = raw[0](*raw[1:])
+            except Exception as e:
+                logger.debug("LLMScope could not build event: %s", e)
+                continue
+            # ids are assigned once per batch so retries are deduplicated server-side
+            event["id"] = str(uuid.uuid4())
+            event["time"] = datetime.fromtimestamp(event["time"], tz=timezone.utc).isoformat()
+            event.setdefault("session_id", self.session_id)
+            event = {k: v for k, v in event.items() if v is not None}
+            lines.append(json.dumps(event, separators=(",", ":"), default=str))
+        return gzip.compress("\n".join(lines).encode(), compresslevel=5)
+
+    def _http_post(self, payload: bytes, headers: Dict[str, str]) -> int:
+        request = urllib.request.Request(self.url, data=payload, headers=headers, method="POST")
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout_s) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    def _ship(self, batch: List[Tuple]):
+        payload = self._encode(batch)
+        headers = {"Content-Type": "application/x-ndjson", "Content-Encoding": "gzip"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        if self.session_id:
+            headers["X-Session-ID"] = self.session_id
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                status = self.transport(payload, headers)
+            except (OSError, urllib.error.URLError) as e:
+                logger.debug("LLMScope ship attempt %d failed: %s", attempt + 1, e)
+                status = None
+            if status is not None and status < 500 and status != 429:
+                break
+            if attempt < self.max_retries:
+                time.sleep(min(0.25 * 2 ** attempt, 5.0))
+
+        self._batches += 1
+        if status is not None and status < 300:
+            self._sent += len(batch)
+        else:
+            self._failed += len(batch)
+            logger.warning("LLMScope dropped a batch of %d events (status=%s)", len(batch), status)
+
+    # -- lifecycle -------------------------------------------------------
+
+    def flush(self, timeout_s: float = 5.0):
+        """Ship everything queued so far, from the calling thread"""
+        self._drain(deadline=time.monotonic() + timeout_s)
+
+    def close(self, timeout_s: float = 5.0):
+        """Stop the background thread and flush what is left"""
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join(timeout=timeout_s)
+        self.flush(timeout_s=timeout_s)
+        try:
+            atexit.unregister(self.close)
+        except Exception:
+            pass